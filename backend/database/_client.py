@@ -1,7 +1,9 @@
+import asyncio
 import hashlib
 import json
 import os
 import uuid
+import weakref
 
 from google.cloud import firestore
 
@@ -13,6 +15,18 @@ if os.environ.get('SERVICE_ACCOUNT_JSON'):
 
 db = firestore.Client()
 
+# AsyncClient channels are bound to the event loop that first uses them, one long-lived client per loop
+_async_dbs = weakref.WeakKeyDictionary()
+
+
+def get_async_db() -> firestore.AsyncClient:
+    loop = asyncio.get_running_loop()
+    async_db = _async_dbs.get(loop)
+    if async_db is None:
+        async_db = firestore.AsyncClient()
+        _async_dbs[loop] = async_db
+    return async_db
+
 
 def get_users_uid():
     users_ref = db.collection('users')
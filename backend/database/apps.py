@@ -8,7 +8,7 @@ from google.cloud.firestore import ArrayUnion, ArrayRemove
 from ulid import ULID
 
 from models.app import UsageHistoryType
-from ._client import db
+from ._client import db, get_async_db
 from .redis_db import get_app_reviews
 
 # *****************************
@@ -437,3 +437,34 @@ def delete_api_key_db(app_id: str, key_id: str):
     api_key_ref = db.collection(apps_collection).document(app_id).collection('api_keys').document(key_id)
     api_key_ref.delete()
     return True
+
+
+# *****************************
+# *********** ASYNC ***********
+# *****************************
+
+async def get_app_by_id_db_async(app_id: str):
+    doc = await get_async_db().collection(apps_collection).document(app_id).get()
+    if doc.exists:
+        return doc.to_dict()
+    return None
+
+
+async def record_app_usage_async(
+        uid: str, app_id: str, usage_type: UsageHistoryType, conversation_id: str = None, message_id: str = None,
+        timestamp: datetime = None
+):
+    if not conversation_id and not message_id:
+        raise ValueError('memory_id or message_id must be provided')
+
+    data = {
+        'uid': uid,
+        'memory_id': conversation_id,
+        'message_id': message_id,
+        'timestamp': datetime.now(timezone.utc) if timestamp is None else timestamp,
+        'type': usage_type,
+    }
+
+    await get_async_db().collection(app_analytics_collection).document(app_id).collection('usage_history') \
+        .document(conversation_id or message_id).set(data)
+    return data
@@ -7,7 +7,7 @@ from google.cloud.firestore_v1 import FieldFilter
 
 from models.chat import Message
 from utils.other.endpoints import timeit
-from ._client import db
+from ._client import db, get_async_db
 
 
 @timeit
@@ -296,3 +296,102 @@ def add_files_to_chat_session(uid: str, chat_session_id: str, file_ids: List[str
     user_ref = db.collection('users').document(uid)
     session_ref = user_ref.collection('chat_sessions').document(chat_session_id)
     session_ref.update({"file_ids": firestore.ArrayUnion(file_ids)})
+
+
+# *****************************
+# *********** ASYNC ***********
+# *****************************
+
+async def add_message_async(uid: str, message_data: dict):
+    del message_data['memories']
+    await get_async_db().collection('users').document(uid).collection('messages').add(message_data)
+    return message_data
+
+
+async def get_messages_async(
+        uid: str, limit: int = 20, offset: int = 0, include_conversations: bool = False, app_id: Optional[str] = None,
+        chat_session_id: Optional[str] = None
+):
+    async_db = get_async_db()
+    user_ref = async_db.collection('users').document(uid)
+    messages_ref = user_ref.collection('messages').where(filter=FieldFilter('plugin_id', '==', app_id))
+    if chat_session_id:
+        messages_ref = messages_ref.where(filter=FieldFilter('chat_session_id', '==', chat_session_id))
+
+    messages_ref = messages_ref.order_by('created_at', direction=firestore.Query.DESCENDING).limit(limit).offset(offset)
+
+    messages = []
+    conversations_id = set()
+    files_id = set()
+    async for doc in messages_ref.stream():
+        message = doc.to_dict()
+        if message.get('reported') is True:
+            continue
+        messages.append(message)
+        conversations_id.update(message.get('memories_id', []))
+        files_id.update(message.get('files_id', []))
+
+    if not include_conversations:
+        return messages
+
+    conversations = {}
+    conversations_ref = user_ref.collection('conversations')
+    doc_refs = [conversations_ref.document(str(conversation_id)) for conversation_id in conversations_id]
+    async for doc in async_db.get_all(doc_refs):
+        if doc.exists:
+            conversation = doc.to_dict()
+            conversations[conversation['id']] = conversation
+
+    for message in messages:
+        message['memories'] = [
+            conversations[conversation_id] for conversation_id in message.get('memories_id', []) if
+            conversation_id in conversations
+        ]
+
+    files = {}
+    files_ref = user_ref.collection('files')
+    doc_refs = [files_ref.document(str(file_id)) for file_id in files_id]
+    async for doc in async_db.get_all(doc_refs):
+        if doc.exists:
+            file = doc.to_dict()
+            files[file['id']] = file
+
+    for message in messages:
+        message['files'] = [
+            files[file_id] for file_id in message.get('files_id', []) if file_id in files
+        ]
+
+    return messages
+
+
+async def get_chat_files_async(uid: str, files_id: List[str] = []):
+    files_ref = get_async_db().collection('users').document(uid).collection('files')
+    if len(files_id) > 0:
+        files_ref = files_ref.where(filter=FieldFilter('id', 'in', files_id))
+
+    return [doc.to_dict() async for doc in files_ref.stream()]
+
+
+async def get_chat_session_async(uid: str, app_id: Optional[str] = None):
+    session_ref = (
+        get_async_db().collection('users').document(uid).collection('chat_sessions')
+        .where(filter=FieldFilter('plugin_id', '==', app_id))
+        .limit(1)
+    )
+    async for session in session_ref.stream():
+        return session.to_dict()
+
+    return None
+
+
+async def add_message_to_chat_session_async(uid: str, chat_session_id: str, message_id: str):
+    session_ref = get_async_db().collection('users').document(uid).collection('chat_sessions').document(chat_session_id)
+    await session_ref.update({"message_ids": firestore.ArrayUnion([message_id])})
+
+
+async def add_files_to_chat_session_async(uid: str, chat_session_id: str, file_ids: List[str]):
+    if not file_ids:
+        return
+
+    session_ref = get_async_db().collection('users').document(uid).collection('chat_sessions').document(chat_session_id)
+    await session_ref.update({"file_ids": firestore.ArrayUnion(file_ids)})
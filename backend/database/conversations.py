@@ -11,7 +11,7 @@ from google.cloud.firestore_v1.async_client import AsyncClient
 import utils.other.hume as hume
 from models.conversation import ConversationPhoto, PostProcessingStatus, PostProcessingModel, ConversationStatus
 from models.transcript_segment import TranscriptSegment
-from ._client import db
+from ._client import db, get_async_db
 
 conversations_collection = 'conversations'
 
@@ -183,6 +183,20 @@ def update_conversation_segments(uid: str, conversation_id: str, segments: List[
     conversation_ref.update({'transcript_segments': segments})
 
 
+def update_conversation_segments_and_finished_at(uid: str, conversation_id: str, segments: List[dict],
+                                                 finished_at: datetime):
+    user_ref = db.collection('users').document(uid)
+    conversation_ref = user_ref.collection(conversations_collection).document(conversation_id)
+    conversation_ref.update({'transcript_segments': segments, 'finished_at': finished_at})
+
+
+def append_conversation_segments(uid: str, conversation_id: str, segments: List[dict], finished_at: datetime):
+    """Appends new segments without rewriting the existing ones, segment ids keep ArrayUnion from deduping."""
+    user_ref = db.collection('users').document(uid)
+    conversation_ref = user_ref.collection(conversations_collection).document(conversation_id)
+    conversation_ref.update({'transcript_segments': firestore.ArrayUnion(segments), 'finished_at': finished_at})
+
+
 # ***********************************
 # ********** VISIBILITY *************
 # ***********************************
@@ -203,17 +217,13 @@ async def _get_public_conversation(db: AsyncClient, uid: str, conversation_id: s
     return None
 
 
-async def _get_public_conversations(data: List[Tuple[str, str]]):
-    db = AsyncClient()
-    tasks = [_get_public_conversation(db, uid, conversation_id) for uid, conversation_id in data]
+async def get_public_conversations_async(data: List[Tuple[str, str]]):
+    async_db = get_async_db()
+    tasks = [_get_public_conversation(async_db, uid, conversation_id) for uid, conversation_id in data]
     conversations = await asyncio.gather(*tasks)
     return [conversation for conversation in conversations if conversation is not None]
 
 
-def run_get_public_conversations(data: List[Tuple[str, str]]):
-    return asyncio.run(_get_public_conversations(data))
-
-
 # ****************************************
 # ********** POSTPROCESSING **************
 # ****************************************
@@ -367,3 +377,107 @@ def get_last_completed_conversation(uid: str) -> Optional[dict]:
     )
     conversations = [doc.to_dict() for doc in query.stream()]
     return conversations[0] if conversations else None
+
+
+# *****************************
+# *********** ASYNC ***********
+# *****************************
+
+def _conversation_ref_async(uid: str, conversation_id: str):
+    return get_async_db().collection('users').document(uid).collection(conversations_collection).document(
+        conversation_id)
+
+
+async def upsert_conversation_async(uid: str, conversation_data: dict):
+    if 'audio_base64_url' in conversation_data:
+        del conversation_data['audio_base64_url']
+    if 'photos' in conversation_data:
+        del conversation_data['photos']
+
+    await _conversation_ref_async(uid, conversation_data['id']).set(conversation_data)
+
+
+async def get_conversation_async(uid: str, conversation_id: str):
+    doc = await _conversation_ref_async(uid, conversation_id).get()
+    return doc.to_dict()
+
+
+async def get_conversation_status_async(uid: str, conversation_id: str) -> Optional[str]:
+    doc = await _conversation_ref_async(uid, conversation_id).get(field_paths=['status'])
+    return doc.to_dict().get('status') if doc.exists else None
+
+
+async def get_conversations_async(uid: str, limit: int = 100, offset: int = 0, include_discarded: bool = False,
+                                  statuses: List[str] = [], start_date: Optional[datetime] = None,
+                                  end_date: Optional[datetime] = None, categories: Optional[List[str]] = None):
+    conversations_ref = get_async_db().collection('users').document(uid).collection(conversations_collection)
+    if not include_discarded:
+        conversations_ref = conversations_ref.where(filter=FieldFilter('discarded', '==', False))
+    if len(statuses) > 0:
+        conversations_ref = conversations_ref.where(filter=FieldFilter('status', 'in', statuses))
+    if categories:
+        conversations_ref = conversations_ref.where(filter=FieldFilter('structured.category', 'in', categories))
+    if start_date:
+        conversations_ref = conversations_ref.where(filter=FieldFilter('created_at', '>=', start_date))
+    if end_date:
+        conversations_ref = conversations_ref.where(filter=FieldFilter('created_at', '<=', end_date))
+
+    conversations_ref = conversations_ref.order_by('created_at', direction=firestore.Query.DESCENDING)
+    conversations_ref = conversations_ref.limit(limit).offset(offset)
+    return [doc.to_dict() async for doc in conversations_ref.stream()]
+
+
+async def get_in_progress_conversation_async(uid: str):
+    conversations_ref = (
+        get_async_db().collection('users').document(uid).collection(conversations_collection)
+        .where(filter=FieldFilter('status', '==', 'in_progress'))
+    )
+    docs = [doc.to_dict() async for doc in conversations_ref.stream()]
+    return docs[0] if docs else None
+
+
+async def get_processing_conversations_async(uid: str):
+    conversations_ref = (
+        get_async_db().collection('users').document(uid).collection(conversations_collection)
+        .where(filter=FieldFilter('status', '==', 'processing'))
+    )
+    return [doc.to_dict() async for doc in conversations_ref.stream()]
+
+
+async def get_last_completed_conversation_async(uid: str) -> Optional[dict]:
+    query = (
+        get_async_db().collection('users').document(uid).collection(conversations_collection)
+        .where(filter=FieldFilter('status', '==', ConversationStatus.completed))
+        .order_by('created_at', direction=firestore.Query.DESCENDING)
+        .limit(1)
+    )
+    conversations = [doc.to_dict() async for doc in query.stream()]
+    return conversations[0] if conversations else None
+
+
+async def update_conversation_status_async(uid: str, conversation_id: str, status: str):
+    await _conversation_ref_async(uid, conversation_id).update({'status': status})
+
+
+async def set_conversation_as_discarded_async(uid: str, conversation_id: str):
+    await _conversation_ref_async(uid, conversation_id).update({'discarded': True})
+
+
+async def update_conversation_finished_at_async(uid: str, conversation_id: str, finished_at: datetime):
+    await _conversation_ref_async(uid, conversation_id).update({'finished_at': finished_at})
+
+
+async def update_conversation_segments_async(uid: str, conversation_id: str, segments: List[dict]):
+    await _conversation_ref_async(uid, conversation_id).update({'transcript_segments': segments})
+
+
+async def update_conversation_segments_and_finished_at_async(uid: str, conversation_id: str, segments: List[dict],
+                                                             finished_at: datetime):
+    await _conversation_ref_async(uid, conversation_id).update(
+        {'transcript_segments': segments, 'finished_at': finished_at})
+
+
+async def append_conversation_segments_async(uid: str, conversation_id: str, segments: List[dict],
+                                             finished_at: datetime):
+    await _conversation_ref_async(uid, conversation_id).update(
+        {'transcript_segments': firestore.ArrayUnion(segments), 'finished_at': finished_at})
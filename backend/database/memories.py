@@ -4,7 +4,7 @@ from typing import List
 from google.cloud import firestore
 from google.cloud.firestore_v1 import FieldFilter
 
-from ._client import db
+from ._client import db, get_async_db
 
 memories_collection = 'memories'
 users_collection = 'users'
@@ -184,3 +184,24 @@ def migrate_memories(prev_uid: str, new_uid: str, app_id: str = None):
     batch.commit()
     print(f'Migrated {len(memories_to_migrate)} memories from {prev_uid} to {new_uid}')
     return len(memories_to_migrate)
+
+
+# *****************************
+# *********** ASYNC ***********
+# *****************************
+
+async def get_memories_async(uid: str, limit: int = 100, offset: int = 0, categories: List[str] = []):
+    memories_ref = get_async_db().collection(users_collection).document(uid).collection(memories_collection)
+    if categories:
+        memories_ref = memories_ref.where(filter=FieldFilter('category', 'in', categories))
+
+    memories_ref = (
+        memories_ref
+        .order_by('scoring', direction=firestore.Query.DESCENDING)
+        .order_by('created_at', direction=firestore.Query.DESCENDING)
+        .limit(limit)
+        .offset(offset)
+    )
+
+    memories = [doc.to_dict() async for doc in memories_ref.stream()]
+    return [memory for memory in memories if memory['user_review'] is not False]
@@ -1,6 +1,7 @@
 import base64
 import json
 import os
+import time
 from typing import List, Union, Optional
 
 import redis
@@ -211,10 +212,12 @@ def get_user_paid_app(app_id: str, uid: str) -> str:
 
 def enable_app(uid: str, app_id: str):
     r.sadd(f'users:{uid}:enabled_plugins', app_id)
+    publish_user_context_invalidation(uid, 'apps')
 
 
 def disable_app(uid: str, app_id: str):
     r.srem(f'users:{uid}:enabled_plugins', app_id)
+    publish_user_context_invalidation(uid, 'apps')
 
 
 def get_enabled_apps(uid: str):
@@ -290,6 +293,19 @@ def remove_user_soniox_speech_profile(uid: str):
     r.delete(f'users:{uid}:has_soniox_speech_profile')
 
 
+@try_catch_decorator
+def set_speech_profile_generation(uid: str, generation: Optional[int], ttl: int = 60 * 60 * 24 * 30):
+    # 0 caches the absence of a profile
+    r.set(f'users:{uid}:speech_profile_generation', generation or 0, ex=ttl)
+
+
+@try_catch_decorator
+def get_speech_profile_generation(uid: str) -> Optional[int]:
+    """Last known generation of the speech profile blob, 0 if the user has none, None if unknown."""
+    generation = r.get(f'users:{uid}:speech_profile_generation')
+    return int(generation) if generation is not None else None
+
+
 def cache_user_name(uid: str, name: str, ttl: int = 60 * 60 * 24 * 7):
     r.set(f'users:{uid}:name', name)
     r.expire(f'users:{uid}:name', ttl)
@@ -401,16 +417,109 @@ def get_in_progress_conversation_id(uid: str) -> str:
     return conversation_id.decode()
 
 
+@try_catch_decorator
+def set_listen_session_snapshot(token: str, data: bytes, ttl: int):
+    r.set(f'listen_sessions:{token}', data, ex=ttl)
+
+
+@try_catch_decorator
+def pop_listen_session_snapshot(token: str) -> Optional[bytes]:
+    """The snapshot of a closed listen session, a token resumes a single session."""
+    pipe = r.pipeline()
+    pipe.get(f'listen_sessions:{token}')
+    pipe.delete(f'listen_sessions:{token}')
+    data, _ = pipe.execute()
+    return data
+
+
+# Pusher outbox, the frames of a listen session to the pusher, stream ids are `<seq>-1`
+def pusher_outbox_write(session_id: str, frames: List[tuple], trim_seq: int, maxlen: int, ttl: int):
+    key = f'pusher_outbox:{session_id}'
+    pipe = r.pipeline()
+    for seq, header_type, payload in frames:
+        pipe.xadd(key, {'t': header_type, 'd': payload}, id=f'{seq}-1', maxlen=maxlen, approximate=False)
+    if frames:
+        pipe.expire(key, ttl)
+    if trim_seq:
+        pipe.xtrim(key, minid=f'{trim_seq + 1}-0')
+    pipe.execute()
+
+
+def pusher_outbox_read(session_id: str, after_seq: int, count: int) -> List[tuple]:
+    entries = r.xrange(f'pusher_outbox:{session_id}', min=f'{after_seq + 1}-0', count=count)
+    return [(int(entry_id.split(b'-')[0]), int(fields[b't']), fields[b'd']) for entry_id, fields in entries]
+
+
+@try_catch_decorator
+def delete_pusher_outbox(session_id: str):
+    r.delete(f'pusher_outbox:{session_id}')
+
+
+@try_catch_decorator
+def set_pusher_offsets(session_id: str, offsets: dict, ttl: int):
+    r.set(f'pusher_offsets:{session_id}', json.dumps(offsets), ex=ttl)
+
+
+@try_catch_decorator
+def set_pusher_offsets_many(offsets: dict, ttl: int):
+    pipe = r.pipeline()
+    for session_id, session_offsets in offsets.items():
+        pipe.set(f'pusher_offsets:{session_id}', json.dumps(session_offsets), ex=ttl)
+    pipe.execute()
+
+
+@try_catch_decorator
+def get_pusher_offsets(session_id: str) -> Optional[dict]:
+    data = r.get(f'pusher_offsets:{session_id}')
+    return json.loads(data) if data else None
+
+
+@try_catch_decorator
+def get_cached_translations(keys: List[str]) -> Optional[List[Optional[str]]]:
+    if not keys:
+        return []
+    values = r.mget([f'translations:{key}' for key in keys])
+    return [value.decode() if value is not None else None for value in values]
+
+
+@try_catch_decorator
+def cache_translations(translations: dict, ttl: int = 60 * 60 * 24 * 7):
+    pipe = r.pipeline()
+    for key, text in translations.items():
+        pipe.set(f'translations:{key}', text, ex=ttl)
+    pipe.execute()
+
+
+@try_catch_decorator
+def set_endpoint_circuits(opened: dict, closed: List[str]):
+    pipe = r.pipeline()
+    for key, circuit in opened.items():
+        ttl = max(1, int(circuit['open_until'] - time.time()) + 1)
+        pipe.set(f'endpoint_circuits:{key}', json.dumps(circuit), ex=ttl)
+    for key in closed:
+        pipe.delete(f'endpoint_circuits:{key}')
+    pipe.execute()
+
+
+@try_catch_decorator
+def get_endpoint_circuits(keys: List[str]) -> Optional[List[Optional[dict]]]:
+    values = r.mget([f'endpoint_circuits:{key}' for key in keys])
+    return [json.loads(value) if value else None for value in values]
+
+
 def set_user_webhook_db(uid: str, wtype: str, url: str):
     r.set(f'users:{uid}:developer:webhook:{wtype}', url)
+    publish_user_context_invalidation(uid, 'webhooks')
 
 
 def disable_user_webhook_db(uid: str, wtype: str):
     r.set(f'users:{uid}:developer:webhook_status:{wtype}', str(False).lower())
+    publish_user_context_invalidation(uid, 'webhooks')
 
 
 def enable_user_webhook_db(uid: str, wtype: str):
     r.set(f'users:{uid}:developer:webhook_status:{wtype}', str(True).lower())
+    publish_user_context_invalidation(uid, 'webhooks')
 
 
 def user_webhook_status_db(uid: str, wtype: str):
@@ -427,6 +536,65 @@ def get_user_webhook_db(uid: str, wtype: str) -> str:
     return url.decode()
 
 
+def get_user_webhook_with_status_db(uid: str, wtype: str) -> (Optional[bool], str):
+    """Status and url of the webhook in one round trip."""
+    pipe = r.pipeline()
+    pipe.get(f'users:{uid}:developer:webhook_status:{wtype}')
+    pipe.get(f'users:{uid}:developer:webhook:{wtype}')
+    status, url = pipe.execute()
+    return (None if status is None else status.decode() == str(True).lower()), (url.decode() if url else '')
+
+
+# Sessions holding a snapshot of the user settings (utils/user_context.py) drop the invalidated fields
+USER_CONTEXT_INVALIDATION_CHANNEL = 'user_context:invalidate'
+
+
+@try_catch_decorator
+def publish_user_context_invalidation(uid: str, *fields: str):
+    r.publish(USER_CONTEXT_INVALIDATION_CHANNEL, json.dumps({'uid': uid, 'fields': list(fields)}))
+
+
+# The live session holding an in-progress conversation (utils/conversations/segment_store.py) writes its
+# segments on request, before another reader finalises the conversation
+IN_PROGRESS_CONVERSATION_FLUSH_CHANNEL = 'in_progress_conversation:flush'
+
+
+def set_in_progress_conversation_holder(conversation_id: str, holder: str, ttl: int = 150):
+    r.set(f'in_progress_conversation_holder:{conversation_id}', holder, ex=ttl)
+
+
+def hold_in_progress_conversation(uid: str, conversation_id: str, holder: str, ttl: int = 150):
+    """The in-progress conversation of the user and its holder, in a single round trip."""
+    pipe = r.pipeline()
+    pipe.set(f'users:{uid}:in_progress_memory_id', conversation_id, ex=ttl)
+    pipe.set(f'in_progress_conversation_holder:{conversation_id}', holder, ex=ttl)
+    pipe.execute()
+
+
+def remove_in_progress_conversation_holder(conversation_id: str, holder: str):
+    key = f'in_progress_conversation_holder:{conversation_id}'
+    if r.get(key) == holder.encode():
+        r.delete(key)
+
+
+def get_in_progress_conversation_holder(conversation_id: str) -> Optional[str]:
+    holder = r.get(f'in_progress_conversation_holder:{conversation_id}')
+    return holder.decode() if holder else None
+
+
+def publish_in_progress_conversation_flush(conversation_id: str, request_id: str, release: bool):
+    r.publish(IN_PROGRESS_CONVERSATION_FLUSH_CHANNEL,
+              json.dumps({'conversation_id': conversation_id, 'request_id': request_id, 'release': release}))
+
+
+def set_in_progress_conversation_flushed(request_id: str, ttl: int = 60):
+    r.set(f'in_progress_conversation_flushed:{request_id}', 1, ex=ttl)
+
+
+def is_in_progress_conversation_flushed(request_id: str) -> bool:
+    return r.exists(f'in_progress_conversation_flushed:{request_id}') > 0
+
+
 def get_filter_category_items(uid: str, category: str) -> List[str]:
     val = r.smembers(f'users:{uid}:filters:{category}')
     if not val:
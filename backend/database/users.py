@@ -2,7 +2,7 @@ from datetime import datetime, timezone
 
 from google.cloud.firestore_v1 import FieldFilter
 
-from ._client import db, document_id_from_seed
+from ._client import db, document_id_from_seed, get_async_db
 
 
 def is_exists_user(uid: str):
@@ -18,6 +18,16 @@ def get_user_store_recording_permission(uid: str):
     return user_data.get('store_recording_permission', False)
 
 
+def get_user_settings(uid: str) -> dict:
+    """The settings of the user document read by the realtime sessions, in a single read."""
+    user_data = db.collection('users').document(uid).get().to_dict() or {}
+    return {
+        'store_recording_permission': user_data.get('store_recording_permission', False),
+        'language': user_data.get('language', ''),
+        'fcm_token': user_data.get('fcm_token'),
+    }
+
+
 def set_user_store_recording_permission(uid: str, value: bool):
     user_ref = db.collection('users').document(uid)
     user_ref.update({'store_recording_permission': value})
@@ -201,3 +211,12 @@ def set_user_language_preference(uid: str, language: str) -> None:
     """
     user_ref = db.collection('users').document(uid)
     user_ref.set({'language': language}, merge=True)
+
+
+# *****************************
+# *********** ASYNC ***********
+# *****************************
+
+async def is_exists_user_async(uid: str):
+    user_doc = await get_async_db().collection('users').document(uid).get()
+    return user_doc.exists
@@ -7,7 +7,7 @@ from fastapi import FastAPI
 from modal import Image, App, asgi_app, Secret
 from routers import workflow, chat, firmware, plugins, transcribe, notifications, \
     speech_profile, agents, users, trends, sync, apps, custom_auth, \
-    payment, integration, conversations, memories, mcp, oauth # Added oauth
+    payment, integration, conversations, memories, mcp, oauth, metrics
 
 from utils.other.timeout import TimeoutMiddleware
 
@@ -43,6 +43,7 @@ app.include_router(oauth.router) # Added oauth router
 
 app.include_router(payment.router)
 app.include_router(mcp.router)
+app.include_router(metrics.router)
 
 
 methods_timeout = {
@@ -106,6 +106,30 @@ class LastConversationEvent(MessageEvent):
         return j
 
 
+class TranscriptProtocolEvent(MessageEvent):
+    event_type: str = "transcript_protocol"
+    protocol: str
+
+    def to_json(self):
+        j = self.model_dump(mode="json")
+        j["type"] = self.event_type
+        del j["event_type"]
+        return j
+
+
+class SessionResumableEvent(MessageEvent):
+    event_type: str = "session_resumable"
+    token: str
+    resumable_seconds: int
+    resumed: bool = False
+
+    def to_json(self):
+        j = self.model_dump(mode="json")
+        j["type"] = self.event_type
+        del j["event_type"]
+        return j
+
+
 class TranslationEvent(MessageEvent):
     event_type: str = "translating"
     segments: List = []
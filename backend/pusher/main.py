@@ -5,7 +5,7 @@ import firebase_admin
 from fastapi import FastAPI
 
 from modal import Image, App, asgi_app, Secret
-from routers import pusher
+from routers import pusher, metrics
 
 if os.environ.get('SERVICE_ACCOUNT_JSON'):
     service_account_info = json.loads(os.environ["SERVICE_ACCOUNT_JSON"])
@@ -16,6 +16,7 @@ else:
 
 app = FastAPI()
 app.include_router(pusher.router)
+app.include_router(metrics.router)
 
 modal_app = App(
     name='pusher',
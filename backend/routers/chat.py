@@ -1,3 +1,4 @@
+import asyncio
 import uuid
 import re
 import base64
@@ -10,7 +11,7 @@ from fastapi.responses import StreamingResponse
 from multipart.multipart import shutil
 
 import database.chat as chat_db
-from database.apps import record_app_usage
+from database.apps import record_app_usage_async
 from models.app import App, UsageHistoryType
 from models.chat import ChatSession, Message, SendMessageRequest, MessageSender, ResponseMessage, MessageConversation, \
     FileChat
@@ -53,7 +54,7 @@ def acquire_chat_session(uid: str, plugin_id: Optional[str] = None):
 
 
 @router.post('/v2/messages', tags=['chat'], response_model=ResponseMessage)
-def send_message(
+async def send_message(
         data: SendMessageRequest, plugin_id: Optional[str] = None, uid: str = Depends(auth.get_current_user_uid)
 ):
     print('send_message', data.text, plugin_id, uid)
@@ -62,7 +63,7 @@ def send_message(
         plugin_id = None
 
     # get chat session
-    chat_session = chat_db.get_chat_session(uid, app_id=plugin_id)
+    chat_session = await chat_db.get_chat_session_async(uid, app_id=plugin_id)
     chat_session = ChatSession(**chat_session) if chat_session else None
 
     message = Message(
@@ -74,29 +75,29 @@ def send_message(
         if chat_session:
             new_file_ids = chat_session.retrieve_new_file(data.file_ids)
             chat_session.add_file_ids(data.file_ids)
-            chat_db.add_files_to_chat_session(uid, chat_session.id, data.file_ids)
+            await chat_db.add_files_to_chat_session_async(uid, chat_session.id, data.file_ids)
 
         if len(new_file_ids) > 0:
             message.files_id = new_file_ids
-            files = chat_db.get_chat_files(uid, new_file_ids)
+            files = await chat_db.get_chat_files_async(uid, new_file_ids)
             files = [FileChat(**f) if f else None for f in files]
             message.files = files
             fc.add_files(new_file_ids)
 
     if chat_session:
         message.chat_session_id = chat_session.id
-        chat_db.add_message_to_chat_session(uid, chat_session.id, message.id)
+        await chat_db.add_message_to_chat_session_async(uid, chat_session.id, message.id)
 
-    chat_db.add_message(uid, message.dict())
+    await chat_db.add_message_async(uid, message.dict())
 
-    app = get_available_app_by_id(plugin_id, uid)
+    app = await asyncio.to_thread(get_available_app_by_id, plugin_id, uid)
     app = App(**app) if app else None
 
     app_id = app.id if app else None
 
-    messages = list(reversed([Message(**msg) for msg in chat_db.get_messages(uid, limit=10, app_id=plugin_id)]))
+    messages = list(reversed([Message(**msg) for msg in await chat_db.get_messages_async(uid, limit=10, app_id=plugin_id)]))
 
-    def process_message(response: str, callback_data: dict):
+    async def process_message(response: str, callback_data: dict):
         memories = callback_data.get('memories_found', [])
         ask_for_nps = callback_data.get('ask_for_nps', False)
 
@@ -128,12 +129,12 @@ def send_message(
         )
         if chat_session:
             ai_message.chat_session_id = chat_session.id
-            chat_db.add_message_to_chat_session(uid, chat_session.id, ai_message.id)
+            await chat_db.add_message_to_chat_session_async(uid, chat_session.id, ai_message.id)
 
-        chat_db.add_message(uid, ai_message.dict())
+        await chat_db.add_message_async(uid, ai_message.dict())
         ai_message.memories = [MessageConversation(**m) for m in (memories if len(memories) < 5 else memories[:5])]
         if app_id:
-            record_app_usage(uid, app_id, UsageHistoryType.chat_message_sent, message_id=ai_message.id)
+            await record_app_usage_async(uid, app_id, UsageHistoryType.chat_message_sent, message_id=ai_message.id)
 
         return ai_message, ask_for_nps
 
@@ -147,7 +148,7 @@ def send_message(
             else:
                 response = callback_data.get('answer')
                 if response:
-                    ai_message, ask_for_nps = process_message(response, callback_data)
+                    ai_message, ask_for_nps = await process_message(response, callback_data)
                     ai_message_dict = ai_message.dict()
                     response_message = ResponseMessage(**ai_message_dict)
                     response_message.ask_for_nps = ask_for_nps
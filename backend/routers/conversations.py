@@ -8,6 +8,7 @@ from models.conversation import SearchRequest
 
 from utils.conversations.process_conversation import process_conversation, retrieve_in_progress_conversation
 from utils.conversations.search import search_conversations
+from utils.conversations.segment_store import request_in_progress_conversation_flush
 from utils.llm.conversation_processing import generate_summary_with_prompt
 from utils.other import endpoints as auth
 from utils.other.storage import get_conversation_recording_if_exists
@@ -28,6 +29,9 @@ def process_in_progress_conversation(uid: str = Depends(auth.get_current_user_ui
     conversation = retrieve_in_progress_conversation(uid)
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation in progress not found")
+    # the live session holding it writes its last segments, its next ones start a new conversation
+    if request_in_progress_conversation_flush(conversation['id'], release=True):
+        conversation = conversations_db.get_conversation(uid, conversation['id'])
     redis_db.remove_in_progress_conversation_id(uid)
 
     conversation = Conversation(**conversation)
@@ -352,7 +356,7 @@ def get_shared_conversation_by_id(conversation_id: str):
 
 
 @router.get("/v1/public-conversations", response_model=List[Conversation], tags=['conversations'])
-def get_public_conversations(offset: int = 0, limit: int = 1000):
+async def get_public_conversations(offset: int = 0, limit: int = 1000):
     conversations = redis_db.get_public_conversations()
     data = []
 
@@ -361,7 +365,7 @@ def get_public_conversations(offset: int = 0, limit: int = 1000):
     data = [[uid, conversation_id] for conversation_id, uid in conversation_uids.items() if uid]
     # TODO: sort in some way to have proper pagination
 
-    conversations = conversations_db.run_get_public_conversations(data[offset:offset + limit])
+    conversations = await conversations_db.get_public_conversations_async(data[offset:offset + limit])
     for conversation in conversations:
         conversation['geolocation'] = None
     return conversations
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from datetime import datetime, timedelta, timezone
 from typing import Optional, List, Tuple, Union
@@ -81,7 +82,7 @@ async def create_conversation_via_integration(
         raise HTTPException(status_code=403, detail="Invalid integration API key")
 
     # Verify if the app exists
-    app = apps_db.get_app_by_id_db(app_id)
+    app = await apps_db.get_app_by_id_db_async(app_id)
     if not app:
         raise HTTPException(status_code=404, detail="App not found")
 
@@ -120,10 +121,10 @@ async def create_conversation_via_integration(
     create_conversation.app_id = app_id
 
     # Process
-    conversation = process_conversation(uid, language_code, create_conversation)
+    conversation = await asyncio.to_thread(process_conversation, uid, language_code, create_conversation)
 
     # Always trigger integration
-    trigger_external_integrations(uid, conversation)
+    await asyncio.to_thread(trigger_external_integrations, uid, conversation)
 
     # TODO: Empty for now, replace with ConversationCreateResponse once we don't have to wait for process_conversation
     # to finish for the conversation id
@@ -148,7 +149,7 @@ async def create_memories_via_integration(
         raise HTTPException(status_code=403, detail="Invalid integrationAPI key")
 
     # Verify if the app exists
-    app = apps_db.get_app_by_id_db(app_id)
+    app = await apps_db.get_app_by_id_db_async(app_id)
     if not app:
         raise HTTPException(status_code=404, detail="App not found")
 
@@ -167,7 +168,7 @@ async def create_memories_via_integration(
         raise HTTPException(status_code=422, detail="Either text or explicit memories(facts) are required and cannot be empty")
 
     # Process and save the memory using the utility function
-    process_external_integration_memory(uid, fact_data, app_id)
+    await asyncio.to_thread(process_external_integration_memory, uid, fact_data, app_id)
 
     # Empty response
     return {}
@@ -191,7 +192,7 @@ async def create_facts_via_integration(
         raise HTTPException(status_code=403, detail="Invalid integrationAPI key")
 
     # Verify if the app exists
-    app = apps_db.get_app_by_id_db(app_id)
+    app = await apps_db.get_app_by_id_db_async(app_id)
     if not app:
         raise HTTPException(status_code=404, detail="App not found")
 
@@ -210,7 +211,7 @@ async def create_facts_via_integration(
         raise HTTPException(status_code=422, detail="Either text or explicit memories(facts) are required and cannot be empty")
 
     # Process and save the memory using the utility function
-    process_external_integration_memory(uid, fact_data, app_id)
+    await asyncio.to_thread(process_external_integration_memory, uid, fact_data, app_id)
 
     # Empty response
     return {}
@@ -238,7 +239,7 @@ async def get_memories_via_integration(
         raise HTTPException(status_code=403, detail="Invalid integrationAPI key")
 
     # Verify if the app exists
-    app = apps_db.get_app_by_id_db(app_id)
+    app = await apps_db.get_app_by_id_db_async(app_id)
     if not app:
         raise HTTPException(status_code=404, detail="App not found")
 
@@ -251,7 +252,7 @@ async def get_memories_via_integration(
     if not apps_utils.app_can_read_memories(app):
         raise HTTPException(status_code=403, detail="App does not have the capability to read memories")
 
-    memories = memory_db.get_memories(uid, limit=limit, offset=offset)
+    memories = await memory_db.get_memories_async(uid, limit=limit, offset=offset)
     memory_items = [integration_models.MemoryItem(**fact) for fact in memories]
 
     return {"memories": memory_items}
@@ -289,7 +290,7 @@ async def get_conversations_via_integration(
         raise HTTPException(status_code=403, detail="Invalid API key")
 
     # Verify if the app exists
-    app = apps_db.get_app_by_id_db(app_id)
+    app = await apps_db.get_app_by_id_db_async(app_id)
     if not app:
         raise HTTPException(status_code=404, detail="App not found")
 
@@ -315,7 +316,7 @@ async def get_conversations_via_integration(
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid end_date format. Use ISO format (YYYY-MM-DDTHH:MM:SS.sssZ)")
 
-    conversations_data = conversations_db.get_conversations(
+    conversations_data = await conversations_db.get_conversations_async(
         uid,
         limit=limit,
         offset=offset,
@@ -370,7 +371,7 @@ async def search_conversations_via_integration(
         raise HTTPException(status_code=403, detail="Invalid API key")
 
     # Verify if the app exists
-    app = apps_db.get_app_by_id_db(app_id)
+    app = await apps_db.get_app_by_id_db_async(app_id)
     if not app:
         raise HTTPException(status_code=404, detail="App not found")
 
@@ -394,7 +395,8 @@ async def search_conversations_via_integration(
         end_timestamp = int(datetime.fromisoformat(search_request.end_date).timestamp())
 
     # Search conversations
-    search_results = search_conversations(
+    search_results = await asyncio.to_thread(
+        search_conversations,
         query=search_request.query,
         page=search_request.page,
         per_page=search_request.per_page,
@@ -410,7 +412,7 @@ async def search_conversations_via_integration(
     # Get full conversation data using the IDs
     full_conversations = []
     if conversation_ids:
-        full_conversations = conversations_db.get_conversations_by_id(uid, conversation_ids)
+        full_conversations = await asyncio.to_thread(conversations_db.get_conversations_by_id, uid, conversation_ids)
 
     # Convert database conversations to integration model
     conversation_items = []
@@ -457,7 +459,7 @@ async def send_notification_via_integration(
         raise HTTPException(status_code=403, detail="Invalid API key")
 
     # Verify if the app exists
-    app_data = apps_utils.get_available_app_by_id(app_id, uid)
+    app_data = await asyncio.to_thread(apps_utils.get_available_app_by_id, app_id, uid)
     if not app_data:
         raise HTTPException(status_code=404, detail='App not found')
 
@@ -488,8 +490,8 @@ async def send_notification_via_integration(
             }
         )
 
-    token = notification_db.get_token_only(uid)
-    send_app_notification(token, app.name, app.id, message)
+    token = await asyncio.to_thread(notification_db.get_token_only, uid)
+    await asyncio.to_thread(send_app_notification, token, app.name, app.id, message)
     return JSONResponse(
         status_code=200,
         headers=headers,
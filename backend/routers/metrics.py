@@ -0,0 +1,20 @@
+import hmac
+import os
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from utils.other.metrics import render_metrics, CONTENT_TYPE
+
+router = APIRouter()
+
+# Bearer token the scraper must send, the endpoint refuses every request when unset
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+
+@router.get('/metrics', include_in_schema=False)
+def get_metrics(authorization: str = Header(None)):
+    if not METRICS_TOKEN or not hmac.compare_digest((authorization or '').encode(),
+                                                    f'Bearer {METRICS_TOKEN}'.encode()):
+        raise HTTPException(status_code=403, detail='You are not authorized to perform this action')
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
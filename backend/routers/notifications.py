@@ -5,7 +5,7 @@ from fastapi import APIRouter, Depends, Header, HTTPException, Request
 from fastapi.responses import JSONResponse
 from typing import Tuple, Optional
 
-from database.redis_db import get_enabled_apps, r as redis_client
+from database.redis_db import get_enabled_apps, r as redis_client, publish_user_context_invalidation
 from utils.apps import get_available_app_by_id, verify_api_key
 from utils.app_integrations import send_app_notification
 import database.notifications as notification_db
@@ -58,6 +58,7 @@ def check_rate_limit(app_id: str, user_id: str) -> Tuple[bool, int, int, int]:
 @router.post('/v1/users/fcm-token')
 def save_token(data: SaveFcmTokenRequest, uid: str = Depends(auth.get_current_user_uid)):
     notification_db.save_token(uid, data.dict())
+    publish_user_context_invalidation(uid, 'user')
     return {'status': 'Ok'}
 
 # ******************************************************
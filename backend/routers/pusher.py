@@ -1,23 +1,141 @@
-import struct
 import asyncio
 import json
+from typing import Dict, Optional
 
 from fastapi import APIRouter
 from fastapi.websockets import WebSocketDisconnect, WebSocket
 from starlette.websockets import WebSocketState
 
-from utils.apps import is_audio_bytes_app_enabled
 from utils.app_integrations import trigger_realtime_integrations, trigger_realtime_audio_bytes
 from utils.webhooks import send_audio_bytes_developer_webhook, realtime_transcript_webhook, \
     get_audio_bytes_webhook_seconds
+from utils.other.metrics import Counter, Gauge
+from utils.pusher_framing import AUDIO_BYTES_FRAME, decode_legacy_frame, iter_frames, split_channel_message, \
+    TRANSCRIPT_FRAME
+from utils.pusher_outbox import PusherSessionOffsets
+from utils.pusher_triggers import TriggerGroup
+from utils.user_context import acquire_user_context, release_user_context
 
 router = APIRouter()
 
+PUSHER_SESSIONS = Gauge('pusher_sessions_active', 'Trigger sessions running')
+PUSHER_MUX_CONNECTIONS = Gauge('pusher_mux_connections_active', 'Multiplexed connections from the backend pods')
+PUSHER_MESSAGES = Counter('pusher_messages_total', 'Messages received from the listen sessions', ['type'])
+PUSHER_BYTES = Counter('pusher_bytes_total', 'Bytes received from the listen sessions', ['type'])
+
+# The acknowledgements of the sessions of a multiplexed connection are sent together, at most every
+PUSHER_MUX_ACK_INTERVAL_SECONDS = 0.05
+
+
+class TriggerSession:
+    """
+    The triggers of a listen session: the realtime integrations and webhooks of its transcripts, the audio
+    bytes apps and webhook of its audio.
+
+    With a session id the frames are sequenced, the session resumes from the offsets persisted by a
+    previous pusher. The triggers run in the TriggerGroup of the session, the frames are handled without
+    waiting for them.
+
+    Creating a session reads the settings of the user and the offsets, blocking: use `create` on the loop.
+    """
+
+    def __init__(self, uid: str, sample_rate: int = 8000, session_id: Optional[str] = None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.uid = uid
+        self.sample_rate = sample_rate
+        self.triggers = TriggerGroup(uid, loop=loop)
+
+        # settings of the user, read once for the session and shared with the triggers
+        self.user_context = acquire_user_context(uid)
+        PUSHER_SESSIONS.inc()
+
+        # audio bytes
+        self.audio_bytes_webhook_delay_seconds = get_audio_bytes_webhook_seconds(uid)
+        self.audio_bytes_trigger_delay_seconds = 5
+        self.has_audio_apps_enabled = self.user_context.audio_bytes_apps_enabled
+        self.audiobuffer = bytearray()
+        self.trigger_audiobuffer = bytearray()
+
+        self.transcript_messages = PUSHER_MESSAGES.labels('transcript')
+        self.transcript_bytes = PUSHER_BYTES.labels('transcript')
+        self.audio_messages = PUSHER_MESSAGES.labels('audio_bytes')
+        self.audio_bytes = PUSHER_BYTES.labels('audio_bytes')
+
+        # Sequenced frames of a listen session outbox, resumed from the offset persisted by a previous pusher
+        self.offsets = PusherSessionOffsets.load(session_id) if session_id else None
+
+    @staticmethod
+    async def create(uid: str, sample_rate: int = 8000, session_id: Optional[str] = None) -> 'TriggerSession':
+        """A session created off the loop, its triggers running on it."""
+        return await asyncio.to_thread(TriggerSession, uid, sample_rate, session_id, asyncio.get_running_loop())
+
+    def handle(self, data) -> Optional[int]:
+        """Handles a message of the session, returns the offset to acknowledge if it moved."""
+        uid, triggers, offsets = self.uid, self.triggers, self.offsets
+        if offsets is not None:
+            frames = iter_frames(data)
+        else:
+            header_type, payload = decode_legacy_frame(data)
+            frames = ((header_type, None, payload),)
+
+        offset = None
+        for header_type, seq, payload in frames:
+            if seq is not None and seq <= offsets.offset:
+                # replayed, already done with
+                continue
+
+            # Transcript
+            if header_type == TRANSCRIPT_FRAME:
+                self.transcript_messages.inc()
+                self.transcript_bytes.inc(len(payload))
+                if seq is None or not offsets.is_processed(seq):
+                    res = json.loads(str(payload, "utf-8"))
+                    segments = res.get('segments')
+                    memory_id = res.get('memory_id')
+                    triggers.submit('realtime_integrations', trigger_realtime_integrations, uid, segments, memory_id)
+                    triggers.submit('realtime_transcript_webhook', realtime_transcript_webhook, uid, segments)
+
+            # Audio bytes
+            elif header_type == AUDIO_BYTES_FRAME:
+                self.audio_messages.inc()
+                self.audio_bytes.inc(len(payload))
+                if self.has_audio_apps_enabled and (seq is None or offsets.should_buffer('trigger', seq)):
+                    self.trigger_audiobuffer.extend(payload)
+                    if seq is not None:
+                        offsets.buffered('trigger', seq)
+                    if len(self.trigger_audiobuffer) > self.sample_rate * self.audio_bytes_trigger_delay_seconds * 2:
+                        triggers.submit('realtime_audio_bytes', trigger_realtime_audio_bytes, uid, self.sample_rate,
+                                        self.trigger_audiobuffer)
+                        self.trigger_audiobuffer = bytearray()
+                        if seq is not None:
+                            offsets.flushed_buffer('trigger', seq)
+                if self.audio_bytes_webhook_delay_seconds and (seq is None or offsets.should_buffer('webhook', seq)):
+                    self.audiobuffer.extend(payload)
+                    if seq is not None:
+                        offsets.buffered('webhook', seq)
+                    if len(self.audiobuffer) > self.sample_rate * self.audio_bytes_webhook_delay_seconds * 2:
+                        triggers.submit('audio_bytes_webhook', send_audio_bytes_developer_webhook, uid,
+                                        self.sample_rate, self.audiobuffer)
+                        self.audiobuffer = bytearray()
+                        if seq is not None:
+                            offsets.flushed_buffer('webhook', seq)
+
+            if seq is not None:
+                offset = offsets.done(seq) or offset
+        return offset
+
+    def close(self):
+        print('TriggerSession user context', self.uid, self.user_context.stats(), 'triggers dropped',
+              self.triggers.dropped, 'expired', self.triggers.expired)
+        self.triggers.close()
+        release_user_context(self.uid)
+        PUSHER_SESSIONS.dec()
+
 
 async def _websocket_util_trigger(
-        websocket: WebSocket, uid: str, sample_rate: int = 8000,
+        websocket: WebSocket, uid: str, sample_rate: int = 8000, session_id: Optional[str] = None,
 ):
-    print('_websocket_util_trigger', uid)
+    print('_websocket_util_trigger', uid, session_id)
 
     try:
         await websocket.accept()
@@ -29,50 +147,29 @@ async def _websocket_util_trigger(
     websocket_active = True
     websocket_close_code = 1000
 
-    loop = asyncio.get_event_loop()
-
-    # audio bytes
-    audio_bytes_webhook_delay_seconds = get_audio_bytes_webhook_seconds(uid)
-    audio_bytes_trigger_delay_seconds = 5
-    has_audio_apps_enabled = is_audio_bytes_app_enabled(uid)
+    try:
+        session = await TriggerSession.create(uid, sample_rate, session_id)
+    except Exception as e:
+        print(f'Could not create the trigger session: error {e}', uid)
+        await websocket.close(code=1011)
+        return
+    if session.offsets is not None:
+        await websocket.send_text(json.dumps({'type': 'resume', 'offset': session.offsets.offset}))
 
     # task
     async def receive_tasks():
         nonlocal websocket_active
         nonlocal websocket_close_code
 
-        audiobuffer = bytearray()
-        trigger_audiobuffer = bytearray()
-
         try:
             while websocket_active:
                 data = await websocket.receive_bytes()
-                header_type = struct.unpack('<I', data[:4])[0]
-
-                # Transcript
-                if header_type == 102:
-                    res = json.loads(bytes(data[4:]).decode("utf-8"))
-                    segments = res.get('segments')
-                    memory_id = res.get('memory_id')
-                    asyncio.run_coroutine_threadsafe(trigger_realtime_integrations(uid, segments, memory_id), loop)
-                    asyncio.run_coroutine_threadsafe(realtime_transcript_webhook(uid, segments), loop)
-                    continue
-
-                # Audio bytes
-                if header_type == 101:
-                    audiobuffer.extend(data[4:])
-                    trigger_audiobuffer.extend(data[4:])
-                    if has_audio_apps_enabled and len(
-                            trigger_audiobuffer) > sample_rate * audio_bytes_trigger_delay_seconds * 2:
-                        asyncio.run_coroutine_threadsafe(
-                            trigger_realtime_audio_bytes(uid, sample_rate, trigger_audiobuffer.copy()), loop)
-                        trigger_audiobuffer = bytearray()
-                    if audio_bytes_webhook_delay_seconds and len(
-                            audiobuffer) > sample_rate * audio_bytes_webhook_delay_seconds * 2:
-                        asyncio.run_coroutine_threadsafe(
-                            send_audio_bytes_developer_webhook(uid, sample_rate, audiobuffer.copy()), loop)
-                        audiobuffer = bytearray()
-                    continue
+                offset = session.handle(data)
+                # Acknowledge what is done with once persisted, the backend drops it from the outbox
+                if session.offsets is not None:
+                    await session.offsets.save()
+                if offset is not None:
+                    await websocket.send_text(json.dumps({'type': 'ack', 'offset': offset}))
 
         except WebSocketDisconnect:
             print("WebSocket disconnected")
@@ -90,6 +187,107 @@ async def _websocket_util_trigger(
         print(f"Error during WebSocket operation: {e}")
     finally:
         websocket_active = False
+        session.close()
+        if websocket.client_state == WebSocketState.CONNECTED:
+            try:
+                await websocket.close(code=websocket_close_code)
+            except Exception as e:
+                print(f"Error closing WebSocket: {e}")
+
+
+async def _websocket_util_trigger_mux(websocket: WebSocket):
+    """
+    A multiplexed connection of a backend pod, carrying the sequenced frames of many listen sessions.
+
+    The backend opens a session on a channel of the connection, the messages of the channel are then
+    handled by its TriggerSession. The pusher acknowledges the offset of the sessions and the last frame
+    processed, every PUSHER_MUX_ACK_INTERVAL_SECONDS for all the sessions with new frames, the backend sends
+    more frames of a session as they are processed. A session failing is closed alone, the backend opens it
+    again.
+    """
+    try:
+        await websocket.accept()
+    except RuntimeError as e:
+        print(e)
+        await websocket.close(code=1011, reason="Dirty state")
+        return
+
+    PUSHER_MUX_CONNECTIONS.inc()
+    sessions: Dict[int, TriggerSession] = {}
+    # channel -> [offset, processed] not acknowledged yet
+    pending_acks: Dict[int, list] = {}
+    websocket_active = True
+    websocket_close_code = 1000
+
+    async def send_acks():
+        while websocket_active:
+            await asyncio.sleep(PUSHER_MUX_ACK_INTERVAL_SECONDS)
+            if not pending_acks:
+                continue
+            acks = [[channel, offset, processed] for channel, (offset, processed) in pending_acks.items()]
+            pending_acks.clear()
+            try:
+                # persisted before they are acknowledged
+                await PusherSessionOffsets.save_many([sessions[channel].offsets for channel, _, _ in acks
+                                                      if channel in sessions])
+                await websocket.send_text(json.dumps({'type': 'ack', 'acks': acks}))
+            except Exception as e:
+                print(f"Error sending the acknowledgements: {e}")
+                return
+
+    ack_task = asyncio.create_task(send_acks())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+
+            if message.get('bytes') is not None:
+                channel, data = split_channel_message(message['bytes'])
+                session = sessions.get(channel)
+                if session is None:
+                    continue
+                try:
+                    session.handle(data)
+                except Exception as e:
+                    print(f'Could not process the session {session.uid}: error {e}')
+                    sessions.pop(channel).close()
+                    pending_acks.pop(channel, None)
+                    await websocket.send_text(json.dumps({'type': 'closed', 'channel': channel}))
+                    continue
+                pending_acks[channel] = [session.offsets.offset, session.offsets.processed]
+                continue
+
+            control = json.loads(message['text'])
+            channel = control.get('channel')
+            if control.get('type') == 'open':
+                if channel in sessions:
+                    sessions.pop(channel).close()
+                try:
+                    session = await TriggerSession.create(control['uid'], control.get('sample_rate', 8000),
+                                                          control['session_id'])
+                except Exception as e:
+                    print(f'Could not create the trigger session {control["uid"]}: error {e}')
+                    await websocket.send_text(json.dumps({'type': 'closed', 'channel': channel}))
+                    continue
+                sessions[channel] = session
+                await websocket.send_text(json.dumps({'type': 'resume', 'channel': channel,
+                                                      'offset': session.offsets.offset}))
+            elif control.get('type') == 'close' and channel in sessions:
+                sessions.pop(channel).close()
+                pending_acks.pop(channel, None)
+
+    except WebSocketDisconnect:
+        print("WebSocket disconnected")
+    except Exception as e:
+        print(f"Error during multiplexed WebSocket operation: {e}")
+        websocket_close_code = 1011
+    finally:
+        websocket_active = False
+        ack_task.cancel()
+        for session in sessions.values():
+            session.close()
+        PUSHER_MUX_CONNECTIONS.dec()
         if websocket.client_state == WebSocketState.CONNECTED:
             try:
                 await websocket.close(code=websocket_close_code)
@@ -99,6 +297,11 @@ async def _websocket_util_trigger(
 
 @router.websocket("/v1/trigger/listen")
 async def websocket_endpoint_trigger(
-        websocket: WebSocket, uid: str, sample_rate: int = 8000,
+        websocket: WebSocket, uid: str, sample_rate: int = 8000, session_id: Optional[str] = None,
 ):
-    await _websocket_util_trigger(websocket, uid, sample_rate)
+    await _websocket_util_trigger(websocket, uid, sample_rate, session_id)
+
+
+@router.websocket("/v1/trigger/mux")
+async def websocket_endpoint_trigger_mux(websocket: WebSocket):
+    await _websocket_util_trigger_mux(websocket)
@@ -16,6 +16,7 @@ from models.transcript_segment import TranscriptSegment
 from utils.conversations.process_conversation import process_conversation
 from utils.other import endpoints as auth
 from utils.other.storage import get_syncing_file_temporal_signed_url, delete_syncing_temporal_file
+from utils.stt.opus_decoder import decode_opus_frames
 from utils.stt.pre_recorded import fal_whisperx, fal_postprocessing
 from utils.stt.vad import vad_is_empty
 
@@ -28,8 +29,7 @@ import wave
 def decode_opus_file_to_wav(opus_file_path, wav_file_path, sample_rate=16000, channels=1, frame_size: int = 160):
     decoder = Decoder(sample_rate, channels)
     with open(opus_file_path, 'rb') as f:
-        pcm_data = []
-        frame_count = 0
+        frames = []
         while True:
             length_bytes = f.read(4)
             if not length_bytes:
@@ -40,28 +40,25 @@ def decode_opus_file_to_wav(opus_file_path, wav_file_path, sample_rate=16000, ch
                 break
 
             frame_length = struct.unpack('<I', length_bytes)[0]
-            # print(f"Reading frame {frame_count}: length {frame_length}")
             opus_data = f.read(frame_length)
             if len(opus_data) < frame_length:
-                print(f"Unexpected end of file at frame {frame_count}.")
+                print(f"Unexpected end of file at frame {len(frames)}.")
                 break
-            try:
-                pcm_frame = decoder.decode(opus_data, frame_size=frame_size)
-                pcm_data.append(pcm_frame)
-                frame_count += 1
-            except Exception as e:
-                print(f"Error decoding frame {frame_count}: {e}")
-                break
-        if pcm_data:
-            pcm_bytes = b''.join(pcm_data)
-            with wave.open(wav_file_path, 'wb') as wav_file:
-                wav_file.setnchannels(channels)
-                wav_file.setsampwidth(2)  # 16-bit audio
-                wav_file.setframerate(sample_rate)
-                wav_file.writeframes(pcm_bytes)
-            print(f"Decoded audio saved to {wav_file_path}")
-        else:
-            print("No PCM data was decoded.")
+            frames.append(opus_data)
+
+    # all the frames decoded into a single PCM buffer
+    pcm_bytes, offsets, error = decode_opus_frames(decoder, frames, frame_size, channels)
+    if error is not None:
+        print(f"Error decoding frame {len(offsets)}: {error}")
+    if offsets:
+        with wave.open(wav_file_path, 'wb') as wav_file:
+            wav_file.setnchannels(channels)
+            wav_file.setsampwidth(2)  # 16-bit audio
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(pcm_bytes)
+        print(f"Decoded audio saved to {wav_file_path}")
+    else:
+        print("No PCM data was decoded.")
 
 
 def get_timestamp_from_path(path: str):
@@ -1,9 +1,9 @@
 import os
 import uuid
 import asyncio
-import struct
 from datetime import datetime, timezone, timedelta, time
 from enum import Enum
+from typing import Optional
 
 import opuslib
 import webrtcvad
@@ -15,37 +15,66 @@ from starlette.websockets import WebSocketState
 import database.conversations as conversations_db
 import database.users as user_db
 from database import redis_db
-from database.redis_db import get_cached_user_geolocation
-from models.conversation import Conversation, TranscriptSegment, ConversationStatus, Structured, Geolocation
+from models.chat import Message
+from models.conversation import Conversation, TranscriptSegment, ConversationStatus, Structured
 from models.message_event import ConversationEvent, MessageEvent, MessageServiceStatusEvent, LastConversationEvent, \
-    TranslationEvent
+    TranslationEvent, TranscriptProtocolEvent, SessionResumableEvent
 from models.transcript_segment import Translation
-from utils.apps import is_audio_bytes_app_enabled
-from utils.conversations.location import get_google_maps_location
-from utils.conversations.process_conversation import process_conversation, retrieve_in_progress_conversation
+from utils.conversations.process_conversation import retrieve_in_progress_conversation_async
+from utils.conversations.processing_queue import get_conversation_processing_workers, process_conversation_job, \
+    ConversationQueueFull
+from utils.conversations.segment_store import InProgressConversationStore, request_in_progress_conversation_flush
 from utils.other.task import safe_create_task
-from utils.app_integrations import trigger_external_integrations
 from utils.stt.streaming import *
 from utils.stt.streaming import get_stt_service_for_language, STTService
-from utils.stt.streaming import process_audio_soniox, process_audio_dg, process_audio_speechmatics, \
-    send_initial_file_path
+from utils.stt.streaming import process_audio_soniox, process_audio_dg, process_audio_speechmatics
+from utils.stt.pre_roll import send_initial_audio_frames, PRE_ROLL_FRAME_SECONDS
+from utils.stt.segment_buffer import RealtimeSegmentBuffer
+from utils.stt.codec import is_opus_passthrough, OggOpusWriter
+from utils.stt.opus_decoder import OpusStreamDecoder, OPUS_DECODE_MAX_BATCH_FRAMES
+from utils.stt.speech_gate import SpeechGate, STT_SPEECH_GATE_ENABLED
+from utils.stt.latency import STTLatencyTracker
+from utils.stt.audio_fanout import AudioFanout, AudioSink, join_pcm, join_opus_frames, AUDIO_FANOUT_STT_MAX_SECONDS, \
+    AUDIO_FANOUT_STT_OVERFLOW, AUDIO_FANOUT_PUSHER_MAX_SECONDS
+from utils.stt.transcript_protocol import TranscriptDeltaEncoder, negotiate_transcript_protocol, \
+    TRANSCRIPT_PROTOCOL_MSGPACK_V1
 from utils.webhooks import get_audio_bytes_webhook_seconds
 from utils.pusher import connect_to_trigger_pusher
-from utils.translation import translate_text, detect_language
+from utils.pusher_framing import AUDIO_BYTES_FRAME, batch_frames, encode_frames, encode_legacy_frame, TRANSCRIPT_FRAME
+from utils.pusher_mux import get_pusher_mux, PUSHER_TRANSPORT
+from utils.pusher_outbox import create_pusher_outbox, PUSHER_OUTBOX_DRAIN_SECONDS, PUSHER_OUTBOX_REPLAYED_FRAMES, \
+    PUSHER_RESUME_TIMEOUT_SECONDS
+from utils.translation import detect_language, get_translation_batcher, normalize_text
 from utils.translation_cache import TranscriptSegmentLanguageCache
 
 from utils.other import endpoints as auth
-from utils.other.storage import get_profile_audio_if_exists
+from utils.other.metrics import Counter, Gauge, Histogram, BYTES_BUCKETS
+from utils.other.timer_wheel import get_timer_wheel
+from utils.user_context import acquire_user_context, release_user_context
+from utils.listen_session import ListenSessionSnapshot, new_resume_token, resume_listen_session, save_listen_session, \
+    LISTEN_SESSION_RESUME_SECONDS
+from utils.stt.profile_audio_cache import get_profile_audio
 
 router = APIRouter()
 
+LISTEN_SESSIONS = Gauge('listen_sessions_active', 'Listen sessions running')
+LISTEN_AUDIO_FRAMES = Counter('listen_audio_frames_total', 'Audio frames received from the clients', ['codec'])
+LISTEN_AUDIO_BYTES = Counter('listen_audio_bytes_total', 'Audio bytes received from the clients', ['codec'])
+STT_SEND_BUFFER_BYTES = Histogram('listen_stt_send_buffer_bytes',
+                                  'Bytes queued in the socket of an STT provider after an audio send', ['provider'],
+                                  buckets=BYTES_BUCKETS)
+SEGMENT_TO_CLIENT_SECONDS = Histogram('listen_segment_to_client_seconds',
+                                      'Time from a segment received from the STT provider to its update sent to the client')
+
 
 async def _listen(
         websocket: WebSocket, uid: str, language: str = 'en', sample_rate: int = 8000, codec: str = 'pcm8',
         channels: int = 1, include_speech_profile: bool = True, stt_service: STTService = None,
-        including_combined_segments: bool = False,
+        including_combined_segments: bool = False, transcript_protocol: Optional[str] = None,
+        resumable: bool = False, resume_token: Optional[str] = None,
 ):
-    print('_listen', uid, language, sample_rate, codec, include_speech_profile, stt_service)
+    print('_listen', uid, language, sample_rate, codec, include_speech_profile, stt_service, transcript_protocol,
+          resume_token is not None)
 
     if not uid or len(uid) <= 0:
         await websocket.close(code=1008, reason="Bad uid")
@@ -76,6 +105,9 @@ async def _listen(
     websocket_active = True
     websocket_close_code = 1001  # Going Away, don't close with good from backend
 
+    # Segments from STT callbacks, closed when the session ends
+    realtime_segment_buffers = RealtimeSegmentBuffer()
+
     async def _asend_message_event(msg: MessageEvent):
         nonlocal websocket_active
         print(f"Message: type ${msg.event_type}", uid)
@@ -95,6 +127,25 @@ async def _listen(
     def _send_message_event(msg: MessageEvent):
         return asyncio.create_task(_asend_message_event(msg))
 
+    # Transcript updates as msgpack deltas when the client asked for them, JSON segment lists otherwise
+    transcript_encoder = None
+    if transcript_protocol:
+        transcript_protocol = negotiate_transcript_protocol(transcript_protocol)
+        if transcript_protocol == TRANSCRIPT_PROTOCOL_MSGPACK_V1:
+            transcript_encoder = TranscriptDeltaEncoder()
+        # before any transcript, the client knows how to read them
+        await _asend_message_event(TranscriptProtocolEvent(protocol=transcript_protocol))
+
+    # Resumable session, a reconnect with the token within the grace window skips the cold setup
+    resumed: Optional[ListenSessionSnapshot] = None
+    if resume_token:
+        resumed = await asyncio.to_thread(resume_listen_session, resume_token, uid, language, codec, sample_rate)
+        print('_listen resumed' if resumed else '_listen could not resume', uid)
+    session_token = new_resume_token() if resumable or resume_token else None
+    if session_token:
+        _send_message_event(SessionResumableEvent(token=session_token, resumable_seconds=LISTEN_SESSION_RESUME_SECONDS,
+                                                  resumed=resumed is not None))
+
     # Heart beat
     started_at = time.time()
     timeout_seconds = 420  # 7m # Soft timeout, should < MODAL_TIME_OUT - 3m
@@ -142,6 +193,7 @@ async def _listen(
             websocket_close_code = 1011
         finally:
             websocket_active = False
+            realtime_segment_buffers.close()
 
     # Start heart beat
     heartbeat_task = asyncio.create_task(send_heartbeat())
@@ -149,54 +201,66 @@ async def _listen(
     _send_message_event(
         MessageServiceStatusEvent(event_type="service_status", status="initiating", status_text="Service Starting"))
 
-    # Validate user
-    if not user_db.is_exists_user(uid):
+    # Validate user, a resumed session was validated by the one it resumes
+    if resumed is None and not await user_db.is_exists_user_async(uid):
         websocket_active = False
         await websocket.close(code=1008, reason="Bad user")
         return
 
     # Stream transcript
-    async def _trigger_create_conversation_with_delay(delay_seconds: int, finished_at: datetime):
-        try:
-            await asyncio.sleep(delay_seconds)
+    async def _trigger_create_conversation(finished_at: datetime):
+        # recheck session
+        await segment_store.flush(force=True)
+        conversation = await retrieve_in_progress_conversation_async(uid)
+        # a live session on another pod holding it writes its last segments first
+        if conversation and await asyncio.to_thread(request_in_progress_conversation_flush, conversation['id'],
+                                                    False, segment_store.holder):
+            conversation = await retrieve_in_progress_conversation_async(uid)
+        if not conversation or conversation['finished_at'] > finished_at:
+            print("_trigger_create_conversation not conversation or not last session", uid)
+            return
+        await _create_current_conversation()
 
-            # recheck session
-            conversation = retrieve_in_progress_conversation(uid)
-            if not conversation or conversation['finished_at'] > finished_at:
-                print("_trigger_create_conversation_with_delay not conversation or not last session", uid)
-                return
-            await _create_current_conversation()
-        except asyncio.CancelledError:
-            pass
+    # not finished when the session closed, a resumed session finalizes them
+    processing_conversation_ids = set()
 
     async def _create_conversation(conversation: dict):
         conversation = Conversation(**conversation)
+        processing_conversation_ids.add(conversation.id)
         if conversation.status != ConversationStatus.processing:
             _send_message_event(ConversationEvent(event_type="memory_processing_started", memory=conversation))
-            conversations_db.update_conversation_status(uid, conversation.id, ConversationStatus.processing)
+            await conversations_db.update_conversation_status_async(uid, conversation.id, ConversationStatus.processing)
             conversation.status = ConversationStatus.processing
 
+        # Processed by the conversation workers, the session only waits for the result
         try:
-            # Geolocation
-            geolocation = get_cached_user_geolocation(uid)
-            if geolocation:
-                geolocation = Geolocation(**geolocation)
-                conversation.geolocation = get_google_maps_location(geolocation.latitude, geolocation.longitude)
-
-            conversation = process_conversation(uid, language, conversation)
-            messages = trigger_external_integrations(uid, conversation)
+            job_id = await conversation_workers.submit(uid, conversation.id, language)
+            result = await conversation_workers.wait(job_id)
+        except ConversationQueueFull:
+            print("Conversation processing queue full, processing in the session", uid)
+            result = await asyncio.to_thread(
+                process_conversation_job, {'uid': uid, 'conversation_id': conversation.id, 'language': language})
         except Exception as e:
             print(f"Error processing conversation: {e}", uid)
-            conversations_db.set_conversation_as_discarded(uid, conversation.id)
+            result = {'error': str(e)}
+
+        if 'error' in result:
+            await conversations_db.set_conversation_as_discarded_async(uid, conversation.id)
             conversation.discarded = True
             messages = []
+        else:
+            conversation = Conversation(**result['conversation'])
+            messages = [Message(**message) for message in result['messages']]
 
         _send_message_event(ConversationEvent(event_type="memory_created", memory=conversation, messages=messages))
+        processing_conversation_ids.discard(conversation.id)
+
+    conversation_workers = get_conversation_processing_workers()
 
     async def finalize_processing_conversations():
         # handle edge case of conversation was actually processing? maybe later, doesn't hurt really anyway.
         # also fix from getMemories endpoint?
-        processing = conversations_db.get_processing_conversations(uid)
+        processing = await conversations_db.get_processing_conversations_async(uid)
         print('finalize_processing_conversations len(processing):', len(processing), uid)
         if not processing or len(processing) == 0:
             return
@@ -207,15 +271,17 @@ async def _listen(
             await _create_conversation(conversation)
 
     # Process processing conversations
-    asyncio.create_task(finalize_processing_conversations())
+    if resumed is None or resumed.processing_conversation_ids:
+        asyncio.create_task(finalize_processing_conversations())
 
     # Send last completed conversation to client
     async def send_last_conversation():
-        last_conversation = conversations_db.get_last_completed_conversation(uid)
+        last_conversation = await conversations_db.get_last_completed_conversation_async(uid)
         if last_conversation:
             await _send_message_event(LastConversationEvent(memory_id=last_conversation['id']))
 
-    asyncio.create_task(send_last_conversation())
+    if resumed is None:
+        asyncio.create_task(send_last_conversation())
 
     async def _create_current_conversation():
         print("_create_current_conversation", uid)
@@ -226,25 +292,47 @@ async def _listen(
         seconds_to_trim = None
         seconds_to_add = None
 
-        conversation = retrieve_in_progress_conversation(uid)
+        # Persist the live segments, the next segments will start a new conversation
+        await segment_store.flush(force=True)
+        await segment_store.reset()
+
+        conversation = await retrieve_in_progress_conversation_async(uid)
+        if conversation and await asyncio.to_thread(request_in_progress_conversation_flush, conversation['id'],
+                                                    True, segment_store.holder):
+            conversation = await conversations_db.get_conversation_async(uid, conversation['id'])
         if not conversation or not conversation['transcript_segments']:
             return
         await _create_conversation(conversation)
 
-    conversation_creation_task_lock = asyncio.Lock()
-    conversation_creation_task = None
+    # In-progress conversation segments, persisted write-behind
+    segment_store = InProgressConversationStore(uid, language)
+
+    # Silence timeout of the in-progress conversation, on the timer wheel of the process, it still
+    # fires once the session is closed
+    conversation_timers = get_timer_wheel()
+    conversation_timer_key = tuple(resumed.timer_key) if resumed and resumed.timer_key else (uid, uuid.uuid4().hex)
     seconds_to_trim = None
     seconds_to_add = None
 
     conversation_creation_timeout = 120
 
     # Process existing conversations
-    def _process_in_progess_memories():
-        nonlocal conversation_creation_task
+    async def _process_in_progess_memories():
         nonlocal seconds_to_add
         nonlocal conversation_creation_timeout
         # Determine previous disconnected socket seconds to add + start processing timer if a conversation in progress
-        if existing_conversation := retrieve_in_progress_conversation(uid):
+        existing_conversation = None
+        if resumed and resumed.conversation:
+            existing_conversation = Conversation(**resumed.conversation).dict()
+            # finalised since the snapshot (POST /v1/conversations, the timer of another pod), not resumed
+            status = await conversations_db.get_conversation_status_async(uid, existing_conversation['id'])
+            if status != ConversationStatus.in_progress:
+                print('_websocket_util resumed conversation no longer in progress', existing_conversation['id'],
+                      status, uid)
+                existing_conversation = None
+        if existing_conversation is None:
+            existing_conversation = await retrieve_in_progress_conversation_async(uid)
+        if existing_conversation:
             # segments seconds alignment
             started_at = datetime.fromisoformat(existing_conversation['started_at'].isoformat())
             seconds_to_add = (datetime.now(timezone.utc) - started_at).total_seconds()
@@ -259,56 +347,26 @@ async def _listen(
             else:
                 print('_websocket_util will process', existing_conversation['id'], 'in',
                       conversation_creation_timeout - seconds_since_last_segment, 'seconds')
-                conversation_creation_task = asyncio.create_task(
-                    _trigger_create_conversation_with_delay(conversation_creation_timeout - seconds_since_last_segment,
-                                                            finished_at)
-                )
+                if resumed:
+                    # the segments of the previous session, no lookup on the first upsert
+                    await segment_store.load(existing_conversation)
+                conversation_timers.schedule(conversation_timer_key,
+                                             conversation_creation_timeout - seconds_since_last_segment,
+                                             _trigger_create_conversation, finished_at)
 
     _send_message_event(
         MessageServiceStatusEvent(status="in_progress_memories_processing", status_text="Processing Memories"))
-    _process_in_progess_memories()
-
-    def _upsert_in_progress_conversation(segments: List[TranscriptSegment], finished_at: datetime):
-        if existing := retrieve_in_progress_conversation(uid):
-            conversation = Conversation(**existing)
-            conversation.transcript_segments, (starts, ends) = TranscriptSegment.combine_segments(
-                conversation.transcript_segments, segments)
-            conversations_db.update_conversation_segments(uid, conversation.id,
-                                                          [segment.dict() for segment in
-                                                           conversation.transcript_segments])
-            conversations_db.update_conversation_finished_at(uid, conversation.id, finished_at)
-            redis_db.set_in_progress_conversation_id(uid, conversation.id)
-            return conversation, (starts, ends)
-
-        # new
-        started_at = datetime.now(timezone.utc) - timedelta(seconds=segments[0].end - segments[0].start)
-        conversation = Conversation(
-            id=str(uuid.uuid4()),
-            uid=uid,
-            structured=Structured(),
-            language=language,
-            created_at=started_at,
-            started_at=started_at,
-            finished_at=datetime.now(timezone.utc),
-            transcript_segments=segments,
-            status=ConversationStatus.in_progress,
-        )
-        print('_get_in_progress_conversation new', conversation, uid)
-        conversations_db.upsert_conversation(uid, conversation_data=conversation.dict())
-        redis_db.set_in_progress_conversation_id(uid, conversation.id)
-        return conversation, (0, len(segments))
-
-    async def create_conversation_on_segment_received_task(finished_at: datetime):
-        nonlocal conversation_creation_task
-        async with conversation_creation_task_lock:
-            if conversation_creation_task is not None:
-                conversation_creation_task.cancel()
-                try:
-                    await conversation_creation_task
-                except asyncio.CancelledError:
-                    print("conversation_creation_task is cancelled now", uid)
-            conversation_creation_task = asyncio.create_task(
-                _trigger_create_conversation_with_delay(conversation_creation_timeout, finished_at))
+    await _process_in_progess_memories()
+
+    async def _upsert_in_progress_conversation(segments: List[TranscriptSegment], finished_at: datetime):
+        if segment_store.conversation is None:
+            await segment_store.load(await retrieve_in_progress_conversation_async(uid))
+        return await segment_store.upsert(segments, finished_at)
+
+    def create_conversation_on_segment_received(finished_at: datetime):
+        # pushes the deadline back, no task until it expires
+        conversation_timers.schedule(conversation_timer_key, conversation_creation_timeout,
+                                     _trigger_create_conversation, finished_at)
 
     # STT
     # Validate websocket_active before initiating STT
@@ -328,13 +386,31 @@ async def _listen(
     deepgram_socket = None
     deepgram_socket2 = None
     speech_profile_duration = 0
+    # known for a resumed session of a user without a profile, skips the lookup
+    has_speech_profile = resumed.has_speech_profile if resumed else None
+
+    # Opus frames forwarded as is (Ogg muxed) to the STT, decoded only for the consumers needing PCM
+    opus_passthrough = is_opus_passthrough(stt_service, codec, sample_rate)
+    deepgram_ogg1 = OggOpusWriter(frame_size) if opus_passthrough else None
+    deepgram_ogg2 = OggOpusWriter(frame_size) if opus_passthrough else None
+
+    # Silence is not streamed to the STT providers, needs the PCM of the session
+    speech_gate = SpeechGate(sample_rate) if STT_SPEECH_GATE_ENABLED and (
+            codec != 'opus' or sample_rate == 16000) else None
 
-    realtime_segment_buffers = []
+    # round trip of the primary provider
+    stt_latency = STTLatencyTracker(stt_service.value)
 
     def stream_transcript(segments):
-        nonlocal realtime_segment_buffers
+        stt_latency.received(segments)
         realtime_segment_buffers.extend(segments)
 
+    # the main STT socket, fed through the speech gate: its timestamps are mapped back on the session audio,
+    # on the loop, the profile socket gets the audio as is
+    def stream_transcript_gated(segments):
+        stt_latency.received(segments)
+        realtime_segment_buffers.extend(segments, speech_gate.restore_timestamps if speech_gate else None)
+
     async def _process_stt():
         nonlocal websocket_close_code
         nonlocal soniox_socket
@@ -343,27 +419,42 @@ async def _listen(
         nonlocal deepgram_socket
         nonlocal deepgram_socket2
         nonlocal speech_profile_duration
+        nonlocal opus_passthrough
+        nonlocal has_speech_profile
         try:
-            file_path, speech_profile_duration = None, 0
+            profile_audio, speech_profile_duration = None, 0
             # Thougts: how bee does for recognizing other languages speech profile?
             if (language == 'en' or language == 'auto') and (
-                    codec == 'opus' or codec == 'pcm16') and include_speech_profile:
-                file_path = get_profile_audio_if_exists(uid)
-                speech_profile_duration = AudioSegment.from_wav(file_path).duration_seconds + 5 if file_path else 0
+                    codec == 'opus' or codec == 'pcm16') and include_speech_profile and has_speech_profile is not False:
+                profile_audio = await asyncio.to_thread(get_profile_audio, uid)
+                has_speech_profile = profile_audio is not None
+                speech_profile_duration = profile_audio.duration_seconds + 5 if profile_audio else 0
+                # the pre-roll is encoded to opus once per profile, at the session sample rate only
+                if profile_audio and profile_audio.sample_rate != sample_rate:
+                    opus_passthrough = False
 
             # DEEPGRAM
             if stt_service == STTService.deepgram:
+                dg_encoding = 'opus' if opus_passthrough else 'linear16'
                 deepgram_socket = await process_audio_dg(
-                    stream_transcript, stt_language, sample_rate, 1, preseconds=speech_profile_duration,
-                    model=stt_model, )
+                    stream_transcript_gated, stt_language, sample_rate, 1, preseconds=speech_profile_duration,
+                    model=stt_model, encoding=dg_encoding)
                 if speech_profile_duration:
                     deepgram_socket2 = await process_audio_dg(stream_transcript, stt_language, sample_rate, 1,
-                                                              model=stt_model)
+                                                              model=stt_model, encoding=dg_encoding)
 
                     async def deepgram_socket_send(data):
-                        return deepgram_socket.send(data)
-
-                    safe_create_task(send_initial_file_path(file_path, deepgram_socket_send))
+                        return await asyncio.to_thread(deepgram_socket.send, data)
+
+                    if opus_passthrough:
+                        packets = await asyncio.to_thread(profile_audio.opus_packets, frame_size)
+                        per_frame = max(1, int(PRE_ROLL_FRAME_SECONDS * sample_rate) // frame_size)
+                        frames = [deepgram_ogg1.write(packets[i:i + per_frame]) for i in
+                                  range(0, len(packets), per_frame)]
+                        frame_seconds = per_frame * frame_size / sample_rate
+                    else:
+                        frames, frame_seconds = profile_audio.frames(PRE_ROLL_FRAME_SECONDS), PRE_ROLL_FRAME_SECONDS
+                    safe_create_task(send_initial_audio_frames(frames, frame_seconds, deepgram_socket_send))
 
             # SONIOX
             elif stt_service == STTService.soniox:
@@ -374,7 +465,7 @@ async def _listen(
                     hints = [language]
 
                 soniox_socket = await process_audio_soniox(
-                    stream_transcript, sample_rate, stt_language,
+                    stream_transcript_gated, sample_rate, stt_language,
                     uid if include_speech_profile else None,
                     preseconds=speech_profile_duration,
                     language_hints=hints
@@ -382,23 +473,24 @@ async def _listen(
 
                 # Create a second socket for initial speech profile if needed
                 print("speech_profile_duration", speech_profile_duration)
-                print("file_path", file_path)
-                if speech_profile_duration and file_path:
+                if speech_profile_duration and profile_audio:
                     soniox_socket2 = await process_audio_soniox(
                         stream_transcript, sample_rate, stt_language,
                         uid if include_speech_profile else None,
                         language_hints=hints
                     )
 
-                    safe_create_task(send_initial_file_path(file_path, soniox_socket.send))
+                    safe_create_task(send_initial_audio_frames(
+                        profile_audio.frames(PRE_ROLL_FRAME_SECONDS), PRE_ROLL_FRAME_SECONDS, soniox_socket.send))
                     print('speech_profile soniox duration', speech_profile_duration, uid)
             # SPEECHMATICS
             elif stt_service == STTService.speechmatics:
                 speechmatics_socket = await process_audio_speechmatics(
-                    stream_transcript, sample_rate, stt_language, preseconds=speech_profile_duration
+                    stream_transcript_gated, sample_rate, stt_language, preseconds=speech_profile_duration
                 )
                 if speech_profile_duration:
-                    safe_create_task(send_initial_file_path(file_path, speechmatics_socket.send))
+                    safe_create_task(send_initial_audio_frames(
+                        profile_audio.frames(PRE_ROLL_FRAME_SECONDS), PRE_ROLL_FRAME_SECONDS, speechmatics_socket.send))
                     print('speech_profile speechmatics duration', speech_profile_duration, uid)
 
         except Exception as e:
@@ -409,79 +501,113 @@ async def _listen(
 
     # Pusher
     #
-    def create_pusher_task_handler():
+    async def create_pusher_task_handler():
         nonlocal websocket_active
 
         pusher_ws = None
         pusher_connect_lock = asyncio.Lock()
         pusher_connected = False
+        # Frames to the pusher, kept until it acknowledges them and sent again from its offset on a reconnect
+        outbox = create_pusher_outbox(f'{uid}:{uuid.uuid4().hex}')
+        sent_seq = 0
+        # a pusher not resuming the session (deployed before the sequenced frames) gets a frame per message,
+        # acknowledged once sent, for the rest of the session
+        legacy_framing = False
 
         # Transcript
-        segment_buffers = []
-        in_progress_conversation_id = None
-
         def transcript_send(segments, conversation_id):
-            nonlocal segment_buffers
-            nonlocal in_progress_conversation_id
-            in_progress_conversation_id = conversation_id
-            segment_buffers.extend(segments)
+            outbox.append(TRANSCRIPT_FRAME,
+                          bytes(json.dumps({"segments": segments, "memory_id": conversation_id}), "utf-8"))
 
-        async def transcript_consume():
-            nonlocal websocket_active
-            nonlocal segment_buffers
-            nonlocal in_progress_conversation_id
-            nonlocal pusher_ws
-            nonlocal pusher_connected
-            while websocket_active or len(segment_buffers) > 0:
-                await asyncio.sleep(1)
-                if pusher_connected and pusher_ws and len(segment_buffers) > 0:
-                    try:
-                        # 102|data
-                        data = bytearray()
-                        data.extend(struct.pack("I", 102))
-                        data.extend(
-                            bytes(json.dumps({"segments": segment_buffers, "memory_id": in_progress_conversation_id}),
-                                  "utf-8"))
-                        segment_buffers = []  # reset
-                        await pusher_ws.send(data)
-                    except websockets.exceptions.ConnectionClosed as e:
-                        print(f"Pusher transcripts Connection closed: {e}", uid)
-                        pusher_connected = False
-                    except Exception as e:
-                        print(f"Pusher transcripts failed: {e}", uid)
-                if pusher_connected is False:
-                    await connect()
+        # Audio bytes, bounded while the pusher is slow or reconnecting
+        audio_bytes_enabled = bool(await asyncio.to_thread(get_audio_bytes_webhook_seconds, uid)) \
+            or user_context.audio_bytes_apps_enabled
 
-        # Audio bytes
-        audio_buffers = bytearray()
-        audio_bytes_enabled = bool(get_audio_bytes_webhook_seconds(uid)) or is_audio_bytes_app_enabled(uid)
+        async def audio_bytes_send(audio_bytes) -> bool:
+            outbox.append(AUDIO_BYTES_FRAME, audio_bytes)
+            return True
 
-        def audio_bytes_send(audio_bytes):
-            nonlocal audio_buffers
-            audio_buffers.extend(audio_bytes)
+        audio_bytes_sink = AudioSink('pusher', audio_bytes_send, AUDIO_FANOUT_PUSHER_MAX_SECONDS, coalesce=join_pcm,
+                                     min_interval_seconds=1)
 
-        async def audio_bytes_consume():
-            nonlocal websocket_active
-            nonlocal audio_buffers
-            nonlocal pusher_ws
+        if PUSHER_TRANSPORT == 'mux':
+            # The sessions of the pod share a few connections to the pusher, the outbox goes in turns with theirs
+            channel = None
+
+            async def mux_connect():
+                nonlocal channel
+                if channel is None:
+                    channel = get_pusher_mux().open(uid, sample_rate, outbox)
+
+            async def mux_consume():
+                await mux_connect()
+                await channel.run(lambda: websocket_active)
+
+            async def mux_close(code: int = 1000):
+                if channel is not None:
+                    channel.close()
+                if outbox.dropped or outbox.replayed:
+                    print('Pusher outbox dropped', outbox.dropped, 'replayed', outbox.replayed, 'frames', uid)
+                await outbox.close()
+
+            return (mux_connect, mux_close,
+                    transcript_send, mux_consume,
+                    audio_bytes_sink if audio_bytes_enabled else None)
+
+        async def outbox_consume():
             nonlocal pusher_connected
-            while websocket_active or len(audio_buffers) > 0:
-                await asyncio.sleep(1)
-                if pusher_connected and pusher_ws and len(audio_buffers) > 0:
-                    try:
-                        # 101|data
-                        data = bytearray()
-                        data.extend(struct.pack("I", 101))
-                        data.extend(audio_buffers.copy())
-                        audio_buffers = bytearray()  # reset
-                        await pusher_ws.send(data)
-                    except websockets.exceptions.ConnectionClosed as e:
-                        print(f"Pusher audio_bytes Connection closed: {e}", uid)
-                        pusher_connected = False
-                    except Exception as e:
-                        print(f"Pusher audio_bytes failed: {e}", uid)
-                if pusher_connected is False:
+            nonlocal sent_seq
+            drain_until = None
+            while True:
+                if not websocket_active:
+                    if outbox.pending() == 0:
+                        break
+                    if drain_until is None:
+                        drain_until = time.monotonic() + PUSHER_OUTBOX_DRAIN_SECONDS
+                    elif time.monotonic() > drain_until:
+                        print('Pusher outbox not drained', outbox.pending(), 'frames', uid)
+                        break
+                if not pusher_connected:
                     await connect()
+                    if not pusher_connected:
+                        await asyncio.sleep(1)
+                        continue
+
+                frames = await outbox.read_after(sent_seq)
+                if not frames:
+                    await outbox.wait(1)
+                    continue
+                try:
+                    if legacy_framing:
+                        for seq, header_type, payload in frames:
+                            await pusher_ws.send(encode_legacy_frame(header_type, payload))
+                            sent_seq = seq
+                            outbox.ack(seq)
+                    else:
+                        for batch in batch_frames(frames):
+                            await pusher_ws.send(encode_frames(batch))
+                            sent_seq = batch[-1][0]
+                except websockets.exceptions.ConnectionClosed as e:
+                    print(f"Pusher Connection closed: {e}", uid)
+                    pusher_connected = False
+                except Exception as e:
+                    print(f"Pusher send failed: {e}", uid)
+                    await asyncio.sleep(1)
+
+        async def receive_acks(ws):
+            nonlocal pusher_connected
+            try:
+                async for message in ws:
+                    data = json.loads(message)
+                    if data.get('type') == 'ack':
+                        outbox.ack(data['offset'])
+            except websockets.exceptions.ConnectionClosed:
+                pass
+            except Exception as e:
+                print(f"Pusher acks failed: {e}", uid)
+            if ws is pusher_ws:
+                pusher_connected = False
+                outbox.wake()
 
         async def connect():
             nonlocal pusher_connected
@@ -503,26 +629,54 @@ async def _listen(
         async def _connect():
             nonlocal pusher_ws
             nonlocal pusher_connected
+            nonlocal sent_seq
+            nonlocal legacy_framing
 
             try:
-                pusher_ws = await connect_to_trigger_pusher(uid, sample_rate)
+                if legacy_framing:
+                    ws = await connect_to_trigger_pusher(uid, sample_rate)
+                    pusher_ws = ws
+                    pusher_connected = True
+                    safe_create_task(receive_acks(ws))
+                    return
+
+                ws = await connect_to_trigger_pusher(uid, sample_rate, session_id=outbox.session_id)
+                # the pusher resumes from the last frame it is done with
+                try:
+                    resume = json.loads(await asyncio.wait_for(ws.recv(), PUSHER_RESUME_TIMEOUT_SECONDS))
+                except asyncio.TimeoutError:
+                    print('Pusher did not resume the session, falling back to the legacy frames', uid)
+                    legacy_framing = True
+                    await ws.close()
+                    await _connect()
+                    return
+                offset = resume.get('offset', 0)
+                outbox.ack(offset)
+                resume_seq = max(offset, outbox.acked)
+                if sent_seq > resume_seq:
+                    outbox.replayed += sent_seq - resume_seq
+                    PUSHER_OUTBOX_REPLAYED_FRAMES.inc(sent_seq - resume_seq)
+                sent_seq = resume_seq
+                pusher_ws = ws
                 pusher_connected = True
+                safe_create_task(receive_acks(ws))
             except Exception as e:
                 print(f"Exception in connect: {e}")
 
         async def close(code: int = 1000):
             if pusher_ws:
                 await pusher_ws.close(code)
+            if outbox.dropped or outbox.replayed:
+                print('Pusher outbox dropped', outbox.dropped, 'replayed', outbox.replayed, 'frames', uid)
+            await outbox.close()
 
         return (connect, close,
-                transcript_send, transcript_consume,
-                audio_bytes_send if audio_bytes_enabled else None,
-                audio_bytes_consume if audio_bytes_enabled else None)
+                transcript_send, outbox_consume,
+                audio_bytes_sink if audio_bytes_enabled else None)
 
     transcript_send = None
-    transcript_consume = None
-    audio_bytes_send = None
-    audio_bytes_consume = None
+    outbox_consume = None
+    audio_bytes_sink = None
     pusher_close = None
     pusher_connect = None
 
@@ -531,40 +685,51 @@ async def _listen(
     current_conversation_id = None
     translation_enabled = including_combined_segments and stt_language == 'multi'
     language_cache = TranscriptSegmentLanguageCache()
+    if resumed:
+        language_cache.cache = {segment_id: tuple(result) for segment_id, result in resumed.language_cache.items()}
+
+    translation_batcher = get_translation_batcher()
+
+    async def _detect_is_target_language(segment: TranscriptSegment) -> Optional[bool]:
+        """
+        Whether the segment is in the target language: True (or the detection failed) skips its translation,
+        False or None (nothing new to detect) translates it.
+        """
+        segment_text = segment.text.strip()
+        # Check cache for language detection result
+        is_previously_target_language, diff_text = language_cache.get_language_result(segment.id, segment_text,
+                                                                                      language)
+        if (is_previously_target_language is None or is_previously_target_language is True) and diff_text:
+            try:
+                detected_lang = await asyncio.to_thread(detect_language, diff_text)
+                is_target_language = detected_lang is not None and detected_lang == language
 
-    async def translate(segments: List[TranscriptSegment], conversation_id: str):
-        try:
-            translated_segments = []
-            for segment in segments:
-                segment_text = segment.text.strip()
-                if not segment_text or len(segment_text) <= 0:
-                    continue
-                # Check cache for language detection result
-                is_previously_target_language, diff_text = language_cache.get_language_result(segment.id, segment_text,
-                                                                                              language)
-                if (is_previously_target_language is None or is_previously_target_language is True) \
-                        and diff_text:
-                    try:
-                        detected_lang = detect_language(diff_text)
-                        is_target_language = detected_lang is not None and detected_lang == language
-
-                        # Update cache with the detection result
-                        language_cache.update_cache(segment.id, segment_text, is_target_language)
+                # Update cache with the detection result
+                language_cache.update_cache(segment.id, segment_text, is_target_language)
+                return is_target_language
+            except Exception as e:
+                print(f"Language detection error: {e}")
+                # Skip translation if couldn't detect the language
+                return True
+        return None
 
-                        # Skip translation if it's the target language
-                        if is_target_language:
-                            continue
-                    except Exception as e:
-                        print(f"Language detection error: {e}")
-                        # Skip translation if couldn't detect the language
-                        continue
+    async def translate(segments: List[TranscriptSegment], conversation_id: str, starts: int):
+        try:
+            segments = [segment for segment in segments if segment.text.strip()]
+            detected = await asyncio.gather(*[_detect_is_target_language(segment) for segment in segments])
+            # Skip translation if it's the target language
+            segments = [segment for segment, is_target_language in zip(segments, detected) if not is_target_language]
+            if not segments:
+                return
 
-                # Translate the text to the target language
-                translated_text = translate_text(language, segment.text)
+            # Translate the texts to the target language, batched with the other sessions
+            translated_texts = await translation_batcher.translate(language, [segment.text for segment in segments])
 
+            translated_segments = []
+            for segment, translated_text in zip(segments, translated_texts):
                 # Skip, del cache to detect language again
-                if translated_text == segment.text:
-                    language_cache.delete_cache(segment.id)
+                if normalize_text(translated_text) == normalize_text(segment.text):
+                    language_cache.cache.pop(segment.id, None)
                     continue
 
                 # Create a Translation object
@@ -582,34 +747,31 @@ async def _listen(
 
                 # Replace existing translation or add a new one
                 if existing_translation_index is not None:
+                    if segment.translations[existing_translation_index].text == translated_text:
+                        continue
                     segment.translations[existing_translation_index] = translation
                 else:
                     segment.translations.append(translation)
 
                 translated_segments.append(segment)
 
-            # Update the conversation in the database to persist translations
-            if len(translated_segments) > 0:
-                conversation = conversations_db.get_conversation(uid, conversation_id)
-                if conversation:
-                    should_updates = False
-                    for segment in translated_segments:
-                        for i, existing_segment in enumerate(conversation['transcript_segments']):
-                            if existing_segment['id'] == segment.id:
-                                conversation['transcript_segments'][i]['translations'] = segment.dict()['translations']
-                                should_updates = True
-                                break
-
-                    # Update the database
-                    if should_updates:
-                        conversations_db.update_conversation_segments(
-                            uid,
-                            conversation_id,
-                            conversation['transcript_segments']
-                        )
+            if not translated_segments:
+                return
+
+            # Persist the translations, the segments are the ones of the in-progress conversation, only the
+            # changed ones are written with the next write of the store
+            conversation = segment_store.conversation
+            if conversation is not None and conversation.id == conversation_id:
+                indexes = {id(segment): i for i, segment in enumerate(conversation.transcript_segments[starts:], starts)}
+                changed = [indexes[id(segment)] for segment in translated_segments if id(segment) in indexes]
+                if changed:
+                    segment_store.mark_changed(min(changed))
+            else:
+                # the conversation was finalised meanwhile
+                await _save_translations(conversation_id, translated_segments)
 
             # Send a translation event to the client with the translated segments
-            if websocket_active and len(translated_segments) > 0:
+            if websocket_active:
                 translation_event = TranslationEvent(
                     segments=[segment.dict() for segment in translated_segments]
                 )
@@ -618,31 +780,41 @@ async def _listen(
         except Exception as e:
             print(f"Translation error: {e}", uid)
 
+    async def _save_translations(conversation_id: str, translated_segments: List[TranscriptSegment]):
+        conversation = await conversations_db.get_conversation_async(uid, conversation_id)
+        if not conversation:
+            return
+        translations = {segment.id: segment.dict()['translations'] for segment in translated_segments}
+        should_updates = False
+        for existing_segment in conversation['transcript_segments']:
+            if existing_segment['id'] in translations:
+                existing_segment['translations'] = translations[existing_segment['id']]
+                should_updates = True
+        if should_updates:
+            await conversations_db.update_conversation_segments_async(uid, conversation_id,
+                                                                      conversation['transcript_segments'])
+
     async def stream_transcript_process():
         nonlocal websocket_active
-        nonlocal realtime_segment_buffers
         nonlocal websocket
         nonlocal seconds_to_trim
         nonlocal current_conversation_id
         nonlocal including_combined_segments
         nonlocal translation_enabled
 
-        while websocket_active or len(realtime_segment_buffers) > 0:
-            try:
-                await asyncio.sleep(0.3)  # 300ms
-
-                if not realtime_segment_buffers or len(realtime_segment_buffers) == 0:
-                    continue
-
-                segments = realtime_segment_buffers.copy()
-                realtime_segment_buffers = []
+        while True:
+            # Wakes up on new segments, returns empty once the session is closed and drained
+            segments = await realtime_segment_buffers.drain()
+            if not segments:
+                break
 
+            try:
                 # Align the start, end segment
                 if seconds_to_trim is None:
                     seconds_to_trim = segments[0]["start"]
 
                 finished_at = datetime.now(timezone.utc)
-                await create_conversation_on_segment_received_task(finished_at)
+                create_conversation_on_segment_received(finished_at)
 
                 # Segments aligning duration seconds.
                 if seconds_to_add:
@@ -661,16 +833,20 @@ async def _listen(
                                                                              segments])
 
                 # can trigger race condition? increase soniox utterance?
-                conversation, (starts, ends) = _upsert_in_progress_conversation(transcript_segments, finished_at)
+                conversation, (starts, ends) = await _upsert_in_progress_conversation(transcript_segments, finished_at)
                 current_conversation_id = conversation.id
 
                 # Send to client
-                if including_combined_segments:
-                    updates_segments = [segment.dict() for segment in conversation.transcript_segments[starts:ends]]
+                updated_segments = conversation.transcript_segments[starts:ends] if including_combined_segments \
+                    else transcript_segments
+                if transcript_encoder is not None:
+                    frame = transcript_encoder.encode(updated_segments)
+                    if frame is not None:
+                        await websocket.send_bytes(frame)
                 else:
-                    updates_segments = [segment.dict() for segment in transcript_segments]
-
-                await websocket.send_json(updates_segments)
+                    await websocket.send_json([segment.dict() for segment in updated_segments])
+                if realtime_segment_buffers.drained_received_at is not None:
+                    SEGMENT_TO_CLIENT_SECONDS.observe(time.monotonic() - realtime_segment_buffers.drained_received_at)
 
                 # Send to external trigger
                 if transcript_send is not None:
@@ -678,32 +854,13 @@ async def _listen(
 
                 # Translate
                 if translation_enabled:
-                    await translate(conversation.transcript_segments[starts:ends], conversation.id)
+                    await translate(conversation.transcript_segments[starts:ends], conversation.id, starts)
 
             except Exception as e:
                 print(f'Could not process transcript: error {e}', uid)
 
-    # Audio bytes
-    #
-    # # Initiate a separate vad for each websocket
-    # w_vad = webrtcvad.Vad()
-    # w_vad.set_mode(1)
-
-    decoder = opuslib.Decoder(sample_rate, 1)
-
-    # # A  frame must be either 10, 20, or 30 ms in duration
-    # def _has_speech(data, sample_rate):
-    #     sample_size = 320 if sample_rate == 16000 else 160
-    #     offset = 0
-    #     while offset < len(data):
-    #         sample = data[offset:offset + sample_size]
-    #         if len(sample) < sample_size:
-    #             sample = sample + bytes([0x00] * (sample_size - len(sample) % sample_size))
-    #         has_speech = w_vad.is_speech(sample, sample_rate)
-    #         if has_speech:
-    #             return True
-    #         offset += sample_size
-    #     return False
+    # decodes off the event loop, in batches shared with the other sessions
+    decoder = OpusStreamDecoder(sample_rate, frame_size)
 
     async def receive_audio(dg_socket1, dg_socket2, soniox_socket, soniox_socket2, speechmatics_socket1):
         nonlocal websocket_active
@@ -712,52 +869,146 @@ async def _listen(
 
         timer_start = time.time()
         last_audio_received_time = timer_start
+        # without a speech profile socket, the audio before the speech gate starts goes to the gated stream
+        ungated_to_stream = dg_socket2 is None and soniox_socket2 is None
+        # counted locally, added to the metrics about once a second
+        frames_in = LISTEN_AUDIO_FRAMES.labels(codec)
+        bytes_in = LISTEN_AUDIO_BYTES.labels(codec)
+        soniox_send_buffer = STT_SEND_BUFFER_BYTES.labels(STTService.soniox.value)
+        speechmatics_send_buffer = STT_SEND_BUFFER_BYTES.labels(STTService.speechmatics.value)
+        frames_count, bytes_count = 0, 0
+        sample_metrics = False
+
+        # Every STT socket gets the audio through its own bounded buffer, a slow one lags on its own
+        fanout = AudioFanout()
+
+        def on_sink_failure(name: str, error: Optional[Exception]):
+            nonlocal websocket_active
+            nonlocal websocket_close_code
+            print(f'Audio sink {name} failed, closing the session: {error}', uid)
+            websocket_close_code = 1011
+            websocket_active = False
+
+        async def send_soniox(chunk):
+            nonlocal soniox_socket2
+            elapsed_seconds = time.time() - timer_start
+            if elapsed_seconds > speech_profile_duration or not soniox_socket2:
+                await soniox_socket.send(chunk)
+                if sample_metrics:
+                    soniox_send_buffer.observe(soniox_socket.transport.get_write_buffer_size())
+                if soniox_socket2:
+                    print('Killing soniox_socket2', uid)
+                    await soniox_socket2.close()
+                    soniox_socket2 = None
+            else:
+                await soniox_socket2.send(chunk)
+
+        async def send_speechmatics(chunk):
+            await speechmatics_socket1.send(chunk)
+            if sample_metrics:
+                speechmatics_send_buffer.observe(speechmatics_socket1.transport.get_write_buffer_size())
+
+        async def send_deepgram(chunk):
+            # opus frames, Ogg muxed, or PCM; the SDK sends and finishes blocking, in a thread
+            nonlocal dg_socket2
+            elapsed_seconds = time.time() - timer_start
+            if elapsed_seconds > speech_profile_duration or not dg_socket2:
+                await asyncio.to_thread(dg_socket1.send, deepgram_ogg1.write(chunk) if opus_passthrough else chunk)
+                if dg_socket2:
+                    print('Killing deepgram_socket2', uid)
+                    socket2, dg_socket2 = dg_socket2, None
+                    await asyncio.to_thread(socket2.finish)
+            else:
+                await asyncio.to_thread(dg_socket2.send, deepgram_ogg2.write(chunk) if opus_passthrough else chunk)
+
+        def stt_sink(name: str, send, coalesce=join_pcm):
+            return fanout.add(AudioSink(name, send, AUDIO_FANOUT_STT_MAX_SECONDS, AUDIO_FANOUT_STT_OVERFLOW,
+                                        coalesce=coalesce, on_failure=on_sink_failure))
+
+        soniox_sink = stt_sink('soniox', send_soniox) if soniox_socket is not None else None
+        speechmatics_sink = stt_sink('speechmatics', send_speechmatics) if speechmatics_socket1 is not None else None
+        deepgram_sink = stt_sink('deepgram', send_deepgram, join_opus_frames if opus_passthrough else join_pcm) \
+            if dg_socket1 is not None else None
+        # keep-alive of the providers getting a short silence while the speech gate is closed
+        silence = b'\x00' * (sample_rate // 10 * 2)
+
+        # Frames received, in order, their decode pending: the next frames are read while a batch decodes,
+        # the receive waits once a full batch is pending
+        received_frames: asyncio.Queue = asyncio.Queue(maxsize=OPUS_DECODE_MAX_BATCH_FRAMES)
+
+        async def process_frames():
+            nonlocal websocket_active
+            nonlocal websocket_close_code
+            try:
+                while True:
+                    frame = await received_frames.get()
+                    if frame is None:
+                        return
+                    await process_frame(*frame)
+            except Exception as e:
+                print(f'Could not process audio: error {e}', uid)
+                websocket_close_code = 1011
+                websocket_active = False
+                # the receive never waits on a full queue
+                while await received_frames.get() is not None:
+                    pass
+
+        async def process_frame(data, opus_data, decoded: Optional[asyncio.Future], gated: bool):
+            if decoded is not None:
+                data = await decoded
+            chunk_seconds = frame_size / sample_rate if codec == 'opus' else len(data) / (2 * sample_rate)
+
+            chunks = [(opus_data, data)]
+            if gated:
+                chunks = speech_gate.push(data, (opus_data, data))
+                if not chunks and speech_gate.keepalive_due():
+                    # Deepgram has a keep-alive message
+                    if dg_socket1 is not None:
+                        await asyncio.to_thread(dg_socket1.keep_alive)
+                    if soniox_sink is not None or speechmatics_sink is not None:
+                        for sink in (soniox_sink, speechmatics_sink):
+                            if sink is not None:
+                                sink.push(silence, 0.1)
+                        speech_gate.sent_silence(0.1)
+                        stt_latency.sent(0.1)
+            elif speech_gate is not None and ungated_to_stream:
+                speech_gate.passed(chunk_seconds)
+
+            for chunk_opus_data, chunk in chunks:
+                stt_latency.sent(chunk_seconds)
+                if soniox_sink is not None:
+                    soniox_sink.push(chunk, chunk_seconds)
+                if speechmatics_sink is not None:
+                    speechmatics_sink.push(chunk, chunk_seconds)
+                if deepgram_sink is not None:
+                    deepgram_sink.push([chunk_opus_data] if opus_passthrough else chunk, chunk_seconds)
+
+            # Send to external trigger
+            if audio_bytes_sink is not None:
+                audio_bytes_sink.push(data, chunk_seconds)
+
+        processor = asyncio.create_task(process_frames())
         try:
             while websocket_active:
                 data = await websocket.receive_bytes()
                 last_audio_received_time = time.time()
+                frames_count += 1
+                bytes_count += len(data)
+                sample_metrics = frames_count == 50
+                if sample_metrics:
+                    frames_in.inc(frames_count)
+                    bytes_in.inc(bytes_count)
+                    frames_count, bytes_count = 0, 0
+                # STT, silence gated once past the speech profile
+                gated = speech_gate is not None and time.time() - timer_start > speech_profile_duration
+                opus_data = None
+                decoded = None
                 if codec == 'opus' and sample_rate == 16000:
-                    data = decoder.decode(bytes(data), frame_size=frame_size)
-                    # audio_data.extend(data)
-
-                # STT
-                has_speech = True
-                # thinh's comment: disabled cause bad performance
-                # if include_speech_profile and codec != 'opus':  # don't do for opus 1.0.4 for now
-                #     has_speech = _has_speech(data, sample_rate)
-
-                if has_speech:
-                    # Handle Soniox sockets
-                    if soniox_socket is not None:
-                        elapsed_seconds = time.time() - timer_start
-                        if elapsed_seconds > speech_profile_duration or not soniox_socket2:
-                            await soniox_socket.send(data)
-                            if soniox_socket2:
-                                print('Killing soniox_socket2', uid)
-                                await soniox_socket2.close()
-                                soniox_socket2 = None
-                        else:
-                            await soniox_socket2.send(data)
-
-                    # Handle Speechmatics socket
-                    if speechmatics_socket1 is not None:
-                        await speechmatics_socket1.send(data)
-
-                    # Handle Deepgram sockets
-                    if dg_socket1 is not None:
-                        elapsed_seconds = time.time() - timer_start
-                        if elapsed_seconds > speech_profile_duration or not dg_socket2:
-                            dg_socket1.send(data)
-                            if dg_socket2:
-                                print('Killing deepgram_socket2', uid)
-                                dg_socket2.finish()
-                                dg_socket2 = None
-                        else:
-                            dg_socket2.send(data)
-
-                # Send to external trigger
-                if audio_bytes_send is not None:
-                    audio_bytes_send(data)
+                    opus_data = bytes(data)
+                    # decoded only for the consumers of PCM, handled in order once decoded
+                    if not opus_passthrough or audio_bytes_sink is not None or gated:
+                        decoded = decoder.submit(opus_data)
+                await received_frames.put((data, opus_data, decoded, gated))
 
         except WebSocketDisconnect:
             print("WebSocket disconnected", uid)
@@ -765,10 +1016,27 @@ async def _listen(
             print(f'Could not process audio: error {e}', uid)
             websocket_close_code = 1011
         finally:
+            # the frames received are processed before the sinks close
+            if not processor.done():
+                await received_frames.put(None)
+                await processor
             websocket_active = False
+            realtime_segment_buffers.close()
+            frames_in.inc(frames_count)
+            bytes_in.inc(bytes_count)
+            if audio_bytes_sink is not None:
+                audio_bytes_sink.close()
+            await fanout.close()
+            print('Audio sinks', fanout.stats(), uid)
+            if speech_gate is not None:
+                print('Speech gate', speech_gate.stats(), uid)
 
     # Start
     #
+    # Settings of the user, read once for the session and shared with the pusher and the triggers
+    user_context = acquire_user_context(uid)
+    LISTEN_SESSIONS.inc()
+
     try:
         # Init STT
         _send_message_event(MessageServiceStatusEvent(status="stt_initiating", status_text="STT Service Starting"))
@@ -776,8 +1044,8 @@ async def _listen(
 
         # Init pusher
         pusher_connect, pusher_close, \
-            transcript_send, transcript_consume, \
-            audio_bytes_send, audio_bytes_consume = create_pusher_task_handler()
+            transcript_send, outbox_consume, \
+            audio_bytes_sink = await create_pusher_task_handler()
 
         # Tasks
         audio_process_task = asyncio.create_task(
@@ -787,10 +1055,10 @@ async def _listen(
 
         # Pusher tasks
         pusher_tasks = [asyncio.create_task(pusher_connect())]
-        if transcript_consume is not None:
-            pusher_tasks.append(asyncio.create_task(transcript_consume()))
-        if audio_bytes_consume is not None:
-            pusher_tasks.append(asyncio.create_task(audio_bytes_consume()))
+        if outbox_consume is not None:
+            pusher_tasks.append(asyncio.create_task(outbox_consume()))
+        if audio_bytes_sink is not None:
+            pusher_tasks.append(asyncio.create_task(audio_bytes_sink.run()))
 
         _send_message_event(MessageServiceStatusEvent(status="ready"))
 
@@ -801,13 +1069,37 @@ async def _listen(
         print(f"Error during WebSocket operation: {e}", uid)
     finally:
         websocket_active = False
+        release_user_context(uid)
+        LISTEN_SESSIONS.dec()
+
+        if realtime_segment_buffers.dropped:
+            print('realtime_segment_buffers dropped segments', realtime_segment_buffers.stats(), uid)
+
+        # In-progress conversation
+        try:
+            await segment_store.flush(force=True)
+        except Exception as e:
+            print(f"Error flushing in-progress conversation: {e}", uid)
+
+        # Resumable session, after the flush the snapshot matches what is persisted
+        if session_token:
+            try:
+                conversation = segment_store.conversation
+                save_listen_session(session_token, ListenSessionSnapshot(
+                    uid, language, codec, sample_rate,
+                    conversation=conversation.dict() if conversation is not None else None,
+                    timer_key=list(conversation_timer_key), language_cache=language_cache.cache,
+                    has_speech_profile=has_speech_profile,
+                    processing_conversation_ids=list(processing_conversation_ids)))
+            except Exception as e:
+                print(f"Error saving the listen session snapshot: {e}", uid)
 
         # STT sockets
         try:
             if deepgram_socket:
-                deepgram_socket.finish()
+                await asyncio.to_thread(deepgram_socket.finish)
             if deepgram_socket2:
-                deepgram_socket2.finish()
+                await asyncio.to_thread(deepgram_socket2.finish)
             if soniox_socket:
                 await soniox_socket.close()
             if soniox_socket2:
@@ -847,7 +1139,9 @@ async def listen_handler_v3(
 async def listen_handler(
         websocket: WebSocket, uid: str = Depends(auth.get_current_user_uid), language: str = 'en',
         sample_rate: int = 8000, codec: str = 'pcm8',
-        channels: int = 1, include_speech_profile: bool = True, stt_service: STTService = None
+        channels: int = 1, include_speech_profile: bool = True, stt_service: STTService = None,
+        transcript_protocol: Optional[str] = None, resumable: bool = False, resume_token: Optional[str] = None,
 ):
     await _listen(websocket, uid, language, sample_rate, codec, channels, include_speech_profile, None,
-                  including_combined_segments=True)
+                  including_combined_segments=True, transcript_protocol=transcript_protocol, resumable=resumable,
+                  resume_token=resume_token)
@@ -6,7 +6,8 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 
 from database.conversations import get_in_progress_conversation, get_conversation
 from database.redis_db import cache_user_geolocation, set_user_webhook_db, get_user_webhook_db, disable_user_webhook_db, \
-    enable_user_webhook_db, user_webhook_status_db, set_user_preferred_app
+    enable_user_webhook_db, user_webhook_status_db, set_user_preferred_app, \
+    publish_user_context_invalidation
 from database.users import *
 from models.conversation import Geolocation, Conversation
 from models.other import Person, CreatePerson
@@ -100,6 +101,7 @@ def get_user_webhooks_status(uid: str = Depends(auth.get_current_user_uid)):
 @router.post('/v1/users/store-recording-permission', tags=['v1'])
 def store_recording_permission(value: bool, uid: str = Depends(auth.get_current_user_uid)):
     set_user_store_recording_permission(uid, value)
+    publish_user_context_invalidation(uid, 'user')
     return {'status': 'ok'}
 
 
@@ -111,6 +113,7 @@ def get_store_recording_permission(uid: str = Depends(auth.get_current_user_uid)
 @router.delete('/v1/users/store-recording-permission', tags=['v1'])
 def delete_permission_and_recordings(uid: str = Depends(auth.get_current_user_uid)):
     set_user_store_recording_permission(uid, False)
+    publish_user_context_invalidation(uid, 'user')
     delete_all_conversation_recordings(uid)
     return {'status': 'ok'}
 
@@ -248,6 +251,7 @@ def set_user_language(data: dict, uid: str = Depends(auth.get_current_user_uid))
     if not language:
         raise HTTPException(status_code=400, detail="Language is required")
     set_user_language_preference(uid, language)
+    publish_user_context_invalidation(uid, 'user')
     return {'status': 'ok'}
 
 
@@ -0,0 +1,111 @@
+# Benchmark of the event loop of the /v4/listen sockets while their conversations are processed.
+#
+# Concurrent sockets tick every 20ms, like the audio frames, and each makes a short Firestore-like call
+# through `asyncio.to_thread` every 100ms. Meanwhile a wave of conversations is processed, each job
+# standing for process_conversation: 60ms of Python CPU (prompt building, parsing, pydantic) and 1.5s
+# of blocking LLM / Firestore I/O. Compares:
+# - inline: the job run on the event loop, like `_create_conversation` originally did
+# - to_thread: the job run on the default executor of the loop, shared with the sockets calls
+# - worker queue: the job enqueued to ConversationProcessingWorkers, the socket waits for the result
+# Reports the event loop stall (max tick lateness), the tick jitter, and the latency of the sockets
+# to_thread calls.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_conversation_queue.py [sockets] [conversations]
+import asyncio
+import statistics
+import sys
+import time
+import types
+
+SOCKETS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+CONVERSATIONS = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+JOB_CPU_SECONDS = 0.06
+JOB_IO_SECONDS = 1.5
+TICK_SECONDS = 0.02
+
+
+def _install_stand_ins():
+    # the queue and the workers only, the job below stands for the processing
+    stand_ins = {
+        'database': {},
+        'database.conversations': {},
+        'database.redis_db': {'r': None, 'get_cached_user_geolocation': None},
+        'utils.app_integrations': {'trigger_external_integrations': None},
+        'utils.conversations.location': {'get_google_maps_location': None},
+        'utils.conversations.process_conversation': {'process_conversation': None},
+    }
+    for name, attributes in stand_ins.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+def _process_job(job: dict) -> dict:
+    deadline = time.thread_time() + JOB_CPU_SECONDS
+    while time.thread_time() < deadline:
+        sum(i * i for i in range(200))
+    time.sleep(JOB_IO_SECONDS)
+    return {'conversation': {'id': job['conversation_id']}, 'messages': []}
+
+
+async def _socket(stop: asyncio.Event, lateness: list, call_latency: list):
+    ticks = 0
+    while not stop.is_set():
+        next_tick = time.perf_counter() + TICK_SECONDS
+        await asyncio.sleep(TICK_SECONDS)
+        lateness.append(time.perf_counter() - next_tick)
+        ticks += 1
+        if ticks % 5 == 0:
+            started = time.perf_counter()
+            await asyncio.to_thread(time.sleep, 0.002)
+            call_latency.append(time.perf_counter() - started)
+
+
+async def _run(name: str, process):
+    stop = asyncio.Event()
+    lateness, call_latency = [], []
+    sockets = [asyncio.create_task(_socket(stop, lateness, call_latency)) for _ in range(SOCKETS)]
+    await asyncio.sleep(0.5)
+    lateness.clear()
+    call_latency.clear()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[process({'uid': f'uid-{i % 50}', 'conversation_id': f'conversation-{i}', 'language': 'en'})
+                           for i in range(CONVERSATIONS)])
+    elapsed = time.perf_counter() - started
+    # the ticks and calls held up by the processing land
+    await asyncio.sleep(0.5)
+    stop.set()
+    await asyncio.gather(*sockets)
+
+    lateness.sort()
+    call_latency.sort()
+    print(f'{name:<12} stall {lateness[-1] * 1000:7.0f}ms | tick jitter p50 {lateness[len(lateness) // 2] * 1000:5.1f}ms '
+          f'p99 {lateness[int(len(lateness) * 0.99)] * 1000:6.1f}ms stdev {statistics.pstdev(lateness) * 1000:6.1f}ms '
+          f'| to_thread call p99 {call_latency[int(len(call_latency) * 0.99)] * 1000:7.1f}ms '
+          f'| {CONVERSATIONS} conversations in {elapsed:.1f}s')
+
+
+if __name__ == '__main__':
+    _install_stand_ins()
+    from utils.conversations.processing_queue import ConversationProcessingWorkers, InMemoryConversationQueue
+
+    print(f'{SOCKETS} sockets, {CONVERSATIONS} conversations of {JOB_CPU_SECONDS * 1000:.0f}ms cpu '
+          f'+ {JOB_IO_SECONDS:.1f}s io')
+
+    async def inline(job):
+        await asyncio.sleep(0)
+        return _process_job(job)
+
+    async def in_thread(job):
+        return await asyncio.to_thread(_process_job, job)
+
+    workers = ConversationProcessingWorkers(InMemoryConversationQueue(), process_job=_process_job)
+
+    async def worker_queue(job):
+        job_id = await workers.submit(job['uid'], job['conversation_id'], job['language'])
+        return await workers.wait(job_id)
+
+    for name, process in [('inline', inline), ('to_thread', in_thread), ('worker queue', worker_queue)]:
+        asyncio.run(_run(name, process))
+    workers.stop()
@@ -0,0 +1,119 @@
+# Benchmark of the silence timeout of the in-progress conversations of the /v4/listen sessions.
+#
+# Every segment batch of a session pushes its conversation deadline back by 120s. Compares, for
+# growing numbers of concurrent sessions:
+# - task per deadline: the previous task cancelled, awaited, and a new sleeping task created on each batch
+# - timer wheel: the deadline moved on the TimerWheel of the process
+# Reports the tasks created and the scheduler CPU time per segment batch, then checks on a fast wheel
+# that every deadline fires once, not before its last move and at most a tick late.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_conversation_timers.py [max_sessions] [batches_per_session]
+import asyncio
+import random
+import sys
+import time
+
+from utils.other.timer_wheel import TimerWheel
+
+MAX_SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+BATCHES_PER_SESSION = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+TIMEOUT_SECONDS = 120
+
+
+class _TaskPerDeadline:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    async def _trigger(self, delay_seconds):
+        try:
+            await asyncio.sleep(delay_seconds)
+        except asyncio.CancelledError:
+            pass
+
+    async def on_batch(self):
+        async with self.lock:
+            if self.task is not None:
+                self.task.cancel()
+                try:
+                    await self.task
+                except asyncio.CancelledError:
+                    pass
+            self.task = asyncio.create_task(self._trigger(TIMEOUT_SECONDS))
+
+
+async def _trigger():
+    pass
+
+
+async def _run(name: str, sessions: int):
+    created = [0]
+    loop = asyncio.get_running_loop()
+
+    def factory(loop, coro, **kwargs):
+        created[0] += 1
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    loop.set_task_factory(factory)
+    wheel = TimerWheel()
+    schedulers = [_TaskPerDeadline() for _ in range(sessions)] if name == 'task per deadline' else None
+    order = [s for _ in range(BATCHES_PER_SESSION) for s in range(sessions)]
+    random.shuffle(order)
+
+    started = time.process_time()
+    for session in order:
+        if schedulers is not None:
+            await schedulers[session].on_batch()
+        else:
+            wheel.schedule(('uid', session), TIMEOUT_SECONDS, _trigger)
+        if session % 100 == 0:
+            # the loop runs between the batches, like the sessions receiving their segments
+            await asyncio.sleep(0)
+    cpu = time.process_time() - started
+    batches = len(order)
+
+    if schedulers is not None:
+        for scheduler in schedulers:
+            scheduler.task.cancel()
+        await asyncio.gather(*[s.task for s in schedulers], return_exceptions=True)
+    loop.set_task_factory(None)
+    print(f'{name:<17} {sessions:>6} sessions | {created[0] / batches:4.2f} tasks/batch '
+          f'| {cpu / batches * 1e6:6.1f}us cpu/batch')
+
+
+async def _fires_once_on_time():
+    tick = 0.01
+    wheel = TimerWheel(tick_seconds=tick)
+    fired = {}
+    deadlines = {}
+
+    def on_expired(key):
+        assert key not in fired, f'{key} fired twice'
+        fired[key] = time.monotonic()
+
+    for key in range(2000):
+        delay = random.uniform(0.02, 1.5)
+        deadlines[key] = time.monotonic() + delay
+        wheel.schedule(key, delay, on_expired, key)
+    # moves, half pushed back, half brought forward
+    await asyncio.sleep(0.1)
+    for key in range(0, 2000, 2):
+        if key in wheel:
+            delay = random.uniform(0.02, 1.5)
+            deadlines[key] = time.monotonic() + delay
+            wheel.schedule(key, delay, on_expired, key)
+    await asyncio.sleep(1.8)
+
+    assert len(fired) == 2000, f'{len(fired)} fired'
+    late = [fired[k] - deadlines[k] for k in fired]
+    assert min(late) >= -1e-3, f'fired {-min(late) * 1000:.1f}ms early'
+    print(f'fires once, on time: 2000 timers, late by at most {max(late) * 1000:.1f}ms at {tick * 1000:.0f}ms ticks, '
+          f'{wheel.stats()}')
+
+
+if __name__ == '__main__':
+    counts = [n for n in (100, 1000, 10000, 100000) if n <= MAX_SESSIONS]
+    for name in ('task per deadline', 'timer wheel'):
+        for sessions in counts:
+            asyncio.run(_run(name, sessions))
+    asyncio.run(_fires_once_on_time())
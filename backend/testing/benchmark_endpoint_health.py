@@ -0,0 +1,152 @@
+# Benchmark of the deliveries to a mix of healthy and failing app endpoints, the HttpDeliveryEngine without
+# and with the circuits of utils/other/endpoint_health.
+#
+# Starts 20 local HTTP/1.1 keep-alive app endpoints in a separate process: 15 answering at once, 3 never
+# answering in time and 2 answering 500. Every 0.5s a transcript batch is fanned out to all of them, like the
+# realtime integrations of a session, for 60s. Reports the time spent on the deliveries to the failing
+# endpoints (wasted outbound time), the deliveries in flight on average and at peak (the connections and the
+# slots of the pool held), the latency of the healthy deliveries and the deliveries skipped. The last run is a
+# second pod picking up the circuits the first one shared (on a dict backed Redis stand-in).
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_endpoint_health.py [seconds] [cooldown_seconds]
+import asyncio
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+import types
+
+DURATION_SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 60
+os.environ['ENDPOINT_HEALTH_COOLDOWN_SECONDS'] = sys.argv[2] if len(sys.argv) > 2 else '10'
+FANOUT_INTERVAL_SECONDS = 0.5
+DEADLINE_SECONDS = 3
+BASE_PORT = 18700
+HEALTHY, HANGING, ERRORING = 15, 3, 2
+PAYLOAD = {'session_id': 'uid', 'segments': [{'id': str(i), 'text': 'some words ' * 10, 'speaker': 'SPEAKER_00',
+                                              'start': i, 'end': i + 1} for i in range(5)]}
+
+
+def _install_stand_ins():
+    store = {}
+
+    def set_endpoint_circuits(opened, closed):
+        store.update(opened)
+        for key in closed:
+            store.pop(key, None)
+
+    redis_db = types.ModuleType('database.redis_db')
+    redis_db.set_endpoint_circuits = set_endpoint_circuits
+    redis_db.get_endpoint_circuits = lambda keys: [store.get(key) for key in keys]
+    sys.modules['database'] = types.ModuleType('database')
+    sys.modules['database'].redis_db = redis_db
+    sys.modules['database.redis_db'] = redis_db
+
+
+def _serve():
+    async def handle(reader, writer, kind):
+        try:
+            while True:
+                headers = await reader.readuntil(b'\r\n\r\n')
+                length = 0
+                for line in headers.split(b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':')[1])
+                await reader.readexactly(length)
+                status = b'200 OK'
+                if kind == 'hanging':
+                    await asyncio.sleep(60)
+                elif kind == 'erroring':
+                    status = b'500 Internal Server Error'
+                body = b'{}'
+                writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: application/json\r\nContent-Length: '
+                             + str(len(body)).encode() + b'\r\n\r\n' + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        for i, kind in enumerate(_kinds()):
+            await asyncio.start_server(lambda r, w, k=kind: handle(r, w, k), '127.0.0.1', BASE_PORT + i,
+                                       backlog=1024)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def _kinds():
+    return ['healthy'] * HEALTHY + ['hanging'] * HANGING + ['erroring'] * ERRORING
+
+
+async def _run(engine, duration):
+    kinds = _kinds()
+    urls = [f'http://127.0.0.1:{BASE_PORT + i}/webhook?uid=uid' for i in range(len(kinds))]
+    stats = {'wasted': 0.0, 'busy': 0.0, 'in_flight': 0, 'peak': 0, 'skipped': 0, 'failing_sent': 0}
+    latencies = []
+
+    async def _single(kind, url):
+        started = time.monotonic()
+        stats['in_flight'] += 1
+        stats['peak'] = max(stats['peak'], stats['in_flight'])
+        response = await engine.post(url, json=PAYLOAD, timeout=DEADLINE_SECONDS)
+        stats['in_flight'] -= 1
+        elapsed = time.monotonic() - started
+        stats['busy'] += elapsed
+        if kind == 'healthy':
+            if response is not None:
+                latencies.append(elapsed)
+            return
+        stats['wasted'] += elapsed
+        # a skipped delivery returns before the engine loop is reached
+        if elapsed < 0.0005 and response is None:
+            stats['skipped'] += 1
+        else:
+            stats['failing_sent'] += 1
+
+    started = time.monotonic()
+    fanouts = []
+    while time.monotonic() - started < duration:
+        fanouts.append(asyncio.ensure_future(asyncio.gather(*[_single(k, u) for k, u in zip(kinds, urls)])))
+        await asyncio.sleep(FANOUT_INTERVAL_SECONDS)
+    await asyncio.gather(*fanouts)
+    stats['elapsed'] = time.monotonic() - started
+    return stats, latencies
+
+
+def _report(name, stats, latencies, fanouts):
+    latencies.sort()
+    failing = (HANGING + ERRORING) * fanouts
+    print(f'{name:<15} wasted {stats["wasted"]:6.1f}s on {stats["failing_sent"]}/{failing} failing deliveries sent, '
+          f'{stats["skipped"]} skipped | in flight avg {stats["busy"] / stats["elapsed"]:5.2f} peak '
+          f'{stats["peak"]:3d} | healthy {len(latencies)}/{HEALTHY * fanouts} p50 '
+          f'{statistics.median(latencies) * 1000:5.1f}ms p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:5.1f}ms')
+
+
+if __name__ == '__main__':
+    _install_stand_ins()
+    from utils.other.endpoint_health import EndpointHealth, ENDPOINT_HEALTH_COOLDOWN_SECONDS
+    from utils.other.http_delivery import HttpDeliveryEngine
+
+    process = multiprocessing.Process(target=_serve, daemon=True)
+    process.start()
+    time.sleep(1)
+    fanouts = int(DURATION_SECONDS / FANOUT_INTERVAL_SECONDS)
+    print(f'{fanouts} fan-outs to {HEALTHY} healthy, {HANGING} hanging and {ERRORING} erroring endpoints, '
+          f'{DEADLINE_SECONDS}s deadline, {ENDPOINT_HEALTH_COOLDOWN_SECONDS:.0f}s cooldown, '
+          f'{len(json.dumps(PAYLOAD))}B payload')
+
+    _report('no circuits', *asyncio.run(_run(HttpDeliveryEngine(), DURATION_SECONDS)), fanouts)
+
+    health = EndpointHealth(sync_seconds=None)
+    _report('circuits', *asyncio.run(_run(HttpDeliveryEngine(health=health), DURATION_SECONDS)), fanouts)
+
+    # the first pod shares its circuits, the second pulls those of the endpoints it delivers to on its first sync
+    health.sync()
+    second = EndpointHealth(sync_seconds=1)
+    short = min(DURATION_SECONDS, ENDPOINT_HEALTH_COOLDOWN_SECONDS)
+    _report('second pod', *asyncio.run(_run(HttpDeliveryEngine(health=second), short)),
+            int(short / FANOUT_INTERVAL_SECONDS))
+    process.terminate()
@@ -0,0 +1,82 @@
+# Load test of the Firestore calls made from the event loop of the listen/chat handlers.
+#
+# Runs N fake sessions on a single event loop. Every session writes its in-progress conversation and
+# reads the chat history once per second, while a ticker measures how late the loop wakes it up, which
+# is what a websocket send waits for. Compares the sync client (blocking the loop) with the async layer.
+#
+# Requires the Firestore emulator:
+#   gcloud emulators firestore start --host-port=localhost:8080
+#   cd backend && FIRESTORE_EMULATOR_HOST=localhost:8080 GOOGLE_CLOUD_PROJECT=demo-omi \
+#     PYTHONPATH=. python testing/benchmark_firestore_async.py [sessions] [seconds]
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+SECONDS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+TICK_SECONDS = 0.02
+
+if not os.getenv('FIRESTORE_EMULATOR_HOST'):
+    sys.exit('FIRESTORE_EMULATOR_HOST is not set, start the Firestore emulator first')
+
+import database.chat as chat_db
+import database.conversations as conversations_db
+
+
+def _conversation(uid: str) -> dict:
+    now = datetime.now(timezone.utc)
+    return {'id': str(uuid.uuid4()), 'uid': uid, 'created_at': now, 'started_at': now, 'finished_at': now,
+            'status': 'in_progress', 'discarded': False, 'transcript_segments': []}
+
+
+async def _session_sync(uid: str, deadline: float):
+    conversation = _conversation(uid)
+    conversations_db.upsert_conversation(uid, conversation)
+    while time.monotonic() < deadline:
+        conversations_db.update_conversation_finished_at(uid, conversation['id'], datetime.now(timezone.utc))
+        chat_db.get_messages(uid, limit=10)
+        await asyncio.sleep(1)
+
+
+async def _session_async(uid: str, deadline: float):
+    conversation = _conversation(uid)
+    await conversations_db.upsert_conversation_async(uid, conversation)
+    while time.monotonic() < deadline:
+        await conversations_db.update_conversation_finished_at_async(uid, conversation['id'],
+                                                                     datetime.now(timezone.utc))
+        await chat_db.get_messages_async(uid, limit=10)
+        await asyncio.sleep(1)
+
+
+async def _ticker(deadline: float, lags: list):
+    while time.monotonic() < deadline:
+        expected = time.monotonic() + TICK_SECONDS
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(time.monotonic() - expected)
+
+
+async def _run(session):
+    deadline = time.monotonic() + SECONDS
+    lags = []
+    started = time.monotonic()
+    await asyncio.gather(_ticker(deadline, lags),
+                         *[session(f'benchmark-{i}', deadline) for i in range(SESSIONS)])
+    return lags, time.monotonic() - started
+
+
+def _report(name, lags, elapsed):
+    lags = sorted(lags)
+    p50 = statistics.median(lags) * 1000
+    p99 = lags[int(len(lags) * 0.99) - 1] * 1000
+    print(f'{name:<6} loop lag p50 {p50:8.1f}ms p99 {p99:8.1f}ms max {lags[-1] * 1000:8.1f}ms | '
+          f'ran {elapsed:5.1f}s for {SECONDS}s of sessions')
+
+
+if __name__ == '__main__':
+    print(f'sessions={SESSIONS} duration={SECONDS}s emulator={os.getenv("FIRESTORE_EMULATOR_HOST")}')
+    _report('sync', *asyncio.run(_run(_session_sync)))
+    _report('async', *asyncio.run(_run(_session_async)))
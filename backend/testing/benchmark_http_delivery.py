@@ -0,0 +1,165 @@
+# Benchmark of the fan-out of the app integrations and webhooks, a thread and a new connection per delivery
+# (the previous requests.post paths) vs the shared HttpDeliveryEngine.
+#
+# Starts 100 local HTTP/1.1 keep-alive webhook receivers in a separate process, one of them answering after an
+# injected latency. Fires concurrent fan-outs, a POST of a transcript payload to every receiver, like the
+# realtime integrations of concurrent pusher sessions, and reports the deliveries per second to the healthy
+# receivers, their latency from the fan-out fired, the connections the receivers accepted and the peak
+# concurrency on the slow one.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_http_delivery.py [fanouts] [slow_ms] [receivers]
+import asyncio
+import json
+import multiprocessing
+import statistics
+import sys
+import threading
+import time
+import types
+
+import requests
+
+FANOUTS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+SLOW_SECONDS = (float(sys.argv[2]) if len(sys.argv) > 2 else 2000) / 1000
+RECEIVERS = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+BASE_PORT = 18400
+DEADLINE_SECONDS = 3
+PAYLOAD = {'session_id': 'uid', 'segments': [{'id': str(i), 'text': 'some words ' * 10, 'speaker': 'SPEAKER_00',
+                                              'start': i, 'end': i + 1} for i in range(5)]}
+
+
+def _install_stand_ins():
+    # the engines of the benchmark have no circuits, none shared
+    redis_db = types.ModuleType('database.redis_db')
+    sys.modules['database'] = types.ModuleType('database')
+    sys.modules['database'].redis_db = redis_db
+    sys.modules['database.redis_db'] = redis_db
+
+
+def _serve(stats):
+    async def handle(reader, writer, slow):
+        stats['connections'] += 1
+        try:
+            while True:
+                headers = await reader.readuntil(b'\r\n\r\n')
+                length = 0
+                for line in headers.split(b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':')[1])
+                await reader.readexactly(length)
+                if slow:
+                    stats['slow_in_flight'] += 1
+                    stats['slow_peak'] = max(stats['slow_peak'], stats['slow_in_flight'])
+                    await asyncio.sleep(SLOW_SECONDS)
+                    stats['slow_in_flight'] -= 1
+                body = b'{}'
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: '
+                             + str(len(body)).encode() + b'\r\n\r\n' + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        for i in range(RECEIVERS):
+            await asyncio.start_server(lambda r, w, s=(i == 0): handle(r, w, s), '127.0.0.1', BASE_PORT + i,
+                                       backlog=1024)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def _stats_server():
+    # counters in a plain dict, read back over a pipe
+    parent, child = multiprocessing.Pipe()
+
+    def run(conn):
+        stats = {'connections': 0, 'slow_in_flight': 0, 'slow_peak': 0}
+        def report():
+            while True:
+                conn.recv()
+                conn.send(dict(stats))
+                stats['slow_peak'] = stats['slow_in_flight']
+
+        threading.Thread(target=report, daemon=True).start()
+        _serve(stats)
+
+    process = multiprocessing.Process(target=run, args=(child,), daemon=True)
+    process.start()
+    return process, parent
+
+
+def _read_stats(conn):
+    conn.send(0)
+    return conn.recv()
+
+
+def _urls():
+    return [f'http://127.0.0.1:{BASE_PORT + i}/webhook?uid=uid' for i in range(RECEIVERS)]
+
+
+def _threads_fanout(latencies):
+    started = time.perf_counter()
+
+    def _single(i, url):
+        try:
+            requests.post(url, json=PAYLOAD, timeout=DEADLINE_SECONDS)
+        except Exception:
+            return
+        if i:
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=_single, args=(i, url)) for i, url in enumerate(_urls())]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+
+async def _engine_fanout(engine, latencies):
+    deadline = time.monotonic() + DEADLINE_SECONDS
+    started = time.perf_counter()
+
+    async def _single(i, url):
+        response = await engine.post(url, json=PAYLOAD, deadline=deadline)
+        if i and response is not None:
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*[_single(i, url) for i, url in enumerate(_urls())])
+
+
+def _run(name, conn):
+    latencies = []
+    before = _read_stats(conn)
+    started = time.perf_counter()
+    if name == 'threads':
+        fanouts = [threading.Thread(target=_threads_fanout, args=(latencies,)) for _ in range(FANOUTS)]
+        [t.start() for t in fanouts]
+        [t.join() for t in fanouts]
+    else:
+        from utils.other.http_delivery import HttpDeliveryEngine
+
+        engine = HttpDeliveryEngine()
+
+        async def _all():
+            await asyncio.gather(*[_engine_fanout(engine, latencies) for _ in range(FANOUTS)])
+
+        asyncio.run(_all())
+    elapsed = time.perf_counter() - started
+    after = _read_stats(conn)
+    return latencies, elapsed, after['connections'] - before['connections'], after['slow_peak']
+
+
+if __name__ == '__main__':
+    _install_stand_ins()
+    process, conn = _stats_server()
+    time.sleep(1)
+    print(f'{FANOUTS} concurrent fan-outs to {RECEIVERS} receivers, 1 answering in {SLOW_SECONDS * 1000:.0f}ms, '
+          f'{len(json.dumps(PAYLOAD))}B payload, {DEADLINE_SECONDS}s deadline')
+    for name in ('threads', 'engine'):
+        latencies, elapsed, connections, slow_peak = _run(name, conn)
+        latencies.sort()
+        print(f'{name:<8} {len(latencies)}/{FANOUTS * (RECEIVERS - 1)} healthy deliveries in {elapsed:.2f}s '
+              f'({len(latencies) / elapsed:6.0f}/s) | latency p50 {statistics.median(latencies) * 1000:6.1f}ms '
+              f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:6.1f}ms | {connections} connections | '
+              f'slow receiver peak {slow_peak} concurrent')
+    process.terminate()
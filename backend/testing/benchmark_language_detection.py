@@ -0,0 +1,103 @@
+# Benchmark of the language detection gating the realtime translation, remote only vs local first.
+#
+# Replays a multilingual transcript fixture the way translate() of /v4/listen detects it: the segments grow
+# a few words per update and only the text added since the previous detection (the delta of
+# TranscriptSegmentLanguageCache) is detected. The remote Google detection is a stand-in that counts its
+# calls, answers the language of the fixture and takes a fixed round trip. Reports the remote calls saved,
+# the detection latency, and the local detections that disagree with the fixture.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_language_detection.py [remote_ms]
+import statistics
+import sys
+import time
+import types
+
+REMOTE_SECONDS = (float(sys.argv[1]) if len(sys.argv) > 1 else 60) / 1000
+# words added to a segment per update
+WORDS_PER_UPDATE = 4
+
+FIXTURE = {
+    'en': ["so I was thinking we could move the meeting to thursday afternoon if that works for everyone",
+           "okay", "the budget for the next quarter still needs to be approved by the finance team",
+           "yeah sure", "can you send me the slides after the call so I can review them tonight"],
+    'es': ["no estoy seguro de que podamos terminar el proyecto antes de la fecha prevista",
+           "vale", "mi hermana vive en Barcelona desde hace tres años y trabaja en un hospital",
+           "creo que deberíamos hablar con el cliente mañana por la mañana"],
+    'fr': ["je pense que nous devrions reporter la réunion à la semaine prochaine",
+           "d'accord", "les enfants sont allés à la plage avec leurs grands-parents pendant les vacances",
+           "est-ce que tu peux m'envoyer le document avant ce soir"],
+    'de': ["wir müssen die Präsentation bis Freitag fertig haben sonst wird der Chef sauer",
+           "ja genau", "gestern habe ich mit meinem Bruder über die neue Wohnung gesprochen"],
+    'vi': ["hôm nay tôi sẽ đi chợ mua rau và thịt để nấu bữa tối cho cả nhà",
+           "vâng", "chúng ta cần hoàn thành báo cáo trước cuối tuần này"],
+    'pt': ["eu acho que a gente precisa conversar com o gerente antes de tomar essa decisão",
+           "obrigado", "o restaurante novo perto do escritório tem uma comida muito boa"],
+    'it': ["domani mattina devo andare dal medico e poi passo in ufficio verso le dieci",
+           "certo", "abbiamo comprato una casa in campagna vicino a Firenze"],
+}
+
+counts = {'remote': 0}
+
+
+class _FakeClient:
+    language = None
+
+    def detect_language(self, parent, content, mime_type):
+        counts['remote'] += 1
+        time.sleep(REMOTE_SECONDS)
+        return types.SimpleNamespace(languages=[types.SimpleNamespace(language_code=self.language, confidence=1)])
+
+
+def _install_stand_ins():
+    translate_v3 = types.ModuleType('google.cloud.translate_v3')
+    translate_v3.TranslationServiceClient = _FakeClient
+    google = types.ModuleType('google')
+    google.cloud = types.ModuleType('google.cloud')
+    google.cloud.translate_v3 = translate_v3
+    sys.modules.update({'google': google, 'google.cloud': google.cloud, 'google.cloud.translate_v3': translate_v3})
+    sys.modules['database'] = types.ModuleType('database')
+    sys.modules['database'].redis_db = sys.modules['database.redis_db'] = types.ModuleType('database.redis_db')
+
+
+def _deltas():
+    """(language, text delta) in the order they are detected"""
+    deltas = []
+    for language, sentences in FIXTURE.items():
+        for sentence in sentences:
+            words = sentence.split()
+            for i in range(0, len(words), WORDS_PER_UPDATE):
+                deltas.append((language, ' '.join(words[i:i + WORDS_PER_UPDATE])))
+    return deltas
+
+
+def _remote_only(translation, language, text):
+    translation.LANGUAGE_DETECTIONS.labels('remote').inc()
+    return translation.client.detect_language(parent=None, content=text, mime_type=None).languages[0].language_code
+
+
+if __name__ == '__main__':
+    _install_stand_ins()
+    import utils.translation as translation
+    from utils.language_detection import classify_language
+
+    classify_language('warm up the model')
+    deltas = _deltas()
+    print(f'{len(deltas)} text deltas in {len(FIXTURE)} languages, {WORDS_PER_UPDATE} words per update, '
+          f'remote detection {REMOTE_SECONDS * 1000:.0f}ms')
+    for name, detect in (('remote only', lambda language, text: _remote_only(translation, language, text)),
+                         ('local first', lambda language, text: translation.detect_language(text))):
+        counts['remote'] = 0
+        latencies, local_latencies, wrong = [], [], 0
+        for language, text in deltas:
+            translation.client.language = language
+            remote_before = counts['remote']
+            started = time.perf_counter()
+            detected = detect(language, text)
+            latencies.append(time.perf_counter() - started)
+            if counts['remote'] == remote_before:
+                local_latencies.append(latencies[-1])
+                wrong += detected != language
+        print(f'{name:<12} remote calls {counts["remote"]:3d}/{len(deltas)} | latency p50 '
+              f'{statistics.median(latencies) * 1000:5.1f}ms mean {statistics.mean(latencies) * 1000:5.1f}ms'
+              + (f' | local {len(local_latencies)} p50 {statistics.median(local_latencies) * 1000:.2f}ms, '
+                 f'{wrong} wrong' if local_latencies else ''))
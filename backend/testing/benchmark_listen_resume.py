@@ -0,0 +1,139 @@
+# Benchmark of the time to first transcript of a /v4/listen reconnect, cold start vs resumed session.
+#
+# Replays the setup `_listen` awaits before the first transcript reaches the client, with local stand-ins
+# for the backends: user validation, in-progress conversation lookup (Redis id + Firestore read), speech
+# profile lookup, STT connection checkout, provider latency to the first transcript, then the in-progress
+# conversation load of the first upsert. The catch-up queries (processing conversations, last conversation)
+# run in the background and are only counted. The resumed path saves and resumes a real ListenSessionSnapshot
+# through a dict backed Redis stand-in and skips what the snapshot covers.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_listen_resume.py [reconnects] [firestore_ms] [stt_ms]
+import asyncio
+import statistics
+import sys
+import time
+import types
+from datetime import datetime, timezone, timedelta
+
+RECONNECTS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+FIRESTORE_SECONDS = (float(sys.argv[2]) if len(sys.argv) > 2 else 40) / 1000
+# provider handshake of a connection not in the pool
+STT_CONNECT_SECONDS = (float(sys.argv[3]) if len(sys.argv) > 3 else 300) / 1000
+REDIS_SECONDS = 0.001
+# audio to the first transcript, the same for both
+PROVIDER_FIRST_TRANSCRIPT_SECONDS = 0.3
+# STT pool hit rate on reconnects, the pool is sized for the sessions starting, not for reconnect bursts
+STT_POOL_HIT_RATE = 0.5
+
+counts = {'firestore': 0, 'redis': 0}
+_redis_store = {}
+
+
+def _set_listen_session_snapshot(token, data, ttl):
+    counts['redis'] += 1
+    _redis_store[token] = data
+
+
+def _pop_listen_session_snapshot(token):
+    counts['redis'] += 1
+    return _redis_store.pop(token, None)
+
+
+def _install_stand_ins():
+    module = types.ModuleType('database.redis_db')
+    module.set_listen_session_snapshot = _set_listen_session_snapshot
+    module.pop_listen_session_snapshot = _pop_listen_session_snapshot
+    sys.modules['database'] = types.ModuleType('database')
+    sys.modules['database'].redis_db = module
+    sys.modules['database.redis_db'] = module
+
+
+async def _firestore():
+    counts['firestore'] += 1
+    await asyncio.sleep(FIRESTORE_SECONDS)
+
+
+async def _redis():
+    counts['redis'] += 1
+    await asyncio.sleep(REDIS_SECONDS)
+
+
+async def _stt_checkout(i: int):
+    if (i * STT_POOL_HIT_RATE) % 1 >= STT_POOL_HIT_RATE:
+        await asyncio.sleep(STT_CONNECT_SECONDS)
+
+
+def _conversation() -> dict:
+    now = datetime.now(timezone.utc)
+    return {'id': 'conversation', 'started_at': now - timedelta(minutes=3), 'finished_at': now - timedelta(seconds=5),
+            'transcript_segments': [{'id': str(i), 'text': 'some words ' * 8, 'speaker': 'SPEAKER_00', 'is_user': False,
+                                     'start': i * 4, 'end': i * 4 + 3.5} for i in range(60)]}
+
+
+async def _cold(i: int):
+    background = []
+    # is_exists_user_async
+    await _firestore()
+    # finalize_processing_conversations, send_last_conversation
+    background += [asyncio.create_task(_firestore()), asyncio.create_task(_firestore())]
+    # _process_in_progess_memories: retrieve_in_progress_conversation_async
+    await _redis()
+    await _firestore()
+    # _process_stt: speech profile generation (cached audio), STT connection
+    await _redis()
+    await _stt_checkout(i)
+    await asyncio.sleep(PROVIDER_FIRST_TRANSCRIPT_SECONDS)
+    # first upsert: segment_store.load(await retrieve_in_progress_conversation_async(uid))
+    await _redis()
+    await _firestore()
+    await asyncio.gather(*background)
+
+
+async def _resumed(i: int, token: str, snapshot_cls, resume):
+    snapshot = resume(token, 'uid', 'en', 'opus', 16000)
+    await asyncio.sleep(REDIS_SECONDS)
+    assert snapshot is not None and snapshot.conversation is not None
+    if snapshot.processing_conversation_ids:
+        await _firestore()
+    if snapshot.has_speech_profile is not False:
+        await _redis()
+    await _stt_checkout(i)
+    await asyncio.sleep(PROVIDER_FIRST_TRANSCRIPT_SECONDS)
+
+
+async def _run():
+    _install_stand_ins()
+    from utils.listen_session import ListenSessionSnapshot, new_resume_token, resume_listen_session, save_listen_session
+
+    results = {}
+    for name in ('cold', 'resumed'):
+        counts.update(firestore=0, redis=0)
+        ttft = []
+        for i in range(RECONNECTS):
+            token = new_resume_token()
+            # the previous session closing
+            save_listen_session(token, ListenSessionSnapshot(
+                'uid', 'en', 'opus', 16000, conversation=_conversation(), timer_key=['uid', 'key'],
+                language_cache={'0': ['some words', True]}, has_speech_profile=False))
+            started = time.perf_counter()
+            if name == 'cold':
+                await _cold(i)
+            else:
+                await _resumed(i, token, ListenSessionSnapshot, resume_listen_session)
+            ttft.append(time.perf_counter() - started)
+        results[name] = (ttft, dict(counts))
+    return results
+
+
+if __name__ == '__main__':
+    results = asyncio.run(_run())
+    print(f'{RECONNECTS} reconnects, Firestore {FIRESTORE_SECONDS * 1000:.0f}ms, STT handshake '
+          f'{STT_CONNECT_SECONDS * 1000:.0f}ms ({STT_POOL_HIT_RATE * 100:.0f}% pool hits), provider first transcript '
+          f'{PROVIDER_FIRST_TRANSCRIPT_SECONDS * 1000:.0f}ms')
+    for name, (ttft, counted) in results.items():
+        print(f'{name:<8} time to first transcript p50 {statistics.median(ttft) * 1000:6.0f}ms '
+              f'max {max(ttft) * 1000:6.0f}ms | per reconnect: {counted["firestore"] / RECONNECTS:.1f} Firestore reads, '
+              f'{counted["redis"] / RECONNECTS:.1f} Redis round trips (snapshot save included)')
+    cold, resumed = (statistics.median(results[name][0]) for name in ('cold', 'resumed'))
+    print(f'resumed: {(cold - resumed) * 1000:.0f}ms less to the first transcript, '
+          f'{(cold - resumed) / cold * 100:.0f}% of the cold start')
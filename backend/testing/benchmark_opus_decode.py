@@ -0,0 +1,103 @@
+# Benchmark of the opus decoding of the /v4/listen sessions of one instance.
+#
+# Simulates concurrent sessions each receiving a 20ms opus frame every 20ms, like the devices do, and compares:
+# - inline: `opuslib.Decoder.decode` of every frame on the event loop (the path before the shared worker)
+# - worker: `OpusStreamDecoder`, the frames batched per session and decoded on the shared thread pool
+# Reports the event loop occupancy (CPU time of the loop thread / wall time), the frames decoded per
+# second and per core (frames / CPU time of the process), and the lag of the sessions behind the
+# real time stream.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_opus_decode.py [sessions] [seconds]
+import asyncio
+import math
+import struct
+import sys
+import time
+
+import opuslib
+
+from utils.stt.opus_decoder import OpusStreamDecoder, OpusDecodeWorker, decode_opus_frames
+
+SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+SECONDS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+SAMPLE_RATE = 16000
+FRAME_SIZE = 320
+FRAME_SECONDS = FRAME_SIZE / SAMPLE_RATE
+
+
+def _device_frames(seconds: int) -> list:
+    encoder = opuslib.Encoder(SAMPLE_RATE, 1, opuslib.APPLICATION_VOIP)
+    frames = []
+    for n in range(int(seconds / FRAME_SECONDS)):
+        samples = [int(6000 * math.sin(2 * math.pi * (140 + 20 * (n % 7)) * (n * FRAME_SIZE + i) / SAMPLE_RATE))
+                   for i in range(FRAME_SIZE)]
+        frames.append(encoder.encode(struct.pack(f'<{FRAME_SIZE}h', *samples), FRAME_SIZE))
+    return frames
+
+
+async def _session(frames: list, decode, deadline: float, stats: dict):
+    started = time.perf_counter()
+    for n, frame in enumerate(frames):
+        due = started + n * FRAME_SECONDS
+        if due > deadline:
+            break
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        pcm = await decode(frame)
+        stats['frames'] += 1
+        stats['bytes'] += len(pcm)
+        stats['lag'].append(time.perf_counter() - due)
+
+
+async def _run(name: str, make_decode):
+    frames = _device_frames(SECONDS)
+    stats = {'frames': 0, 'bytes': 0, 'lag': []}
+    loop_cpu, process_cpu, wall = time.thread_time(), time.process_time(), time.perf_counter()
+    deadline = wall + SECONDS
+    # sessions started spread over one frame, like independent devices
+    await asyncio.gather(*[_session(frames[s % 10:], make_decode(), deadline + s * FRAME_SECONDS / SESSIONS, stats)
+                           for s in range(SESSIONS)])
+    loop_cpu = time.thread_time() - loop_cpu
+    process_cpu = time.process_time() - process_cpu
+    wall = time.perf_counter() - wall
+
+    lag = sorted(stats['lag'])
+    print(f'{name:<7} loop occupancy {loop_cpu / wall * 100:5.1f}% | {stats["frames"] / process_cpu:9,.0f} frames/s/core '
+          f'| {stats["frames"] / wall:9,.0f} frames/s '
+          f'| lag p50 {lag[len(lag) // 2] * 1000:6.1f}ms p99 {lag[int(len(lag) * 0.99)] * 1000:7.1f}ms')
+
+
+def _inline():
+    decoder = opuslib.Decoder(SAMPLE_RATE, 1)
+
+    async def decode(frame):
+        return decoder.decode(frame, frame_size=FRAME_SIZE)
+
+    return decode
+
+
+def _worker(worker: OpusDecodeWorker):
+    def make():
+        return OpusStreamDecoder(SAMPLE_RATE, FRAME_SIZE, worker=worker).decode
+
+    return make
+
+
+def _file_decode():
+    frames = _device_frames(60)
+    started = time.process_time()
+    decoder = opuslib.Decoder(SAMPLE_RATE, 1)
+    b''.join(decoder.decode(frame, frame_size=FRAME_SIZE) for frame in frames)
+    per_frame = time.process_time() - started
+    started = time.process_time()
+    decode_opus_frames(opuslib.Decoder(SAMPLE_RATE, 1), frames, FRAME_SIZE)
+    batched = time.process_time() - started
+    print(f'sync file, 1min: frame by frame {per_frame * 1000:.1f}ms cpu, one contiguous buffer {batched * 1000:.1f}ms cpu')
+
+
+if __name__ == '__main__':
+    print(f'{SESSIONS} sessions, {SECONDS}s, {1 / FRAME_SECONDS:.0f} frames/s per session')
+    asyncio.run(_run('inline', _inline))
+    asyncio.run(_run('worker', _worker(OpusDecodeWorker())))
+    _file_decode()
@@ -0,0 +1,67 @@
+# Benchmark of the audio path from the device to the STT provider of a /v4/listen session.
+#
+# Replays one minute of 16kHz audio as the device sends it (opus, 20ms frames) and compares:
+# - opus decode: every frame decoded to PCM16 on the loop before being sent (the path before passthrough)
+# - opus passthrough: the frames muxed in Ogg Opus as is, for the providers accepting compressed audio
+# - pcm16: a device streaming raw PCM16, nothing to do
+# Reports the CPU time per session-minute and the bytes sent to the provider per minute.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_opus_passthrough.py [minutes]
+import math
+import struct
+import sys
+import time
+
+import opuslib
+
+from utils.stt.codec import OggOpusWriter
+
+MINUTES = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+SAMPLE_RATE = 16000
+FRAME_SIZE = 320
+
+
+def _speech_like_pcm(seconds: int) -> bytes:
+    # voiced harmonics with a syllable-rate envelope and pauses
+    samples = []
+    for i in range(seconds * SAMPLE_RATE):
+        t = i / SAMPLE_RATE
+        envelope = max(0.0, math.sin(2 * math.pi * 4 * t)) * (1 if int(t) % 5 else 0)
+        pitch = 120 + 30 * math.sin(2 * math.pi * 0.5 * t)
+        value = sum(math.sin(2 * math.pi * pitch * k * t) / k for k in range(1, 6))
+        samples.append(int(6000 * envelope * value))
+    return struct.pack(f'<{len(samples)}h', *samples)
+
+
+def _device_frames(pcm: bytes) -> list:
+    encoder = opuslib.Encoder(SAMPLE_RATE, 1, opuslib.APPLICATION_VOIP)
+    frame_bytes = FRAME_SIZE * 2
+    return [encoder.encode(pcm[i:i + frame_bytes], FRAME_SIZE) for i in range(0, len(pcm) - frame_bytes + 1,
+                                                                              frame_bytes)]
+
+
+def _opus_decode(frames: list, pcm: bytes) -> int:
+    decoder = opuslib.Decoder(SAMPLE_RATE, 1)
+    return sum(len(decoder.decode(frame, frame_size=FRAME_SIZE)) for frame in frames)
+
+
+def _opus_passthrough(frames: list, pcm: bytes) -> int:
+    writer = OggOpusWriter(FRAME_SIZE)
+    return sum(len(writer.write([frame])) for frame in frames)
+
+
+def _pcm16(frames: list, pcm: bytes) -> int:
+    frame_bytes = FRAME_SIZE * 2
+    return sum(len(pcm[i:i + frame_bytes]) for i in range(0, len(pcm), frame_bytes))
+
+
+if __name__ == '__main__':
+    pcm = _speech_like_pcm(60 * MINUTES)
+    frames = _device_frames(pcm)
+    print(f'{MINUTES}min of audio, {len(frames)} opus frames of {FRAME_SIZE} samples, '
+          f'device uplink {sum(map(len, frames)) / MINUTES / 1024:.0f}KB/min')
+    for name, path in [('opus decode', _opus_decode), ('opus passthrough', _opus_passthrough), ('pcm16', _pcm16)]:
+        started = time.process_time()
+        sent = path(frames, pcm)
+        cpu = time.process_time() - started
+        print(f'{name:<17} cpu {cpu / MINUTES * 1000:7.1f}ms/session-min | sent to STT {sent / MINUTES / 1024:8.0f}KB/min')
@@ -0,0 +1,101 @@
+# Benchmark of the speech profile pre-roll sent to the STT socket at the start of a /v4/listen session.
+#
+# Runs a local fake STT websocket server in a subprocess, then pre-rolls a 30s profile over N concurrent
+# connections, comparing the legacy 320 bytes chunks + 0.1ms sleep with the prepared 100ms frames paced
+# on throughput. Reports the client CPU time and the wall time per connection.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_pre_roll.py [connections]
+import asyncio
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import types
+import wave
+
+import websockets
+
+CONNECTIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+PROFILE_SECONDS = 30
+SAMPLE_RATE = 16000
+PORT = 8765
+
+
+def _serve():
+    async def handler(websocket, *args):
+        received = 0
+        async for message in websocket:
+            received += len(message)
+        return received
+
+    async def main():
+        async with websockets.serve(handler, 'localhost', PORT, max_size=None):
+            await asyncio.Future()
+
+    asyncio.run(main())
+
+
+async def _legacy_pre_roll(file_path: str, send):
+    # send_initial_file_path, before the prepared frames
+    with open(file_path, 'rb') as file:
+        while True:
+            chunk = file.read(320)
+            if not chunk:
+                break
+            await send(bytes(chunk))
+            await asyncio.sleep(0.0001)
+
+
+async def _run(pre_roll) -> list:
+    durations = []
+
+    async def connection():
+        async with websockets.connect(f'ws://localhost:{PORT}', max_size=None) as websocket:
+            started = time.perf_counter()
+            await pre_roll(websocket.send)
+            durations.append(time.perf_counter() - started)
+
+    await asyncio.gather(*[connection() for _ in range(CONNECTIONS)])
+    return durations
+
+
+def _report(name: str, pre_roll):
+    cpu_started = time.process_time()
+    durations = asyncio.run(_run(pre_roll))
+    cpu = time.process_time() - cpu_started
+    print(f'{name:<8} cpu {cpu / CONNECTIONS * 1000:7.1f}ms/connection | '
+          f'wall p50 {statistics.median(durations):5.2f}s max {max(durations):5.2f}s')
+
+
+if __name__ == '__main__':
+    server = multiprocessing.Process(target=_serve, daemon=True)
+    server.start()
+    time.sleep(1)
+
+    # the pre-roll does not touch Redis nor the bucket
+    sys.modules['database'] = types.ModuleType('database')
+    sys.modules['database.redis_db'] = sys.modules['database'].redis_db = types.ModuleType('database.redis_db')
+    sys.modules['utils.other.storage'] = storage = types.ModuleType('utils.other.storage')
+    storage.get_profile_audio_generation = storage.download_profile_audio_bytes = None
+    from utils.stt.pre_roll import send_initial_audio_frames, PRE_ROLL_FRAME_SECONDS, PRE_ROLL_SPEED
+    from utils.stt.profile_audio_cache import ProfileAudio
+
+    file_path = tempfile.mktemp(suffix='.wav')
+    with wave.open(file_path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(random.randbytes(PROFILE_SECONDS * SAMPLE_RATE * 2))
+    with open(file_path, 'rb') as f:
+        profile = ProfileAudio.from_wav('uid', 1, f.read())
+
+    print(f'connections={CONNECTIONS} profile={PROFILE_SECONDS}s pre-roll speed={PRE_ROLL_SPEED:.0f}x realtime')
+    _report('legacy', lambda send: _legacy_pre_roll(file_path, send))
+    _report('frames', lambda send: send_initial_audio_frames(
+        profile.frames(PRE_ROLL_FRAME_SECONDS), PRE_ROLL_FRAME_SECONDS, send))
+
+    os.remove(file_path)
+    server.terminate()
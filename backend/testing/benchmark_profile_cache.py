@@ -0,0 +1,155 @@
+# Benchmark of the speech profile lookup done at the start of every /v4/listen session.
+#
+# The bucket is a local filesystem stand-in that adds a simulated round trip per request and a download
+# bandwidth, Redis is an in-memory dict. Reports the session start latency of:
+# - legacy: blob.exists + download_to_filename + AudioSegment.from_wav, on every session
+# - cold: first session of a user with an empty cache
+# - warm disk: first session after a restart of the instance, the local disk cache is kept
+# - warm memory: next sessions on the same instance
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_profile_cache.py [users] [rtt_ms]
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+import wave
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+RTT_SECONDS = (float(sys.argv[2]) if len(sys.argv) > 2 else 40) / 1000
+BANDWIDTH_BYTES_PER_SECOND = 50 * 1024 * 1024
+PROFILE_SECONDS = 30
+SAMPLE_RATE = 16000
+
+
+class LocalFilesystemBucket:
+    """Stand-in for the speech profiles bucket, generations are bumped on every upload."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.generations = {}
+        self.requests = 0
+
+    def _request(self, size: int = 0):
+        self.requests += 1
+        time.sleep(RTT_SECONDS + size / BANDWIDTH_BYTES_PER_SECOND)
+
+    def _path(self, uid: str) -> str:
+        return os.path.join(self.directory, f'{uid}_speech_profile.wav')
+
+    def upload(self, uid: str, data: bytes):
+        with open(self._path(uid), 'wb') as f:
+            f.write(data)
+        self.generations[uid] = time.time_ns()
+
+    def exists(self, uid: str) -> bool:
+        self._request()
+        return uid in self.generations
+
+    def download_to_filename(self, uid: str, file_path: str):
+        self._request(os.path.getsize(self._path(uid)))
+        shutil.copyfile(self._path(uid), file_path)
+
+    def get_profile_audio_generation(self, uid: str):
+        self._request()
+        return self.generations.get(uid)
+
+    def download_profile_audio_bytes(self, uid: str, generation: int) -> bytes:
+        assert self.generations[uid] == generation
+        with open(self._path(uid), 'rb') as f:
+            data = f.read()
+        self._request(len(data))
+        return data
+
+
+def _wav(seconds: int) -> bytes:
+    path = tempfile.mktemp(suffix='.wav')
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(random.randbytes(seconds * SAMPLE_RATE * 2))
+    with open(path, 'rb') as f:
+        data = f.read()
+    os.remove(path)
+    return data
+
+
+def _install_stand_ins(bucket: LocalFilesystemBucket):
+    generations = {}
+    redis_db = types.ModuleType('database.redis_db')
+    redis_db.get_speech_profile_generation = lambda uid: generations.get(uid)
+    redis_db.set_speech_profile_generation = lambda uid, generation, ttl=None: generations.__setitem__(
+        uid, generation or 0)
+    database = types.ModuleType('database')
+    database.redis_db = redis_db
+
+    storage = types.ModuleType('utils.other.storage')
+    storage.get_profile_audio_generation = bucket.get_profile_audio_generation
+    storage.download_profile_audio_bytes = bucket.download_profile_audio_bytes
+    sys.modules.update({'database': database, 'database.redis_db': redis_db, 'utils.other.storage': storage})
+
+
+def _legacy_session_start(bucket: LocalFilesystemBucket, uid: str, temp_dir: str) -> float:
+    from pydub import AudioSegment
+
+    if not bucket.exists(uid):
+        return 0
+    file_path = os.path.join(temp_dir, f'{uid}_speech_profile.wav')
+    bucket.download_to_filename(uid, file_path)
+    return AudioSegment.from_wav(file_path).duration_seconds + 5
+
+
+def _measure(name: str, start_session, uids) -> list:
+    latencies = []
+    for uid in uids:
+        started = time.perf_counter()
+        duration = start_session(uid)
+        latencies.append(time.perf_counter() - started)
+        assert abs(duration - (PROFILE_SECONDS + 5)) < 0.01, duration
+    latencies.sort()
+    print(f'{name:<12} session start p50 {statistics.median(latencies) * 1000:7.1f}ms '
+          f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:7.1f}ms')
+    return latencies
+
+
+if __name__ == '__main__':
+    work_dir = tempfile.mkdtemp()
+    bucket = LocalFilesystemBucket(os.path.join(work_dir, 'bucket'))
+    os.makedirs(bucket.directory)
+    profile = _wav(PROFILE_SECONDS)
+    uids = [f'user-{i}' for i in range(USERS)]
+    for uid in uids:
+        bucket.upload(uid, profile)
+
+    _install_stand_ins(bucket)
+    from utils.stt.profile_audio_cache import ProfileAudioCache
+
+    def _cached_session_start(cache):
+        def start(uid):
+            profile_audio = cache.get(uid)
+            return profile_audio.duration_seconds + 5 if profile_audio else 0
+
+        return start
+
+    print(f'users={USERS} rtt={RTT_SECONDS * 1000:.0f}ms profile={PROFILE_SECONDS}s ({len(profile) / 1024:.0f}KB)')
+    _measure('legacy', lambda uid: _legacy_session_start(bucket, uid, work_dir), uids)
+
+    cache_dir = os.path.join(work_dir, 'cache')
+    _measure('cold', _cached_session_start(ProfileAudioCache(cache_dir)), uids)
+    # restarted instance, empty memory but the disk cache is kept
+    restarted = ProfileAudioCache(cache_dir)
+    _measure('warm disk', _cached_session_start(restarted), uids)
+    requests = bucket.requests
+    _measure('warm memory', _cached_session_start(restarted), uids)
+    assert bucket.requests == requests, 'warm sessions must not reach the bucket'
+
+    # a new upload is picked up on the next session
+    bucket.upload(uids[0], profile)
+    sys.modules['database.redis_db'].set_speech_profile_generation(uids[0], bucket.generations[uids[0]])
+    assert restarted.get(uids[0]).generation == bucket.generations[uids[0]]
+
+    shutil.rmtree(work_dir)
@@ -0,0 +1,169 @@
+# Microbenchmark of the framing of the backend to pusher messages, the previous struct/bytearray frames vs
+# utils/pusher_framing, one frame per message and batched like the outbox consumer sends them.
+#
+# A stream of frames like a listen session sends them, a 1s audio frame (16kHz) and a transcript update every
+# second, is encoded by the backend side and parsed by the pusher side, which decodes the transcripts and
+# buffers the audio in the trigger and webhook buffers. Reports the frames and MB per second through both sides
+# (median of 5 runs) with the time to encode and to parse, and the memory allocated per MB of payload: the sum
+# over the messages of the tracemalloc peak while a message is encoded and while it is parsed, what is handed
+# to the buffers held until then.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_pusher_framing.py [frames] [audio_bytes]
+import json
+import statistics
+import struct
+import sys
+import time
+import tracemalloc
+
+FRAMES = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+AUDIO_BYTES = int(sys.argv[2]) if len(sys.argv) > 2 else 32000
+# frames read from the outbox at once
+BATCH_FRAMES = 64
+# the pusher buffers are handed over past it, like its 5s trigger chunks
+BUFFER_BYTES = AUDIO_BYTES * 5
+
+
+def _frames():
+    transcript = json.dumps({'segments': [{'id': 'segment', 'text': 'some words ' * 30, 'speaker': 'SPEAKER_00',
+                                           'start': 0, 'end': 1}], 'memory_id': 'conversation'}).encode()
+    audio = bytes(AUDIO_BYTES)
+    return [(seq, 101 if seq % 2 else 102, audio if seq % 2 else transcript) for seq in range(1, FRAMES + 1)]
+
+
+class _Pusher:
+    def __init__(self):
+        self.trigger_buffer = bytearray()
+        self.webhook_buffer = bytearray()
+        self.transcripts = 0
+
+    def transcript(self, res):
+        self.transcripts += len(res['segments'])
+
+    def trigger(self, payload):
+        self.trigger_buffer.extend(payload)
+        if len(self.trigger_buffer) > BUFFER_BYTES:
+            self.trigger_buffer = bytearray()
+
+    def webhook(self, payload):
+        self.webhook_buffer.extend(payload)
+        if len(self.webhook_buffer) > BUFFER_BYTES:
+            self.webhook_buffer = bytearray()
+
+
+class _CountingPusher(_Pusher):
+    """
+    Holds on to the audio it is handed until the message is measured, so the copies made one after the other
+    add up, and leaves out the growth of the buffers, the same for all the approaches
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.held = []
+
+    def trigger(self, payload):
+        self.held.append(payload)
+
+    def webhook(self, payload):
+        self.held.append(payload)
+
+
+def _legacy_messages(frames):
+    for _, header_type, payload in frames:
+        data = bytearray()
+        data.extend(struct.pack("I", header_type))
+        data.extend(payload)
+        yield data
+
+
+def _legacy_parse(pusher, data):
+    header_type = struct.unpack('<I', data[:4])[0]
+    if header_type == 102:
+        pusher.transcript(json.loads(bytes(data[4:]).decode("utf-8")))
+    elif header_type == 101:
+        pusher.trigger(data[4:])
+        pusher.webhook(data[4:])
+
+
+def _framing_messages(frames, batched):
+    from utils.pusher_framing import batch_frames, encode_frame, encode_frames
+
+    if not batched:
+        for seq, header_type, payload in frames:
+            yield encode_frame(header_type, seq, payload)
+        return
+    for i in range(0, len(frames), BATCH_FRAMES):
+        for batch in batch_frames(frames[i:i + BATCH_FRAMES]):
+            yield encode_frames(batch)
+
+
+def _framing_parse(pusher, data):
+    from utils.pusher_framing import iter_frames
+
+    for header_type, _, payload in iter_frames(data):
+        if header_type == 102:
+            pusher.transcript(json.loads(str(payload, "utf-8")))
+        elif header_type == 101:
+            pusher.trigger(payload)
+            pusher.webhook(payload)
+
+
+APPROACHES = {
+    'struct/bytearray': (_legacy_messages, _legacy_parse),
+    'framing': (lambda frames: _framing_messages(frames, False), _framing_parse),
+    'framing batched': (lambda frames: _framing_messages(frames, True), _framing_parse),
+}
+
+
+def _throughput(messages, parse, frames):
+    pusher = _Pusher()
+    encoding, parsing = 0, 0
+    encoded = messages(frames)
+    while True:
+        started = time.perf_counter()
+        data = next(encoded, None)
+        encoded_at = time.perf_counter()
+        if data is None:
+            break
+        parse(pusher, data)
+        encoding += encoded_at - started
+        parsing += time.perf_counter() - encoded_at
+    return encoding, parsing, pusher.transcripts
+
+
+def _allocated(messages, parse, frames):
+    pusher = _CountingPusher()
+    allocated = 0
+    tracemalloc.start()
+    encoding = messages(frames)
+    while True:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        data = next(encoding, None)
+        if data is None:
+            break
+        allocated += tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        parse(pusher, data)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+        pusher.held.clear()
+    tracemalloc.stop()
+    return allocated
+
+
+if __name__ == '__main__':
+    frames = _frames()
+    payload_mb = sum(len(payload) for _, _, payload in frames) / 1e6
+    print(f'{FRAMES} frames, audio {AUDIO_BYTES}B and transcripts {len(frames[1][2])}B, {payload_mb:.0f}MB of payload')
+    for name, (messages, parse) in APPROACHES.items():
+        # warm up
+        _throughput(messages, parse, frames[:1000])
+        runs = [_throughput(messages, parse, frames) for _ in range(5)]
+        assert all(transcripts == FRAMES // 2 for _, _, transcripts in runs)
+        encoding = statistics.median(run[0] for run in runs)
+        parsing = statistics.median(run[1] for run in runs)
+        allocated = _allocated(messages, parse, frames)
+        print(f'{name:<17} {FRAMES / (encoding + parsing):7.0f} frames/s {payload_mb / (encoding + parsing):5.0f}MB/s '
+              f'(encode {encoding / FRAMES * 1e6:4.2f}us parse {parsing / FRAMES * 1e6:4.2f}us per frame) | '
+              f'allocated {allocated / payload_mb / 1e6:.2f}MB per MB of payload')
@@ -0,0 +1,348 @@
+# Benchmark of the transport of the listen sessions of a backend pod to the pusher, a connection per session
+# (PUSHER_TRANSPORT=session) vs the multiplexed connections of utils/pusher_mux (PUSHER_TRANSPORT=mux).
+#
+# The backend and the pusher run in two processes over local websockets (aiohttp, with a stand-in of the
+# websockets client used by utils/pusher). Every session sends a transcript update every second through its
+# outbox, a share of them 1s audio frames of 8kHz too; the pusher handles the sequenced frames with the
+# session offsets (on a dict backed Redis stand-in) and acknowledges them. Once all the sessions are
+# connected, reports for both processes the sockets open, the memory (RSS) and the CPU time over the window,
+# with the latency of the transcripts from the outbox to the pusher.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_pusher_mux.py [sessions] [window_seconds] [audio_share]
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+import types
+import uuid
+
+import aiohttp
+from aiohttp import web
+
+SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+WINDOW_SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+AUDIO_SHARE = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+WARMUP_SECONDS = 10
+PORT = 18600
+SAMPLE_RATE = 8000
+HEARTBEAT_SECONDS = 15
+
+
+def _process_stats():
+    with open('/proc/self/status') as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+    sockets = 0
+    for fd in os.listdir('/proc/self/fd'):
+        try:
+            sockets += os.readlink(f'/proc/self/fd/{fd}').startswith('socket:')
+        except OSError:
+            pass
+    times = os.times()
+    return {'rss': rss, 'sockets': sockets, 'cpu': times.user + times.system}
+
+
+def _install_stand_ins():
+    store = {}
+    redis_db = types.ModuleType('database.redis_db')
+    redis_db.set_pusher_offsets = lambda session_id, offsets, ttl: store.__setitem__(session_id, json.dumps(offsets))
+    redis_db.set_pusher_offsets_many = lambda offsets, ttl: store.update(
+        {session_id: json.dumps(session_offsets) for session_id, session_offsets in offsets.items()})
+    redis_db.get_pusher_offsets = lambda session_id: json.loads(store[session_id]) if session_id in store else None
+    redis_db.delete_pusher_outbox = lambda session_id: None
+    sys.modules['database'] = types.ModuleType('database')
+    sys.modules['database'].redis_db = redis_db
+    sys.modules['database.redis_db'] = redis_db
+
+    class ConnectionClosed(Exception):
+        pass
+
+    class _Websocket:
+        """websockets client connection over aiohttp, a session and a socket per connection like websockets"""
+
+        def __init__(self, session, ws):
+            self.session = session
+            self.ws = ws
+
+        async def send(self, message):
+            try:
+                if isinstance(message, str):
+                    await self.ws.send_str(message)
+                else:
+                    await self.ws.send_bytes(message)
+            except (ConnectionError, RuntimeError) as e:
+                raise ConnectionClosed(e)
+
+        async def recv(self):
+            message = await self.ws.receive()
+            if message.type not in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                raise ConnectionClosed(message.type)
+            return message.data
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            try:
+                return await self.recv()
+            except ConnectionClosed:
+                raise StopAsyncIteration
+
+        async def close(self, code=1000):
+            await self.ws.close(code=code)
+            await self.session.close()
+
+    async def connect(url, ping_interval=None):
+        session = aiohttp.ClientSession()
+        try:
+            return _Websocket(session, await session.ws_connect(url, heartbeat=ping_interval, max_msg_size=0))
+        except Exception:
+            await session.close()
+            raise
+
+    websockets = types.ModuleType('websockets')
+    websockets.connect = connect
+    websockets.exceptions = types.SimpleNamespace(ConnectionClosed=ConnectionClosed)
+    sys.modules['websockets'] = websockets
+    os.environ['HOSTED_PUSHER_API_URL'] = f'http://127.0.0.1:{PORT}'
+
+
+# Pusher
+#
+class _TriggerSession:
+    """routers/pusher.py TriggerSession without the integrations, counts the transcripts and buffers the audio"""
+
+    def __init__(self, session_id, latencies):
+        from utils.pusher_outbox import PusherSessionOffsets
+
+        self.offsets = PusherSessionOffsets.load(session_id)
+        self.latencies = latencies
+        self.audiobuffer = bytearray()
+
+    def handle(self, data):
+        from utils.pusher_framing import iter_frames
+
+        offsets, offset = self.offsets, None
+        for header_type, seq, payload in iter_frames(data):
+            if seq <= offsets.offset:
+                continue
+            if header_type == 102 and not offsets.is_processed(seq):
+                self.latencies.append(time.time() - json.loads(str(payload, 'utf-8'))['sent_at'])
+            elif header_type == 101 and offsets.should_buffer('trigger', seq):
+                self.audiobuffer.extend(payload)
+                offsets.buffered('trigger', seq)
+                if len(self.audiobuffer) > SAMPLE_RATE * 5 * 2:
+                    self.audiobuffer = bytearray()
+                    offsets.flushed_buffer('trigger', seq)
+            offset = offsets.done(seq) or offset
+        return offset
+
+
+def _pusher(conn):
+    _install_stand_ins()
+    from utils.pusher_framing import split_channel_message
+    from utils.pusher_outbox import PusherSessionOffsets
+
+    latencies = []
+
+    async def listen(request):
+        ws = web.WebSocketResponse(heartbeat=HEARTBEAT_SECONDS, max_msg_size=0)
+        await ws.prepare(request)
+        session = _TriggerSession(request.query['session_id'], latencies)
+        await ws.send_str(json.dumps({'type': 'resume', 'offset': session.offsets.offset}))
+        async for message in ws:
+            offset = session.handle(message.data)
+            await session.offsets.save()
+            if offset is not None:
+                await ws.send_str(json.dumps({'type': 'ack', 'offset': offset}))
+        return ws
+
+    async def mux(request):
+        ws = web.WebSocketResponse(heartbeat=HEARTBEAT_SECONDS, max_msg_size=0)
+        await ws.prepare(request)
+        sessions, pending_acks = {}, {}
+
+        async def send_acks():
+            while not ws.closed:
+                await asyncio.sleep(0.05)
+                if pending_acks:
+                    acks = [[channel, offset, processed] for channel, (offset, processed) in pending_acks.items()]
+                    pending_acks.clear()
+                    await PusherSessionOffsets.save_many([sessions[channel].offsets for channel, _, _ in acks
+                                                          if channel in sessions])
+                    await ws.send_str(json.dumps({'type': 'ack', 'acks': acks}))
+
+        ack_task = asyncio.create_task(send_acks())
+        async for message in ws:
+            if message.type == aiohttp.WSMsgType.BINARY:
+                channel, data = split_channel_message(message.data)
+                session = sessions.get(channel)
+                if session is None:
+                    continue
+                session.handle(data)
+                pending_acks[channel] = [session.offsets.offset, session.offsets.processed]
+                continue
+            control = json.loads(message.data)
+            if control['type'] == 'open':
+                session = sessions[control['channel']] = _TriggerSession(control['session_id'], latencies)
+                await ws.send_str(json.dumps({'type': 'resume', 'channel': control['channel'],
+                                              'offset': session.offsets.offset}))
+            elif control['type'] == 'close':
+                sessions.pop(control['channel'], None)
+                pending_acks.pop(control['channel'], None)
+        ack_task.cancel()
+        return ws
+
+    def report():
+        while True:
+            if conn.recv() == 'latencies':
+                conn.send(list(latencies))
+                latencies.clear()
+            else:
+                conn.send(_process_stats())
+
+    threading.Thread(target=report, daemon=True).start()
+    app = web.Application()
+    app.add_routes([web.get('/v1/trigger/listen', listen), web.get('/v1/trigger/mux', mux)])
+    web.run_app(app, host='127.0.0.1', port=PORT, print=None, backlog=4096)
+
+
+# Backend
+#
+async def _session_transport(uid, outbox, is_active):
+    """The previous path of /v4/listen, a connection per session (create_pusher_task_handler)"""
+    import websockets
+    from utils.pusher import connect_to_trigger_pusher
+    from utils.pusher_framing import batch_frames, encode_frames
+
+    state = {'ws': None, 'sent_seq': 0}
+
+    async def receive_acks(ws):
+        async for message in ws:
+            data = json.loads(message)
+            if data.get('type') == 'ack':
+                outbox.ack(data['offset'])
+        if ws is state['ws']:
+            state['ws'] = None
+            outbox.wake()
+
+    drain_until = None
+    while True:
+        if not is_active():
+            if outbox.pending() == 0:
+                break
+            drain_until = drain_until or time.monotonic() + 10
+            if time.monotonic() > drain_until:
+                break
+        if state['ws'] is None:
+            try:
+                ws = await connect_to_trigger_pusher(uid, SAMPLE_RATE, session_id=outbox.session_id)
+                resume = json.loads(await asyncio.wait_for(ws.recv(), 10))
+                outbox.ack(resume['offset'])
+                state['sent_seq'] = max(resume['offset'], outbox.acked)
+                state['ws'] = ws
+                asyncio.create_task(receive_acks(ws))
+            except Exception as e:
+                print('connect failed', e)
+                await asyncio.sleep(1)
+                continue
+        frames = await outbox.read_after(state['sent_seq'])
+        if not frames:
+            await outbox.wait(1)
+            continue
+        try:
+            for batch in batch_frames(frames):
+                await state['ws'].send(encode_frames(batch))
+                state['sent_seq'] = batch[-1][0]
+        except websockets.exceptions.ConnectionClosed:
+            state['ws'] = None
+    if state['ws'] is not None:
+        await state['ws'].close()
+
+
+async def _mux_transport(uid, outbox, is_active):
+    from utils.pusher_mux import get_pusher_mux
+
+    channel = get_pusher_mux().open(uid, SAMPLE_RATE, outbox)
+    await channel.run(is_active)
+    channel.close()
+
+
+async def _backend(transport, pusher_conn):
+    from utils.pusher_outbox import MemoryPusherOutbox
+
+    active = True
+    sessions = []
+
+    async def session(i):
+        uid = f'uid{i}'
+        outbox = MemoryPusherOutbox(f'{uid}:{uuid.uuid4().hex}')
+        audio = i < SESSIONS * AUDIO_SHARE
+        await asyncio.sleep(i / SESSIONS)
+        consume = asyncio.create_task(transport(uid, outbox, lambda: active))
+        while active:
+            transcript = {'segments': [{'text': 'some words ' * 20}], 'sent_at': time.time()}
+            outbox.append(102, json.dumps(transcript).encode())
+            if audio:
+                outbox.append(101, bytes(SAMPLE_RATE * 2))
+            await asyncio.sleep(1)
+        await consume
+
+    def stats_of_both():
+        pusher_conn.send('stats')
+        return _process_stats(), pusher_conn.recv()
+
+    baseline = await asyncio.to_thread(stats_of_both)
+    sessions = [asyncio.create_task(session(i)) for i in range(SESSIONS)]
+    await asyncio.sleep(WARMUP_SECONDS)
+    pusher_conn.send('latencies')
+    await asyncio.to_thread(pusher_conn.recv)
+    started = await asyncio.to_thread(stats_of_both)
+    await asyncio.sleep(WINDOW_SECONDS)
+    ended = await asyncio.to_thread(stats_of_both)
+    pusher_conn.send('latencies')
+    latencies = await asyncio.to_thread(pusher_conn.recv)
+    active = False
+    await asyncio.gather(*sessions)
+    # the multiplexed connections close once idle
+    await asyncio.sleep(2)
+    return baseline, started, ended, latencies
+
+
+def _run_backend(transport, pusher_conn, conn):
+    _install_stand_ins()
+    import utils.pusher_mux as pusher_mux
+    pusher_mux.PUSHER_MUX_IDLE_SECONDS = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(_backend(_session_transport if transport == 'session' else _mux_transport,
+                                      pusher_conn))
+    conn.send(result)
+
+
+if __name__ == '__main__':
+    print(f'{SESSIONS} sessions, a transcript update per second, {AUDIO_SHARE:.0%} with 8kHz audio, '
+          f'{WINDOW_SECONDS:g}s window after {WARMUP_SECONDS}s')
+    for transport in ('session', 'mux'):
+        pusher_parent, pusher_child = multiprocessing.Pipe()
+        pusher = multiprocessing.Process(target=_pusher, args=(pusher_child,), daemon=True)
+        pusher.start()
+        time.sleep(2)
+        parent, child = multiprocessing.Pipe()
+        backend = multiprocessing.Process(target=_run_backend, args=(transport, pusher_parent, child))
+        backend.start()
+        baseline, started, ended, latencies = parent.recv()
+        backend.join()
+        pusher.terminate()
+        latencies.sort()
+        for side, index in (('backend', 0), ('pusher', 1)):
+            print(f'{transport:<8} {side:<8} sockets {ended[index]["sockets"] - baseline[index]["sockets"]:5d} | rss '
+                  f'+{(ended[index]["rss"] - baseline[index]["rss"]) / 2 ** 20:6.1f}MiB | cpu '
+                  f'{(ended[index]["cpu"] - started[index]["cpu"]) / WINDOW_SECONDS:5.1%}')
+        print(f'{transport:<8} {len(latencies)} transcripts in the window, latency p50 '
+              f'{statistics.median(latencies) * 1000:.1f}ms '
+              f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms')
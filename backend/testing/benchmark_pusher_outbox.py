@@ -0,0 +1,327 @@
+# Benchmark of the backend to pusher delivery while the pusher is killed and restarted on a loop, the previous
+# buffers vs the sequenced outbox.
+#
+# A listen session sends a transcript update every second and 100ms audio chunks, batched every second like the
+# pusher audio sink, to a pusher running the audio bytes trigger (5s chunks). The connection is an in-process
+# stand-in, killing the pusher drops its state and what is sent to it until the backend sees the socket closed
+# (1s), the pusher is back after a downtime. The outbox
+# runs on MemoryPusherOutbox and the pusher offsets on a dict backed Redis stand-in.
+# - buffers: the previous transcript_consume (1s poll, the batch is lost when the send fails) and pusher
+#   audio sink (30s kept while reconnecting), the pusher buffers the audio in memory only
+# - outbox: sequence-numbered frames acknowledged by the pusher, replayed from its offset on a reconnect
+# Reports the transcripts triggered (lost, twice), the audio delivered, the end-to-end latency of the
+# transcripts and the peak memory held by the backend for the pusher.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_pusher_outbox.py [session_seconds] [kill_every] [down]
+import asyncio
+import json
+import statistics
+import sys
+import time
+import types
+
+SESSION_SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 120
+KILL_EVERY_SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 15
+DOWN_SECONDS = float(sys.argv[3]) if len(sys.argv) > 3 else 3
+# time the backend keeps sending into the socket of a killed pusher before it sees it closed
+DETECT_SECONDS = 1
+# the replay runs that many times faster than real time
+SPEEDUP = 10
+SAMPLE_RATE = 16000
+AUDIO_CHUNK_SECONDS = 0.1
+TRIGGER_SECONDS = 5
+AUDIO_SINK_MAX_SECONDS = 30
+
+_redis_store = {}
+
+
+def _install_stand_ins():
+    redis_db = types.ModuleType('database.redis_db')
+    redis_db.set_pusher_offsets = lambda session_id, offsets, ttl: _redis_store.__setitem__(session_id,
+                                                                                           json.dumps(offsets))
+    redis_db.get_pusher_offsets = lambda session_id: json.loads(_redis_store[session_id]) \
+        if session_id in _redis_store else None
+    sys.modules['database'] = types.ModuleType('database')
+    sys.modules['database'].redis_db = redis_db
+    sys.modules['database.redis_db'] = redis_db
+
+
+def _sleep(seconds):
+    return asyncio.sleep(seconds / SPEEDUP)
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class Connection:
+    """Websocket stand-in between the backend and the pusher"""
+
+    def __init__(self):
+        self.to_pusher = asyncio.Queue()
+        self.to_backend = asyncio.Queue()
+        self.dead = False
+        self.closed = False
+
+    async def send(self, data):
+        if self.closed:
+            raise ConnectionClosed()
+        await asyncio.sleep(0.0005)
+        if not self.dead:
+            self.to_pusher.put_nowait(data)
+
+    async def recv_backend(self):
+        message = await self.to_backend.get()
+        if message is None:
+            raise ConnectionClosed()
+        return message
+
+    def kill(self):
+        self.dead = True
+        self.to_pusher.put_nowait(None)
+
+    def close(self):
+        self.closed = True
+        self.to_backend.put_nowait(None)
+
+
+class Pusher:
+    """The pusher process, restarted by `Harness.kill_loop`, its state is lost with it"""
+
+    def __init__(self, stats, sequenced):
+        self.stats = stats
+        self.sequenced = sequenced
+        self.up = True
+        self.accepting = asyncio.Event()
+        self.accepting.set()
+
+    async def serve(self, connection: Connection):
+        from utils.pusher_framing import iter_frames
+        from utils.pusher_outbox import PusherSessionOffsets
+        offsets = None
+        if self.sequenced:
+            offsets = PusherSessionOffsets.load('session')
+            connection.to_backend.put_nowait(json.dumps({'type': 'resume', 'offset': offsets.offset}))
+        audio = bytearray()
+        while True:
+            data = await connection.to_pusher.get()
+            if data is None:
+                return
+            frames = iter_frames(data) if offsets is not None else ((data[0], None, data[1]),)
+            offset = None
+            for header_type, seq, payload in frames:
+                if seq is not None and seq <= offsets.offset:
+                    continue
+                if header_type == 102:
+                    if seq is None or not offsets.is_processed(seq):
+                        for sent_at, index in json.loads(str(payload, 'utf-8'))['segments']:
+                            self.stats['latencies'].append(time.perf_counter() - sent_at)
+                            self.stats['triggered'][index] = self.stats['triggered'].get(index, 0) + 1
+                elif header_type == 101 and (seq is None or offsets.should_buffer('trigger', seq)):
+                    audio.extend(payload)
+                    if seq is not None:
+                        offsets.buffered('trigger', seq)
+                    if len(audio) >= SAMPLE_RATE * 2 * TRIGGER_SECONDS:
+                        self.stats['audio_delivered'] += len(audio)
+                        audio = bytearray()
+                        if seq is not None:
+                            offsets.flushed_buffer('trigger', seq)
+                if seq is not None:
+                    offset = offsets.done(seq) or offset
+            if offsets is not None:
+                await offsets.save()
+            if offset is not None:
+                connection.to_backend.put_nowait(json.dumps({'type': 'ack', 'offset': offset}))
+
+
+class Harness:
+    def __init__(self, sequenced):
+        self.stats = {'latencies': [], 'triggered': {}, 'audio_delivered': 0, 'peak_backend_bytes': 0}
+        self.pusher = Pusher(self.stats, sequenced)
+        self.connection = None
+        self.serving = None
+        self.active = True
+
+    async def connect(self) -> Connection:
+        if not self.pusher.up:
+            await _sleep(1)
+            raise ConnectionClosed()
+        self.connection = Connection()
+        self.serving = asyncio.create_task(self.pusher.serve(self.connection))
+        return self.connection
+
+    async def kill_loop(self):
+        while self.active:
+            await _sleep(KILL_EVERY_SECONDS)
+            if not self.active:
+                return
+            self.pusher.up = False
+            connection = self.connection
+            if connection:
+                connection.kill()
+            if self.serving:
+                self.serving.cancel()
+            await _sleep(DETECT_SECONDS)
+            if connection:
+                connection.close()
+            await _sleep(DOWN_SECONDS - DETECT_SECONDS)
+            self.pusher.up = True
+
+
+async def _produce(harness, transcript_send, audio_send):
+    audio_batch = bytearray()
+    chunks = int(SESSION_SECONDS / AUDIO_CHUNK_SECONDS)
+    for i in range(chunks):
+        audio_batch.extend(b'\0' * int(SAMPLE_RATE * 2 * AUDIO_CHUNK_SECONDS))
+        if (i + 1) % int(1 / AUDIO_CHUNK_SECONDS) == 0:
+            transcript_send([[time.perf_counter(), i]])
+            await audio_send(bytes(audio_batch))
+            audio_batch = bytearray()
+        await _sleep(AUDIO_CHUNK_SECONDS)
+    harness.active = False
+
+
+async def _buffers_session(harness):
+    stats = harness.stats
+    segment_buffers = []
+    audio_queue = []
+    connection = None
+
+    def transcript_send(segments):
+        segment_buffers.extend(segments)
+
+    async def audio_send(chunk):
+        audio_queue.append(chunk)
+        while len(audio_queue) > AUDIO_SINK_MAX_SECONDS:
+            audio_queue.pop(0)
+
+    async def ensure_connected():
+        nonlocal connection
+        if connection is None or connection.closed:
+            try:
+                connection = await harness.connect()
+            except ConnectionClosed:
+                connection = None
+        return connection is not None
+
+    async def transcript_consume():
+        nonlocal segment_buffers
+        while harness.active or segment_buffers:
+            await _sleep(1)
+            if await ensure_connected() and segment_buffers:
+                data = json.dumps({'segments': segment_buffers}).encode()
+                segment_buffers = []
+                try:
+                    await connection.send((102, data))
+                except ConnectionClosed:
+                    pass
+            if not harness.active and not harness.pusher.up:
+                break
+
+    async def audio_consume():
+        while harness.active or audio_queue:
+            stats['peak_backend_bytes'] = max(stats['peak_backend_bytes'], sum(len(c) for c in audio_queue) + sum(
+                len(json.dumps(s)) for s in segment_buffers))
+            if audio_queue and await ensure_connected():
+                try:
+                    await connection.send((101, audio_queue[0]))
+                    audio_queue.pop(0)
+                    continue
+                except ConnectionClosed:
+                    pass
+            await _sleep(0.2)
+            if not harness.active and not harness.pusher.up:
+                break
+
+    await asyncio.gather(_produce(harness, transcript_send, audio_send), transcript_consume(), audio_consume(),
+                         harness.kill_loop())
+
+
+async def _outbox_session(harness):
+    from utils.pusher_framing import batch_frames, encode_frames
+    from utils.pusher_outbox import MemoryPusherOutbox
+
+    stats = harness.stats
+    outbox = MemoryPusherOutbox('session')
+    connection = None
+    sent_seq = 0
+
+    def transcript_send(segments):
+        outbox.append(102, json.dumps({'segments': segments}).encode())
+
+    async def audio_send(chunk):
+        outbox.append(101, chunk)
+
+    async def receive_acks(conn):
+        try:
+            while True:
+                data = json.loads(await conn.recv_backend())
+                if data.get('type') == 'ack':
+                    outbox.ack(data['offset'])
+        except ConnectionClosed:
+            outbox.wake()
+
+    async def connect():
+        nonlocal connection, sent_seq
+        try:
+            conn = await harness.connect()
+            resume = json.loads(await conn.recv_backend())
+            outbox.ack(resume['offset'])
+            resume_seq = max(resume['offset'], outbox.acked)
+            outbox.replayed += max(0, sent_seq - resume_seq)
+            sent_seq = resume_seq
+            connection = conn
+            asyncio.create_task(receive_acks(conn))
+        except ConnectionClosed:
+            connection = None
+
+    async def outbox_consume():
+        nonlocal sent_seq
+        while harness.active or outbox.pending():
+            stats['peak_backend_bytes'] = max(stats['peak_backend_bytes'],
+                                              sum(len(frame[2]) for frame in outbox._frames))
+            if connection is None or connection.closed:
+                await connect()
+                if connection is None:
+                    continue
+            frames = await outbox.read_after(sent_seq)
+            if not frames:
+                await outbox.wait(1 / SPEEDUP)
+                continue
+            try:
+                for batch in batch_frames(frames):
+                    await connection.send(encode_frames(batch))
+                    sent_seq = batch[-1][0]
+            except ConnectionClosed:
+                pass
+
+    await asyncio.gather(_produce(harness, transcript_send, audio_send), outbox_consume(), harness.kill_loop())
+    return outbox
+
+
+async def _run(name):
+    _redis_store.clear()
+    harness = Harness(sequenced=name == 'outbox')
+    outbox = await (_buffers_session(harness) if name == 'buffers' else _outbox_session(harness))
+    await asyncio.sleep(0.1)
+    return harness.stats, outbox
+
+
+if __name__ == '__main__':
+    _install_stand_ins()
+    transcripts = int(SESSION_SECONDS)
+    audio_bytes = int(SESSION_SECONDS * SAMPLE_RATE * 2)
+    print(f'{SESSION_SECONDS:g}s session, pusher killed every {KILL_EVERY_SECONDS:g}s for {DOWN_SECONDS:g}s, '
+          f'replayed {SPEEDUP}x (latencies in session time)')
+    for name in ('buffers', 'outbox'):
+        stats, outbox = asyncio.run(_run(name))
+        triggered = stats['triggered']
+        twice = sum(1 for count in triggered.values() if count > 1)
+        latencies = sorted(latency * SPEEDUP for latency in stats['latencies'])
+        full_chunks = audio_bytes // (SAMPLE_RATE * 2 * TRIGGER_SECONDS)
+        print(f'{name:<8} transcripts {len(triggered)}/{transcripts} triggered, {transcripts - len(triggered)} lost, '
+              f'{twice} twice | audio {stats["audio_delivered"] / (SAMPLE_RATE * 2):.0f}/'
+              f'{full_chunks * TRIGGER_SECONDS}s delivered | latency p50 {statistics.median(latencies):.2f}s '
+              f'p99 {latencies[int(len(latencies) * 0.99) - 1]:.2f}s | backend peak '
+              f'{stats["peak_backend_bytes"] / 1024:.0f}KiB'
+              + (f' (in Redis with the Redis outbox), {outbox.replayed} frames replayed' if outbox else ''))
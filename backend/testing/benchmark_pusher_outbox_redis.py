@@ -0,0 +1,183 @@
+# Benchmark of the Redis round trips of the pusher outbox and the pusher offsets on the loop of a pod: a
+# round trip per frame on the loop (the previous RedisPusherOutbox and PusherSessionOffsets.done) vs the
+# writes batched off the loop and the offsets saved once per message.
+#
+# Runs the listen sessions of a backend pod and their pusher on one loop, the pusher is an in-process
+# stand-in acknowledging what it handled. Every session appends a transcript update and an audio frame every
+# second. The Redis stand-in keeps the streams and the offsets in dicts and blocks the calling thread for a
+# round trip of `rtt_ms`, like redis-py over the network. Reports the round trips per second, the lag of the
+# loop (a 10ms ticker) and the latency of the transcripts from their append to the pusher.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_pusher_outbox_redis.py [sessions] [seconds] [rtt_ms]
+import asyncio
+import statistics
+import sys
+import threading
+import time
+import types
+
+SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+DURATION_SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+RTT_SECONDS = (float(sys.argv[3]) if len(sys.argv) > 3 else 0.5) / 1000
+AUDIO_FRAME = bytes(16000 * 2)
+
+_round_trips = [0]
+_round_trips_lock = threading.Lock()
+
+
+def _install_stand_ins():
+    streams, offsets = {}, {}
+
+    def round_trip():
+        with _round_trips_lock:
+            _round_trips[0] += 1
+        time.sleep(RTT_SECONDS)
+
+    def pusher_outbox_append(session_id, seq, header_type, payload, maxlen, ttl):
+        round_trip()
+        streams.setdefault(session_id, {})[seq] = (seq, header_type, payload)
+
+    def trim(session_id, seq):
+        stream = streams.get(session_id, {})
+        for kept in [kept for kept in stream if kept <= seq]:
+            del stream[kept]
+
+    def pusher_outbox_write(session_id, frames, trim_seq, maxlen, ttl):
+        round_trip()
+        stream = streams.setdefault(session_id, {})
+        for frame in frames:
+            stream[frame[0]] = frame
+        if trim_seq:
+            trim(session_id, trim_seq)
+
+    def pusher_outbox_read(session_id, after_seq, count):
+        round_trip()
+        stream = streams.get(session_id, {})
+        return [stream[seq] for seq in sorted(stream) if seq > after_seq][:count]
+
+    def pusher_outbox_trim(session_id, seq):
+        round_trip()
+        trim(session_id, seq)
+
+    def set_pusher_offsets(session_id, session_offsets, ttl):
+        round_trip()
+        offsets[session_id] = dict(session_offsets)
+
+    def set_pusher_offsets_many(states, ttl):
+        round_trip()
+        offsets.update(states)
+
+    redis_db = types.ModuleType('database.redis_db')
+    for function in (pusher_outbox_append, pusher_outbox_write, pusher_outbox_read, pusher_outbox_trim,
+                     set_pusher_offsets, set_pusher_offsets_many):
+        setattr(redis_db, function.__name__, function)
+    redis_db.get_pusher_offsets = lambda session_id: offsets.get(session_id)
+    redis_db.delete_pusher_outbox = lambda session_id: streams.pop(session_id, None)
+    sys.modules['database'] = types.ModuleType('database')
+    sys.modules['database'].redis_db = redis_db
+    sys.modules['database.redis_db'] = redis_db
+
+
+def _outbox_classes():
+    from database import redis_db
+    from utils.pusher_outbox import PusherOutbox, PusherSessionOffsets, RedisPusherOutbox, \
+        PUSHER_OUTBOX_TTL_SECONDS
+
+    class PerFrameOutbox(PusherOutbox):
+        """The previous RedisPusherOutbox, a round trip per append, read and trim on the loop"""
+
+        def _append(self, seq, header_type, payload):
+            redis_db.pusher_outbox_append(self.session_id, seq, header_type, bytes(payload), self.max_frames,
+                                          PUSHER_OUTBOX_TTL_SECONDS)
+
+        async def _read(self, after_seq, count):
+            return redis_db.pusher_outbox_read(self.session_id, after_seq, count)
+
+        def _trim(self, seq):
+            redis_db.pusher_outbox_trim(self.session_id, seq)
+
+    class PerFrameOffsets(PusherSessionOffsets):
+        """The previous offsets, saved on the loop for every frame done with"""
+
+        def done(self, seq):
+            offset = super().done(seq)
+            redis_db.set_pusher_offsets(self.session_id, self.state(), PUSHER_OUTBOX_TTL_SECONDS)
+            self.dirty = False
+            return offset
+
+    return {'per frame': (PerFrameOutbox, PerFrameOffsets), 'batched': (RedisPusherOutbox, PusherSessionOffsets)}
+
+
+async def _session(i, outbox_class, offsets_class, stats, is_active):
+    from utils.pusher_framing import TRANSCRIPT_FRAME, AUDIO_BYTES_FRAME
+
+    outbox = outbox_class(f'uid{i}:session')
+    offsets = offsets_class(outbox.session_id)
+    sent_seq = 0
+    appended_at = {}
+
+    async def produce():
+        await asyncio.sleep(i / SESSIONS)
+        while is_active():
+            appended_at[outbox.append(TRANSCRIPT_FRAME, b'{"segments": []}')] = time.monotonic()
+            outbox.append(AUDIO_BYTES_FRAME, AUDIO_FRAME)
+            await asyncio.sleep(1)
+
+    async def consume():
+        # the pusher handles a message of frames, saves its offsets and acknowledges them
+        nonlocal sent_seq
+        while is_active() or outbox.pending():
+            frames = await outbox.read_after(sent_seq)
+            if not frames:
+                await outbox.wait(1)
+                continue
+            sent_seq = frames[-1][0]
+            offset = None
+            for seq, header_type, _ in frames:
+                if header_type == TRANSCRIPT_FRAME and seq in appended_at:
+                    stats['latencies'].append(time.monotonic() - appended_at.pop(seq))
+                offset = offsets.done(seq) or offset
+            await offsets.save()
+            if offset is not None:
+                outbox.ack(offset)
+
+    await asyncio.gather(produce(), consume())
+    await outbox.close()
+
+
+async def _run(outbox_class, offsets_class):
+    stats = {'latencies': [], 'lags': []}
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+
+    def is_active():
+        return loop.time() - started < DURATION_SECONDS
+
+    async def ticker():
+        while is_active():
+            tick = loop.time()
+            await asyncio.sleep(0.01)
+            stats['lags'].append(loop.time() - tick - 0.01)
+
+    round_trips = _round_trips[0]
+    await asyncio.gather(ticker(), *[_session(i, outbox_class, offsets_class, stats, is_active)
+                                     for i in range(SESSIONS)])
+    stats['round_trips'] = (_round_trips[0] - round_trips) / (loop.time() - started)
+    return stats
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+if __name__ == '__main__':
+    _install_stand_ins()
+    print(f'{SESSIONS} sessions for {DURATION_SECONDS:.0f}s, a transcript and a 1s audio frame per second each, '
+          f'{RTT_SECONDS * 1000:g}ms Redis round trips')
+    for name, (outbox_class, offsets_class) in _outbox_classes().items():
+        stats = asyncio.run(_run(outbox_class, offsets_class))
+        print(f'{name:<9} {stats["round_trips"]:6.0f} round trips/s | loop lag p50 '
+              f'{statistics.median(stats["lags"]) * 1000:6.1f}ms p99 {_percentile(stats["lags"], 0.99):7.1f}ms '
+              f'max {max(stats["lags"]) * 1000:7.1f}ms | transcript latency p50 '
+              f'{statistics.median(stats["latencies"]) * 1000:7.1f}ms p99 {_percentile(stats["latencies"], 0.99):7.1f}ms')
@@ -0,0 +1,180 @@
+# Load test of the realtime triggers of the pusher sessions with one slow webhook: the previous coroutines
+# posting with requests on the loop, a task per trigger on the HttpDeliveryEngine (run_coroutine_threadsafe)
+# and the TriggerGroup of utils/pusher_triggers.
+#
+# Starts a local HTTP/1.1 keep-alive app in a separate process, serving the realtime integration and the
+# transcript webhook of every session, it answers the requests of one of the sessions after 10s. Each session
+# gets a transcript update every second and submits both triggers, like TriggerSession.handle. Reports for the
+# other sessions the latency of a trigger from its submission to its response and the delay of the transcript
+# updates (the loop lag of the frame handling), and the peak of the requests of the slow session in flight.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_pusher_triggers.py [sessions] [seconds] [slow_ms]
+import asyncio
+import json
+import multiprocessing
+import statistics
+import sys
+import threading
+import time
+import types
+
+import requests
+
+SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+DURATION_SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 30
+SLOW_SECONDS = (float(sys.argv[3]) if len(sys.argv) > 3 else 10000) / 1000
+PORT = 18500
+SLOW_UID = 'uid-0'
+PAYLOAD = {'segments': [{'id': str(i), 'text': 'some words ' * 10, 'speaker': 'SPEAKER_00', 'start': i,
+                         'end': i + 1} for i in range(3)]}
+
+
+def _install_stand_ins():
+    # the circuits of the endpoints are not shared
+    redis_db = types.ModuleType('database.redis_db')
+    redis_db.set_endpoint_circuits = lambda opened, closed: None
+    redis_db.get_endpoint_circuits = lambda keys: None
+    sys.modules['database'] = types.ModuleType('database')
+    sys.modules['database'].redis_db = redis_db
+    sys.modules['database.redis_db'] = redis_db
+
+
+def _serve(stats):
+    async def handle(reader, writer):
+        try:
+            while True:
+                headers = await reader.readuntil(b'\r\n\r\n')
+                length = 0
+                for line in headers.split(b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':')[1])
+                await reader.readexactly(length)
+                if f'uid={SLOW_UID} '.encode() in headers.split(b'\r\n')[0]:
+                    stats['slow_in_flight'] += 1
+                    stats['slow_peak'] = max(stats['slow_peak'], stats['slow_in_flight'])
+                    await asyncio.sleep(SLOW_SECONDS)
+                    stats['slow_in_flight'] -= 1
+                body = b'{}'
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: '
+                             + str(len(body)).encode() + b'\r\n\r\n' + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def main():
+        await asyncio.start_server(handle, '127.0.0.1', PORT, backlog=1024)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def _stats_server():
+    parent, child = multiprocessing.Pipe()
+
+    def run(conn):
+        stats = {'slow_in_flight': 0, 'slow_peak': 0}
+
+        def report():
+            while True:
+                conn.recv()
+                conn.send(dict(stats))
+                stats['slow_peak'] = stats['slow_in_flight']
+
+        threading.Thread(target=report, daemon=True).start()
+        _serve(stats)
+
+    process = multiprocessing.Process(target=run, args=(child,), daemon=True)
+    process.start()
+    return process, parent
+
+
+def _read_stats(conn):
+    conn.send(0)
+    return conn.recv()
+
+
+def _url(trigger, uid):
+    return f'http://127.0.0.1:{PORT}/{trigger}?uid={uid}'
+
+
+async def _blocking_trigger(trigger, uid, submitted_at, latencies):
+    # requests.post on the loop, like the triggers before the HttpDeliveryEngine
+    try:
+        requests.post(_url(trigger, uid), json=PAYLOAD, timeout=30)
+    except Exception:
+        return
+    if uid != SLOW_UID:
+        latencies.append(time.monotonic() - submitted_at)
+
+
+async def _engine_trigger(trigger, uid, submitted_at, latencies):
+    from utils.other.http_delivery import get_http_delivery_engine
+
+    response = await get_http_delivery_engine().post(_url(trigger, uid), json=PAYLOAD, timeout=30)
+    if response is not None and uid != SLOW_UID:
+        latencies.append(time.monotonic() - submitted_at)
+
+
+async def _session(uid, mode, latencies, lags, groups):
+    from utils.pusher_triggers import TriggerGroup
+
+    trigger = _blocking_trigger if mode == 'blocking' else _engine_trigger
+    group = TriggerGroup(uid) if mode == 'trigger group' else None
+    if group is not None:
+        groups.append(group)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    # staggered like the sessions of a pod
+    tick = started + (int(uid.split('-')[1]) % 100) / 100
+    # the updates a blocked loop did not get to are not sent
+    while tick - started < DURATION_SECONDS and loop.time() - started < DURATION_SECONDS:
+        await asyncio.sleep(max(0.0, tick - loop.time()))
+        if uid != SLOW_UID:
+            lags.append(loop.time() - tick)
+        submitted_at = time.monotonic()
+        for name in ('realtime_integrations', 'realtime_transcript_webhook'):
+            if group is not None:
+                group.submit(name, trigger, name, uid, submitted_at, latencies)
+            else:
+                # a task per trigger, like asyncio.run_coroutine_threadsafe
+                asyncio.ensure_future(trigger(name, uid, submitted_at, latencies))
+        tick += 1
+    if group is not None:
+        group.close()
+
+
+async def _load(mode):
+    latencies, lags, groups = [], [], []
+    await asyncio.gather(*[_session(f'uid-{i}', mode, latencies, lags, groups) for i in range(SESSIONS)])
+    # the last triggers of the healthy sessions
+    await asyncio.sleep(1)
+    for task in asyncio.all_tasks() - {asyncio.current_task()}:
+        task.cancel()
+    return latencies, lags, sum(group.dropped for group in groups)
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+if __name__ == '__main__':
+    _install_stand_ins()
+    process, conn = _stats_server()
+    time.sleep(1)
+    expected = (SESSIONS - 1) * int(DURATION_SECONDS) * 2
+    print(f'{SESSIONS} sessions for {DURATION_SECONDS:.0f}s, 2 triggers per transcript update every second, the '
+          f'webhook of {SLOW_UID} answering in {SLOW_SECONDS * 1000:.0f}ms, {len(json.dumps(PAYLOAD))}B payload')
+    for mode in ('blocking', 'engine tasks', 'trigger group'):
+        # the slow requests of the previous run are over
+        time.sleep(SLOW_SECONDS)
+        _read_stats(conn)
+        latencies, lags, dropped = asyncio.run(_load(mode))
+        stats = _read_stats(conn)
+        print(f'{mode:<13} {len(latencies)}/{expected} healthy triggers | latency p50 '
+              f'{statistics.median(latencies) * 1000:7.1f}ms p99 {_percentile(latencies, 0.99):7.1f}ms | '
+              f'update delay p99 {_percentile(lags, 0.99):7.1f}ms max {max(lags) * 1000:7.1f}ms | '
+              f'slow session peak {stats["slow_peak"]} in flight, {dropped} dropped')
+    process.terminate()
@@ -0,0 +1,155 @@
+# Benchmark of the in-progress conversation writes of a listen session.
+#
+# Replays a one hour session (one STT batch per second, speaker changes every ~15s) against an in-memory
+# Firestore stand-in, comparing the legacy read + full rewrite per batch with InProgressConversationStore.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_segment_store.py [minutes]
+import asyncio
+import json
+import random
+import sys
+import types
+from datetime import datetime, timezone, timedelta
+
+MINUTES = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+
+
+class InMemoryFirestore:
+    """Stand-in for the conversations collection, counts the bytes sent over the wire."""
+
+    def __init__(self):
+        self.docs = {}
+        self.writes = 0
+        self.bytes_written = 0
+        self.reads = 0
+        self.bytes_read = 0
+
+    def _write(self, payload):
+        self.writes += 1
+        self.bytes_written += len(json.dumps(payload, default=str))
+
+    def upsert_conversation(self, uid, conversation_data):
+        self._write(conversation_data)
+        self.docs[conversation_data['id']] = json.loads(json.dumps(conversation_data, default=str))
+
+    def get_conversation(self, uid, conversation_id):
+        self.reads += 1
+        doc = self.docs.get(conversation_id)
+        self.bytes_read += len(json.dumps(doc, default=str))
+        return json.loads(json.dumps(doc))
+
+    def update_conversation_segments(self, uid, conversation_id, segments):
+        self._write({'transcript_segments': segments})
+        self.docs[conversation_id]['transcript_segments'] = segments
+
+    def update_conversation_finished_at(self, uid, conversation_id, finished_at):
+        self._write({'finished_at': finished_at})
+        self.docs[conversation_id]['finished_at'] = str(finished_at)
+
+    def update_conversation_segments_and_finished_at(self, uid, conversation_id, segments, finished_at):
+        self._write({'transcript_segments': segments, 'finished_at': finished_at})
+        self.docs[conversation_id]['transcript_segments'] = segments
+        self.docs[conversation_id]['finished_at'] = str(finished_at)
+
+    def append_conversation_segments(self, uid, conversation_id, segments, finished_at):
+        self._write({'transcript_segments': segments, 'finished_at': finished_at})
+        self.docs[conversation_id]['transcript_segments'].extend(segments)
+        self.docs[conversation_id]['finished_at'] = str(finished_at)
+
+
+def _as_async(func):
+    async def wrapper(*args, **kwargs):
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _install_stand_ins():
+    firestore = InMemoryFirestore()
+    conversations_db = types.ModuleType('database.conversations')
+    for name in ['upsert_conversation', 'update_conversation_finished_at',
+                 'update_conversation_segments_and_finished_at', 'append_conversation_segments']:
+        setattr(conversations_db, f'{name}_async', _as_async(getattr(firestore, name)))
+    redis_db = types.ModuleType('database.redis_db')
+    redis_db.hold_in_progress_conversation = lambda uid, conversation_id, holder, ttl=150: None
+    redis_db.set_in_progress_conversation_holder = lambda conversation_id, holder, ttl=150: None
+    redis_db.remove_in_progress_conversation_holder = lambda conversation_id, holder: None
+
+    database = types.ModuleType('database')
+    database.conversations = conversations_db
+    database.redis_db = redis_db
+    sys.modules.update({'database': database, 'database.conversations': conversations_db,
+                        'database.redis_db': redis_db})
+    return firestore
+
+
+def _batches():
+    random.seed(7)
+    words = 'so I was thinking that we could ship the new release next week if the tests pass'.split()
+    speaker = 0
+    now = datetime.now(timezone.utc)
+    for second in range(MINUTES * 60):
+        if random.random() < 1 / 15:
+            speaker = 1 - speaker
+        text = ' '.join(random.choice(words) for _ in range(random.randint(4, 12)))
+        yield now + timedelta(seconds=second), [
+            {'text': text, 'speaker': f'SPEAKER_0{speaker}', 'is_user': speaker == 0, 'start': second,
+             'end': second + 1}]
+
+
+def _run_legacy(firestore):
+    from models.conversation import Conversation, ConversationStatus, Structured
+    from models.transcript_segment import TranscriptSegment
+
+    conversation_id = None
+    for finished_at, batch in _batches():
+        segments = [TranscriptSegment(**s) for s in batch]
+        if conversation_id is None:
+            conversation = Conversation(id='c1', structured=Structured(), created_at=finished_at,
+                                        started_at=finished_at, finished_at=finished_at,
+                                        transcript_segments=segments, status=ConversationStatus.in_progress)
+            firestore.upsert_conversation('uid', conversation.dict())
+            conversation_id = conversation.id
+            continue
+        conversation = Conversation(**firestore.get_conversation('uid', conversation_id))
+        conversation.transcript_segments, _ = TranscriptSegment.combine_segments(
+            conversation.transcript_segments, segments)
+        firestore.update_conversation_segments('uid', conversation_id,
+                                               [segment.dict() for segment in conversation.transcript_segments])
+        firestore.update_conversation_finished_at('uid', conversation_id, finished_at)
+    return firestore.docs[conversation_id]
+
+
+async def _run_store(firestore):
+    from models.transcript_segment import TranscriptSegment
+    import utils.conversations.segment_store as segment_store
+
+    # replayed faster than realtime, the flush cadence follows the session clock
+    clock = 0.0
+    segment_store.time = types.SimpleNamespace(monotonic=lambda: clock)
+    store = segment_store.InProgressConversationStore('uid', 'en')
+    for finished_at, batch in _batches():
+        clock += 1
+        await store.upsert([TranscriptSegment(**s) for s in batch], finished_at)
+    await store.flush(force=True)
+    return firestore.docs[store.conversation.id]
+
+
+def _report(name, firestore, doc):
+    print(f'{name:<12} writes {firestore.writes:6d} ({firestore.writes / MINUTES:6.1f}/min) | '
+          f'written {firestore.bytes_written / 1024 / 1024:9.2f}MB | reads {firestore.reads:5d} '
+          f'({firestore.bytes_read / 1024 / 1024:8.2f}MB) | final segments {len(doc["transcript_segments"])}')
+
+
+if __name__ == '__main__':
+    print(f'session={MINUTES}min, 1 STT batch/s')
+    legacy = _install_stand_ins()
+    legacy_doc = _run_legacy(legacy)
+    _report('legacy', legacy, legacy_doc)
+
+    store = _install_stand_ins()
+    store_doc = asyncio.run(_run_store(store))
+    _report('write-behind', store, store_doc)
+
+    assert [s['text'] for s in legacy_doc['transcript_segments']] == \
+           [s['text'] for s in store_doc['transcript_segments']], 'persisted transcripts differ'
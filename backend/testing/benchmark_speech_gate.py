@@ -0,0 +1,69 @@
+# Benchmark of the server-side speech gate of the audio streamed to the STT providers.
+#
+# Builds a fixture corpus of 16kHz sessions with known speech ratios: voiced utterances of 1 to 4s
+# (harmonics with a syllable-rate envelope) separated by pauses, over a quiet room or a noisy one.
+# Feeds every session through SpeechGate in 20ms blocks, like the decoded opus frames, and reports:
+# - the gate CPU time per hour of audio
+# - the fraction of the bytes suppressed, against the silence ratio of the fixture
+# - the speech recall, the fraction of the speech samples that were sent to the provider
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_speech_gate.py [minutes_per_fixture]
+import sys
+import time
+
+import numpy as np
+
+from utils.stt.speech_gate import SpeechGate
+
+MINUTES = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+SAMPLE_RATE = 16000
+BLOCK_SAMPLES = 320
+SPEECH_RATIOS = [0.1, 0.3, 0.5, 0.8]
+NOISE_DBFS = {'quiet room': -65, 'noisy room': -45}
+
+
+def _fixture(speech_ratio: float, noise_dbfs: float, seed: int):
+    rng = np.random.default_rng(seed)
+    total = int(MINUTES * 60 * SAMPLE_RATE)
+    is_speech = np.zeros(total, dtype=bool)
+    position = 0
+    while position < total:
+        utterance = int(rng.uniform(1, 4) * SAMPLE_RATE)
+        pause = int(utterance * (1 - speech_ratio) / speech_ratio)
+        is_speech[position + pause // 2:position + pause // 2 + utterance] = True
+        position += utterance + pause
+
+    t = np.arange(total) / SAMPLE_RATE
+    pitch = 120 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = 0.3 + 0.7 * np.maximum(0, np.sin(2 * np.pi * 4 * t))
+    speech = 5000 * voiced * envelope * is_speech
+    noise = rng.normal(0, 32768 * 10 ** (noise_dbfs / 20), total)
+    pcm = np.clip(speech + noise, -32768, 32767).astype('<i2')
+    return pcm.tobytes(), is_speech
+
+
+def _run(pcm: bytes, is_speech: np.ndarray):
+    gate = SpeechGate(SAMPLE_RATE)
+    block_bytes = BLOCK_SAMPLES * 2
+    sent_speech = 0
+    started = time.process_time()
+    for i, offset in enumerate(range(0, len(pcm), block_bytes)):
+        for index in gate.push(pcm[offset:offset + block_bytes], i):
+            sent_speech += int(is_speech[index * BLOCK_SAMPLES:(index + 1) * BLOCK_SAMPLES].sum())
+    cpu = time.process_time() - started
+    return gate, cpu, sent_speech
+
+
+if __name__ == '__main__':
+    print(f'{MINUTES:g}min per fixture, {BLOCK_SAMPLES / SAMPLE_RATE * 1000:.0f}ms blocks')
+    for room, noise_dbfs in NOISE_DBFS.items():
+        for ratio in SPEECH_RATIOS:
+            pcm, is_speech = _fixture(ratio, noise_dbfs, seed=int(ratio * 100))
+            gate, cpu, sent_speech = _run(pcm, is_speech)
+            audio_hours = len(pcm) / 2 / SAMPLE_RATE / 3600
+            suppressed = 1 - gate.bytes_sent / gate.bytes_received
+            print(f'{room:<10} speech {is_speech.mean() * 100:3.0f}% | cpu {cpu / audio_hours:5.2f}s/audio-hour '
+                  f'| suppressed {suppressed * 100:5.1f}% of the bytes (silence {(1 - is_speech.mean()) * 100:3.0f}%) '
+                  f'| speech recall {sent_speech / is_speech.sum() * 100:5.1f}%')
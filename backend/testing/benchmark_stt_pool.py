@@ -0,0 +1,103 @@
+# Benchmark of the time to first partial transcript of a /v4/listen session, with and without the STT pool.
+#
+# A local fake STT websocket server delays every handshake (TLS + provider auth) and answers the first
+# audio frame of a connection with a partial transcript. Sessions arrive one after the other and are
+# measured from the session start (socket checkout) to the first partial received. Reports the connections
+# the pool opened ahead of the sessions and those closed unused, both billed.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_stt_pool.py [sessions] [handshake_ms]
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+import websockets
+
+from utils.stt.connection_pool import STTConnectionPool, STTSessionBinding, STT_POOL_SIZE
+
+SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+HANDSHAKE_SECONDS = (float(sys.argv[2]) if len(sys.argv) > 2 else 300) / 1000
+SESSION_INTERVAL_SECONDS = 0.5
+PORT = 8766
+
+
+async def _fake_stt_server():
+    async def process_request(path, headers):
+        await asyncio.sleep(HANDSHAKE_SECONDS)
+
+    async def handler(websocket, *args):
+        config = json.loads(await websocket.recv())
+        answered = False
+        async for _ in websocket:
+            if not answered:
+                await websocket.send(json.dumps({'partial': 'hello', 'language': config['language']}))
+                answered = True
+
+    return await websockets.serve(handler, 'localhost', PORT, process_request=process_request)
+
+
+async def _connect(binding: STTSessionBinding, language: str, sample_rate: int):
+    socket = await websockets.connect(f'ws://localhost:{PORT}')
+    await socket.send(json.dumps({'language': language, 'sample_rate': sample_rate}))
+
+    async def on_message():
+        try:
+            async for message in socket:
+                binding.emit([json.loads(message)])
+        finally:
+            binding.closed = True
+
+    asyncio.create_task(on_message())
+    return socket
+
+
+def _is_healthy(socket, binding: STTSessionBinding) -> bool:
+    return not binding.closed and not socket.closed
+
+
+async def _close(socket):
+    await socket.close()
+
+
+async def _session(pool: STTConnectionPool) -> float:
+    started = time.perf_counter()
+    first_partial = asyncio.get_running_loop().create_future()
+
+    def stream_transcript(segments):
+        if not first_partial.done():
+            first_partial.set_result(time.perf_counter())
+
+    socket = await pool.checkout('fake', stream_transcript, 0, language='en', sample_rate=16000)
+    await socket.send(b'\x00' * 3200)
+    latency = await first_partial - started
+    await socket.close()
+    return latency
+
+
+async def _run(pool_size: int):
+    server = await _fake_stt_server()
+    pool = STTConnectionPool(size=pool_size)
+    pool.register('fake', _connect, _is_healthy, _close)
+
+    latencies = []
+    for _ in range(SESSIONS):
+        latencies.append(await _session(pool))
+        await asyncio.sleep(SESSION_INTERVAL_SECONDS)
+
+    server.close()
+    await server.wait_closed()
+    return latencies, pool
+
+
+def _report(name: str, latencies: list, pool: STTConnectionPool):
+    latencies = sorted(latencies)
+    print(f'{name:<8} time to first partial p50 {statistics.median(latencies) * 1000:7.1f}ms '
+          f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:7.1f}ms max {latencies[-1] * 1000:7.1f}ms | '
+          f'{pool.opened} opened ahead, {pool.expired} closed unused')
+
+
+if __name__ == '__main__':
+    print(f'sessions={SESSIONS} handshake={HANDSHAKE_SECONDS * 1000:.0f}ms interval={SESSION_INTERVAL_SECONDS}s')
+    _report('no pool', *asyncio.run(_run(0)))
+    _report('pool', *asyncio.run(_run(STT_POOL_SIZE)))
@@ -0,0 +1,96 @@
+# Benchmark of the realtime transcript flush loop of /v4/listen.
+#
+# Compares the legacy 300ms polling loop with the event-driven RealtimeSegmentBuffer for N concurrent
+# sessions, reporting:
+# - idle event-loop CPU while every session is silent
+# - latency from the STT callback to the (fake) websocket send
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_transcript_flush.py [sessions]
+import asyncio
+import random
+import statistics
+import sys
+import time
+
+from utils.stt.segment_buffer import RealtimeSegmentBuffer
+
+SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+IDLE_SECONDS = 5
+SEGMENTS_PER_SESSION = 5
+SEGMENT_SPREAD_SECONDS = 3
+
+
+class LegacyBuffer:
+    """The list + 300ms sleep loop used before RealtimeSegmentBuffer."""
+
+    def __init__(self):
+        self.segments = []
+        self.closed = False
+
+    def extend(self, segments):
+        self.segments.extend(segments)
+
+    def close(self):
+        self.closed = True
+
+    async def drain(self):
+        while not self.closed or self.segments:
+            await asyncio.sleep(0.3)
+            if not self.segments:
+                continue
+            segments = self.segments.copy()
+            self.segments = []
+            return segments
+        return []
+
+
+async def _consume(buffer, latencies: list):
+    while True:
+        segments = await buffer.drain()
+        if not segments:
+            break
+        now = time.perf_counter()
+        # websocket.send_json
+        latencies.extend(now - s['created_at'] for s in segments)
+
+
+async def _run(buffer_cls):
+    buffers = [buffer_cls() for _ in range(SESSIONS)]
+    latencies = []
+    consumers = [asyncio.create_task(_consume(b, latencies)) for b in buffers]
+    await asyncio.sleep(0.5)
+
+    # idle
+    cpu_start = time.process_time()
+    await asyncio.sleep(IDLE_SECONDS)
+    idle_cpu = (time.process_time() - cpu_start) / IDLE_SECONDS
+
+    # speech, STT callbacks spread over a few seconds
+    loop = asyncio.get_running_loop()
+
+    def _callback(buffer):
+        buffer.extend([{'text': 'hello', 'created_at': time.perf_counter()}])
+
+    for b in buffers:
+        for _ in range(SEGMENTS_PER_SESSION):
+            loop.call_later(random.random() * SEGMENT_SPREAD_SECONDS, _callback, b)
+    await asyncio.sleep(SEGMENT_SPREAD_SECONDS + 0.5)
+
+    for b in buffers:
+        b.close()
+    await asyncio.gather(*consumers)
+    return idle_cpu, latencies
+
+
+def _report(name, idle_cpu, latencies):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f'{name:<14} idle cpu {idle_cpu * 100:6.2f}% of a core per {SESSIONS} sessions | '
+          f'callback->send p50 {p50:6.1f}ms p99 {p99:6.1f}ms ({len(latencies)} segments)')
+
+
+if __name__ == '__main__':
+    print(f'sessions={SESSIONS} idle={IDLE_SECONDS}s segments/session={SEGMENTS_PER_SESSION}')
+    _report('legacy 300ms', *asyncio.run(_run(LegacyBuffer)))
+    _report('event-driven', *asyncio.run(_run(RealtimeSegmentBuffer)))
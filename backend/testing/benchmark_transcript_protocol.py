@@ -0,0 +1,92 @@
+# Benchmark of the transcript updates sent to a /v4/listen client, JSON segment lists vs msgpack.v1 deltas.
+#
+# Replays a session fixture: a seeded recording of the flushes of a conversation, each the combined
+# segments it touched like `stream_transcript_process` sends them. The last segment mostly grows by a few
+# words, sometimes a new segment starts, a speaker is relabelled or a translation arrives. Reports the
+# bytes per minute of session and the server CPU to serialize the updates for both protocols, and checks
+# the msgpack frames decode to the same segments as the JSON path.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_transcript_protocol.py [minutes] [seed]
+import json
+import random
+import sys
+import time
+
+from models.transcript_segment import TranscriptSegment, Translation
+from utils.stt.transcript_protocol import TranscriptDeltaEncoder, TranscriptDeltaDecoder
+
+MINUTES = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+SEED = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+# flushes of the STT provider, about one per second of speech
+FLUSHES_PER_MINUTE = 60
+WORDS = ('so', 'the', 'meeting', 'tomorrow', 'is', 'at', 'nine', 'we', 'should', 'review', 'budget', 'numbers',
+         'before', 'lunch', 'okay', 'sounds', 'good', 'i', 'think', 'that', 'works', 'for', 'everyone', 'right')
+
+
+def _fixture(minutes: int, seed: int) -> list:
+    """The updates of the session, as the lists of segment models handed to the client on every flush."""
+    rng = random.Random(seed)
+    segments = []
+    updates = []
+    position = 0.0
+    for _ in range(minutes * FLUSHES_PER_MINUTE):
+        words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+        position += rng.uniform(0.6, 1.4)
+        roll = rng.random()
+        if not segments or roll < 0.12:
+            speaker = f'SPEAKER_0{rng.randint(0, 2)}'
+            segments.append(TranscriptSegment(text=words, speaker=speaker, is_user=speaker == 'SPEAKER_00',
+                                              start=round(position - 0.8, 3), end=round(position, 3)))
+            starts = len(segments) - 1
+        else:
+            segment = segments[-1]
+            segment.text = f'{segment.text} {words}'
+            segment.end = round(position, 3)
+            starts = len(segments) - 1
+            if roll > 0.97 and len(segments) > 1:
+                # diarization moved the previous segment to another speaker
+                previous = segments[-2]
+                previous.speaker = f'SPEAKER_0{(int(previous.speaker[-1]) + 1) % 3}'
+                previous.speaker_id = int(previous.speaker.split('_')[1])
+                starts -= 1
+            elif roll > 0.94:
+                segment.translations = [Translation(lang='es', text=f'({segment.text})')]
+        # the state of the segments at the flush, they keep changing after it
+        updates.append([TranscriptSegment(**segment.dict()) for segment in segments[starts:]])
+    return updates
+
+
+def _json(updates: list) -> tuple:
+    # what websocket.send_json puts on the wire
+    started = time.perf_counter()
+    frames = [json.dumps([segment.dict() for segment in update], separators=(',', ':'), ensure_ascii=False).encode()
+              for update in updates]
+    return frames, time.perf_counter() - started
+
+
+def _msgpack(updates: list) -> tuple:
+    encoder = TranscriptDeltaEncoder()
+    started = time.perf_counter()
+    frames = [encoder.encode(update) for update in updates]
+    return frames, time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    updates = _fixture(MINUTES, SEED)
+    json_frames, json_seconds = min((_json(updates) for _ in range(3)), key=lambda result: result[1])
+    delta_frames, delta_seconds = min((_msgpack(updates) for _ in range(3)), key=lambda result: result[1])
+
+    decoder = TranscriptDeltaDecoder()
+    for json_frame, delta_frame in zip(json_frames, delta_frames):
+        assert delta_frame is not None
+        assert decoder.decode(delta_frame) == json.loads(json_frame), 'msgpack.v1 does not decode to the JSON update'
+
+    json_bytes = sum(len(frame) for frame in json_frames)
+    delta_bytes = sum(len(frame) for frame in delta_frames)
+    flushes = len(json_frames)
+    print(f'{MINUTES} minutes, {flushes} updates, {max(len(update) for update in updates)} segments at most per update')
+    for name, total, seconds in (('json', json_bytes, json_seconds), ('msgpack.v1', delta_bytes, delta_seconds)):
+        print(f'{name:<11} {total / MINUTES / 1024:8.1f} KiB/min | {total / flushes:7.0f} B/update '
+              f'| serialize {seconds / flushes * 1e6:6.1f}us/update')
+    print(f'msgpack.v1: {delta_bytes / json_bytes * 100:.1f}% of the bytes, '
+          f'{delta_seconds / json_seconds * 100:.1f}% of the serialization CPU')
@@ -0,0 +1,151 @@
+# Benchmark of the realtime translation of /v4/listen, per segment calls vs the batched pipeline.
+#
+# Replays the transcript updates of concurrent multi-language sessions through a fake Google Translate
+# backend that counts its calls and sleeps a fixed round trip plus a per-text cost. Every update carries the
+# segments changed by the flush (the growing last one and the one just sealed), a share of the phrases is
+# common to all the sessions ("okay", "thank you", ...), the speakers repeat themselves within a session.
+# - per segment: the previous `translate()`, one blocking translate_text call per segment, a process-local
+#   LRU of 1,000 entries, then a conversation read and a full segments rewrite per update with a translation
+# - batched: TranslationBatcher with a dict backed Redis stand-in, the translations ride along with the
+#   writes of the in-progress conversation store
+# Language detection is the same for both and left out.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_translation.py [sessions] [minutes] [api_ms]
+import asyncio
+import hashlib
+import random
+import statistics
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+
+SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+MINUTES = float(sys.argv[2]) if len(sys.argv) > 2 else 2
+API_SECONDS = (float(sys.argv[3]) if len(sys.argv) > 3 else 80) / 1000
+API_SECONDS_PER_TEXT = 0.0005
+# transcript updates of a session per minute, a flush every 3s
+UPDATES_PER_MINUTE = 20
+# the replay runs that many times faster than real time
+SPEEDUP = 20
+COMMON_PHRASES = ['okay', 'thank you', 'yes of course', 'see you tomorrow', 'what do you mean', 'no problem',
+                  'good morning', 'I agree']
+
+counts = {'api': 0, 'texts': 0, 'firestore': 0}
+_counts_lock = threading.Lock()
+_redis_store = {}
+
+
+class _FakeTranslation:
+    def __init__(self, text):
+        self.translated_text = text
+
+
+class _FakeClient:
+    def translate_text(self, contents, parent, mime_type, target_language_code):
+        with _counts_lock:
+            counts['api'] += 1
+            counts['texts'] += len(contents)
+        time.sleep(API_SECONDS + API_SECONDS_PER_TEXT * len(contents))
+        return types.SimpleNamespace(
+            translations=[_FakeTranslation(f'[{target_language_code}] {text}') for text in contents])
+
+
+def _install_stand_ins():
+    translate_v3 = types.ModuleType('google.cloud.translate_v3')
+    translate_v3.TranslationServiceClient = _FakeClient
+    google = types.ModuleType('google')
+    google.cloud = types.ModuleType('google.cloud')
+    google.cloud.translate_v3 = translate_v3
+    sys.modules.update({'google': google, 'google.cloud': google.cloud, 'google.cloud.translate_v3': translate_v3})
+
+    redis_db = types.ModuleType('database.redis_db')
+    redis_db.get_cached_translations = lambda keys: [_redis_store.get(key) for key in keys]
+    redis_db.cache_translations = lambda translations, ttl=None: _redis_store.update(translations)
+    sys.modules['database'] = types.ModuleType('database')
+    sys.modules['database'].redis_db = redis_db
+    sys.modules['database.redis_db'] = redis_db
+
+
+def _session_updates(seed: int):
+    """Texts of the changed segments of every update, a segment grows for 1 to 4 updates then is sealed"""
+    rng = random.Random(seed)
+    own_phrases = [f'session {seed} topic {i} ' + ' '.join(rng.choice('abcdefgh') * 3 for _ in range(4))
+                   for i in range(30)]
+    updates, previous, current = [], None, ''
+    for _ in range(int(MINUTES * UPDATES_PER_MINUTE)):
+        if current and rng.random() < 0.4:
+            previous, current = current, ''
+        phrase = rng.choice(COMMON_PHRASES) if rng.random() < 0.3 else rng.choice(own_phrases)
+        current = f'{current} {phrase}'.strip() if current and rng.random() < 0.5 else phrase
+        updates.append([text for text in (previous, current) if text])
+        previous = None
+    return updates
+
+
+async def _firestore():
+    counts['firestore'] += 1
+    await asyncio.sleep(0.03 / SPEEDUP)
+
+
+async def _per_segment_session(updates, latencies):
+    cache = OrderedDict()
+    client = _FakeClient()
+    for texts in updates:
+        started = time.perf_counter()
+        for text in texts:
+            key = f'{hashlib.md5(text.encode()).hexdigest()}:en'
+            if key in cache:
+                cache.move_to_end(key)
+                continue
+            # blocking, like the previous translate()
+            cache[key] = client.translate_text([text], None, None, 'en').translations[0].translated_text
+            if len(cache) > 1000:
+                cache.popitem(last=False)
+        await _firestore()
+        await _firestore()
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(60 / UPDATES_PER_MINUTE / SPEEDUP)
+
+
+async def _batched_session(batcher, updates, latencies):
+    for texts in updates:
+        started = time.perf_counter()
+        await batcher.translate('en', texts)
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(60 / UPDATES_PER_MINUTE / SPEEDUP)
+
+
+async def _run():
+    _install_stand_ins()
+    from utils.translation import TranslationBatcher
+
+    sessions = [_session_updates(i) for i in range(SESSIONS)]
+    results = {}
+    for name in ('per segment', 'batched'):
+        counts.update(api=0, texts=0, firestore=0)
+        _redis_store.clear()
+        latencies = []
+        started = time.perf_counter()
+        if name == 'per segment':
+            await asyncio.gather(*[_per_segment_session(updates, latencies) for updates in sessions])
+        else:
+            batcher = TranslationBatcher()
+            await asyncio.gather(*[_batched_session(batcher, updates, latencies) for updates in sessions])
+        results[name] = (latencies, dict(counts), time.perf_counter() - started)
+    return results
+
+
+if __name__ == '__main__':
+    results = asyncio.run(_run())
+    translated_minutes = SESSIONS * MINUTES
+    print(f'{SESSIONS} sessions x {MINUTES:g}min, {UPDATES_PER_MINUTE} updates/min, fake API {API_SECONDS * 1000:.0f}ms '
+          f'+ {API_SECONDS_PER_TEXT * 1000:.1f}ms/text, replayed {SPEEDUP}x')
+    for name, (latencies, counted, elapsed) in results.items():
+        print(f'{name:<12} {counted["api"] / translated_minutes:5.1f} API calls/min '
+              f'({counted["texts"] / translated_minutes:5.1f} texts) '
+              f'{counted["firestore"] / translated_minutes:5.1f} Firestore ops/min | update latency '
+              f'p50 {statistics.median(latencies) * 1000:5.0f}ms '
+              f'p99 {statistics.quantiles(latencies, n=100)[98] * 1000:5.0f}ms | '
+              f'translation wait {sum(latencies) / translated_minutes:5.2f}s/min | replay {elapsed:.1f}s')
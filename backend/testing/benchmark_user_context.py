@@ -0,0 +1,150 @@
+# Benchmark of the Firestore reads and Redis round trips of the realtime consumers of a /v4/listen session.
+#
+# Replays a session minute of the pusher and `_listen` lookups: the session start (audio bytes webhook
+# and audio apps checks, by both), every transcript batch (realtime apps and transcript webhook), every
+# 5s of audio bytes (audio apps and audio bytes webhook). Compares:
+# - per call: every trigger reads the settings itself, like the triggers originally did
+# - user context: the triggers read the UserContext snapshot shared by the session
+# The Firestore and Redis accesses are counted by stand-in modules. get_available_apps costs what it does
+# on a warm public apps cache: 3 Firestore reads (private, unapproved, tester) and 3 Redis round trips
+# (apps cache, enabled apps, installs). The user context run also gets a settings change mid-session.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/benchmark_user_context.py [minutes] [transcript_batches_per_minute]
+import sys
+import types
+
+MINUTES = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+TRANSCRIPT_BATCHES_PER_MINUTE = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+AUDIO_BYTES_SECONDS = 5
+
+counts = {'firestore': 0, 'redis': 0}
+
+
+def _firestore(n=1):
+    counts['firestore'] += n
+
+
+def _redis(n=1):
+    counts['redis'] += n
+
+
+class _App:
+    enabled = True
+
+    def triggers_realtime_audio_bytes(self):
+        return True
+
+
+def _get_available_apps(uid):
+    _firestore(3)
+    _redis(3)
+    return [_App()]
+
+
+def _get_user_settings(uid):
+    _firestore()
+    return {'store_recording_permission': True, 'language': 'en', 'fcm_token': 'token'}
+
+
+def _get_user_webhook_with_status_db(uid, wtype):
+    _redis()
+    return True, 'https://example.com/webhook,5'
+
+
+def _install_stand_ins():
+    stand_ins = {
+        'database': {},
+        'database.users': {'get_user_settings': _get_user_settings},
+        'database.redis_db': {'r': None, 'get_user_webhook_with_status_db': _get_user_webhook_with_status_db,
+                              'USER_CONTEXT_INVALIDATION_CHANNEL': 'user_context:invalidate'},
+        'models.app': {'App': _App},
+        'utils.apps': {'get_available_apps': _get_available_apps},
+    }
+    for name, attributes in stand_ins.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+class _PerCall:
+    """The lookups of the triggers before the snapshot."""
+
+    def audio_bytes_webhook(self):
+        # user_webhook_status_db + get_user_webhook_db
+        _redis(2)
+
+    def audio_bytes_apps_enabled(self):
+        # get_enabled_apps + get_audio_apps_count
+        _redis()
+        _firestore()
+
+    def realtime_integrations(self):
+        # get_token_only + get_available_apps
+        _firestore()
+        _get_available_apps('uid')
+
+    def transcript_webhook(self):
+        _redis(2)
+
+    def audio_bytes_integrations(self):
+        _get_available_apps('uid')
+
+
+class _Snapshot:
+    def __init__(self, context):
+        self.context = context
+
+    def audio_bytes_webhook(self):
+        self.context.webhook_url('audio_bytes')
+
+    def audio_bytes_apps_enabled(self):
+        return self.context.audio_bytes_apps_enabled
+
+    def realtime_integrations(self):
+        self.context.token
+        self.context.apps
+
+    def transcript_webhook(self):
+        self.context.webhook_url('realtime_transcript')
+
+    def audio_bytes_integrations(self):
+        self.context.apps
+
+
+def _session(lookups, invalidate=None):
+    counts.update(firestore=0, redis=0)
+    # _listen, then the pusher
+    for _ in range(2):
+        lookups.audio_bytes_webhook()
+        lookups.audio_bytes_apps_enabled()
+
+    seconds = MINUTES * 60
+    transcript_every = 60 / TRANSCRIPT_BATCHES_PER_MINUTE
+    next_transcript, next_audio_bytes = transcript_every, AUDIO_BYTES_SECONDS
+    for second in range(1, seconds + 1):
+        if invalidate and second == seconds // 2:
+            invalidate()
+        while next_transcript <= second:
+            lookups.realtime_integrations()
+            lookups.transcript_webhook()
+            next_transcript += transcript_every
+        if second >= next_audio_bytes:
+            lookups.audio_bytes_integrations()
+            lookups.audio_bytes_webhook()
+            next_audio_bytes += AUDIO_BYTES_SECONDS
+    return counts['firestore'] / MINUTES, counts['redis'] / MINUTES
+
+
+if __name__ == '__main__':
+    _install_stand_ins()
+    from utils.user_context import UserContext
+
+    print(f'{MINUTES}min session, {TRANSCRIPT_BATCHES_PER_MINUTE} transcript batches/min, '
+          f'audio bytes every {AUDIO_BYTES_SECONDS}s')
+    before = _session(_PerCall())
+    context = UserContext('uid')
+    # one settings change mid-session, e.g. an app installed
+    after = _session(_Snapshot(context), invalidate=lambda: context.invalidate(['apps']))
+    for name, (firestore, redis) in [('per call', before), ('user context', after)]:
+        print(f'{name:<13} {firestore:7.1f} Firestore reads/session-minute | {redis:7.1f} Redis round trips/session-minute')
+    print(f'user context {context.stats()}')
@@ -0,0 +1,133 @@
+# Stress test of the audio fan-out of a /v4/listen session with a stalled sink.
+#
+# A client sends a 20ms PCM frame every 20ms to a receive loop feeding three sinks: a healthy STT
+# socket, a stalled one (its send never returns once the session is a second in) and the pusher
+# (batched every second). Compares:
+# - sequential: the receive loop awaits every sink in turn, like `receive_audio` originally did
+# - fan-out: every sink behind its own bounded AudioSink
+# Reports the receive latency of the frames (arrival to the next frame read), the audio delivered to
+# the healthy sink, and the memory held by the sinks. Asserts, for the fan-out, that the receive
+# latency stays flat, the healthy sink gets all the audio, and the stalled sink stays bounded.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/stress_audio_fanout.py [seconds] [policy]
+import asyncio
+import sys
+import time
+import tracemalloc
+
+from utils.stt.audio_fanout import AudioFanout, AudioSink, join_pcm
+
+SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+POLICY = sys.argv[2] if len(sys.argv) > 2 else 'coalesce'
+FRAME_SECONDS = 0.02
+FRAME = b'\x01' * 640
+MAX_SECONDS = 2.0
+
+
+class _Sinks:
+    def __init__(self):
+        self.healthy_bytes = 0
+        self.pusher_bytes = 0
+        self.stall = asyncio.Event()
+        self.started_at = time.monotonic()
+
+    async def healthy(self, chunk):
+        self.healthy_bytes += len(chunk)
+        await asyncio.sleep(0)
+
+    async def stalled(self, chunk):
+        if time.monotonic() - self.started_at > 1:
+            # a socket whose peer stopped reading
+            await self.stall.wait()
+        await asyncio.sleep(0)
+
+    async def pusher(self, chunk):
+        self.pusher_bytes += len(chunk)
+        await asyncio.sleep(0)
+
+
+async def _client(queue: asyncio.Queue):
+    started = time.monotonic()
+    for i in range(int(SECONDS / FRAME_SECONDS)):
+        await asyncio.sleep(max(0.0, started + i * FRAME_SECONDS - time.monotonic()))
+        queue.put_nowait((FRAME, time.monotonic()))
+    queue.put_nowait(None)
+
+
+async def _run(name: str):
+    queue = asyncio.Queue()
+    sinks = _Sinks()
+    latency = []
+    tracemalloc.start()
+    client = asyncio.create_task(_client(queue))
+
+    fanout = None
+    if name == 'fan-out':
+        fanout = AudioFanout()
+        healthy = fanout.add(AudioSink('healthy', sinks.healthy, MAX_SECONDS, POLICY, coalesce=join_pcm))
+        stalled = fanout.add(AudioSink('stalled', sinks.stalled, MAX_SECONDS, POLICY, coalesce=join_pcm))
+        pusher = fanout.add(AudioSink('pusher', sinks.pusher, MAX_SECONDS * 5, coalesce=join_pcm,
+                                      min_interval_seconds=1))
+
+    async def receive():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            frame, arrived_at = item
+            if fanout is not None:
+                for sink in (healthy, stalled, pusher):
+                    sink.push(frame, FRAME_SECONDS)
+            else:
+                await sinks.healthy(frame)
+                await sinks.stalled(frame)
+                await sinks.pusher(frame)
+            latency.append(time.monotonic() - arrived_at)
+
+    try:
+        # the sequential loop never gets past the stalled sink
+        await asyncio.wait_for(receive(), SECONDS + 2)
+    except asyncio.TimeoutError:
+        pass
+    frames_read = len(latency)
+    now = time.monotonic()
+    while not queue.empty():
+        item = queue.get_nowait()
+        if item is not None:
+            # still waiting to be read
+            latency.append(now - item[1])
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = {}
+    if fanout is not None:
+        stats = fanout.stats()
+        await fanout.close(timeout_seconds=0.5)
+    client.cancel()
+
+    latency.sort()
+    sent = int(SECONDS / FRAME_SECONDS)
+    print(f'{name:<10} frames read {frames_read}/{sent} | receive latency p50 {latency[len(latency) // 2] * 1000:.2f}ms '
+          f'p99 {latency[int(len(latency) * 0.99)] * 1000:.2f}ms max {latency[-1] * 1000:.2f}ms '
+          f'| healthy sink {sinks.healthy_bytes / (sent * len(FRAME)) * 100:.0f}% of the audio '
+          f'| peak memory {peak / 1024:.0f}KiB')
+    if stats:
+        print(f'{"":<10} {stats}')
+    return frames_read, latency, sinks, stats, peak
+
+
+if __name__ == '__main__':
+    print(f'{SECONDS:g}s of audio, {FRAME_SECONDS * 1000:.0f}ms frames, stalled sink after 1s, {POLICY} policy, '
+          f'{MAX_SECONDS:g}s sink buffers')
+    asyncio.run(_run('sequential'))
+    frames_read, latency, sinks, stats, peak = asyncio.run(_run('fan-out'))
+
+    assert frames_read == int(SECONDS / FRAME_SECONDS), 'the receive loop fell behind'
+    assert latency[int(len(latency) * 0.99)] < 0.005, 'receive latency is not flat'
+    if POLICY == 'disconnect':
+        assert stats['stalled']['failed'], 'the stalled sink was not disconnected'
+    else:
+        assert stats['stalled']['max_pending_seconds'] <= MAX_SECONDS + FRAME_SECONDS, 'the stalled sink grew unbounded'
+    assert stats['healthy']['dropped'] == 0 and stats['healthy']['sent'] == frames_read, 'the healthy sink lost audio'
+    assert peak < 1024 * 1024, f'{peak / 1024:.0f}KiB held'
+    print('fan-out: receive latency flat, healthy sink complete, stalled sink bounded')
@@ -0,0 +1,92 @@
+# Stress test of the STT callbacks -> event loop handoff of RealtimeSegmentBuffer.
+#
+# Fires the callbacks of many sessions from many threads at once, like the Deepgram SDK threads of a
+# loaded instance, while the sessions consumers drain on the event loop. Checks that every segment is
+# delivered exactly once, then that the bounded buffer drops and counts the oldest segments when its
+# consumer stalls.
+#
+# Usage: cd backend && PYTHONPATH=. python testing/stress_segment_buffer.py [sessions] [threads_per_session]
+import asyncio
+import sys
+import threading
+import time
+
+from utils.stt.segment_buffer import RealtimeSegmentBuffer
+
+SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+THREADS_PER_SESSION = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+CALLBACKS_PER_THREAD = 500
+
+
+async def _consume(buffer: RealtimeSegmentBuffer, delivered: list):
+    while True:
+        segments = await buffer.drain()
+        if not segments:
+            break
+        delivered.extend(segment['id'] for segment in segments)
+
+
+def _fire(buffer: RealtimeSegmentBuffer, session: int, thread: int, start: threading.Event):
+    start.wait()
+    for i in range(CALLBACKS_PER_THREAD):
+        # a callback reuses and mutates its own list, like the adapters building their segments
+        segments = [{'id': (session, thread, i, 0)}, {'id': (session, thread, i, 1)}]
+        buffer.extend(segments)
+        segments.clear()
+
+
+async def _no_loss_no_duplicates():
+    buffers = [RealtimeSegmentBuffer(min_interval_seconds=0.001, max_segments=10 ** 9) for _ in range(SESSIONS)]
+    delivered = [[] for _ in range(SESSIONS)]
+    consumers = [asyncio.create_task(_consume(b, d)) for b, d in zip(buffers, delivered)]
+
+    start = threading.Event()
+    threads = [threading.Thread(target=_fire, args=(buffers[s], s, t, start))
+               for s in range(SESSIONS) for t in range(THREADS_PER_SESSION)]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    start.set()
+    await asyncio.to_thread(lambda: [thread.join() for thread in threads])
+
+    # let the pending handoffs run before closing
+    await asyncio.sleep(0.1)
+    for b in buffers:
+        b.close()
+    await asyncio.gather(*consumers)
+    elapsed = time.perf_counter() - started
+
+    expected = CALLBACKS_PER_THREAD * 2 * THREADS_PER_SESSION
+    for session, ids in enumerate(delivered):
+        assert len(ids) == expected, f'session {session}: {len(ids)} delivered, {expected} expected'
+        assert len(set(ids)) == len(ids), f'session {session}: duplicated segments'
+        # segments of a same thread are delivered in order
+        last_by_thread = {}
+        for segment_id in ids:
+            assert last_by_thread.get(segment_id[1], (-1, 0)) < segment_id[2:], f'session {session}: out of order'
+            last_by_thread[segment_id[1]] = segment_id[2:]
+
+    total = expected * SESSIONS
+    handoffs = sum(b.threadsafe_handoffs for b in buffers)
+    print(f'no loss, no duplicates: {total} segments from {len(threads)} threads in {elapsed:.2f}s '
+          f'({total / elapsed:,.0f}/s), {handoffs} thread-safe handoffs, '
+          f'max pending {max(b.max_pending for b in buffers)}')
+
+
+async def _bounded_backpressure():
+    buffer = RealtimeSegmentBuffer(min_interval_seconds=0, max_segments=100)
+    thread = threading.Thread(target=lambda: [buffer.extend([{'id': i}]) for i in range(1000)])
+    thread.start()
+    await asyncio.to_thread(thread.join)
+    await asyncio.sleep(0.1)
+
+    segments = await buffer.drain()
+    assert [s['id'] for s in segments] == list(range(900, 1000)), 'the newest segments must be kept'
+    assert buffer.received == 1000 and buffer.dropped == 900, buffer.stats()
+    print(f'bounded: consumer stalled, {buffer.stats()}')
+
+
+if __name__ == '__main__':
+    print(f'sessions={SESSIONS} threads/session={THREADS_PER_SESSION} callbacks/thread={CALLBACKS_PER_THREAD}')
+    asyncio.run(_no_loss_no_duplicates())
+    asyncio.run(_bounded_backpressure())
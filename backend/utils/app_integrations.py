@@ -1,10 +1,9 @@
-import threading
+import asyncio
 from typing import List
 import os
 import requests
 import time
 
-import database.notifications as notification_db
 from database import mem_db
 from database import redis_db
 from database.apps import record_app_usage
@@ -15,6 +14,8 @@ from models.chat import Message
 from models.conversation import Conversation, ConversationSource
 from models.notification_message import NotificationMessage
 from utils.apps import get_available_apps
+from utils.other.http_delivery import get_http_delivery_engine
+from utils.user_context import get_user_context
 from utils.notifications import send_notification
 from utils.llm.clients import generate_embedding
 from utils.llm.proactive_notification import get_proactive_message
@@ -81,27 +82,27 @@ def trigger_external_integrations(uid: str, conversation: Conversation) -> list:
     if not filtered_apps:
         return []
 
-    threads = []
+    filtered_apps = [app for app in filtered_apps if app.external_integration.webhook_url]
     results = {}
 
-    def _single(app: App):
-        if not app.external_integration.webhook_url:
-            return
-
-        conversation_dict = conversation.as_dict_cleaned_dates()
+    conversation_dict = conversation.as_dict_cleaned_dates()
 
-        # Ignore external data on workflow
-        if conversation.source == ConversationSource.workflow and 'external_data' in conversation_dict:
-            conversation_dict['external_data'] = None
+    # Ignore external data on workflow
+    if conversation.source == ConversationSource.workflow and 'external_data' in conversation_dict:
+        conversation_dict['external_data'] = None
 
+    def _url(app: App):
         url = app.external_integration.webhook_url
         if '?' in url:
             url += '&uid=' + uid
         else:
             url += '?uid=' + uid
+        return url
 
+    def _single(app: App, response):
+        if response is None:
+            return
         try:
-            response = requests.post(url, json=conversation_dict, timeout=30, )  # TODO: failing?
             if response.status_code != 200:
                 print('App integration failed', app.id, 'status:', response.status_code, 'result:', response.text[:100])
                 return
@@ -121,11 +122,15 @@ def trigger_external_integrations(uid: str, conversation: Conversation) -> list:
             print(f"Plugin integration error: {e}")
             return
 
-    for app in filtered_apps:
-        threads.append(threading.Thread(target=_single, args=(app,)))
+    engine = get_http_delivery_engine()
+    deadline = time.monotonic() + 30
+
+    async def _deliver():
+        return await asyncio.gather(
+            *[engine.post(_url(app), json=conversation_dict, deadline=deadline) for app in filtered_apps])
 
-    [t.start() for t in threads]
-    [t.join() for t in threads]
+    for app, response in zip(filtered_apps, engine.run_sync(_deliver())):
+        _single(app, response)
 
     messages = []
     for key, message in results.items():
@@ -138,15 +143,15 @@ def trigger_external_integrations(uid: str, conversation: Conversation) -> list:
 async def trigger_realtime_integrations(uid: str, segments: list[dict], conversation_id: str | None):
     print("trigger_realtime_integrations", uid)
     """REALTIME STREAMING"""
-    # TODO: don't retrieve token before knowing if to notify
-    token = notification_db.get_token_only(uid)
-    _trigger_realtime_integrations(uid, token, segments, conversation_id)
+    # the settings of the user are loaded on first use, off the loop
+    token = await asyncio.to_thread(lambda: get_user_context(uid).token)
+    await _trigger_realtime_integrations(uid, token, segments, conversation_id)
 
 
 async def trigger_realtime_audio_bytes(uid: str, sample_rate: int, data: bytearray):
     print("trigger_realtime_audio_bytes", uid)
     """REALTIME AUDIO STREAMING"""
-    _trigger_realtime_audio_bytes(uid, sample_rate, data)
+    await _trigger_realtime_audio_bytes(uid, sample_rate, data)
 
 
 # proactive notification
@@ -244,105 +249,96 @@ def _process_proactive_notification(uid: str, token: str, app: App, data):
     return message
 
 
-def _trigger_realtime_audio_bytes(uid: str, sample_rate: int, data: bytearray):
-    apps: List[App] = get_available_apps(uid)
+async def _trigger_realtime_audio_bytes(uid: str, sample_rate: int, data: bytearray):
+    apps: List[App] = await asyncio.to_thread(lambda: get_user_context(uid).apps)
     filtered_apps = [
         app for app in apps if
-        app.triggers_realtime_audio_bytes() and app.enabled
+        app.triggers_realtime_audio_bytes() and app.enabled and app.external_integration.webhook_url
     ]
     if not filtered_apps:
         return {}
 
-    threads = []
-    results = {}
-
-    def _single(app: App):
-        if not app.external_integration.webhook_url:
-            return
+    engine = get_http_delivery_engine()
+    deadline = time.monotonic() + 15
+    content = bytes(data)
 
+    async def _single(app: App):
         url = app.external_integration.webhook_url
         url += f'?sample_rate={sample_rate}&uid={uid}'
-        try:
-            response = requests.post(url, data=data, headers={'Content-Type': 'application/octet-stream'}, timeout=15)
+        response = await engine.post(url, content=content, headers={'Content-Type': 'application/octet-stream'},
+                                     deadline=deadline)
+        if response is not None:
             print('trigger_realtime_audio_bytes', app.id, 'status:', response.status_code)
-        except Exception as e:
-            print(f"Plugin integration error: {e}")
-            return
 
-    for app in filtered_apps:
-        threads.append(threading.Thread(target=_single, args=(app,)))
+    await asyncio.gather(*[_single(app) for app in filtered_apps])
 
-    [t.start() for t in threads]
-    [t.join() for t in threads]
+    return {}
 
-    return results
 
-
-def _trigger_realtime_integrations(uid: str, token: str, segments: List[dict], conversation_id: str | None) -> dict:
-    apps: List[App] = get_available_apps(uid)
+async def _trigger_realtime_integrations(uid: str, token: str, segments: List[dict], conversation_id: str | None) -> dict:
+    apps: List[App] = await asyncio.to_thread(lambda: get_user_context(uid).apps)
     filtered_apps = [
         app for app in apps if
-        app.triggers_realtime() and app.enabled
+        app.triggers_realtime() and app.enabled and app.external_integration.webhook_url
     ]
     if not filtered_apps:
         return {}
 
-    threads = []
     results = {}
+    engine = get_http_delivery_engine()
+    deadline = time.monotonic() + 30
 
-    def _single(app: App):
-        if not app.external_integration.webhook_url:
+    def _process_response(app: App, response):
+        if response.status_code != 200:
+            print('trigger_realtime_integrations', app.id, 'status: ', response.status_code, 'results:',
+                  response.text[:100])
             return
 
+        if (app.uid is None or app.uid != uid) and conversation_id is not None:
+            record_app_usage(uid, app.id, UsageHistoryType.transcript_processed_external_integration, conversation_id=conversation_id)
+
+        response_data = response.json()
+        if not response_data:
+            return
+
+        # message
+        message = response_data.get('message', '')
+        # print('Plugin', plugin.id, 'response message:', message)
+        if message and len(message) > 5:
+            send_app_notification(token, app.name, app.id, message)
+            results[app.id] = message
+
+        # proactive_notification
+        noti = response_data.get('notification', None)
+        # print('Plugin', plugin.id, 'response notification:', noti)
+        if app.has_capability("proactive_notification"):
+            message = _process_proactive_notification(uid, token, app, noti)
+            if message:
+                results[app.id] = message
+
+    async def _single(app: App):
         url = app.external_integration.webhook_url
         if '?' in url:
             url += '&uid=' + uid
         else:
             url += '?uid=' + uid
 
+        response = await engine.post(url, json={"session_id": uid, "segments": segments}, deadline=deadline)
+        if response is None:
+            return
         try:
-            response = requests.post(url, json={"session_id": uid, "segments": segments}, timeout=30)
-            if response.status_code != 200:
-                print('trigger_realtime_integrations', app.id, 'status: ', response.status_code, 'results:',
-                      response.text[:100])
-                return
-
-            if (app.uid is None or app.uid != uid) and conversation_id is not None:
-                record_app_usage(uid, app.id, UsageHistoryType.transcript_processed_external_integration, conversation_id=conversation_id)
-
-            response_data = response.json()
-            if not response_data:
-                return
-
-            # message
-            message = response_data.get('message', '')
-            # print('Plugin', plugin.id, 'response message:', message)
-            if message and len(message) > 5:
-                send_app_notification(token, app.name, app.id, message)
-                results[app.id] = message
-
-            # proactive_notification
-            noti = response_data.get('notification', None)
-            # print('Plugin', plugin.id, 'response notification:', noti)
-            if app.has_capability("proactive_notification"):
-                message = _process_proactive_notification(uid, token, app, noti)
-                if message:
-                    results[app.id] = message
-
+            # usage, notifications and the proactive notification LLM call are blocking
+            await asyncio.to_thread(_process_response, app, response)
         except Exception as e:
             print(f"App integration error: {e}")
             return
 
-    for app in filtered_apps:
-        threads.append(threading.Thread(target=_single, args=(app,)))
-
-    [t.start() for t in threads]
-    [t.join() for t in threads]
+    await asyncio.gather(*[_single(app) for app in filtered_apps])
     messages = []
     for key, message in results.items():
         if not message:
             continue
-        messages.append(add_app_message(message, key, uid))
+        messages.append(await asyncio.to_thread(add_app_message, message, key, uid))
 
     return messages
 
@@ -475,3 +475,17 @@ def retrieve_in_progress_conversation(uid):
     if not existing:
         existing = conversations_db.get_in_progress_conversation(uid)
     return existing
+
+
+async def retrieve_in_progress_conversation_async(uid):
+    conversation_id = redis_db.get_in_progress_conversation_id(uid)
+    existing = None
+
+    if conversation_id:
+        existing = await conversations_db.get_conversation_async(uid, conversation_id)
+        if existing and existing['status'] != 'in_progress':
+            existing = None
+
+    if not existing:
+        existing = await conversations_db.get_in_progress_conversation_async(uid)
+    return existing
@@ -0,0 +1,327 @@
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import redis
+
+import database.conversations as conversations_db
+from database.redis_db import r, get_cached_user_geolocation
+from models.conversation import Conversation, Geolocation
+from utils.app_integrations import trigger_external_integrations
+from utils.conversations.location import get_google_maps_location
+from utils.conversations.process_conversation import process_conversation
+
+# 'redis' for the durable queue shared by the pods, 'memory' for local runs and tests
+CONVERSATION_QUEUE_BACKEND = os.getenv('CONVERSATION_QUEUE_BACKEND', 'redis')
+# Worker threads of the process consuming the queue
+CONVERSATION_PROCESSING_WORKERS = int(os.getenv('CONVERSATION_PROCESSING_WORKERS', '4'))
+# Jobs waiting or processing past which the queue refuses new ones
+CONVERSATION_QUEUE_MAX_PENDING = int(os.getenv('CONVERSATION_QUEUE_MAX_PENDING', '1000'))
+# Jobs left unacknowledged that long by a consumer (e.g. its pod died) are taken over by another one
+CONVERSATION_JOB_CLAIM_IDLE_SECONDS = int(os.getenv('CONVERSATION_JOB_CLAIM_IDLE_SECONDS', '600'))
+CONVERSATION_JOB_RESULT_TTL_SECONDS = 60 * 60
+# Time a session waits for the result of its job, enough for it to be taken over once
+CONVERSATION_JOB_WAIT_SECONDS = int(os.getenv('CONVERSATION_JOB_WAIT_SECONDS',
+                                              str(CONVERSATION_JOB_CLAIM_IDLE_SECONDS * 2)))
+
+CONVERSATION_QUEUE_STREAM = 'conversation_processing'
+CONVERSATION_QUEUE_GROUP = 'workers'
+
+
+class ConversationQueueFull(Exception):
+    pass
+
+
+# The job of the conversation already queued, or the new job added to the stream, in a single atomic step
+_ENQUEUE_SCRIPT = """
+local job_id = redis.call('GET', KEYS[1])
+if job_id then
+    return job_id
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('XADD', KEYS[2], '*', 'job', ARGV[3])
+return ARGV[1]
+"""
+
+
+class InMemoryConversationQueue:
+    """Queue of the process only, same interface as `RedisConversationQueue`, not durable."""
+
+    def __init__(self, max_pending: int = CONVERSATION_QUEUE_MAX_PENDING):
+        self.max_pending = max_pending
+        self._lock = threading.Condition()
+        self._ready: deque = deque()
+        self._processing: Dict[str, dict] = {}
+        self._job_ids: Dict[str, str] = {}
+        self._results: Dict[str, dict] = {}
+        self._results_order: deque = deque()
+
+    def enqueue(self, job: dict) -> str:
+        with self._lock:
+            dedup_key = f'{job["uid"]}:{job["conversation_id"]}'
+            if job_id := self._job_ids.get(dedup_key):
+                return job_id
+            if len(self._ready) + len(self._processing) >= self.max_pending:
+                raise ConversationQueueFull()
+            job_id = str(uuid.uuid4())
+            self._job_ids[dedup_key] = job_id
+            self._ready.append((job_id, {**job, 'job_id': job_id}))
+            self._lock.notify()
+            return job_id
+
+    def read(self, consumer: str, block_seconds: float) -> Optional[Tuple[str, dict]]:
+        """(entry id, job) of the next job, None once `block_seconds` passed without any."""
+        with self._lock:
+            if not self._ready:
+                self._lock.wait(block_seconds)
+            if not self._ready:
+                return None
+            job_id, job = self._ready.popleft()
+            self._processing[job_id] = job
+            return job_id, job
+
+    def claim_stale(self, consumer: str) -> List[Tuple[str, dict]]:
+        return []
+
+    def complete(self, entry_id: str, job: dict, result: dict):
+        job_id = job['job_id']
+        with self._lock:
+            self._processing.pop(entry_id, None)
+            self._job_ids.pop(f'{job["uid"]}:{job["conversation_id"]}', None)
+            self._results[job_id] = result
+            self._results_order.append(job_id)
+            while len(self._results_order) > self.max_pending:
+                self._results.pop(self._results_order.popleft(), None)
+
+    def get_result(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._results.get(job_id)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._ready) + len(self._processing)
+
+
+class RedisConversationQueue:
+    """
+    Durable queue on a Redis stream with a consumer group, shared by the workers of all the pods.
+
+    A job stays pending in the group until its worker acknowledges it, the jobs of a worker that died
+    are claimed by another one after `CONVERSATION_JOB_CLAIM_IDLE_SECONDS`. One job per conversation
+    at a time, and its result is kept an hour for the sessions waiting on it.
+    """
+
+    def __init__(self, client: redis.Redis = r, max_pending: int = CONVERSATION_QUEUE_MAX_PENDING,
+                 stream: str = CONVERSATION_QUEUE_STREAM, group: str = CONVERSATION_QUEUE_GROUP):
+        self.client = client
+        self.max_pending = max_pending
+        self.stream = stream
+        self.group = group
+        self._group_created = False
+        self._enqueue_script = client.register_script(_ENQUEUE_SCRIPT)
+
+    def _ensure_group(self):
+        if self._group_created:
+            return
+        try:
+            self.client.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._group_created = True
+
+    def enqueue(self, job: dict) -> str:
+        self._ensure_group()
+        if self.client.xlen(self.stream) >= self.max_pending:
+            raise ConversationQueueFull()
+
+        # one job per conversation, a job running longer than the claim idle time is taken over anyway
+        dedup_key = f'{self.stream}:job:{job["uid"]}:{job["conversation_id"]}'
+        job = {**job, 'job_id': str(uuid.uuid4())}
+        job_id = self._enqueue_script(keys=[dedup_key, self.stream],
+                                      args=[job['job_id'], CONVERSATION_JOB_CLAIM_IDLE_SECONDS * 2, json.dumps(job)])
+        return job_id.decode()
+
+    @staticmethod
+    def _parse(entries) -> List[Tuple[str, dict]]:
+        return [(entry_id.decode(), json.loads(fields[b'job'])) for entry_id, fields in entries if fields]
+
+    def read(self, consumer: str, block_seconds: float) -> Optional[Tuple[str, dict]]:
+        self._ensure_group()
+        response = self.client.xreadgroup(self.group, consumer, {self.stream: '>'}, count=1,
+                                          block=int(block_seconds * 1000))
+        if not response:
+            return None
+        jobs = self._parse(response[0][1])
+        return jobs[0] if jobs else None
+
+    def claim_stale(self, consumer: str) -> List[Tuple[str, dict]]:
+        self._ensure_group()
+        response = self.client.xautoclaim(self.stream, self.group, consumer,
+                                          min_idle_time=CONVERSATION_JOB_CLAIM_IDLE_SECONDS * 1000, count=10)
+        return self._parse(response[1])
+
+    def complete(self, entry_id: str, job: dict, result: dict):
+        pipe = self.client.pipeline()
+        pipe.set(f'{self.stream}:result:{job["job_id"]}', json.dumps(result), ex=CONVERSATION_JOB_RESULT_TTL_SECONDS)
+        pipe.delete(f'{self.stream}:job:{job["uid"]}:{job["conversation_id"]}')
+        pipe.xack(self.stream, self.group, entry_id)
+        pipe.xdel(self.stream, entry_id)
+        pipe.execute()
+
+    def get_result(self, job_id: str) -> Optional[dict]:
+        result = self.client.get(f'{self.stream}:result:{job_id}')
+        return json.loads(result) if result else None
+
+    def pending(self) -> int:
+        return self.client.xlen(self.stream)
+
+
+def process_conversation_job(job: dict) -> dict:
+    """Processes the conversation of the job, the work `_listen` used to run on its event loop."""
+    uid, language = job['uid'], job['language']
+    conversation = Conversation(**conversations_db.get_conversation(uid, job['conversation_id']))
+    try:
+        # Geolocation
+        geolocation = get_cached_user_geolocation(uid)
+        if geolocation:
+            geolocation = Geolocation(**geolocation)
+            conversation.geolocation = get_google_maps_location(geolocation.latitude, geolocation.longitude)
+
+        conversation = process_conversation(uid, language, conversation)
+        messages = trigger_external_integrations(uid, conversation)
+    except Exception as e:
+        print(f"Error processing conversation: {e}", uid)
+        conversations_db.set_conversation_as_discarded(uid, conversation.id)
+        conversation.discarded = True
+        messages = []
+
+    return {'conversation': conversation.model_dump(mode='json'),
+            'messages': [message.model_dump(mode='json') for message in messages]}
+
+
+class ConversationProcessingWorkers:
+    """
+    Worker threads consuming the conversation processing queue, off the event loops of the websockets.
+
+    A session enqueues its conversation with `submit` and awaits the result with `wait`. The workers
+    of the process hand their results straight to the sessions waiting on them, results processed by
+    another pod are picked up from the queue.
+    """
+
+    def __init__(self, queue, process_job: Callable[[dict], dict] = process_conversation_job,
+                 workers: int = CONVERSATION_PROCESSING_WORKERS):
+        self.queue = queue
+        self.process_job = process_job
+        self.workers = workers
+        self._consumer = f'{socket.gethostname()}-{os.getpid()}'
+        self._threads: List[threading.Thread] = []
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, args=(f'{self._consumer}-{i}',), daemon=True,
+                                          name=f'conversation-worker-{i}')
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stopped.set()
+
+    async def submit(self, uid: str, conversation_id: str, language: str) -> str:
+        self.start()
+        job = {'uid': uid, 'conversation_id': conversation_id, 'language': language, 'enqueued_at': time.time()}
+        return await asyncio.to_thread(self.queue.enqueue, job)
+
+    async def wait(self, job_id: str, poll_seconds: float = 5.0,
+                   timeout_seconds: float = CONVERSATION_JOB_WAIT_SECONDS) -> dict:
+        """The result of the job, an error once past `timeout_seconds`."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            self._waiters.setdefault(job_id, []).append((loop, future))
+        deadline = time.monotonic() + timeout_seconds
+        try:
+            while True:
+                if result := await asyncio.to_thread(self.queue.get_result, job_id):
+                    return result
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print('ConversationProcessingWorkers wait timed out', job_id)
+                    return {'error': f'no result after {timeout_seconds:.0f}s'}
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), min(poll_seconds, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(job_id, [])
+                if (loop, future) in waiters:
+                    waiters.remove((loop, future))
+                if not waiters:
+                    self._waiters.pop(job_id, None)
+
+    def _notify(self, job_id: str, result: dict):
+        with self._lock:
+            waiters = self._waiters.pop(job_id, [])
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(result))
+            except RuntimeError:
+                # loop closed, the session is over
+                pass
+
+    def _run(self, consumer: str):
+        last_claim_at = 0.0
+        while not self._stopped.is_set():
+            try:
+                jobs = []
+                if time.monotonic() - last_claim_at > 60:
+                    last_claim_at = time.monotonic()
+                    jobs = self.queue.claim_stale(consumer)
+                if not jobs:
+                    job = self.queue.read(consumer, block_seconds=1)
+                    jobs = [job] if job else []
+            except Exception as e:
+                print('ConversationProcessingWorkers read failed', e)
+                time.sleep(1)
+                continue
+
+            for entry_id, job in jobs:
+                try:
+                    result = self.process_job(job)
+                    self.processed += 1
+                except Exception as e:
+                    print('ConversationProcessingWorkers job failed', job, e)
+                    result = {'error': str(e)}
+                    self.failed += 1
+                try:
+                    self.queue.complete(entry_id, job, result)
+                except Exception as e:
+                    print('ConversationProcessingWorkers complete failed', job, e)
+                self._notify(job['job_id'], result)
+
+
+_workers: Optional[ConversationProcessingWorkers] = None
+
+
+def get_conversation_processing_workers() -> ConversationProcessingWorkers:
+    global _workers
+    if _workers is None:
+        queue = InMemoryConversationQueue() if CONVERSATION_QUEUE_BACKEND == 'memory' else RedisConversationQueue()
+        _workers = ConversationProcessingWorkers(queue)
+    return _workers
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+import database.conversations as conversations_db
+from database import redis_db
+from models.conversation import Conversation, ConversationStatus, Structured
+from models.transcript_segment import TranscriptSegment
+from utils.other.metrics import Histogram
+
+# Max cadence of the in-progress conversation writes of a listen session
+IN_PROGRESS_CONVERSATION_FLUSH_INTERVAL_SECONDS = float(
+    os.getenv('IN_PROGRESS_CONVERSATION_FLUSH_INTERVAL_SECONDS', '10'))
+# Time a reader finalising a conversation waits for the live session holding it to write its segments
+IN_PROGRESS_CONVERSATION_FLUSH_WAIT_SECONDS = 3
+
+FIRESTORE_WRITE_SECONDS = Histogram('listen_firestore_write_seconds',
+                                    'Latency of the in-progress conversation writes', ['operation'])
+
+
+class InProgressConversationStore:
+    """
+    Write-behind store of the in-progress conversation of a listen session.
+
+    The live segments are kept in memory, only the segments sealed since the previous write (all but
+    the last one, which keeps growing while the speaker talks) are appended to Firestore, at most once
+    per flush interval. The whole segments list is written on `flush(force=True)` (finalisation,
+    session end) or when an already persisted segment has changed.
+
+    The status of the conversation is read again before every write: a conversation finalised elsewhere
+    is not written to, its segments not persisted yet start a new conversation. A reader finalising the
+    conversation first asks the session holding it to write its segments
+    (`request_in_progress_conversation_flush`).
+    """
+
+    def __init__(self, uid: str, language: str,
+                 flush_interval_seconds: float = IN_PROGRESS_CONVERSATION_FLUSH_INTERVAL_SECONDS):
+        self.uid = uid
+        self.language = language
+        self.flush_interval_seconds = flush_interval_seconds
+        self.conversation: Optional[Conversation] = None
+
+        self._persisted_count = 0  # leading segments that are persisted and unchanged
+        self._dirty_from: Optional[int] = None  # first segment index changed since the last write
+        self._finished_at_dirty = False
+        self._last_flush_at = 0.0
+        self._lock = asyncio.Lock()
+
+        # the live session holding the conversation, for the readers finalising it
+        self.holder = uuid.uuid4().hex
+        self.loop = asyncio.get_event_loop()
+        self._released: Set[str] = set()
+
+    async def load(self, existing: Optional[dict]):
+        """Resumes from the in-progress conversation persisted by a previous session, if any."""
+        if not existing or existing['id'] in self._released:
+            return
+        self._hold(Conversation(**existing))
+        self._persisted_count = len(self.conversation.transcript_segments)
+        self._dirty_from = None
+        self._finished_at_dirty = False
+        self._last_flush_at = time.monotonic()
+        await asyncio.to_thread(redis_db.set_in_progress_conversation_holder, self.conversation.id, self.holder)
+
+    async def reset(self):
+        """Detaches the current conversation, the next upsert starts a new one."""
+        conversation = self.conversation
+        self.conversation = None
+        self._persisted_count = 0
+        self._dirty_from = None
+        self._finished_at_dirty = False
+        if conversation is not None:
+            _unregister(self, conversation.id)
+            await asyncio.to_thread(redis_db.remove_in_progress_conversation_holder, conversation.id, self.holder)
+
+    def _hold(self, conversation: Conversation):
+        """Registers the conversation for the flush requests, its holder is set in Redis by the caller."""
+        self.conversation = conversation
+        _register(self, conversation.id)
+
+    async def release(self, conversation_id: str, request_id: str, release: bool):
+        """
+        Writes the segments of the conversation for a reader finalising it, on `release` the conversation
+        is detached and the next segments start a new one.
+        """
+        try:
+            if self.conversation is not None and self.conversation.id == conversation_id:
+                await self.flush(force=True)
+                if release and self.conversation is not None and self.conversation.id == conversation_id:
+                    self._released.add(conversation_id)
+                    await self.reset()
+        finally:
+            await asyncio.to_thread(redis_db.set_in_progress_conversation_flushed, request_id)
+
+    async def upsert(self, segments: List[TranscriptSegment], finished_at: datetime) -> Tuple[Conversation, Tuple[int, int]]:
+        async with self._lock:
+            if self.conversation is None:
+                return await self._create(segments, finished_at), (0, len(segments))
+
+            self.conversation.transcript_segments, (starts, ends) = TranscriptSegment.combine_segments(
+                self.conversation.transcript_segments, segments)
+            self.conversation.finished_at = finished_at
+            self._finished_at_dirty = True
+            self.mark_changed(starts)
+            if self._flush_due():
+                if not await self._in_progress():
+                    pending = await self._detach_finalised()
+                    return await self._create(pending, finished_at), (0, len(pending))
+                await self._write(force=False)
+            return self.conversation, (starts, ends)
+
+    def mark_changed(self, index: int):
+        """Marks the segments from `index` onwards as changed since the last write."""
+        self._dirty_from = index if self._dirty_from is None else min(self._dirty_from, index)
+
+    def _flush_due(self, force: bool = False) -> bool:
+        if self.conversation is None or (self._dirty_from is None and not self._finished_at_dirty):
+            return False
+        return force or time.monotonic() - self._last_flush_at >= self.flush_interval_seconds
+
+    async def _in_progress(self) -> bool:
+        status = await conversations_db.get_conversation_status_async(self.uid, self.conversation.id)
+        return status == ConversationStatus.in_progress
+
+    async def _detach_finalised(self) -> List[TranscriptSegment]:
+        """Detaches the conversation finalised elsewhere, returns its segments not persisted yet or changed."""
+        print('In-progress conversation finalised elsewhere', self.conversation.id, self.uid)
+        pending_from = self._persisted_count if self._dirty_from is None else min(self._dirty_from,
+                                                                                 self._persisted_count)
+        pending = self.conversation.transcript_segments[pending_from:]
+        self._released.add(self.conversation.id)
+        await self.reset()
+        return pending
+
+    async def flush(self, force: bool = False):
+        async with self._lock:
+            if not self._flush_due(force):
+                return
+            if not await self._in_progress():
+                finished_at = self.conversation.finished_at
+                pending = await self._detach_finalised()
+                if pending:
+                    await self._create(pending, finished_at)
+                return
+            await self._write(force)
+
+    async def _write(self, force: bool):
+        conversation = self.conversation
+        segments = conversation.transcript_segments
+        # the last segment is still growing, persist it on forced writes only
+        sealed_count = len(segments) if force else len(segments) - 1
+
+        started = time.perf_counter()
+        if self._dirty_from is not None and (force or self._dirty_from < self._persisted_count):
+            await conversations_db.update_conversation_segments_and_finished_at_async(
+                self.uid, conversation.id, [segment.dict() for segment in segments[:sealed_count]],
+                conversation.finished_at)
+            self._persisted_count = sealed_count
+            operation = 'rewrite'
+        elif sealed_count > self._persisted_count:
+            await conversations_db.append_conversation_segments_async(
+                self.uid, conversation.id,
+                [segment.dict() for segment in segments[self._persisted_count:sealed_count]],
+                conversation.finished_at)
+            self._persisted_count = sealed_count
+            operation = 'append'
+        else:
+            await conversations_db.update_conversation_finished_at_async(self.uid, conversation.id, conversation.finished_at)
+            operation = 'finished_at'
+        FIRESTORE_WRITE_SECONDS.labels(operation).observe(time.perf_counter() - started)
+
+        await asyncio.to_thread(redis_db.hold_in_progress_conversation, self.uid, conversation.id, self.holder)
+        self._dirty_from = self._persisted_count if self._persisted_count < len(segments) else None
+        self._finished_at_dirty = False
+        self._last_flush_at = time.monotonic()
+
+    async def _create(self, segments: List[TranscriptSegment], finished_at: datetime) -> Conversation:
+        started_at = finished_at - timedelta(seconds=segments[0].end - segments[0].start)
+        conversation = Conversation(
+            id=str(uuid.uuid4()),
+            uid=self.uid,
+            structured=Structured(),
+            language=self.language,
+            created_at=started_at,
+            started_at=started_at,
+            finished_at=finished_at,
+            transcript_segments=segments,
+            status=ConversationStatus.in_progress,
+        )
+        print('_get_in_progress_conversation new', conversation, self.uid)
+        started = time.perf_counter()
+        await conversations_db.upsert_conversation_async(self.uid, conversation_data=conversation.dict())
+        FIRESTORE_WRITE_SECONDS.labels('create').observe(time.perf_counter() - started)
+
+        self._hold(conversation)
+        self._persisted_count = len(segments)
+        self._dirty_from = None
+        self._finished_at_dirty = False
+        self._last_flush_at = time.monotonic()
+        await asyncio.to_thread(redis_db.hold_in_progress_conversation, self.uid, conversation.id, self.holder)
+        return conversation
+
+
+# Stores of the process holding an in-progress conversation, by conversation id
+_lock = threading.Lock()
+_stores: Dict[str, InProgressConversationStore] = {}
+_listener: Optional[threading.Thread] = None
+
+
+def _register(store: InProgressConversationStore, conversation_id: str):
+    global _listener
+    with _lock:
+        _stores[conversation_id] = store
+        if _listener is None:
+            _listener = threading.Thread(target=_listen_flush_requests, daemon=True,
+                                         name='in-progress-conversation-flush')
+            _listener.start()
+
+
+def _unregister(store: InProgressConversationStore, conversation_id: str):
+    with _lock:
+        if _stores.get(conversation_id) is store:
+            del _stores[conversation_id]
+
+
+def _listen_flush_requests():
+    while True:
+        try:
+            pubsub = redis_db.r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(redis_db.IN_PROGRESS_CONVERSATION_FLUSH_CHANNEL)
+            for message in pubsub.listen():
+                data = json.loads(message['data'])
+                with _lock:
+                    store = _stores.get(data['conversation_id'])
+                if store is not None:
+                    asyncio.run_coroutine_threadsafe(
+                        store.release(data['conversation_id'], data['request_id'], data['release']), store.loop)
+        except Exception as e:
+            print('In-progress conversation flush listener failed', e)
+            time.sleep(1)
+
+
+def request_in_progress_conversation_flush(conversation_id: str, release: bool,
+                                           holder: Optional[str] = None) -> bool:
+    """
+    Asks the live session holding the in-progress conversation, if any other than `holder`, to write its
+    segments, and on `release` to start a new conversation with the next ones. Waits for it at most
+    IN_PROGRESS_CONVERSATION_FLUSH_WAIT_SECONDS, returns if it did.
+    """
+    current = redis_db.get_in_progress_conversation_holder(conversation_id)
+    if not current or current == holder:
+        return False
+    request_id = uuid.uuid4().hex
+    redis_db.publish_in_progress_conversation_flush(conversation_id, request_id, release)
+    wait_until = time.monotonic() + IN_PROGRESS_CONVERSATION_FLUSH_WAIT_SECONDS
+    while time.monotonic() < wait_until:
+        if redis_db.is_in_progress_conversation_flushed(request_id):
+            return True
+        time.sleep(0.1)
+    print('In-progress conversation not flushed by its session', conversation_id)
+    return False
@@ -0,0 +1,43 @@
+import os
+import threading
+from typing import Optional, Tuple
+
+from langid.langid import LanguageIdentifier, model
+
+# Min probability of the local detection to be used instead of the remote one
+LOCAL_LANGUAGE_DETECTION_MIN_CONFIDENCE = float(os.getenv('LOCAL_LANGUAGE_DETECTION_MIN_CONFIDENCE', '0.95'))
+# Shorter texts are too ambiguous for the character n-grams, they go to the remote detection
+LOCAL_LANGUAGE_DETECTION_MIN_CHARS = int(os.getenv('LOCAL_LANGUAGE_DETECTION_MIN_CHARS', '12'))
+
+_identifier: Optional[LanguageIdentifier] = None
+_identifier_lock = threading.Lock()
+
+
+def _get_identifier() -> LanguageIdentifier:
+    global _identifier
+    if _identifier is None:
+        with _identifier_lock:
+            if _identifier is None:
+                # character n-gram naive Bayes model shipped with langid, 97 languages
+                _identifier = LanguageIdentifier.from_modelstring(model, norm_probs=True)
+    return _identifier
+
+
+def classify_language(text: str) -> Tuple[str, float]:
+    """The most likely ISO 639-1 language of the text and its probability, CPU only (~1ms)."""
+    language, probability = _get_identifier().classify(text)
+    return language, float(probability)
+
+
+def detect_language_locally(text: str) -> Optional[str]:
+    """
+    The language of the text when the local model is confident about it, None when the text is too short
+    or ambiguous and needs the remote detection.
+    """
+    text = text.strip()
+    if len(text) < LOCAL_LANGUAGE_DETECTION_MIN_CHARS:
+        return None
+    language, probability = classify_language(text)
+    if probability < LOCAL_LANGUAGE_DETECTION_MIN_CONFIDENCE:
+        return None
+    return language
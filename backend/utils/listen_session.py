@@ -0,0 +1,76 @@
+import json
+import os
+import secrets
+import time
+from typing import List, Optional
+
+from database import redis_db
+
+# Time a closed listen session can be resumed with its token
+LISTEN_SESSION_RESUME_SECONDS = int(os.getenv('LISTEN_SESSION_RESUME_SECONDS', '60'))
+# Larger snapshots are saved without the in-progress conversation, a resumed session looks it up again
+LISTEN_SESSION_SNAPSHOT_MAX_BYTES = int(os.getenv('LISTEN_SESSION_SNAPSHOT_MAX_BYTES', str(512 * 1024)))
+
+
+class ListenSessionSnapshot:
+    """
+    State of a closed `/v4/listen` session that a reconnect within the grace window picks up instead of
+    redoing the cold setup: the in-progress conversation with its segments (None when it has to be looked
+    up), the key of its silence timer, the language detection cache, whether the user has a speech profile
+    and the conversations still processing when the session closed.
+
+    Only valid for the same user, language and audio format, other reconnects start cold.
+    """
+
+    def __init__(self, uid: str, language: str, codec: str, sample_rate: int,
+                 conversation: Optional[dict] = None, timer_key: Optional[List[str]] = None,
+                 language_cache: Optional[dict] = None, has_speech_profile: Optional[bool] = None,
+                 processing_conversation_ids: Optional[List[str]] = None, closed_at: Optional[float] = None):
+        self.uid = uid
+        self.language = language
+        self.codec = codec
+        self.sample_rate = sample_rate
+        self.conversation = conversation
+        self.timer_key = timer_key
+        self.language_cache = language_cache or {}
+        self.has_speech_profile = has_speech_profile
+        self.processing_conversation_ids = processing_conversation_ids or []
+        self.closed_at = closed_at or time.time()
+
+    def to_bytes(self) -> bytes:
+        data = json.dumps(self.__dict__, default=str).encode()
+        if len(data) > LISTEN_SESSION_SNAPSHOT_MAX_BYTES and self.conversation is not None:
+            data = json.dumps({**self.__dict__, 'conversation': None}, default=str).encode()
+        return data
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'ListenSessionSnapshot':
+        return ListenSessionSnapshot(**json.loads(data))
+
+    def matches(self, uid: str, language: str, codec: str, sample_rate: int) -> bool:
+        return (self.uid, self.language, self.codec, self.sample_rate) == (uid, language, codec, sample_rate)
+
+
+def new_resume_token() -> str:
+    return secrets.token_urlsafe(24)
+
+
+def save_listen_session(token: str, snapshot: ListenSessionSnapshot):
+    redis_db.set_listen_session_snapshot(token, snapshot.to_bytes(), LISTEN_SESSION_RESUME_SECONDS)
+
+
+def resume_listen_session(token: str, uid: str, language: str, codec: str,
+                          sample_rate: int) -> Optional[ListenSessionSnapshot]:
+    """The snapshot saved under `token`, None when it expired, was already resumed or belongs to another session."""
+    data = redis_db.pop_listen_session_snapshot(token)
+    if not data:
+        return None
+    try:
+        snapshot = ListenSessionSnapshot.from_bytes(data)
+    except Exception as e:
+        print(f'Invalid listen session snapshot: {e}', uid)
+        return None
+    if not snapshot.matches(uid, language, codec, sample_rate):
+        print('Listen session snapshot of another session', uid)
+        return None
+    return snapshot
@@ -0,0 +1,224 @@
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from database import redis_db
+from utils.other.metrics import Counter, Gauge
+
+# Last deliveries to an endpoint its health is scored on, those older than ENDPOINT_HEALTH_WINDOW_SECONDS are
+# not counted
+ENDPOINT_HEALTH_WINDOW = int(os.getenv('ENDPOINT_HEALTH_WINDOW', '20'))
+ENDPOINT_HEALTH_WINDOW_SECONDS = 5 * 60
+# The circuit of an endpoint opens once that many of its last deliveries failed, out of at least MIN_CALLS
+ENDPOINT_HEALTH_MIN_CALLS = int(os.getenv('ENDPOINT_HEALTH_MIN_CALLS', '5'))
+ENDPOINT_HEALTH_FAILURE_RATE = float(os.getenv('ENDPOINT_HEALTH_FAILURE_RATE', '0.5'))
+# An open circuit skips the deliveries for a cooldown, doubled every time a probe fails
+ENDPOINT_HEALTH_COOLDOWN_SECONDS = float(os.getenv('ENDPOINT_HEALTH_COOLDOWN_SECONDS', '30'))
+ENDPOINT_HEALTH_MAX_COOLDOWN_SECONDS = 60 * 60
+# A probe not reported after it (cancelled before it started) lets another one through
+ENDPOINT_HEALTH_PROBE_SECONDS = 60
+# The open circuits are shared with the other pods through Redis, pushed and pulled every
+ENDPOINT_HEALTH_SYNC_SECONDS = 5
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+ENDPOINT_CIRCUIT_TRANSITIONS = Counter('http_delivery_circuit_transitions_total',
+                                       'Circuits of the endpoints changing state', ['state'])
+
+
+def endpoint_of(url: str) -> str:
+    """The endpoint of a delivery url: its host and path, without the query (uid, sample rate)."""
+    parts = urlsplit(url)
+    return f'{parts.netloc}{parts.path}'
+
+
+def _shared_key(endpoint: str) -> str:
+    # the paths of the webhooks may carry secrets
+    return hashlib.sha1(endpoint.encode()).hexdigest()
+
+
+class _Circuit:
+    __slots__ = ('endpoint', 'state', 'outcomes', 'open_until', 'cooldown', 'probing', 'latency', 'shared',
+                 'last_used')
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.state = CLOSED
+        self.outcomes: Deque[Tuple[float, bool]] = deque(maxlen=ENDPOINT_HEALTH_WINDOW)
+        self.open_until = 0.0  # wall clock, shared with the other pods
+        self.cooldown = ENDPOINT_HEALTH_COOLDOWN_SECONDS
+        self.probing = 0.0  # time the probe of a half open circuit started, 0 if none
+        self.latency: Optional[float] = None  # moving average of the successful deliveries
+        self.shared: Optional[bool] = None  # opened (True) or closed (False) here, not pushed yet
+        self.last_used = time.monotonic()
+
+    def failure_rate(self, now: float) -> Tuple[int, float]:
+        recent = [ok for at, ok in self.outcomes if now - at < ENDPOINT_HEALTH_WINDOW_SECONDS]
+        if not recent:
+            return 0, 0.0
+        return len(recent), recent.count(False) / len(recent)
+
+
+class EndpointHealth:
+    """
+    Health of the endpoints of the apps and the developer webhooks, a circuit per endpoint.
+
+    The last ENDPOINT_HEALTH_WINDOW deliveries of an endpoint are scored: once at least
+    ENDPOINT_HEALTH_MIN_CALLS of them failed at ENDPOINT_HEALTH_FAILURE_RATE (no response in time, a
+    connection error, a 5xx or a 429) the circuit opens and the deliveries are skipped for a cooldown. The
+    circuit is then half open, a single delivery goes through as a probe: a success closes it, a failure
+    opens it again for twice the cooldown, up to ENDPOINT_HEALTH_MAX_COOLDOWN_SECONDS.
+
+    The open circuits are shared through Redis every ENDPOINT_HEALTH_SYNC_SECONDS by a thread, an
+    endpoint failing for one pod is skipped by the others too, and the deliveries never wait on Redis.
+    """
+
+    def __init__(self, sync_seconds: Optional[float] = ENDPOINT_HEALTH_SYNC_SECONDS):
+        self.sync_seconds = sync_seconds
+        self._lock = threading.Lock()
+        self._circuits: Dict[str, _Circuit] = {}
+        self._sync_thread: Optional[threading.Thread] = None
+
+        self.skipped = 0
+
+    def _circuit(self, endpoint: str) -> _Circuit:
+        circuit = self._circuits.get(endpoint)
+        if circuit is None:
+            circuit = self._circuits[endpoint] = _Circuit(endpoint)
+            if self.sync_seconds and self._sync_thread is None:
+                self._sync_thread = threading.Thread(target=self._sync_loop, daemon=True, name='endpoint-health')
+                self._sync_thread.start()
+        circuit.last_used = time.monotonic()
+        return circuit
+
+    def allow(self, endpoint: str) -> bool:
+        """If a delivery to `endpoint` goes through, the caller then reports its outcome with `record`."""
+        with self._lock:
+            circuit = self._circuit(endpoint)
+            if circuit.state == CLOSED:
+                return True
+            if circuit.state == OPEN and time.time() >= circuit.open_until:
+                circuit.state = HALF_OPEN
+                ENDPOINT_CIRCUIT_TRANSITIONS.labels(HALF_OPEN).inc()
+            now = time.monotonic()
+            probe_over = not circuit.probing or now - circuit.probing > ENDPOINT_HEALTH_PROBE_SECONDS
+            if circuit.state == HALF_OPEN and probe_over:
+                circuit.probing = now
+                return True
+            self.skipped += 1
+            return False
+
+    def record(self, endpoint: str, ok: Optional[bool], seconds: float):
+        """The outcome of a delivery `allow` let through, None if it was cancelled before one."""
+        with self._lock:
+            circuit = self._circuit(endpoint)
+            if ok is None:
+                circuit.probing = 0.0
+                return
+            now = time.monotonic()
+            circuit.outcomes.append((now, ok))
+            if ok:
+                circuit.latency = seconds if circuit.latency is None else 0.8 * circuit.latency + 0.2 * seconds
+
+            if circuit.state == HALF_OPEN and circuit.probing:
+                circuit.probing = 0.0
+                if ok:
+                    self._close(circuit)
+                else:
+                    self._open(circuit, min(circuit.cooldown * 2, ENDPOINT_HEALTH_MAX_COOLDOWN_SECONDS))
+            elif circuit.state == CLOSED and not ok:
+                calls, failure_rate = circuit.failure_rate(now)
+                if calls >= ENDPOINT_HEALTH_MIN_CALLS and failure_rate >= ENDPOINT_HEALTH_FAILURE_RATE:
+                    latency = f'{circuit.latency:.2f}s' if circuit.latency is not None else None
+                    print('Endpoint circuit open', endpoint, f'{failure_rate:.0%} of {calls} deliveries failed',
+                          'latency', latency)
+                    self._open(circuit, ENDPOINT_HEALTH_COOLDOWN_SECONDS)
+
+    def _open(self, circuit: _Circuit, cooldown: float):
+        circuit.state = OPEN
+        circuit.cooldown = cooldown
+        circuit.open_until = time.time() + cooldown
+        circuit.shared = True
+        ENDPOINT_CIRCUIT_TRANSITIONS.labels(OPEN).inc()
+
+    def _close(self, circuit: _Circuit):
+        circuit.state = CLOSED
+        circuit.cooldown = ENDPOINT_HEALTH_COOLDOWN_SECONDS
+        circuit.outcomes.clear()
+        circuit.shared = False
+        ENDPOINT_CIRCUIT_TRANSITIONS.labels(CLOSED).inc()
+
+    def state(self, endpoint: str) -> str:
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            return circuit.state if circuit else CLOSED
+
+    def open_circuits(self) -> int:
+        with self._lock:
+            return sum(circuit.state != CLOSED for circuit in self._circuits.values())
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_seconds)
+            try:
+                self.sync()
+            except Exception as e:
+                print('Endpoint health sync failed', e)
+
+    def sync(self):
+        """Pushes the circuits opened and closed here, pulls those opened by the other pods."""
+        opened, closed = {}, []
+        with self._lock:
+            now = time.monotonic()
+            for endpoint, circuit in list(self._circuits.items()):
+                if circuit.state == CLOSED and now - circuit.last_used > ENDPOINT_HEALTH_WINDOW_SECONDS:
+                    del self._circuits[endpoint]
+                    continue
+                if circuit.shared is True:
+                    opened[_shared_key(endpoint)] = {'open_until': circuit.open_until, 'cooldown': circuit.cooldown}
+                elif circuit.shared is False:
+                    closed.append(_shared_key(endpoint))
+                circuit.shared = None
+            endpoints = list(self._circuits)
+
+        if opened or closed:
+            redis_db.set_endpoint_circuits(opened, closed)
+        if not endpoints:
+            return
+        shared = redis_db.get_endpoint_circuits([_shared_key(endpoint) for endpoint in endpoints])
+        if not shared:
+            return
+
+        with self._lock:
+            for endpoint, value in zip(endpoints, shared):
+                circuit = self._circuits.get(endpoint)
+                if circuit is None or value is None or circuit.shared is not None:
+                    continue
+                if circuit.state == CLOSED and value['open_until'] > time.time():
+                    circuit.state = OPEN
+                    circuit.open_until = value['open_until']
+                    circuit.cooldown = value['cooldown']
+                    ENDPOINT_CIRCUIT_TRANSITIONS.labels(OPEN).inc()
+
+
+_health: Optional[EndpointHealth] = None
+_health_lock = threading.Lock()
+
+
+def get_endpoint_health() -> EndpointHealth:
+    global _health
+    if _health is None:
+        with _health_lock:
+            if _health is None:
+                _health = EndpointHealth()
+    return _health
+
+
+HTTP_DELIVERY_CIRCUITS_OPEN = Gauge('http_delivery_circuits_open', 'Endpoints skipped or probed, their circuit open',
+                                    function=lambda: _health.open_circuits() if _health else 0)
@@ -0,0 +1,163 @@
+import asyncio
+import json as jsonlib
+import os
+import threading
+import time
+from typing import Coroutine, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utils.other.endpoint_health import EndpointHealth, endpoint_of, get_endpoint_health
+from utils.other.metrics import Counter, Gauge, Histogram
+
+# Deliveries in flight in the process, the others wait for a connection
+HTTP_DELIVERY_MAX_IN_FLIGHT = int(os.getenv('HTTP_DELIVERY_MAX_IN_FLIGHT', '512'))
+# Deliveries in flight to a single host, a slow app or webhook only holds that many connections
+HTTP_DELIVERY_MAX_PER_DESTINATION = int(os.getenv('HTTP_DELIVERY_MAX_PER_DESTINATION', '16'))
+HTTP_DELIVERY_KEEPALIVE_SECONDS = float(os.getenv('HTTP_DELIVERY_KEEPALIVE_SECONDS', '30'))
+HTTP_DELIVERY_CONNECT_TIMEOUT_SECONDS = 5
+
+HTTP_DELIVERIES = Counter('http_deliveries_total', 'Deliveries to the apps and webhooks, by outcome', ['outcome'])
+HTTP_DELIVERY_SECONDS = Histogram('http_delivery_seconds', 'Time of a delivery, waiting for a connection included')
+HTTP_DELIVERIES_IN_FLIGHT = Gauge('http_deliveries_in_flight', 'Deliveries waiting for a connection or their response')
+
+
+class DeliveryResponse:
+    """Response of a delivery, its body read, with the `requests.Response` accessors the callers use."""
+
+    def __init__(self, status_code: int, content: bytes):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def is_success(self) -> bool:
+        return 200 <= self.status_code < 300
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(errors='replace')
+
+    def json(self):
+        return jsonlib.loads(self.content)
+
+
+class HttpDeliveryEngine:
+    """
+    Delivers the payloads of the apps and the developer webhooks over one pool of keep-alive connections
+    per process.
+
+    The engine runs on its own event loop thread, so the async paths (pusher) and the threaded ones
+    (conversation processing) share the pool and the limits: at most `max_in_flight` deliveries at once,
+    `max_per_destination` per host. A delivery has a deadline, the time waiting for a connection counts in
+    it, a delivery past its deadline is not sent. A delivery to an endpoint whose circuit is open in
+    `health` is skipped.
+    """
+
+    def __init__(self, max_in_flight: int = HTTP_DELIVERY_MAX_IN_FLIGHT,
+                 max_per_destination: int = HTTP_DELIVERY_MAX_PER_DESTINATION,
+                 health: Optional[EndpointHealth] = None):
+        self.max_in_flight = max_in_flight
+        self.max_per_destination = max_per_destination
+        self.health = health
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def _run():
+                asyncio.set_event_loop(loop)
+                connector = aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=self.max_per_destination,
+                                                 keepalive_timeout=HTTP_DELIVERY_KEEPALIVE_SECONDS)
+                self._session = aiohttp.ClientSession(connector=connector)
+                ready.set()
+                loop.run_forever()
+
+            threading.Thread(target=_run, name='http-delivery', daemon=True).start()
+            ready.wait()
+            self._loop = loop
+
+    def _submit(self, coroutine: Coroutine):
+        if self._loop is None:
+            self._start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def run_sync(self, coroutine: Coroutine):
+        """Runs a coroutine of deliveries on the engine loop and waits for it, for the threaded callers."""
+        return self._submit(coroutine).result()
+
+    async def post(self, url: str, *, json=None, content: Optional[bytes] = None,
+                   headers: Optional[dict] = None, timeout: float = 15,
+                   deadline: Optional[float] = None) -> Optional[DeliveryResponse]:
+        """
+        POSTs to `url`, from any event loop. `deadline` is a `time.monotonic()` time, the sooner of it and
+        now + `timeout` applies.
+
+        Returns the response, None when the delivery failed, ran past its deadline or was skipped, the
+        endpoint failing.
+        """
+        endpoint = endpoint_of(url)
+        if self.health is not None and not self.health.allow(endpoint):
+            HTTP_DELIVERIES.labels('skipped').inc()
+            return None
+        deadline = min(deadline, time.monotonic() + timeout) if deadline is not None else time.monotonic() + timeout
+        coroutine = self._post(url, endpoint, json, content, headers, deadline)
+        if asyncio.get_running_loop() is self._loop:
+            return await coroutine
+        return await asyncio.wrap_future(self._submit(coroutine))
+
+    async def _post(self, url: str, endpoint: str, json, content: Optional[bytes], headers: Optional[dict],
+                    deadline: float) -> Optional[DeliveryResponse]:
+        started = time.monotonic()
+        outcome = 'error'
+        healthy = False
+        HTTP_DELIVERIES_IN_FLIGHT.inc()
+        try:
+            remaining = deadline - started
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+            # the total covers the wait for a connection of the pool
+            timeout = aiohttp.ClientTimeout(total=remaining,
+                                            sock_connect=min(remaining, HTTP_DELIVERY_CONNECT_TIMEOUT_SECONDS))
+            async with self._session.post(url, json=json, data=content, headers=headers, timeout=timeout) as response:
+                body = await response.read()
+            outcome = 'ok' if 200 <= response.status < 300 else 'status'
+            # the app answered, a 5xx or a 429 is the app failing or shedding load
+            healthy = response.status < 500 and response.status != 429
+            return DeliveryResponse(response.status, body)
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            healthy = None
+            raise
+        except asyncio.TimeoutError:
+            outcome = 'expired'
+            print('HTTP delivery past its deadline', urlsplit(url).netloc)
+            return None
+        except Exception as e:
+            print('HTTP delivery error', urlsplit(url).netloc, e)
+            return None
+        finally:
+            HTTP_DELIVERIES_IN_FLIGHT.dec()
+            HTTP_DELIVERIES.labels(outcome).inc()
+            HTTP_DELIVERY_SECONDS.observe(time.monotonic() - started)
+            if self.health is not None:
+                self.health.record(endpoint, healthy, time.monotonic() - started)
+
+
+_engine: Optional[HttpDeliveryEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_http_delivery_engine() -> HttpDeliveryEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = HttpDeliveryEngine(health=get_endpoint_health())
+    return _engine
@@ -1,13 +1,13 @@
 import datetime
 import json
 import os
-from typing import List
+from typing import List, Optional
 
 from google.cloud import storage
 from google.oauth2 import service_account
 from google.cloud.storage import transfer_manager
 
-from database.redis_db import cache_signed_url, get_cached_signed_url
+from database.redis_db import cache_signed_url, get_cached_signed_url, set_speech_profile_generation
 
 if os.environ.get('SERVICE_ACCOUNT_JSON'):
     service_account_info = json.loads(os.environ["SERVICE_ACCOUNT_JSON"])
@@ -32,6 +32,7 @@ def upload_profile_audio(file_path: str, uid: str):
     path = f'{uid}/speech_profile.wav'
     blob = bucket.blob(path)
     blob.upload_from_filename(file_path)
+    set_speech_profile_generation(uid, blob.generation)
     return f'https://storage.googleapis.com/{speech_profiles_bucket}/{path}'
 
 
@@ -55,6 +56,19 @@ def get_profile_audio_if_exists(uid: str, download: bool = True) -> str:
     return None
 
 
+def get_profile_audio_generation(uid: str) -> Optional[int]:
+    """Generation of the current speech profile blob, None if the user has no profile. Metadata only."""
+    bucket = storage_client.bucket(speech_profiles_bucket)
+    blob = bucket.get_blob(f'{uid}/speech_profile.wav')
+    return blob.generation if blob else None
+
+
+def download_profile_audio_bytes(uid: str, generation: int) -> bytes:
+    bucket = storage_client.bucket(speech_profiles_bucket)
+    blob = bucket.blob(f'{uid}/speech_profile.wav', generation=generation)
+    return blob.download_as_bytes()
+
+
 def upload_additional_profile_audio(file_path: str, uid: str) -> None:
     bucket = storage_client.bucket(speech_profiles_bucket)
     path = f'{uid}/additional_profile_recordings/{file_path.split("/")[-1]}'
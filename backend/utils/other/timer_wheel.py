@@ -0,0 +1,180 @@
+import asyncio
+import math
+import os
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Set
+
+from utils.other.task import safe_create_task
+
+# Resolution of the process timer wheel, the deadlines are rounded up to the next tick
+TIMER_WHEEL_TICK_SECONDS = float(os.getenv('TIMER_WHEEL_TICK_SECONDS', '1'))
+
+_SLOT_BITS = 6
+_SLOTS = 1 << _SLOT_BITS
+_SLOT_MASK = _SLOTS - 1
+_LEVELS = 3
+# ~73h at 1s ticks, later deadlines wait in the last level and cascade again
+_MAX_TICKS = (1 << (_SLOT_BITS * _LEVELS)) - 1
+
+
+class _Timer:
+    __slots__ = ('key', 'expires', 'callback', 'args', 'slot')
+
+    def __init__(self, key: Hashable, expires: int, callback: Callable, args: tuple):
+        self.key = key
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        self.slot: Optional[Set['_Timer']] = None
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel of the process, for the many long deadlines that keep moving (e.g. the
+    silence timeout of every in-progress conversation, pushed back on each segment batch).
+
+    Three levels of 64 slots, of 1, 64 and 4096 ticks. Pushing a deadline back only updates the timer,
+    it moves to its new slot when its old one comes up; bringing it forward moves it at once.
+    A single loop timer drives the wheel while it has timers, a task is only created to run an
+    expired callback.
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, tick_seconds: float = TIMER_WHEEL_TICK_SECONDS):
+        self.tick_seconds = tick_seconds
+        self._wheels: List[List[Set[_Timer]]] = [[set() for _ in range(_SLOTS)] for _ in range(_LEVELS)]
+        self._timers: Dict[Hashable, _Timer] = {}
+        self._started_at = time.monotonic()
+        self._tick = 0
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+        self.scheduled = 0
+        self.moved = 0
+        self.cascaded = 0
+        self.fired = 0
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key: Hashable):
+        return key in self._timers
+
+    def _now_tick(self) -> int:
+        return int((time.monotonic() - self._started_at) / self.tick_seconds)
+
+    def _place(self, timer: _Timer):
+        delta = timer.expires - self._tick
+        if delta < 0:
+            # overdue, in the slot of the current tick, processed right after the cascades
+            delta = 0
+        for level in range(_LEVELS):
+            if delta < 1 << (_SLOT_BITS * (level + 1)):
+                break
+        else:
+            level, delta = _LEVELS - 1, _MAX_TICKS
+        expires = self._tick + delta
+        slot = self._wheels[level][(expires >> (_SLOT_BITS * level)) & _SLOT_MASK]
+        slot.add(timer)
+        timer.slot = slot
+
+    def schedule(self, key: Hashable, delay_seconds: float, callback: Callable, *args):
+        """
+        Runs `callback(*args)` in `delay_seconds`, a coroutine function runs in its own task.
+        Replaces the deadline and the callback of a timer already scheduled with the same key.
+        """
+        if not self._timers:
+            self._tick = self._now_tick()
+        # the first tick at or after the deadline
+        expires = max(self._tick + 1,
+                      math.ceil((time.monotonic() - self._started_at + delay_seconds) / self.tick_seconds))
+        timer = self._timers.get(key)
+        if timer is None:
+            timer = _Timer(key, expires, callback, args)
+            self._timers[key] = timer
+            self.scheduled += 1
+            self._place(timer)
+        else:
+            timer.callback, timer.args = callback, args
+            self.moved += 1
+            earlier = expires < timer.expires
+            timer.expires = expires
+            if earlier:
+                timer.slot.discard(timer)
+                self._place(timer)
+        self._arm()
+
+    def cancel(self, key: Hashable) -> bool:
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        timer.slot.discard(timer)
+        timer.slot = None
+        return True
+
+    def _arm(self):
+        if self._handle is not None or not self._timers:
+            return
+        loop = asyncio.get_running_loop()
+        next_tick_at = self._started_at + (self._tick + 1) * self.tick_seconds
+        self._handle = loop.call_at(loop.time() + max(0.0, next_tick_at - time.monotonic()), self._run)
+
+    def _run(self):
+        self._handle = None
+        now_tick = self._now_tick()
+        while self._tick < now_tick and self._timers:
+            self._advance()
+        self._arm()
+
+    def _advance(self):
+        self._tick += 1
+        # higher levels first, their timers may land in the current slot of a lower level
+        for level in range(_LEVELS - 1, 0, -1):
+            if self._tick & ((1 << (_SLOT_BITS * level)) - 1) == 0:
+                self._cascade(level)
+
+        slot = self._wheels[0][self._tick & _SLOT_MASK]
+        if not slot:
+            return
+        due = list(slot)
+        slot.clear()
+        for timer in due:
+            timer.slot = None
+            if timer.expires > self._tick:
+                # pushed back since it was placed
+                self._place(timer)
+                continue
+            del self._timers[timer.key]
+            self.fired += 1
+            self._fire(timer)
+
+    def _cascade(self, level: int):
+        slot = self._wheels[level][(self._tick >> (_SLOT_BITS * level)) & _SLOT_MASK]
+        timers = list(slot)
+        slot.clear()
+        self.cascaded += len(timers)
+        for timer in timers:
+            self._place(timer)
+
+    @staticmethod
+    def _fire(timer: _Timer):
+        try:
+            result = timer.callback(*timer.args)
+            if asyncio.iscoroutine(result):
+                safe_create_task(result)
+        except Exception as e:
+            print('TimerWheel callback failed', timer.key, e)
+
+    def stats(self) -> dict:
+        return {'timers': len(self._timers), 'scheduled': self.scheduled, 'moved': self.moved,
+                'cascaded': self.cascaded, 'fired': self.fired}
+
+
+_timer_wheel: Optional[TimerWheel] = None
+
+
+def get_timer_wheel() -> TimerWheel:
+    global _timer_wheel
+    if _timer_wheel is None:
+        _timer_wheel = TimerWheel()
+    return _timer_wheel
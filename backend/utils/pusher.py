@@ -5,11 +5,11 @@ import websockets
 
 PusherAPI = os.getenv('HOSTED_PUSHER_API_URL')
 
-async def connect_to_trigger_pusher(uid: str, sample_rate: int = 8000, retries: int = 3):
+async def connect_to_trigger_pusher(uid: str, sample_rate: int = 8000, retries: int = 3, session_id: str = None):
     print("connect_to_trigger_pusher", uid)
     for attempt in range(retries):
         try:
-            return await _connect_to_trigger_pusher(uid, sample_rate)
+            return await _connect_to_trigger_pusher(uid, sample_rate, session_id)
         except Exception as error:
             print(f'An error occurred: {error}', uid)
             if attempt == retries - 1:
@@ -20,12 +20,15 @@ async def connect_to_trigger_pusher(uid: str, sample_rate: int = 8000, retries:
 
     raise Exception(f'Could not open socket: All retry attempts failed.', uid)
 
-async def _connect_to_trigger_pusher(uid: str, sample_rate: int = 8000):
+async def _connect_to_trigger_pusher(uid: str, sample_rate: int = 8000, session_id: str = None):
     try:
         print("Connecting to Pusher transcripts trigger WebSocket...", uid)
         ws_host = PusherAPI.replace("http", "ws")
-        socket = await websockets.connect(f"{ws_host}/v1/trigger/listen?uid={uid}&sample_rate={sample_rate}",
-                                          ping_interval=15,)
+        url = f"{ws_host}/v1/trigger/listen?uid={uid}&sample_rate={sample_rate}"
+        if session_id:
+            # sequenced frames, acknowledged by the pusher
+            url += f"&session_id={session_id}"
+        socket = await websockets.connect(url, ping_interval=15,)
         print("Connected to Pusher transcripts trigger WebSocket.", uid)
         return socket
     except Exception as e:
@@ -33,6 +36,15 @@ async def _connect_to_trigger_pusher(uid: str, sample_rate: int = 8000):
         raise
 
 
+async def connect_to_trigger_pusher_mux():
+    """A multiplexed connection to the pusher, carrying the listen sessions of the pod."""
+    print("Connecting to Pusher multiplexed trigger WebSocket...")
+    ws_host = PusherAPI.replace("http", "ws")
+    socket = await websockets.connect(f"{ws_host}/v1/trigger/mux", ping_interval=15)
+    print("Connected to Pusher multiplexed trigger WebSocket.")
+    return socket
+
+
 # Calculate backoff with jitter
 def calculate_backoff_with_jitter(attempt, base_delay=1000, max_delay=15000):
     jitter = random.random() * base_delay
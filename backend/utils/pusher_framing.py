@@ -0,0 +1,98 @@
+import struct
+from typing import Iterable, Iterator, List, Tuple
+
+# Binary frames of the /v4/listen sessions to the pusher /v1/trigger/listen, shared by both sides.
+#
+# A websocket message carries one or more frames, each a header then its payload:
+# 101|102 header type, payload length, sequence number of the frame in the session outbox
+FRAME_HEADER = struct.Struct('<IIQ')
+# Connections without a session id: a single frame per message, the header type then the payload
+LEGACY_FRAME_HEADER = struct.Struct('<I')
+# Multiplexed connections: the channel of the session on the connection, then its frames
+CHANNEL_HEADER = struct.Struct('<I')
+
+AUDIO_BYTES_FRAME = 101
+TRANSCRIPT_FRAME = 102
+
+# Frames packed in a single websocket message, ~8s of 16kHz audio, larger messages cost more to allocate than
+# they save
+PUSHER_MESSAGE_MAX_BYTES = 256 * 1024
+
+Frame = Tuple[int, int, bytes]  # seq, header type, payload
+
+
+class FrameError(ValueError):
+    pass
+
+
+def _frame_parts(frames: Iterable[Frame], parts: list) -> list:
+    for seq, header_type, payload in frames:
+        parts.append(FRAME_HEADER.pack(header_type, len(payload), seq))
+        parts.append(payload)
+    return parts
+
+
+def encode_frames(frames: Iterable[Frame]) -> bytes:
+    """
+    Packs the frames into one message, gathered like a writev: the message is allocated once at its size and
+    the payloads are copied once into it.
+    """
+    return b''.join(_frame_parts(frames, []))
+
+
+def encode_channel_frames(channel: int, frames: Iterable[Frame]) -> bytes:
+    """Packs the frames of a session into one message of a multiplexed connection."""
+    return b''.join(_frame_parts(frames, [CHANNEL_HEADER.pack(channel)]))
+
+
+def encode_frame(header_type: int, seq: int, payload: bytes) -> bytes:
+    return b''.join((FRAME_HEADER.pack(header_type, len(payload), seq), payload))
+
+
+def batch_frames(frames: List[Frame], max_bytes: int = PUSHER_MESSAGE_MAX_BYTES) -> Iterator[List[Frame]]:
+    """Splits the frames in batches of at most `max_bytes` encoded, a larger frame is a batch of its own."""
+    batch, size = [], 0
+    for frame in frames:
+        frame_size = FRAME_HEADER.size + len(frame[2])
+        if batch and size + frame_size > max_bytes:
+            yield batch
+            batch, size = [], 0
+        batch.append(frame)
+        size += frame_size
+    if batch:
+        yield batch
+
+
+def iter_frames(message) -> Iterator[Tuple[int, int, memoryview]]:
+    """
+    Parses the frames of a message in place: header type, seq and a view of the payload, valid as long as
+    the message is. Raises FrameError on a truncated message.
+    """
+    view = memoryview(message)
+    offset, end = 0, len(view)
+    while offset < end:
+        if end - offset < FRAME_HEADER.size:
+            raise FrameError(f'truncated frame header at {offset}')
+        header_type, length, seq = FRAME_HEADER.unpack_from(view, offset)
+        offset += FRAME_HEADER.size
+        if offset + length > end:
+            raise FrameError(f'frame of {length} bytes past the end of the message at {offset}')
+        yield header_type, seq, view[offset:offset + length]
+        offset += length
+
+
+def encode_legacy_frame(header_type: int, payload: bytes) -> bytes:
+    return b''.join((LEGACY_FRAME_HEADER.pack(header_type), payload))
+
+
+def decode_legacy_frame(message) -> Tuple[int, memoryview]:
+    if len(message) < LEGACY_FRAME_HEADER.size:
+        raise FrameError('truncated frame header')
+    return LEGACY_FRAME_HEADER.unpack_from(message)[0], memoryview(message)[LEGACY_FRAME_HEADER.size:]
+
+
+def split_channel_message(message) -> Tuple[int, memoryview]:
+    """The channel of a message of a multiplexed connection and a view of its frames."""
+    if len(message) < CHANNEL_HEADER.size:
+        raise FrameError('truncated channel header')
+    return CHANNEL_HEADER.unpack_from(message)[0], memoryview(message)[CHANNEL_HEADER.size:]
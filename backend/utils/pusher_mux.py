@@ -0,0 +1,287 @@
+import asyncio
+import json
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+import websockets
+
+from utils.other.metrics import Counter, Gauge
+from utils.other.task import safe_create_task
+from utils.pusher import calculate_backoff_with_jitter, connect_to_trigger_pusher_mux
+from utils.pusher_framing import batch_frames, encode_channel_frames
+from utils.pusher_outbox import PusherOutbox, PUSHER_OUTBOX_DRAIN_SECONDS, PUSHER_OUTBOX_REPLAYED_FRAMES
+
+# Transport of the listen sessions to the pusher: session (a connection per session) or mux (the sessions of the
+# pod share a few connections), opt-in once the pushers deployed serve /v1/trigger/mux
+PUSHER_TRANSPORT = os.getenv('PUSHER_TRANSPORT', 'session')
+PUSHER_MUX_CONNECTIONS = int(os.getenv('PUSHER_MUX_CONNECTIONS', '4'))
+# Frames of a session sent and not processed by the pusher yet, the session waits for the pusher past it
+PUSHER_MUX_WINDOW_FRAMES = int(os.getenv('PUSHER_MUX_WINDOW_FRAMES', '32'))
+# Sent for a session on each of its turns on a connection, ~2 audio frames of 16kHz
+PUSHER_MUX_QUANTUM_BYTES = 64 * 1024
+# A connection without sessions is closed after it
+PUSHER_MUX_IDLE_SECONDS = 60
+
+PUSHER_MUX_CONNECTIONS_OPEN = Gauge('listen_pusher_mux_connections', 'Multiplexed connections to the pusher open')
+PUSHER_MUX_CHANNELS = Gauge('listen_pusher_mux_channels', 'Listen sessions on the multiplexed connections')
+PUSHER_MUX_THROTTLED = Counter('listen_pusher_mux_throttled_total',
+                               'Turns a session skipped, waiting for the pusher to process its window')
+
+
+class PusherChannel:
+    """A listen session on a multiplexed connection, its outbox is sent to the pusher in turns with the others."""
+
+    def __init__(self, uid: str, sample_rate: int, outbox: PusherOutbox):
+        self.uid = uid
+        self.sample_rate = sample_rate
+        self.outbox = outbox
+        self.connection: Optional['PusherMuxConnection'] = None
+        self.channel_id = 0
+        self.sent_seq = 0  # last sent
+        self.processed = 0  # last processed by the pusher
+        self.resumed = False
+        self.listener: Optional[Callable[[], None]] = None
+
+    def window(self) -> int:
+        """Frames that can be sent before the pusher processes more."""
+        return PUSHER_MUX_WINDOW_FRAMES - (self.sent_seq - self.processed)
+
+    def resume(self, offset: int):
+        # the pusher resumes from the last frame it is done with
+        self.outbox.ack(offset)
+        resume_seq = max(offset, self.outbox.acked)
+        if self.sent_seq > resume_seq:
+            self.outbox.replayed += self.sent_seq - resume_seq
+            PUSHER_OUTBOX_REPLAYED_FRAMES.inc(self.sent_seq - resume_seq)
+        self.sent_seq = self.processed = resume_seq
+        self.resumed = True
+
+    def acked(self, offset: int, processed: int):
+        self.processed = max(self.processed, processed)
+        self.outbox.ack(offset)
+
+    async def run(self, is_active: Callable[[], bool]):
+        """
+        Waits for the end of the session, then for the pusher to acknowledge the rest of the outbox, at most
+        PUSHER_OUTBOX_DRAIN_SECONDS.
+        """
+        while is_active():
+            await asyncio.sleep(1)
+        drain_until = time.monotonic() + PUSHER_OUTBOX_DRAIN_SECONDS
+        while self.outbox.pending():
+            if time.monotonic() > drain_until:
+                print('Pusher outbox not drained', self.outbox.pending(), 'frames', self.uid)
+                return
+            await asyncio.sleep(0.1)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.remove(self)
+            self.connection = None
+
+
+class PusherMuxConnection:
+    """
+    A long-lived connection to the pusher, shared by listen sessions of the pod.
+
+    The sessions take turns: a session with frames to send is queued, on its turn it sends one message of
+    at most PUSHER_MUX_QUANTUM_BYTES and goes back to the end of the queue if it has more, a session
+    replaying a backlog does not hold the others back. The pusher acknowledges the offset of the sessions
+    and the last frame it processed, a session the pusher is slow to process waits once
+    PUSHER_MUX_WINDOW_FRAMES are in flight.
+    On a reconnect every session is opened again and resumes from its offset.
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.channels: Dict[int, PusherChannel] = {}
+        # channels with frames to send, in turn, a channel sent for goes back to the end
+        self._ready: Dict[int, PusherChannel] = {}
+        self._next_channel_id = 0
+        self._ws = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, channel: PusherChannel):
+        self._next_channel_id += 1
+        channel.connection = self
+        channel.channel_id = self._next_channel_id
+        channel.resumed = False
+        self.channels[channel.channel_id] = channel
+        channel.listener = lambda: self.schedule(channel)
+        channel.outbox.add_listener(channel.listener)
+        PUSHER_MUX_CHANNELS.inc()
+        if self._ws is not None:
+            safe_create_task(self._open(self._ws, channel))
+        if self._task is None:
+            self._task = safe_create_task(self._run())
+        self._wakeup.set()
+
+    def remove(self, channel: PusherChannel):
+        if self.channels.pop(channel.channel_id, None) is None:
+            return
+        self._ready.pop(channel.channel_id, None)
+        channel.outbox.remove_listener(channel.listener)
+        PUSHER_MUX_CHANNELS.dec()
+        if self._ws is not None:
+            safe_create_task(self._send_control(self._ws, {'type': 'close', 'channel': channel.channel_id}))
+        self._wakeup.set()
+
+    def schedule(self, channel: PusherChannel):
+        """Queues the channel for its turn, on an append, an acknowledgement or once resumed."""
+        if channel.channel_id not in self._ready and self.channels.get(channel.channel_id) is channel:
+            self._ready[channel.channel_id] = channel
+            self._wakeup.set()
+
+    async def _send_control(self, ws, message: dict):
+        try:
+            await ws.send(json.dumps(message))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            print(f"Pusher mux control failed: {e}", self.index)
+
+    async def _open(self, ws, channel: PusherChannel):
+        await self._send_control(ws, {'type': 'open', 'channel': channel.channel_id, 'uid': channel.uid,
+                                      'sample_rate': channel.sample_rate, 'session_id': channel.outbox.session_id})
+
+    async def _run(self):
+        attempt = 0
+        idle_since = None
+        while True:
+            if not self.channels:
+                idle_since = idle_since or time.monotonic()
+                if time.monotonic() - idle_since > PUSHER_MUX_IDLE_SECONDS:
+                    break
+            else:
+                idle_since = None
+
+            if self._ws is None and self.channels:
+                try:
+                    ws = await connect_to_trigger_pusher_mux()
+                except Exception as e:
+                    print(f"Pusher mux connect failed: {e}", self.index)
+                    await asyncio.sleep(calculate_backoff_with_jitter(attempt) / 1000)
+                    attempt += 1
+                    continue
+                attempt = 0
+                self._ws = ws
+                PUSHER_MUX_CONNECTIONS_OPEN.inc()
+                safe_create_task(self._receive(ws))
+                for channel in list(self.channels.values()):
+                    await self._open(ws, channel)
+
+            self._wakeup.clear()
+            sent = False
+            if self._ws is not None:
+                ws = self._ws
+                try:
+                    sent = await self._send_ready(ws)
+                except websockets.exceptions.ConnectionClosed as e:
+                    print(f"Pusher mux connection closed: {e}", self.index)
+                    self._closed(ws)
+                    continue
+                except Exception as e:
+                    print(f"Pusher mux send failed: {e}", self.index)
+            if not sent:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+
+        self._task = None
+        if self._ws is not None:
+            self._closed(self._ws)
+
+    async def _send_ready(self, ws) -> bool:
+        sent = False
+        while self._ready:
+            channel_id = next(iter(self._ready))
+            channel = self._ready.pop(channel_id)
+            # queued again once resumed, or once the pusher processes its window
+            if not channel.resumed:
+                continue
+            window = channel.window()
+            if window <= 0:
+                PUSHER_MUX_THROTTLED.inc()
+                continue
+            frames = await channel.outbox.read_after(channel.sent_seq, min(window, 16))
+            if not frames:
+                continue
+            batch = next(batch_frames(frames, PUSHER_MUX_QUANTUM_BYTES))
+            await ws.send(encode_channel_frames(channel_id, batch))
+            channel.sent_seq = batch[-1][0]
+            sent = True
+            if channel.sent_seq < channel.outbox.seq:
+                self.schedule(channel)
+        return sent
+
+    async def _receive(self, ws):
+        try:
+            async for message in ws:
+                data = json.loads(message)
+                if data.get('type') == 'ack':
+                    for channel_id, offset, processed in data['acks']:
+                        channel = self.channels.get(channel_id)
+                        if channel is not None:
+                            channel.acked(offset, processed)
+                    continue
+                channel = self.channels.get(data.get('channel'))
+                if channel is None:
+                    continue
+                if data.get('type') == 'resume':
+                    channel.resume(data.get('offset', 0))
+                    self.schedule(channel)
+                elif data.get('type') == 'closed':
+                    # the pusher dropped the session, opened again after a while
+                    channel.resumed = False
+                    asyncio.get_running_loop().call_later(1, self._reopen, ws, channel)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            print(f"Pusher mux receive failed: {e}", self.index)
+        self._closed(ws)
+
+    async def _close_ws(self, ws):
+        try:
+            await ws.close()
+        except Exception as e:
+            print(f"Pusher mux close failed: {e}", self.index)
+
+    def _reopen(self, ws, channel: PusherChannel):
+        if ws is self._ws and self.channels.get(channel.channel_id) is channel and not channel.resumed:
+            safe_create_task(self._open(ws, channel))
+
+    def _closed(self, ws):
+        if ws is not self._ws:
+            return
+        self._ws = None
+        PUSHER_MUX_CONNECTIONS_OPEN.dec()
+        safe_create_task(self._close_ws(ws))
+        self._ready.clear()
+        for channel in self.channels.values():
+            channel.resumed = False
+        self._wakeup.set()
+
+
+class PusherMux:
+    """The multiplexed connections of the process to the pusher, a session goes on the least loaded."""
+
+    def __init__(self, connections: int = PUSHER_MUX_CONNECTIONS):
+        self.connections: List[PusherMuxConnection] = [PusherMuxConnection(i) for i in range(connections)]
+
+    def open(self, uid: str, sample_rate: int, outbox: PusherOutbox) -> PusherChannel:
+        channel = PusherChannel(uid, sample_rate, outbox)
+        min(self.connections, key=lambda connection: len(connection.channels)).add(channel)
+        return channel
+
+
+_mux: Optional[PusherMux] = None
+
+
+def get_pusher_mux() -> PusherMux:
+    global _mux
+    if _mux is None:
+        _mux = PusherMux()
+    return _mux
@@ -0,0 +1,272 @@
+import asyncio
+import os
+from collections import deque
+from typing import Callable, List, Optional
+
+from database import redis_db
+from utils.other.metrics import Counter, Histogram, SIZE_BUCKETS
+from utils.pusher_framing import Frame
+
+# Outbox of the frames to the pusher: redis (Redis Streams, survives a pusher restart) or memory
+PUSHER_OUTBOX = os.getenv('PUSHER_OUTBOX', 'redis')
+# Frames not acknowledged by the pusher kept per session, the oldest are dropped past it (~5min of a session)
+PUSHER_OUTBOX_MAX_FRAMES = int(os.getenv('PUSHER_OUTBOX_MAX_FRAMES', '600'))
+PUSHER_OUTBOX_TTL_SECONDS = 60 * 60
+# Time the pusher has to resume a session on connect, a pusher not resuming it predates the sequenced frames
+PUSHER_RESUME_TIMEOUT_SECONDS = float(os.getenv('PUSHER_RESUME_TIMEOUT_SECONDS', '5'))
+# Time the pusher has to acknowledge the last frames once the listen session is over
+PUSHER_OUTBOX_DRAIN_SECONDS = float(os.getenv('PUSHER_OUTBOX_DRAIN_SECONDS', '10'))
+
+PUSHER_OUTBOX_PENDING_FRAMES = Histogram('listen_pusher_outbox_pending_frames',
+                                         'Frames not acknowledged by the pusher, on every append',
+                                         buckets=SIZE_BUCKETS)
+PUSHER_OUTBOX_DROPPED_FRAMES = Counter('listen_pusher_outbox_dropped_frames_total',
+                                       'Frames dropped before the pusher acknowledged them')
+PUSHER_OUTBOX_REPLAYED_FRAMES = Counter('listen_pusher_outbox_replayed_frames_total',
+                                        'Frames sent again to the pusher after a reconnect')
+
+class PusherOutbox:
+    """
+    Sequence-numbered frames of a listen session to the pusher, kept until the pusher acknowledges them.
+
+    The pusher acknowledges the frames it is done with and persists its offset, on a reconnect it sends
+    that offset back and the frames after it are sent again, so a pusher restart neither drops nor
+    triggers twice. At most `max_frames` are kept, the oldest are dropped past it.
+
+    Appending and acknowledging return at once, the storage is read on the loop only through `read_after`.
+    """
+
+    def __init__(self, session_id: str, max_frames: int = PUSHER_OUTBOX_MAX_FRAMES):
+        self.session_id = session_id
+        self.max_frames = max_frames
+        self.seq = 0  # last appended
+        self.acked = 0  # last acknowledged by the pusher
+        self.first = 1  # oldest kept
+        self._event = asyncio.Event()
+        self._listeners: List[Callable[[], None]] = []
+
+        self.dropped = 0
+        self.replayed = 0
+
+    def pending(self) -> int:
+        return self.seq - max(self.acked, self.first - 1)
+
+    def append(self, header_type: int, payload: bytes) -> int:
+        self.seq += 1
+        self._append(self.seq, header_type, payload)
+        kept_from = self.seq - self.max_frames + 1
+        if kept_from > self.first:
+            dropped = kept_from - max(self.first, self.acked + 1)
+            if dropped > 0:
+                self.dropped += dropped
+                PUSHER_OUTBOX_DROPPED_FRAMES.inc(dropped)
+            self.first = kept_from
+        PUSHER_OUTBOX_PENDING_FRAMES.observe(self.pending())
+        self._notify()
+        return self.seq
+
+    async def read_after(self, seq: int, count: int = 64) -> List[Frame]:
+        # what is appended from now on wakes `wait`
+        self._event.clear()
+        return await self._read(max(seq, self.first - 1), count)
+
+    def ack(self, seq: int):
+        if seq <= self.acked:
+            return
+        self.acked = min(seq, self.seq)
+        self._trim(self.acked)
+        self._notify()
+
+    def wake(self):
+        self._notify()
+
+    def add_listener(self, callback: Callable[[], None]):
+        """Calls `callback` on every append and acknowledgement, e.g. to wake a multiplexed connection."""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable[[], None]):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _notify(self):
+        self._event.set()
+        for callback in self._listeners:
+            callback()
+
+    async def wait(self, timeout: float):
+        """Waits for an append or an acknowledgement since the last read."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def close(self):
+        pass
+
+    def _append(self, seq: int, header_type: int, payload: bytes):
+        raise NotImplementedError
+
+    async def _read(self, after_seq: int, count: int) -> List[Frame]:
+        raise NotImplementedError
+
+    def _trim(self, seq: int):
+        raise NotImplementedError
+
+
+class MemoryPusherOutbox(PusherOutbox):
+    """Outbox in the process memory, the stand-in of the Redis one in the tests, lost with the backend."""
+
+    def __init__(self, session_id: str, max_frames: int = PUSHER_OUTBOX_MAX_FRAMES):
+        super().__init__(session_id, max_frames)
+        self._frames: deque = deque(maxlen=max_frames)
+
+    def _append(self, seq: int, header_type: int, payload: bytes):
+        self._frames.append((seq, header_type, bytes(payload)))
+
+    async def _read(self, after_seq: int, count: int) -> List[Frame]:
+        frames = []
+        for frame in self._frames:
+            if frame[0] > after_seq:
+                frames.append(frame)
+                if len(frames) >= count:
+                    break
+        return frames
+
+    def _trim(self, seq: int):
+        while self._frames and self._frames[0][0] <= seq:
+            self._frames.popleft()
+
+
+class RedisPusherOutbox(PusherOutbox):
+    """
+    Outbox in a Redis stream of the session, the backend only holds the sequence numbers and the frames not
+    written yet.
+
+    The frames appended and the trims of the acknowledgements are written by a task of the session, in a
+    pipeline per round trip and off the loop: the frames appended while a write is in flight go in the next
+    one. A frame is read once written, the listeners are notified then.
+    """
+
+    def __init__(self, session_id: str, max_frames: int = PUSHER_OUTBOX_MAX_FRAMES):
+        super().__init__(session_id, max_frames)
+        self._unwritten: List[Frame] = []
+        self._trim_seq = 0
+        self._writer: Optional[asyncio.Task] = None
+
+    def _append(self, seq: int, header_type: int, payload: bytes):
+        self._unwritten.append((seq, header_type, bytes(payload)))
+        self._write_soon()
+
+    def _trim(self, seq: int):
+        self._trim_seq = seq
+        self._write_soon()
+
+    def _write_soon(self):
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_event_loop().create_task(self._write())
+
+    async def _write(self):
+        while self._unwritten or self._trim_seq:
+            frames, trim_seq = self._unwritten, self._trim_seq
+            self._unwritten, self._trim_seq = [], 0
+            try:
+                await asyncio.to_thread(redis_db.pusher_outbox_write, self.session_id, frames, trim_seq,
+                                        self.max_frames, PUSHER_OUTBOX_TTL_SECONDS)
+            except Exception as e:
+                print('Pusher outbox write failed', self.session_id, e)
+                if frames:
+                    self.dropped += len(frames)
+                    PUSHER_OUTBOX_DROPPED_FRAMES.inc(len(frames))
+            if frames:
+                self._notify()
+
+    async def _read(self, after_seq: int, count: int) -> List[Frame]:
+        try:
+            return await asyncio.to_thread(redis_db.pusher_outbox_read, self.session_id, after_seq, count)
+        except Exception as e:
+            print('Pusher outbox read failed', self.session_id, e)
+            return []
+
+    async def close(self):
+        if self._writer is not None:
+            await self._writer
+        await asyncio.to_thread(redis_db.delete_pusher_outbox, self.session_id)
+
+
+def create_pusher_outbox(session_id: str) -> PusherOutbox:
+    if PUSHER_OUTBOX == 'memory':
+        return MemoryPusherOutbox(session_id)
+    return RedisPusherOutbox(session_id)
+
+
+class PusherSessionOffsets:
+    """
+    Progress of the pusher on the frames of a listen session, persisted so a restarted pusher resumes it.
+
+    - processed: last frame handled, a transcript up to it is not triggered again
+    - flushed: per audio buffer, last frame included in a delivered chunk, a replayed frame up to it is
+      not buffered again
+    - offset: every frame up to it is done with, the last one acknowledged to the backend
+
+    A buffered audio frame is not done with until its buffer is delivered, it is replayed after a restart.
+    The offsets are saved once per message, or per acknowledgement of a multiplexed connection, before the
+    offset is acknowledged: a pusher restarting in between triggers the frames of that message again.
+    """
+
+    def __init__(self, session_id: str, offsets: Optional[dict] = None):
+        self.session_id = session_id
+        offsets = offsets or {}
+        self.offset = offsets.get('offset', 0)
+        self.processed = offsets.get('processed', 0)
+        self.flushed = dict(offsets.get('flushed', {}))
+        # buffer name -> seq of its first frame not delivered yet
+        self.buffered_from = {}
+        self.dirty = False
+
+    @staticmethod
+    def load(session_id: str) -> 'PusherSessionOffsets':
+        return PusherSessionOffsets(session_id, redis_db.get_pusher_offsets(session_id))
+
+    def is_processed(self, seq: int) -> bool:
+        return seq <= self.processed
+
+    def should_buffer(self, name: str, seq: int) -> bool:
+        return seq > self.flushed.get(name, 0)
+
+    def buffered(self, name: str, seq: int):
+        self.buffered_from.setdefault(name, seq)
+
+    def flushed_buffer(self, name: str, seq: int):
+        self.flushed[name] = seq
+        self.buffered_from.pop(name, None)
+
+    def done(self, seq: int) -> Optional[int]:
+        """Marks the frame handled, returns the new offset to acknowledge if it moved."""
+        self.processed = max(self.processed, seq)
+        offset = min(self.buffered_from.values()) - 1 if self.buffered_from else self.processed
+        moved = offset > self.offset
+        if moved:
+            self.offset = offset
+        self.dirty = True
+        return offset if moved else None
+
+    def state(self) -> dict:
+        return {'offset': self.offset, 'processed': self.processed, 'flushed': dict(self.flushed)}
+
+    async def save(self):
+        """Persists the offsets, if frames were done with since the last save."""
+        if not self.dirty:
+            return
+        self.dirty = False
+        await asyncio.to_thread(redis_db.set_pusher_offsets, self.session_id, self.state(), PUSHER_OUTBOX_TTL_SECONDS)
+
+    @staticmethod
+    async def save_many(sessions: List['PusherSessionOffsets']):
+        """Persists the offsets of the sessions with frames done with since their last save, in a round trip."""
+        states = {}
+        for offsets in sessions:
+            if offsets.dirty:
+                offsets.dirty = False
+                states[offsets.session_id] = offsets.state()
+        if states:
+            await asyncio.to_thread(redis_db.set_pusher_offsets_many, states, PUSHER_OUTBOX_TTL_SECONDS)
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+from utils.other.metrics import Counter, Gauge, Histogram
+
+# Triggers of a kind running at once for a session, the next ones wait for a slot
+PUSHER_TRIGGER_MAX_IN_FLIGHT = int(os.getenv('PUSHER_TRIGGER_MAX_IN_FLIGHT', '4'))
+# Triggers of a kind waiting for a slot, the oldest is dropped past it
+PUSHER_TRIGGER_MAX_PENDING = int(os.getenv('PUSHER_TRIGGER_MAX_PENDING', '16'))
+# Time a trigger has from its submission, waiting for a slot included, it is cancelled past it
+PUSHER_TRIGGER_DEADLINE_SECONDS = float(os.getenv('PUSHER_TRIGGER_DEADLINE_SECONDS', '30'))
+# Time the running triggers of a closed session have to finish before they are cancelled
+PUSHER_TRIGGER_CLOSE_GRACE_SECONDS = 5
+
+PUSHER_TRIGGERS = Counter('pusher_triggers_total', 'Triggers of the sessions, by outcome', ['trigger', 'outcome'])
+PUSHER_TRIGGER_SECONDS = Histogram('pusher_trigger_seconds', 'Time of a trigger from its submission', ['trigger'])
+PUSHER_TRIGGERS_IN_FLIGHT = Gauge('pusher_triggers_in_flight', 'Triggers of the sessions running')
+
+Trigger = Callable[..., Awaitable]
+
+
+class _Lane:
+    __slots__ = ('name', 'tasks', 'pending')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.tasks: Set[asyncio.Task] = set()
+        self.pending: Deque[Tuple[Trigger, tuple, float]] = deque()
+
+
+class TriggerGroup:
+    """
+    The triggers of a session running on the loop of the pusher, bounded per kind of trigger.
+
+    A trigger is submitted from the frame handling and returns at once, at most `max_in_flight` of a
+    kind run at once, the next ones wait in their order, at most `max_pending`, the oldest waiting is
+    dropped past it. A trigger has `deadline_seconds` from its submission and is cancelled past it, so an
+    app slow to respond holds a few slots of its session and nothing else: the frames of the session are
+    still parsed and the other kinds and sessions run as usual. On close the waiting triggers are dropped
+    and the running ones are cancelled after PUSHER_TRIGGER_CLOSE_GRACE_SECONDS.
+    """
+
+    def __init__(self, uid: str, max_in_flight: int = PUSHER_TRIGGER_MAX_IN_FLIGHT,
+                 max_pending: int = PUSHER_TRIGGER_MAX_PENDING,
+                 deadline_seconds: float = PUSHER_TRIGGER_DEADLINE_SECONDS,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.uid = uid
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        self.deadline_seconds = deadline_seconds
+        # the loop the triggers run on, that of the caller if not given
+        self.loop = loop or asyncio.get_event_loop()
+        self._lanes: Dict[str, _Lane] = {}
+        self.closed = False
+
+        self.dropped = 0
+        self.expired = 0
+
+    def submit(self, name: str, trigger: Trigger, *args):
+        """Runs `trigger(*args)` once a slot of its kind is free, `trigger` is called only then."""
+        if self.closed:
+            return
+        lane = self._lanes.get(name)
+        if lane is None:
+            lane = self._lanes[name] = _Lane(name)
+        submitted_at = time.monotonic()
+        if len(lane.tasks) < self.max_in_flight:
+            self._start(lane, trigger, args, submitted_at)
+            return
+        if len(lane.pending) >= self.max_pending:
+            lane.pending.popleft()
+            self.dropped += 1
+            PUSHER_TRIGGERS.labels(name, 'dropped').inc()
+        lane.pending.append((trigger, args, submitted_at))
+
+    def _start(self, lane: _Lane, trigger: Trigger, args: tuple, submitted_at: float):
+        task = self.loop.create_task(self._run(lane.name, trigger, args, submitted_at))
+        lane.tasks.add(task)
+        task.add_done_callback(lambda t: self._done(lane, t))
+
+    async def _run(self, name: str, trigger: Trigger, args: tuple, submitted_at: float):
+        outcome = 'error'
+        PUSHER_TRIGGERS_IN_FLIGHT.inc()
+        try:
+            remaining = submitted_at + self.deadline_seconds - time.monotonic()
+            await asyncio.wait_for(trigger(*args), remaining)
+            outcome = 'ok'
+        except asyncio.TimeoutError:
+            outcome = 'expired'
+            self.expired += 1
+            print('Pusher trigger past its deadline', name, self.uid)
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+        except Exception as e:
+            print(f'Pusher trigger {name} failed: {e}', self.uid)
+        finally:
+            PUSHER_TRIGGERS_IN_FLIGHT.dec()
+            PUSHER_TRIGGERS.labels(name, outcome).inc()
+            PUSHER_TRIGGER_SECONDS.labels(name).observe(time.monotonic() - submitted_at)
+
+    def _done(self, lane: _Lane, task: asyncio.Task):
+        lane.tasks.discard(task)
+        now = time.monotonic()
+        while lane.pending and len(lane.tasks) < self.max_in_flight and not self.closed:
+            trigger, args, submitted_at = lane.pending.popleft()
+            if now - submitted_at >= self.deadline_seconds:
+                self.expired += 1
+                PUSHER_TRIGGERS.labels(lane.name, 'expired').inc()
+                continue
+            self._start(lane, trigger, args, submitted_at)
+
+    def close(self, grace_seconds: Optional[float] = PUSHER_TRIGGER_CLOSE_GRACE_SECONDS):
+        """Drops the waiting triggers, cancels the running ones after `grace_seconds`, at once if None."""
+        if self.closed:
+            return
+        self.closed = True
+        for lane in self._lanes.values():
+            if lane.pending:
+                PUSHER_TRIGGERS.labels(lane.name, 'cancelled').inc(len(lane.pending))
+                lane.pending.clear()
+        if grace_seconds:
+            self.loop.call_later(grace_seconds, self._cancel)
+        else:
+            self._cancel()
+
+    def _cancel(self):
+        for lane in self._lanes.values():
+            for task in list(lane.tasks):
+                task.cancel()
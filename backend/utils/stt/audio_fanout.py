@@ -0,0 +1,193 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, List, Optional
+
+from utils.other.metrics import Counter, Histogram
+
+# Audio an STT provider socket may lag behind the client before its overflow policy applies
+AUDIO_FANOUT_STT_MAX_SECONDS = float(os.getenv('AUDIO_FANOUT_STT_MAX_SECONDS', '10'))
+# Overflow policy of the STT sinks: drop_oldest, coalesce or disconnect
+AUDIO_FANOUT_STT_OVERFLOW = os.getenv('AUDIO_FANOUT_STT_OVERFLOW', 'coalesce')
+# Audio kept for the pusher while it is slow or reconnecting, the oldest is dropped past it
+AUDIO_FANOUT_PUSHER_MAX_SECONDS = float(os.getenv('AUDIO_FANOUT_PUSHER_MAX_SECONDS', '30'))
+
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_COALESCE = 'coalesce'
+OVERFLOW_DISCONNECT = 'disconnect'
+
+AUDIO_SINK_LAG_SECONDS = Histogram('listen_audio_sink_lag_seconds',
+                                   'Time from a chunk pushed to an audio sink to its send', ['sink'])
+AUDIO_SINK_DROPPED_SECONDS = Counter('listen_audio_sink_dropped_seconds_total',
+                                     'Audio dropped by the sinks on overflow', ['sink'])
+AUDIO_SINK_DISCONNECTS = Counter('listen_audio_sink_disconnects_total',
+                                 'Sinks closed on overflow or send failure', ['sink'])
+
+
+class AudioSink:
+    """
+    Consumer of the audio of a session (an STT provider socket, the pusher) behind a bounded buffer.
+
+    `push` never waits: the chunk is queued and sent by the `run` task of the sink, so a slow sink
+    lags on its own instead of holding up the receive loop and the other sinks. Past `max_seconds`
+    of queued audio the overflow policy applies:
+    - drop_oldest: the oldest chunks are dropped
+    - coalesce: same, and a lagging sink gets its whole backlog merged by `coalesce` in one send
+    - disconnect: the sink is closed and `on_failure` called, nothing is dropped silently
+
+    `send` returns False when the chunk could not be delivered yet (e.g. reconnecting), it is queued
+    again. Raising closes the sink and calls `on_failure`. Dropped audio shifts the timestamps of an
+    STT provider, keep their buffers large enough to only drop on a broken connection.
+    """
+
+    def __init__(self, name: str, send: Callable[[Any], Awaitable[Optional[bool]]], max_seconds: float,
+                 overflow: str = OVERFLOW_DROP_OLDEST, coalesce: Callable[[List[Any]], Any] = None,
+                 min_interval_seconds: float = 0, on_failure: Callable[[str, Optional[Exception]], None] = None):
+        if overflow not in (OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE, OVERFLOW_DISCONNECT):
+            raise ValueError(f'Unknown overflow policy {overflow}')
+        if overflow == OVERFLOW_COALESCE and coalesce is None:
+            raise ValueError('The coalesce policy needs a coalesce function')
+        self.name = name
+        self.send = send
+        self.max_seconds = max_seconds
+        self.overflow = overflow
+        self.coalesce = coalesce
+        self.min_interval_seconds = min_interval_seconds
+        self.on_failure = on_failure
+        # (payload, audio seconds, pushed at)
+        self._queue: deque = deque()
+        self._event = asyncio.Event()
+        self._closed = False
+        self.failed = False
+        self.pending_seconds = 0.0
+
+        self._lag = AUDIO_SINK_LAG_SECONDS.labels(name)
+        self._dropped = AUDIO_SINK_DROPPED_SECONDS.labels(name)
+        self.pushed = 0
+        self.sent = 0
+        self.dropped = 0
+        self.dropped_seconds = 0.0
+        self.max_pending_seconds = 0.0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def push(self, payload: Any, seconds: float):
+        if self._closed:
+            return
+        self._queue.append((payload, seconds, time.monotonic()))
+        self.pending_seconds += seconds
+        self.pushed += 1
+        if self.pending_seconds > self.max_seconds:
+            if self.overflow == OVERFLOW_DISCONNECT:
+                self._fail(None)
+                return
+            while self.pending_seconds > self.max_seconds and len(self._queue) > 1:
+                _, dropped_seconds, _ = self._queue.popleft()
+                self.pending_seconds -= dropped_seconds
+                self.dropped += 1
+                self.dropped_seconds += dropped_seconds
+                self._dropped.inc(dropped_seconds)
+        self.max_pending_seconds = max(self.max_pending_seconds, self.pending_seconds)
+        self._event.set()
+
+    def close(self):
+        """The queued chunks are still sent, then `run` returns."""
+        self._closed = True
+        self._event.set()
+
+    def _fail(self, error: Optional[Exception]):
+        self._closed = True
+        self.failed = True
+        self._queue.clear()
+        self.pending_seconds = 0.0
+        self._event.set()
+        AUDIO_SINK_DISCONNECTS.labels(self.name).inc()
+        if self.on_failure is not None:
+            self.on_failure(self.name, error)
+
+    def _take(self) -> List[tuple]:
+        # the whole backlog in one send when it can be merged, one chunk at a time otherwise
+        if self.coalesce is not None and (self.overflow == OVERFLOW_COALESCE or self.min_interval_seconds):
+            items = list(self._queue)
+            self._queue.clear()
+        else:
+            items = [self._queue.popleft()]
+        self.pending_seconds -= sum(seconds for _, seconds, _ in items)
+        return items
+
+    async def run(self):
+        last_sent_at = 0.0
+        while True:
+            while not self._queue:
+                if self._closed:
+                    return
+                self._event.clear()
+                await self._event.wait()
+
+            wait_seconds = last_sent_at + self.min_interval_seconds - time.monotonic()
+            if wait_seconds > 0 and not self._closed:
+                await asyncio.sleep(wait_seconds)
+
+            items = self._take()
+            payload = self.coalesce([item[0] for item in items]) if len(items) > 1 else items[0][0]
+            try:
+                delivered = await self.send(payload)
+            except Exception as e:
+                print(f'Audio sink {self.name} send failed: {e}')
+                self._fail(e)
+                return
+            last_sent_at = time.monotonic()
+
+            if delivered is False:
+                if self._closed:
+                    # the session is over, nothing will deliver it
+                    return
+                # back in front of the chunks pushed meanwhile, the overflow policy applies on the next push
+                self._queue.extendleft(reversed(items))
+                self.pending_seconds += sum(seconds for _, seconds, _ in items)
+                await asyncio.sleep(max(self.min_interval_seconds, 0.1))
+                continue
+
+            self.sent += len(items)
+            self._lag.observe(last_sent_at - items[0][2])
+
+    def stats(self) -> dict:
+        return {'pushed': self.pushed, 'sent': self.sent, 'dropped': self.dropped,
+                'dropped_seconds': round(self.dropped_seconds, 2), 'pending': len(self._queue),
+                'max_pending_seconds': round(self.max_pending_seconds, 2), 'failed': self.failed}
+
+
+class AudioFanout:
+    """The sinks of a session, each chunk pushed to all of them without waiting on any."""
+
+    def __init__(self):
+        self.sinks: List[AudioSink] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def add(self, sink: AudioSink) -> AudioSink:
+        self.sinks.append(sink)
+        self._tasks.append(asyncio.create_task(sink.run()))
+        return sink
+
+    async def close(self, timeout_seconds: float = 1.0):
+        """Closes the sinks and gives them `timeout_seconds` to send what is queued."""
+        for sink in self.sinks:
+            sink.close()
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout_seconds)
+        for task in pending:
+            task.cancel()
+
+    def stats(self) -> dict:
+        return {sink.name: sink.stats() for sink in self.sinks}
+
+
+def join_pcm(payloads: List[bytes]) -> bytes:
+    return b''.join(payloads)
+
+
+def join_opus_frames(payloads: List[List[bytes]]) -> List[bytes]:
+    return [frame for frames in payloads for frame in frames]
@@ -0,0 +1,107 @@
+import os
+import random
+import struct
+from typing import List
+
+import opuslib
+
+# STT services that take the opus frames of the device as is, muxed in an Ogg container,
+# instead of the decoded PCM (~8x the bytes).
+OPUS_PASSTHROUGH_STT_SERVICES = {'deepgram'}
+STT_OPUS_PASSTHROUGH_ENABLED = os.getenv('STT_OPUS_PASSTHROUGH_ENABLED', 'true').lower() == 'true'
+
+OPUS_SAMPLE_RATE = 16000
+
+
+def is_opus_passthrough(stt_service: str, codec: str, sample_rate: int) -> bool:
+    """Whether the opus frames of the session can be forwarded to the STT service without decoding."""
+    return STT_OPUS_PASSTHROUGH_ENABLED and codec == 'opus' and sample_rate == OPUS_SAMPLE_RATE and \
+        stt_service in OPUS_PASSTHROUGH_STT_SERVICES
+
+
+def encode_opus_packets(pcm: bytes, sample_rate: int, frame_size: int, channels: int = 1) -> List[bytes]:
+    """Encodes PCM16 into opus packets of `frame_size` samples, the last frame is padded with silence."""
+    encoder = opuslib.Encoder(sample_rate, channels, opuslib.APPLICATION_VOIP)
+    frame_bytes = frame_size * channels * 2
+    packets = []
+    for i in range(0, len(pcm), frame_bytes):
+        frame = pcm[i:i + frame_bytes]
+        if len(frame) < frame_bytes:
+            frame += b'\x00' * (frame_bytes - len(frame))
+        packets.append(encoder.encode(frame, frame_size))
+    return packets
+
+
+def _ogg_crc_table() -> List[int]:
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_OGG_CRC_TABLE = _ogg_crc_table()
+
+
+def _ogg_crc(data: bytes) -> int:
+    crc = 0
+    table = _OGG_CRC_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ table[(crc >> 24) ^ byte]
+    return crc
+
+
+class OggOpusWriter:
+    """
+    Muxes the raw opus packets of a session into an Ogg Opus stream (RFC 7845), no re-encoding.
+
+    One writer per STT connection, the first page written carries the Opus headers.
+    """
+
+    def __init__(self, frame_size: int, sample_rate: int = OPUS_SAMPLE_RATE, channels: int = 1):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        # granule positions are always counted at 48kHz
+        self._granule_per_packet = frame_size * 48000 // sample_rate
+        self._serial = random.getrandbits(32)
+        self._sequence = 0
+        self._granule = 0
+        self._started = False
+
+    def _page(self, packets: List[bytes], header_type: int = 0) -> bytes:
+        lacing = bytearray()
+        for packet in packets:
+            lacing.extend(b'\xff' * (len(packet) // 255))
+            lacing.append(len(packet) % 255)
+        header = struct.pack('<4sBBqIIIB', b'OggS', 0, header_type, self._granule, self._serial, self._sequence, 0,
+                             len(lacing))
+        page = bytearray(header + lacing + b''.join(packets))
+        struct.pack_into('<I', page, 22, _ogg_crc(page))
+        self._sequence += 1
+        return bytes(page)
+
+    def headers(self) -> bytes:
+        opus_head = struct.pack('<8sBBHIhB', b'OpusHead', 1, self.channels, 0, self.sample_rate, 0, 0)
+        vendor = b'omi'
+        opus_tags = struct.pack('<8sI', b'OpusTags', len(vendor)) + vendor + struct.pack('<I', 0)
+        return self._page([opus_head], header_type=0x02) + self._page([opus_tags])
+
+    def write(self, packets: List[bytes]) -> bytes:
+        """Ogg pages of the packets, prefixed with the stream headers on the first call."""
+        data = b''
+        if not self._started:
+            self._started = True
+            data = self.headers()
+        # 255 lacing values max per page
+        start = 0
+        while start < len(packets):
+            end, lacing_values = start, 0
+            while end < len(packets) and lacing_values + len(packets[end]) // 255 + 1 <= 255:
+                lacing_values += len(packets[end]) // 255 + 1
+                end += 1
+            self._granule += self._granule_per_packet * (end - start)
+            data += self._page(packets[start:end])
+            start = end
+        return data
@@ -0,0 +1,194 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Coroutine, Deque, Dict, Optional, Set, Tuple
+
+from utils.other.task import safe_create_task
+
+# Ready connections kept per (provider, connection params) key, 0 disables the pool
+STT_POOL_SIZE = int(os.getenv('STT_POOL_SIZE', '1'))
+# Idle connections are closed before the providers time them out, and not replaced
+STT_POOL_MAX_IDLE_SECONDS = float(os.getenv('STT_POOL_MAX_IDLE_SECONDS', '20'))
+STT_POOL_HEALTH_CHECK_INTERVAL_SECONDS = 5
+
+
+class STTSessionBinding:
+    """
+    Callbacks of an STT connection, bound when a session checks it out of the pool.
+
+    The provider message handlers read the session state from here, a connection opened ahead of any
+    session drops what it receives until it is bound.
+    """
+
+    def __init__(self):
+        self.stream_transcript: Optional[Callable] = None
+        self.preseconds = 0
+        self.closed = False
+
+    def bind(self, stream_transcript: Callable, preseconds: int = 0):
+        self.stream_transcript = stream_transcript
+        self.preseconds = preseconds
+
+    def emit(self, segments: list):
+        if self.stream_transcript is not None:
+            self.stream_transcript(segments)
+
+
+class STTProvider:
+    """How the pool opens, health checks and closes the connections of a provider."""
+
+    def __init__(self, connect: Callable[..., Awaitable[Any]], is_healthy: Callable[[Any, STTSessionBinding], bool],
+                 close: Callable[[Any], Awaitable[None]]):
+        self.connect = connect
+        self.is_healthy = is_healthy
+        self.close = close
+
+
+class _PooledConnection:
+    def __init__(self, socket, binding: STTSessionBinding):
+        self.socket = socket
+        self.binding = binding
+        self.opened_at = time.monotonic()
+
+
+def calculate_backoff_with_jitter(attempt, base_delay=1000, max_delay=32000):
+    jitter = random.random() * base_delay
+    backoff = min(((2 ** attempt) * base_delay) + jitter, max_delay)
+    return backoff
+
+
+async def connect_with_backoff(connect: Callable[[], Awaitable[Any]], retries=3):
+    for attempt in range(retries):
+        try:
+            return await connect()
+        except Exception as error:
+            print(f'An error occurred: {error}')
+            if attempt == retries - 1:  # Last attempt
+                raise
+        backoff_delay = calculate_backoff_with_jitter(attempt)
+        print(f"Waiting {backoff_delay:.0f}ms before next retry...")
+        await asyncio.sleep(backoff_delay / 1000)
+
+    raise Exception(f'Could not open socket: All retry attempts failed.')
+
+
+class STTConnectionPool:
+    """
+    Per-process pool of pre-warmed STT connections, keyed by provider and connection params
+    (language, sample rate, model...), so the handshake is off the time to first transcript.
+
+    Keys are learned from the sessions and refilled on demand only: a checkout opens a connection for
+    the next session of its key, up to `size` ready. A connection not checked out within
+    `max_idle_seconds` is closed by a background health check and not replaced, a connection is billed
+    while open, so only the keys with sessions arriving that often are kept warm.
+    Connections are single use, they are handed to one session and never come back to the pool.
+    """
+
+    def __init__(self, size: int = STT_POOL_SIZE, max_idle_seconds: float = STT_POOL_MAX_IDLE_SECONDS):
+        self.size = size
+        self.max_idle_seconds = max_idle_seconds
+        self._providers: Dict[str, STTProvider] = {}
+        self._idle: Dict[Tuple, Deque[_PooledConnection]] = {}
+        self._opening: Dict[Tuple, int] = {}
+        self._health_check_task: Optional[asyncio.Task] = None
+        # the loop only holds weak references to its tasks
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.opened = 0
+        self.expired = 0
+
+    def register(self, provider: str, connect: Callable[..., Awaitable[Any]],
+                 is_healthy: Callable[[Any, STTSessionBinding], bool], close: Callable[[Any], Awaitable[None]]):
+        """`connect(binding, **params)` opens a connection whose handlers read from `binding`."""
+        self._providers[provider] = STTProvider(connect, is_healthy, close)
+
+    @staticmethod
+    def _key(provider: str, params: dict) -> Tuple:
+        return provider, tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in params.items()))
+
+    async def checkout(self, provider: str, stream_transcript: Callable, preseconds: int = 0, **params):
+        """A connected socket bound to the session, from the pool when one is ready."""
+        key = self._key(provider, params)
+        connection = self._pop_ready(key)
+        if connection is None:
+            binding = STTSessionBinding()
+            binding.bind(stream_transcript, preseconds)
+            socket = await connect_with_backoff(lambda: self._providers[provider].connect(binding, **params))
+        else:
+            connection.binding.bind(stream_transcript, preseconds)
+            socket = connection.socket
+
+        if self.size > 0:
+            self._ensure_health_check()
+            self._spawn(self._refill(key, params))
+        return socket
+
+    def _spawn(self, coroutine: Coroutine):
+        task = safe_create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _pop_ready(self, key: Tuple) -> Optional[_PooledConnection]:
+        provider = self._providers[key[0]]
+        idle = self._idle.get(key)
+        while idle:
+            connection = idle.popleft()
+            if self._is_usable(provider, connection):
+                return connection
+            self._spawn(self._close(provider, connection))
+        return None
+
+    def _is_usable(self, provider: STTProvider, connection: _PooledConnection) -> bool:
+        if time.monotonic() - connection.opened_at > self.max_idle_seconds:
+            return False
+        try:
+            return provider.is_healthy(connection.socket, connection.binding)
+        except Exception:
+            return False
+
+    async def _close(self, provider: STTProvider, connection: _PooledConnection):
+        try:
+            await provider.close(connection.socket)
+        except Exception as e:
+            print('stt_pool close error', e)
+
+    async def _refill(self, key: Tuple, params: dict):
+        provider = self._providers[key[0]]
+        idle = self._idle.setdefault(key, deque())
+        missing = self.size - len(idle) - self._opening.get(key, 0)
+        if missing <= 0:
+            return
+
+        self._opening[key] = self._opening.get(key, 0) + missing
+
+        async def _open():
+            binding = STTSessionBinding()
+            try:
+                socket = await connect_with_backoff(lambda: provider.connect(binding, **params))
+                idle.append(_PooledConnection(socket, binding))
+                self.opened += 1
+            except Exception as e:
+                print('stt_pool pre-warm failed', key, e)
+            finally:
+                self._opening[key] -= 1
+
+        await asyncio.gather(*[_open() for _ in range(missing)])
+
+    def _ensure_health_check(self):
+        if self._health_check_task is None or self._health_check_task.done():
+            self._health_check_task = safe_create_task(self._health_check())
+
+    async def _health_check(self):
+        while self._idle:
+            await asyncio.sleep(STT_POOL_HEALTH_CHECK_INTERVAL_SECONDS)
+            for key in list(self._idle.keys()):
+                provider = self._providers[key[0]]
+                idle = self._idle[key]
+                for connection in [c for c in idle if not self._is_usable(provider, c)]:
+                    idle.remove(connection)
+                    self.expired += 1
+                    self._spawn(self._close(provider, connection))
+                if not idle and not self._opening.get(key):
+                    del self._idle[key]
@@ -0,0 +1,67 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import List
+
+from utils.other.metrics import Histogram
+
+STT_FIRST_TRANSCRIPT_SECONDS = Histogram(
+    'listen_stt_first_transcript_seconds',
+    'Time from the first audio sent to an STT provider to the first transcript of the session',
+    ['provider'])
+STT_FINAL_LATENCY_SECONDS = Histogram(
+    'listen_stt_final_latency_seconds',
+    'Time from the audio at the end of a final segment sent to an STT provider to the segment received',
+    ['provider'])
+
+# Send times kept, one per ~100ms of audio, covers the provider delays the metric can report
+_MAX_MARKS = 1200
+_MARK_EVERY_SECONDS = 0.1
+
+
+class STTLatencyTracker:
+    """
+    Provider round trip of a listen session, from the audio sent to the transcript received.
+
+    `sent` is called with the duration of every chunk of audio sent to the provider, `received` with
+    the segments it returns, before any timestamp adjustment so their times are on the provider timeline.
+    Thread safe, the Deepgram callbacks run on the SDK thread.
+    """
+
+    def __init__(self, provider: str):
+        self._first = STT_FIRST_TRANSCRIPT_SECONDS.labels(provider)
+        self._final = STT_FINAL_LATENCY_SECONDS.labels(provider)
+        self._lock = threading.Lock()
+        self._positions = deque(maxlen=_MAX_MARKS)
+        self._times = deque(maxlen=_MAX_MARKS)
+        self._audio_seconds = 0.0
+        self._first_sent_at = None
+        self._first_received = False
+
+    def sent(self, seconds: float):
+        # a single sender, the lock is only taken to add a mark
+        self._audio_seconds += seconds
+        if self._positions and self._audio_seconds - self._positions[-1] < _MARK_EVERY_SECONDS:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self._first_sent_at is None:
+                self._first_sent_at = now
+            self._positions.append(self._audio_seconds)
+            self._times.append(now)
+
+    def received(self, segments: List[dict]):
+        if not segments:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self._first_sent_at is None:
+                return
+            if not self._first_received:
+                self._first_received = True
+                self._first.observe(now - self._first_sent_at)
+            # the first mark at or after the end of the segment, the audio it needed was sent by then
+            index = min(bisect_left(self._positions, segments[-1]['end']), len(self._positions) - 1)
+            sent_at = self._times[index]
+        self._final.observe(max(0.0, now - sent_at))
@@ -0,0 +1,184 @@
+import asyncio
+import ctypes
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import opuslib
+import opuslib.api.decoder as opus_api
+
+from utils.other.metrics import Histogram, SIZE_BUCKETS
+
+# Threads of the shared decode worker, libopus runs without the GIL so they decode in parallel
+OPUS_DECODE_WORKERS = int(os.getenv('OPUS_DECODE_WORKERS', str(min(8, os.cpu_count() or 1))))
+# Max frames of a session decoded in one batch
+OPUS_DECODE_MAX_BATCH_FRAMES = int(os.getenv('OPUS_DECODE_MAX_BATCH_FRAMES', '64'))
+# One frame in that many has its decode latency measured
+OPUS_DECODE_LATENCY_SAMPLING = 8
+
+OPUS_DECODE_SECONDS = Histogram('listen_opus_decode_seconds',
+                                'Time from an opus frame received to its PCM, waiting for its batch included')
+OPUS_DECODE_BATCH_FRAMES = Histogram('listen_opus_decode_batch_frames', 'Frames of the decoded batches',
+                                     buckets=SIZE_BUCKETS)
+
+
+def decode_opus_frames(decoder: opuslib.Decoder, frames: List[bytes], frame_size: int,
+                       channels: int = 1) -> Tuple[memoryview, List[int], Optional[opuslib.OpusError]]:
+    """
+    Decodes the frames in order with libopus straight into one contiguous PCM16 buffer, instead of
+    an array then a `bytes` copy per frame like `Decoder.decode`.
+
+    Returns the PCM, the end offset of every decoded frame in it, and the error of the first frame
+    failing to decode, the frames after it are not decoded.
+    """
+    sample_bytes = 2 * channels
+    pcm = bytearray(len(frames) * frame_size * sample_bytes)
+    address = ctypes.addressof((ctypes.c_char * len(pcm)).from_buffer(pcm)) if pcm else 0
+    offsets = []
+    position = 0
+    for frame in frames:
+        output = ctypes.cast(address + position, opuslib.api.c_int16_pointer)
+        result = opus_api.libopus_decode(decoder.decoder_state, frame, len(frame), output, frame_size, 0)
+        if result < 0:
+            return memoryview(pcm)[:position], offsets, opuslib.OpusError(result)
+        position += result * sample_bytes
+        offsets.append(position)
+    return memoryview(pcm)[:position], offsets, None
+
+
+class OpusStreamDecoder:
+    """
+    Opus decoder of a session, the frames are decoded by the shared `OpusDecodeWorker` off the event loop.
+
+    Frames decode in order, a batch of a session is never in two worker threads at once. A session
+    pipelines its frames with `submit`: the frames received while a batch decodes go in the next one.
+    """
+
+    def __init__(self, sample_rate: int, frame_size: int, channels: int = 1, worker: 'OpusDecodeWorker' = None):
+        self.sample_rate = sample_rate
+        self.frame_size = frame_size
+        self.channels = channels
+        self.worker = worker or get_opus_decode_worker()
+        self.decoder = opuslib.Decoder(sample_rate, channels)
+        self._pending: List[Tuple[bytes, asyncio.Future]] = []
+        self._running = False
+        self._requested = 0
+
+        self.frames = 0
+        self.batches = 0
+        self.errors = 0
+
+    def submit(self, frame: bytes) -> asyncio.Future:
+        """Queues the frame, the future resolves to its PCM16, a view in the contiguous buffer of its batch."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((frame, future))
+        self.worker.schedule(self)
+        self._requested += 1
+        if not self._requested % OPUS_DECODE_LATENCY_SAMPLING:
+            started = time.perf_counter()
+            future.add_done_callback(lambda _: OPUS_DECODE_SECONDS.observe(time.perf_counter() - started))
+        return future
+
+    async def decode(self, frame: bytes) -> memoryview:
+        """PCM16 of the frame, a view in the contiguous buffer of its batch."""
+        return await self.submit(frame)
+
+    def _take_batch(self) -> List[Tuple[bytes, asyncio.Future]]:
+        batch = self._pending[:OPUS_DECODE_MAX_BATCH_FRAMES]
+        del self._pending[:OPUS_DECODE_MAX_BATCH_FRAMES]
+        return batch
+
+    def _decode_batch(self, frames: List[bytes]):
+        # worker thread
+        return decode_opus_frames(self.decoder, frames, self.frame_size, self.channels)
+
+    def _resolve(self, batch: List[Tuple[bytes, asyncio.Future]], pcm: memoryview, offsets: List[int],
+                 error: Optional[Exception]):
+        self.frames += len(offsets)
+        self.batches += 1
+        OPUS_DECODE_BATCH_FRAMES.observe(len(batch))
+        start = 0
+        for (_, future), end in zip(batch, offsets):
+            if not future.done():
+                future.set_result(pcm[start:end])
+            start = end
+        if error is None:
+            return
+
+        self.errors += 1
+        failed = batch[len(offsets)][1]
+        if not failed.done():
+            failed.set_exception(error)
+        # the frames after the failing one go in the next batch
+        self._pending[0:0] = batch[len(offsets) + 1:]
+
+
+class OpusDecodeWorker:
+    """
+    Decodes the opus frames of all the sessions of the process on a shared thread pool.
+
+    The frames received during an iteration of the event loop are grouped by session and dispatched
+    together once the iteration is over, so a loaded instance runs one batch per session instead of
+    an executor round trip per frame, and the event loop only appends frames and resolves futures.
+    """
+
+    def __init__(self, max_workers: int = OPUS_DECODE_WORKERS):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='opus-decode')
+        self._ready: Dict[int, OpusStreamDecoder] = {}
+        self._flush_scheduled = False
+
+    def schedule(self, stream: OpusStreamDecoder):
+        if stream._running:
+            # picked up again once its running batch is over
+            return
+        self._ready[id(stream)] = stream
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        streams = list(self._ready.values())
+        self._ready.clear()
+        if not streams:
+            return
+
+        # split in one job per worker thread
+        jobs = [streams[i::self.max_workers] for i in range(min(self.max_workers, len(streams)))]
+        loop = asyncio.get_running_loop()
+        for job in jobs:
+            batches = []
+            for stream in job:
+                stream._running = True
+                batches.append((stream, stream._take_batch()))
+            future = loop.run_in_executor(self._executor, self._decode_job, batches)
+            future.add_done_callback(lambda f, b=batches: self._done(f, b))
+
+    @staticmethod
+    def _decode_job(batches):
+        return [stream._decode_batch([frame for frame, _ in batch]) for stream, batch in batches]
+
+    def _done(self, future: asyncio.Future, batches):
+        try:
+            results = future.result()
+        except Exception as e:
+            print('OpusDecodeWorker job failed', e)
+            results = [(memoryview(b''), [], e) for _ in batches]
+
+        for (stream, batch), (pcm, offsets, error) in zip(batches, results):
+            stream._running = False
+            stream._resolve(batch, pcm, offsets, error)
+            if stream._pending:
+                self.schedule(stream)
+
+
+_worker: Optional[OpusDecodeWorker] = None
+
+
+def get_opus_decode_worker() -> OpusDecodeWorker:
+    global _worker
+    if _worker is None:
+        _worker = OpusDecodeWorker()
+    return _worker
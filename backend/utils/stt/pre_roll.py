@@ -0,0 +1,23 @@
+import asyncio
+import os
+import time
+from typing import List
+
+# The speech profile pre-roll is sent in frames of ~100ms of audio, the size all providers are tuned for,
+# and paced at a multiple of realtime instead of sleeping between every frame.
+PRE_ROLL_FRAME_SECONDS = 0.1
+PRE_ROLL_SPEED = float(os.getenv('SPEECH_PROFILE_PRE_ROLL_SPEED', '40'))
+
+
+async def send_initial_audio_frames(frames: List[bytes], frame_seconds: float, transcript_socket_async_send,
+                                    speed: float = PRE_ROLL_SPEED):
+    print('send_initial_audio_frames', len(frames))
+    start = time.monotonic()
+    for i, frame in enumerate(frames):
+        await transcript_socket_async_send(frame)
+        # only yield when ahead of the target throughput
+        ahead_seconds = start + (i + 1) * frame_seconds / speed - time.monotonic()
+        if ahead_seconds > 0:
+            await asyncio.sleep(ahead_seconds)
+
+    print('send_initial_audio_frames', time.monotonic() - start)
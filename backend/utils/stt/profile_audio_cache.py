@@ -0,0 +1,249 @@
+import io
+import os
+import sys
+import threading
+import wave
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from google.api_core.exceptions import NotFound
+
+from database import redis_db
+from utils.other.storage import get_profile_audio_generation, download_profile_audio_bytes
+from utils.stt.codec import encode_opus_packets
+
+PROFILE_AUDIO_CACHE_DIR = os.getenv('PROFILE_AUDIO_CACHE_DIR', '_speech_profiles')
+PROFILE_AUDIO_CACHE_MEMORY_BYTES = int(os.getenv('PROFILE_AUDIO_CACHE_MEMORY_MB', '64')) * 1024 * 1024
+PROFILE_AUDIO_CACHE_DISK_BYTES = int(os.getenv('PROFILE_AUDIO_CACHE_DISK_MB', '1024')) * 1024 * 1024
+
+# Users without a profile are re-checked against the bucket after this TTL
+NO_PROFILE_TTL_SECONDS = 60 * 60
+
+
+def _buffers_bytes(buffers: List[bytes]) -> int:
+    return sum(sys.getsizeof(buffer) for buffer in buffers)
+
+
+class ProfileAudio:
+    """
+    Decoded speech profile of a user, raw PCM16 frames without the WAV header.
+
+    `nbytes` counts every buffer held, the PCM and the frames and opus packets prepared from it, each
+    preparation reported to `on_resize`.
+    """
+
+    def __init__(self, uid: str, generation: int, pcm: bytes, sample_rate: int, channels: int = 1,
+                 sample_width: int = 2):
+        self.uid = uid
+        self.generation = generation
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.duration_seconds = len(pcm) / (sample_rate * channels * sample_width)
+        self._frames: Dict[float, List[bytes]] = {}
+        self._opus_packets: Dict[int, List[bytes]] = {}
+        self.nbytes = sys.getsizeof(pcm)
+        self.on_resize: Optional[Callable[['ProfileAudio'], None]] = None
+
+    def _grew(self, buffers: List[bytes]):
+        self.nbytes += _buffers_bytes(buffers)
+        if self.on_resize is not None:
+            self.on_resize(self)
+
+    def frames(self, frame_seconds: float) -> List[bytes]:
+        """The PCM split in frames of `frame_seconds`, prepared once and shared by every session."""
+        frames = self._frames.get(frame_seconds)
+        if frames is None:
+            frame_size = int(self.sample_rate * frame_seconds) * self.channels * self.sample_width
+            frames = [self.pcm[i:i + frame_size] for i in range(0, len(self.pcm), frame_size)]
+            self._frames[frame_seconds] = frames
+            self._grew(frames)
+        return frames
+
+    def opus_packets(self, frame_size: int) -> List[bytes]:
+        """The PCM encoded in opus packets of `frame_size` samples, for the sessions forwarding opus to the STT."""
+        packets = self._opus_packets.get(frame_size)
+        if packets is None:
+            packets = encode_opus_packets(self.pcm, self.sample_rate, frame_size, self.channels)
+            self._opus_packets[frame_size] = packets
+            self._grew(packets)
+        return packets
+
+    @staticmethod
+    def from_wav(uid: str, generation: int, data: bytes) -> 'ProfileAudio':
+        with wave.open(io.BytesIO(data), 'rb') as wav:
+            return ProfileAudio(uid, generation, wav.readframes(wav.getnframes()), wav.getframerate(),
+                                wav.getnchannels(), wav.getsampwidth())
+
+    def to_wav(self) -> bytes:
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(self.channels)
+            wav.setsampwidth(self.sample_width)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(self.pcm)
+        return buffer.getvalue()
+
+
+class ProfileAudioCache:
+    """
+    Two levels LRU cache of speech profiles keyed by uid and GCS generation, in memory and on the local disk.
+
+    The current generation of each profile is tracked in Redis (set on upload), so a hit costs neither
+    the bucket round trips nor the WAV decode, and a new upload is picked up by every instance.
+    """
+
+    def __init__(self, directory: str = PROFILE_AUDIO_CACHE_DIR, max_memory_bytes: int = PROFILE_AUDIO_CACHE_MEMORY_BYTES,
+                 max_disk_bytes: int = PROFILE_AUDIO_CACHE_DISK_BYTES):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: OrderedDict[str, ProfileAudio] = OrderedDict()
+        # bytes of each entry counted in `_memory_bytes`
+        self._counted: Dict[str, int] = {}
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, uid: str) -> Optional[ProfileAudio]:
+        generation = redis_db.get_speech_profile_generation(uid)
+        if generation is None:
+            generation = self._refresh_generation(uid)
+        if not generation:
+            return None
+
+        try:
+            profile = self._load(uid, generation)
+        except NotFound:
+            # the generation in Redis is stale, the profile was uploaded again or deleted since
+            generation = self._refresh_generation(uid)
+            if not generation:
+                return None
+            try:
+                profile = self._load(uid, generation)
+            except NotFound:
+                print('profile_audio_cache profile gone', uid, generation)
+                redis_db.set_speech_profile_generation(uid, None, ttl=NO_PROFILE_TTL_SECONDS)
+                return None
+        self._put_memory(profile)
+        return profile
+
+    @staticmethod
+    def _refresh_generation(uid: str) -> Optional[int]:
+        generation = get_profile_audio_generation(uid)
+        if generation:
+            redis_db.set_speech_profile_generation(uid, generation)
+        else:
+            redis_db.set_speech_profile_generation(uid, generation, ttl=NO_PROFILE_TTL_SECONDS)
+        return generation
+
+    def _load(self, uid: str, generation: int) -> ProfileAudio:
+        """The profile of that generation, from the memory, the disk or the bucket. Raises NotFound."""
+        profile = self._get_memory(uid, generation) or self._get_disk(uid, generation)
+        if profile is None:
+            profile = ProfileAudio.from_wav(uid, generation, download_profile_audio_bytes(uid, generation))
+            self._put_disk(profile)
+        return profile
+
+    def _path(self, uid: str, generation: int) -> str:
+        return os.path.join(self.directory, f'{uid}_{generation}.wav')
+
+    def _get_memory(self, uid: str, generation: int) -> Optional[ProfileAudio]:
+        with self._lock:
+            profile = self._entries.get(uid)
+            if profile is None or profile.generation != generation:
+                return None
+            self._entries.move_to_end(uid)
+            return profile
+
+    def _put_memory(self, profile: ProfileAudio):
+        with self._lock:
+            self._entries.pop(profile.uid, None)
+            self._memory_bytes -= self._counted.pop(profile.uid, 0)
+            self._entries[profile.uid] = profile
+            profile.on_resize = self._resized
+            self._count(profile)
+
+    def _resized(self, profile: ProfileAudio):
+        # the frames and opus packets are prepared by the sessions once the profile is cached
+        with self._lock:
+            if self._entries.get(profile.uid) is profile:
+                self._count(profile)
+
+    def _count(self, profile: ProfileAudio):
+        self._memory_bytes += profile.nbytes - self._counted.get(profile.uid, 0)
+        self._counted[profile.uid] = profile.nbytes
+        while self._memory_bytes > self.max_memory_bytes and len(self._entries) > 1:
+            uid, _ = self._entries.popitem(last=False)
+            self._memory_bytes -= self._counted.pop(uid)
+
+    def _get_disk(self, uid: str, generation: int) -> Optional[ProfileAudio]:
+        path = self._path(uid, generation)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return ProfileAudio.from_wav(uid, generation, data)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print('profile_audio_cache corrupted entry', path, e)
+            os.remove(path)
+            return None
+
+    def _put_disk(self, profile: ProfileAudio):
+        try:
+            # write then rename, concurrent sessions of the same user may be filling the same entry
+            path = self._path(profile.uid, profile.generation)
+            tmp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(profile.to_wav())
+            os.replace(tmp_path, path)
+            self._prune_disk(profile)
+        except Exception as e:
+            print('profile_audio_cache disk write failed', profile.uid, e)
+
+    def _prune_disk(self, current: ProfileAudio):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.wav'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            # older generations of the current user are stale, files not named by the cache are left alone
+            try:
+                uid, generation = name[:-len('.wav')].rsplit('_', 1)
+            except ValueError:
+                continue
+            if uid == current.uid and generation != str(current.generation):
+                os.remove(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+_cache: Optional[ProfileAudioCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_profile_audio(uid: str) -> Optional[ProfileAudio]:
+    """Speech profile audio of the user, served from the local cache when the profile has not changed."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ProfileAudioCache()
+    return _cache.get(uid)
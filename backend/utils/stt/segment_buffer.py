@@ -0,0 +1,125 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+
+from utils.other.metrics import Histogram, SIZE_BUCKETS
+
+# Minimum time between two flushes of the same session, bursts of STT callbacks inside
+# this window are coalesced into a single client update.
+TRANSCRIPT_FLUSH_MIN_INTERVAL_SECONDS = float(os.getenv('TRANSCRIPT_FLUSH_MIN_INTERVAL_MS', '100')) / 1000
+# Max segments waiting for the consumer of a session, the oldest are dropped past it
+TRANSCRIPT_BUFFER_MAX_SEGMENTS = int(os.getenv('TRANSCRIPT_BUFFER_MAX_SEGMENTS', '1000'))
+
+SEGMENT_BUFFER_FLUSH_SEGMENTS = Histogram('listen_segment_buffer_flush_segments',
+                                          'Segments handed to the consumer of a session per flush',
+                                          buckets=SIZE_BUCKETS)
+
+
+class RealtimeSegmentBuffer:
+    """
+    Hands the segments produced by the STT callbacks of a session over to its event loop, and wakes
+    the consumer as soon as new segments arrive instead of having it poll on a fixed interval.
+
+    The segments are only touched on the event loop thread. Callbacks running on other threads
+    (e.g. the Deepgram SDK) go through `call_soon_threadsafe`, so there is no lock and no window
+    where a segment appended during a drain gets lost. Pending segments are bounded, when the consumer
+    falls behind the oldest are dropped and counted.
+
+    Must be created inside the event loop that consumes it.
+    """
+
+    def __init__(self, min_interval_seconds: float = TRANSCRIPT_FLUSH_MIN_INTERVAL_SECONDS,
+                 max_segments: int = TRANSCRIPT_BUFFER_MAX_SEGMENTS):
+        self.min_interval_seconds = min_interval_seconds
+        self.max_segments = max_segments
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._event = asyncio.Event()
+        self._segments: List[dict] = []
+        self._closed = False
+        self._last_flush_at = 0.0
+        # when the oldest pending segment was received, then the oldest of the last drain
+        self._pending_since: Optional[float] = None
+        self.drained_received_at: Optional[float] = None
+
+        # Backpressure counters, updated on the loop thread only
+        self.received = 0
+        self.dropped = 0
+        self.threadsafe_handoffs = 0
+        self.max_pending = 0
+
+    def __len__(self):
+        return len(self._segments)
+
+    def extend(self, segments: List[dict], restore: Optional[Callable[[List[dict]], None]] = None):
+        """`restore` updates the segments in place on the loop before they are appended (e.g. their timestamps)."""
+        if not segments:
+            return
+        if threading.get_ident() == self._loop_thread_id:
+            self._append(segments, False, time.monotonic(), restore)
+            return
+        try:
+            # copied, the caller may keep mutating its list
+            self._loop.call_soon_threadsafe(self._append, list(segments), True, time.monotonic(), restore)
+        except RuntimeError:
+            # loop closed, the session is over
+            pass
+
+    def close(self):
+        if threading.get_ident() == self._loop_thread_id:
+            self._close()
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._close)
+        except RuntimeError:
+            pass
+
+    def stats(self) -> dict:
+        return {'received': self.received, 'dropped': self.dropped, 'threadsafe_handoffs': self.threadsafe_handoffs,
+                'max_pending': self.max_pending, 'pending': len(self._segments)}
+
+    def _append(self, segments: List[dict], handoff: bool, received_at: float,
+                restore: Optional[Callable[[List[dict]], None]] = None):
+        if restore is not None:
+            restore(segments)
+        if self._pending_since is None:
+            self._pending_since = received_at
+        self._segments.extend(segments)
+        self.received += len(segments)
+        if handoff:
+            self.threadsafe_handoffs += 1
+
+        overflow = len(self._segments) - self.max_segments
+        if overflow > 0:
+            del self._segments[:overflow]
+            self.dropped += overflow
+        self.max_pending = max(self.max_pending, len(self._segments))
+        self._event.set()
+
+    def _close(self):
+        self._closed = True
+        self._event.set()
+
+    async def drain(self) -> List[dict]:
+        """
+        Waits until segments are available and returns them all, at most once per min interval.
+        Returns an empty list once the buffer is closed and fully drained.
+        """
+        while not self._segments:
+            if self._closed:
+                return []
+            await self._event.wait()
+            self._event.clear()
+
+        wait_seconds = self._last_flush_at + self.min_interval_seconds - time.monotonic()
+        if wait_seconds > 0 and not self._closed:
+            await asyncio.sleep(wait_seconds)
+
+        segments = self._segments
+        self._segments = []
+        self._last_flush_at = time.monotonic()
+        self.drained_received_at, self._pending_since = self._pending_since, None
+        SEGMENT_BUFFER_FLUSH_SEGMENTS.observe(len(segments))
+        return segments
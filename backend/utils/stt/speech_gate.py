@@ -0,0 +1,165 @@
+import bisect
+import os
+import time
+from collections import deque
+from typing import Any, List, Tuple
+
+import numpy as np
+
+# Server side speech gating of the audio streamed to the STT providers, the silence is not sent. Opt-in: the
+# gate needs the PCM, the opus frames passed through to Deepgram are then decoded too
+STT_SPEECH_GATE_ENABLED = os.getenv('STT_SPEECH_GATE_ENABLED', 'false').lower() == 'true'
+# Audio kept sending after the last speech, so the providers still see the end of the utterances
+SPEECH_GATE_HANGOVER_SECONDS = float(os.getenv('SPEECH_GATE_HANGOVER_MS', '800')) / 1000
+# Audio sent ahead of the speech onset once the gate opens, the first syllable is quiet
+SPEECH_GATE_PRE_ROLL_SECONDS = float(os.getenv('SPEECH_GATE_PRE_ROLL_MS', '300')) / 1000
+# Interval of the keep-alives sent to the providers while the gate is closed
+SPEECH_GATE_KEEPALIVE_SECONDS = float(os.getenv('SPEECH_GATE_KEEPALIVE_SECONDS', '5'))
+
+# Energy of a 10ms frame above the noise floor, or the absolute level, to count as speech
+SPEECH_GATE_MARGIN_DB = 10.0
+SPEECH_GATE_MIN_LEVEL_DBFS = -50.0
+# The noise floor follows a lower level at once, a higher one at this rate
+SPEECH_GATE_FLOOR_RISE_DB_PER_SECOND = 3.0
+
+_FULL_SCALE_POWER = 32768.0 ** 2
+
+
+class SpeechGate:
+    """
+    Streaming speech gate of a session, on the decoded PCM16 mono blocks as they arrive.
+
+    Every block is split in 10ms frames scored all at once with NumPy, a frame is speech when its
+    energy is `SPEECH_GATE_MARGIN_DB` over the adaptive noise floor. The gate opens on speech with the
+    last `pre_roll_seconds` of audio, and closes `hangover_seconds` after the last speech.
+
+    `push` takes the payload to send with each block (the PCM itself, or its opus frame) and returns
+    the payloads to send now. The providers timestamps count the sent audio only, the keep-alive
+    silences reported with `sent_silence` included, `restore_timestamps` maps them back on the session
+    audio. The audio sent to the same stream before the gate started is reported with `passed`, its
+    timestamps are kept. Not thread safe, used on the loop of the session only.
+    """
+
+    def __init__(self, sample_rate: int, hangover_seconds: float = SPEECH_GATE_HANGOVER_SECONDS,
+                 pre_roll_seconds: float = SPEECH_GATE_PRE_ROLL_SECONDS,
+                 keepalive_seconds: float = SPEECH_GATE_KEEPALIVE_SECONDS):
+        self.sample_rate = sample_rate
+        self.hangover_seconds = hangover_seconds
+        self.pre_roll_seconds = pre_roll_seconds
+        self.keepalive_seconds = keepalive_seconds
+        self._frame_samples = sample_rate // 100
+        self._pre_roll: deque = deque()
+        self._pre_roll_duration = 0.0
+        self._noise_floor_db = SPEECH_GATE_MIN_LEVEL_DBFS
+        self._last_speech_at = None
+        self._last_sent_at = time.monotonic()
+        self.open = False
+
+        # audio seconds, sent to the stream before the gate started, received and sent
+        self.stream_offset = 0.0
+        self.position = 0.0
+        self.sent_seconds = 0.0
+        self.suppressed_seconds = 0.0
+        # (sent seconds, suppressed seconds before), one per reopening of the gate
+        self._gaps: List[Tuple[float, float]] = [(0.0, 0.0)]
+
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.keepalives = 0
+
+    def _has_speech(self, samples: np.ndarray) -> bool:
+        frames = len(samples) // self._frame_samples
+        if frames == 0:
+            frames, frame_samples = 1, len(samples)
+        else:
+            frame_samples = self._frame_samples
+        blocks = samples[:frames * frame_samples].reshape(frames, frame_samples).astype(np.float32)
+        power = np.einsum('ij,ij->i', blocks, blocks) / frame_samples
+        level_db = 10 * np.log10(power / _FULL_SCALE_POWER + 1e-12)
+
+        block_seconds = len(samples) / self.sample_rate
+        self._noise_floor_db = min(self._noise_floor_db + SPEECH_GATE_FLOOR_RISE_DB_PER_SECOND * block_seconds,
+                                   float(level_db.min()))
+        threshold = max(self._noise_floor_db + SPEECH_GATE_MARGIN_DB, SPEECH_GATE_MIN_LEVEL_DBFS)
+        return bool((level_db > threshold).any())
+
+    def push(self, pcm: bytes, payload: Any = None) -> List[Any]:
+        """Payloads to send for this block of PCM, `payload` defaults to the PCM."""
+        if payload is None:
+            payload = pcm
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        if len(samples) == 0:
+            return []
+        seconds = len(samples) / self.sample_rate
+        self.bytes_received += len(pcm)
+        self.position += seconds
+
+        if self._has_speech(samples):
+            self._last_speech_at = self.position
+        speaking = self._last_speech_at is not None and \
+            self.position - self._last_speech_at <= self.hangover_seconds
+
+        if speaking:
+            payloads = []
+            if not self.open:
+                self.open = True
+                # the pre-roll was counted as suppressed
+                self.suppressed_seconds -= self._pre_roll_duration
+                self._gaps.append((self.sent_seconds, self.suppressed_seconds))
+                for pre_roll_pcm_bytes, pre_roll_seconds, pre_roll_payload in self._pre_roll:
+                    self.sent_seconds += pre_roll_seconds
+                    self.bytes_sent += pre_roll_pcm_bytes
+                    payloads.append(pre_roll_payload)
+                self._pre_roll.clear()
+                self._pre_roll_duration = 0.0
+            self.sent_seconds += seconds
+            self.bytes_sent += len(pcm)
+            self._last_sent_at = time.monotonic()
+            payloads.append(payload)
+            return payloads
+
+        self.open = False
+        self.suppressed_seconds += seconds
+        self._pre_roll.append((len(pcm), seconds, payload))
+        self._pre_roll_duration += seconds
+        while self._pre_roll and self._pre_roll_duration - self._pre_roll[0][1] >= self.pre_roll_seconds:
+            self._pre_roll_duration -= self._pre_roll.popleft()[1]
+        return []
+
+    def keepalive_due(self) -> bool:
+        """Whether to send a keep-alive to the providers, the gate being closed for a while."""
+        if self.open or time.monotonic() - self._last_sent_at < self.keepalive_seconds:
+            return False
+        self._last_sent_at = time.monotonic()
+        self.keepalives += 1
+        return True
+
+    def sent_silence(self, seconds: float):
+        """A keep-alive silence sent while the gate is closed, in place of as much suppressed audio."""
+        self.sent_seconds += seconds
+        self.suppressed_seconds -= seconds
+        self.bytes_sent += int(seconds * self.sample_rate) * 2
+
+    def passed(self, seconds: float):
+        """Audio sent to the stream as is before the gate started, ahead of the gated audio."""
+        if self.position == 0:
+            self.stream_offset += seconds
+
+    def session_seconds(self, stream_seconds: float) -> float:
+        """Position in the session audio of a position in the stream."""
+        sent_seconds = stream_seconds - self.stream_offset
+        if sent_seconds <= 0:
+            return stream_seconds
+        # a gap starting right at the position applies
+        index = bisect.bisect_right(self._gaps, (sent_seconds, float('inf'))) - 1
+        return stream_seconds + self._gaps[max(index, 0)][1]
+
+    def restore_timestamps(self, segments: List[dict]):
+        """Maps the segments of the gated stream, shifted past the speech profile, on the session audio."""
+        for segment in segments:
+            segment['start'] = self.session_seconds(segment['start'])
+            segment['end'] = self.session_seconds(segment['end'])
+
+    def stats(self) -> dict:
+        return {'seconds': round(self.position, 2), 'sent_seconds': round(self.sent_seconds, 2),
+                'bytes_received': self.bytes_received, 'bytes_sent': self.bytes_sent, 'keepalives': self.keepalives}
@@ -1,6 +1,5 @@
 import asyncio
 import os
-import random
 import time
 from typing import List
 from enum import Enum
@@ -9,6 +8,7 @@ import websockets
 from deepgram import DeepgramClient, DeepgramClientOptions, LiveTranscriptionEvents
 from deepgram.clients.live.v1 import LiveOptions
 
+from utils.stt.connection_pool import STTConnectionPool, STTSessionBinding
 from utils.stt.soniox_util import *
 
 headers = {
@@ -65,36 +65,6 @@ def get_stt_service_for_language(language: str):
     return STTService.deepgram, 'en', 'nova-2-general'
 
 
-async def send_initial_file_path(file_path: str, transcript_socket_async_send):
-    print('send_initial_file_path')
-    start = time.time()
-    # Reading and sending in chunks
-    with open(file_path, "rb") as file:
-        while True:
-            chunk = file.read(320)
-            if not chunk:
-                break
-            # print('Uploading', len(chunk))
-            await transcript_socket_async_send(bytes(chunk))
-            await asyncio.sleep(0.0001)  # if it takes too long to transcribe
-
-    print('send_initial_file_path', time.time() - start)
-
-
-async def send_initial_file(data: List[List[int]], transcript_socket):
-    print('send_initial_file2')
-    start = time.time()
-
-    # Reading and sending in chunks
-    for i in range(0, len(data)):
-        chunk = data[i]
-        # print('Uploading', chunk)
-        transcript_socket.send(bytes(chunk))
-        await asyncio.sleep(0.00005)  # if it takes too long to transcribe
-
-    print('send_initial_file', time.time() - start)
-
-
 # Initialize Deepgram client based on environment configuration
 is_dg_self_hosted = os.getenv('DEEPGRAM_SELF_HOSTED_ENABLED', '').lower() == 'true'
 deepgram_options = DeepgramClientOptions(options={"keepalive": "true", "termination_exception_connect": "true"})
@@ -116,9 +86,15 @@ deepgram_beta = DeepgramClient(os.getenv('DEEPGRAM_API_KEY'), deepgram_beta_opti
 
 async def process_audio_dg(
     stream_transcript, language: str, sample_rate: int, channels: int, preseconds: int = 0, model: str = 'nova-2-general',
+    encoding: str = 'linear16',
 ):
-    print('process_audio_dg', language, sample_rate, channels, preseconds)
+    print('process_audio_dg', language, sample_rate, channels, preseconds, encoding)
+    return await stt_pool.checkout(STTService.deepgram, stream_transcript, preseconds, language=language,
+                                   sample_rate=sample_rate, channels=channels, model=model, encoding=encoding)
+
 
+async def _connect_dg(binding: STTSessionBinding, language: str, sample_rate: int, channels: int, model: str,
+                      encoding: str):
     def on_message(self, result, **kwargs):
         # print(f"Received message from Deepgram")  # Log when message is received
         sentence = result.channel.alternatives[0].transcript
@@ -126,6 +102,7 @@ async def process_audio_dg(
         if len(sentence) == 0:
             return
         # print(sentence)
+        preseconds = binding.preseconds
         segments = []
         for word in result.channel.alternatives[0].words:
             is_user = True if word.speaker == 0 and preseconds > 0 else False
@@ -157,39 +134,22 @@ async def process_audio_dg(
                     })
 
         # stream
-        stream_transcript(segments)
+        binding.emit(segments)
 
     def on_error(self, error, **kwargs):
         print(f"Error: {error}")
 
-    print("Connecting to Deepgram")  # Log before connection attempt
-    return connect_to_deepgram_with_backoff(on_message, on_error, language, sample_rate, channels, model)
-
-
-# Calculate backoff with jitter
-def calculate_backoff_with_jitter(attempt, base_delay=1000, max_delay=32000):
-    jitter = random.random() * base_delay
-    backoff = min(((2 ** attempt) * base_delay) + jitter, max_delay)
-    return backoff
-
+    def on_closed(self, close, **kwargs):
+        binding.closed = True
 
-def connect_to_deepgram_with_backoff(on_message, on_error, language: str, sample_rate: int, channels: int, model: str, retries=3):
-    print("connect_to_deepgram_with_backoff")
-    for attempt in range(retries):
-        try:
-            return connect_to_deepgram(on_message, on_error, language, sample_rate, channels, model)
-        except Exception as error:
-            print(f'An error occurred: {error}')
-            if attempt == retries - 1:  # Last attempt
-                raise
-        backoff_delay = calculate_backoff_with_jitter(attempt)
-        print(f"Waiting {backoff_delay:.0f}ms before next retry...")
-        time.sleep(backoff_delay / 1000)  # Convert ms to seconds for sleep
-
-    raise Exception(f'Could not open socket: All retry attempts failed.')
+    print("Connecting to Deepgram")  # Log before connection attempt
+    # the SDK handshake is blocking
+    return await asyncio.to_thread(connect_to_deepgram, on_message, on_error, language, sample_rate, channels, model,
+                                   on_closed, encoding)
 
 
-def connect_to_deepgram(on_message, on_error, language: str, sample_rate: int, channels: int, model: str):
+def connect_to_deepgram(on_message, on_error, language: str, sample_rate: int, channels: int, model: str,
+                        on_closed=None, encoding: str = 'linear16'):
     try:
         # get connection by model
         if model == "nova-3":
@@ -223,6 +183,8 @@ def connect_to_deepgram(on_message, on_error, language: str, sample_rate: int, c
         dg_connection.on(LiveTranscriptionEvents.SpeechStarted, on_speech_started)
         dg_connection.on(LiveTranscriptionEvents.UtteranceEnd, on_utterance_end)
         dg_connection.on(LiveTranscriptionEvents.Close, on_close)
+        if on_closed is not None:
+            dg_connection.on(LiveTranscriptionEvents.Close, on_closed)
         dg_connection.on(LiveTranscriptionEvents.Unhandled, on_unhandled)
         options = LiveOptions(
             punctuate=True,
@@ -237,8 +199,9 @@ def connect_to_deepgram(on_message, on_error, language: str, sample_rate: int, c
             channels=channels,
             multichannel=channels > 1,
             model=model,
-            sample_rate=sample_rate,
-            encoding='linear16'
+            # containerized audio (Ogg Opus) is described by its own headers
+            sample_rate=sample_rate if encoding == 'linear16' else None,
+            encoding=encoding if encoding == 'linear16' else None,
         )
         result = dg_connection.start(options)
         print('Deepgram connection started:', result)
@@ -249,6 +212,11 @@ def connect_to_deepgram(on_message, on_error, language: str, sample_rate: int, c
         raise Exception(f'Could not open socket: {e}')
 
 async def process_audio_soniox(stream_transcript, sample_rate: int, language: str, uid: str, preseconds: int = 0, language_hints: List[str] = []):
+    return await stt_pool.checkout(STTService.soniox, stream_transcript, preseconds,
+                                   sample_rate=sample_rate, language_hints=list(language_hints or []))
+
+
+async def _connect_soniox(binding: STTSessionBinding, sample_rate: int, language_hints: List[str]):
     # Soniox supports diarization primarily for English
     api_key = os.getenv('SONIOX_API_KEY')
     if not api_key:
@@ -274,10 +242,10 @@ async def process_audio_soniox(stream_transcript, sample_rate: int, language: st
         'language_hints': language_hints,
     }
 
-    # Add speaker identification if available
-    if has_speech_profile:
-        request['enable_speaker_identification'] = True
-        request['cand_speaker_names'] = [uid]
+    # Add speaker identification if available, needs a connection per user (uid in the pool key)
+    # if has_speech_profile:
+    #     request['enable_speaker_identification'] = True
+    #     request['cand_speaker_names'] = [uid]
 
     try:
         # Connect to Soniox WebSocket
@@ -300,6 +268,7 @@ async def process_audio_soniox(stream_transcript, sample_rate: int, language: st
             try:
                 async for message in soniox_socket:
                     response = json.loads(message)
+                    preseconds = binding.preseconds
                     # print(response)
 
                     # Update last message time
@@ -318,7 +287,7 @@ async def process_audio_soniox(stream_transcript, sample_rate: int, language: st
 
                         if not tokens:
                             if current_segment:
-                                stream_transcript([current_segment])
+                                binding.emit([current_segment])
                                 current_segment = None
                                 current_segment_time = None
                             continue
@@ -350,7 +319,7 @@ async def process_audio_soniox(stream_transcript, sample_rate: int, language: st
                         time_threshold_exceed = current_segment_time and current_time - current_segment_time > 0.3 and \
                             (current_segment and current_segment['text'][-1] in punctuation_marks)
                         if (speaker_change_detected or time_threshold_exceed) and current_segment:
-                            stream_transcript([current_segment])
+                            binding.emit([current_segment])
                             current_segment = None
                             current_segment_time = None
 
@@ -370,11 +339,9 @@ async def process_audio_soniox(stream_transcript, sample_rate: int, language: st
                             start_time -= preseconds
                             end_time -= preseconds
 
-                        # Determine if this is the user based on speaker identification
+                        # Determine if this is the user based on the speech profile pre-roll
                         is_user = False
-                        if has_speech_profile and new_speaker_id == uid:
-                            is_user = True
-                        elif preseconds > 0 and new_speaker_id == "1":
+                        if preseconds > 0 and new_speaker_id == "1":
                             is_user = True
 
                         # Create a new segment or append to existing one
@@ -399,6 +366,7 @@ async def process_audio_soniox(stream_transcript, sample_rate: int, language: st
             except Exception as e:
                 print(f"Error receiving from Soniox: {e}")
             finally:
+                binding.closed = True
                 if not soniox_socket.closed:
                     await soniox_socket.close()
                     print("Soniox WebSocket closed in on_message.")
@@ -416,6 +384,11 @@ async def process_audio_soniox(stream_transcript, sample_rate: int, language: st
 
 
 async def process_audio_speechmatics(stream_transcript, sample_rate: int, language: str, preseconds: int = 0):
+    return await stt_pool.checkout(STTService.speechmatics, stream_transcript, preseconds,
+                                   sample_rate=sample_rate, language=language)
+
+
+async def _connect_speechmatics(binding: STTSessionBinding, sample_rate: int, language: str):
     api_key = os.getenv('SPEECHMATICS_API_KEY')
     uri = 'wss://eu2.rt.speechmatics.com/v2'
 
@@ -458,6 +431,7 @@ async def process_audio_speechmatics(stream_transcript, sample_rate: int, langua
                         results = response['results']
                         if not results:
                             continue
+                        preseconds = binding.preseconds
                         segments = []
                         for r in results:
                             # print(r)
@@ -507,7 +481,7 @@ async def process_audio_speechmatics(stream_transcript, sample_rate: int, langua
                                     })
 
                         if segments:
-                            stream_transcript(segments)
+                            binding.emit(segments)
                         # print('---')
                     else:
                         print(response)
@@ -516,6 +490,7 @@ async def process_audio_speechmatics(stream_transcript, sample_rate: int, langua
             except Exception as e:
                 print(f"Error receiving from Speechmatics: {e}")
             finally:
+                binding.closed = True
                 if not socket.closed:
                     await socket.close()
                     print("Speechmatics WebSocket closed in on_message.")
@@ -525,3 +500,29 @@ async def process_audio_speechmatics(stream_transcript, sample_rate: int, langua
     except Exception as e:
         print(f"Exception in process_audio_speechmatics: {e}")
         raise
+
+
+# *****************************
+# *********** POOL ************
+# *****************************
+
+def _is_websocket_healthy(socket, binding: STTSessionBinding) -> bool:
+    return not binding.closed and not socket.closed
+
+
+async def _close_websocket(socket):
+    await socket.close()
+
+
+def _is_dg_healthy(dg_connection, binding: STTSessionBinding) -> bool:
+    return not binding.closed
+
+
+async def _close_dg(dg_connection):
+    await asyncio.to_thread(dg_connection.finish)
+
+
+stt_pool = STTConnectionPool()
+stt_pool.register(STTService.deepgram, _connect_dg, _is_dg_healthy, _close_dg)
+stt_pool.register(STTService.soniox, _connect_soniox, _is_websocket_healthy, _close_websocket)
+stt_pool.register(STTService.speechmatics, _connect_speechmatics, _is_websocket_healthy, _close_websocket)
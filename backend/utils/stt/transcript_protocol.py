@@ -0,0 +1,149 @@
+import os
+from collections import OrderedDict
+from typing import List, Optional
+
+import msgpack
+
+from models.transcript_segment import TranscriptSegment
+
+# Transcript protocols a /v4/listen client can ask for with the `transcript_protocol` query parameter
+TRANSCRIPT_PROTOCOL_JSON = 'json'
+TRANSCRIPT_PROTOCOL_MSGPACK_V1 = 'msgpack.v1'
+TRANSCRIPT_PROTOCOLS = (TRANSCRIPT_PROTOCOL_JSON, TRANSCRIPT_PROTOCOL_MSGPACK_V1)
+
+# Segments of a session the delta encoder remembers, a segment updated after being evicted is sent in full again
+TRANSCRIPT_DELTA_MAX_SEGMENTS = int(os.getenv('TRANSCRIPT_DELTA_MAX_SEGMENTS', '512'))
+
+# Ops of a msgpack.v1 frame, `ref` is the short handle of a segment given by its OP_NEW
+OP_NEW = 0  # [OP_NEW, ref, id, text, speaker, is_user, person_id, start_ms, end_ms, translations]
+OP_APPEND = 1  # [OP_APPEND, ref, appended text, end_ms]
+OP_TEXT = 2  # [OP_TEXT, ref, text, start_ms, end_ms]
+OP_SPEAKER = 3  # [OP_SPEAKER, ref, speaker, is_user, person_id]
+OP_TIMES = 4  # [OP_TIMES, ref, start_ms, end_ms]
+OP_TRANSLATIONS = 5  # [OP_TRANSLATIONS, ref, translations]
+
+
+def negotiate_transcript_protocol(requested: Optional[str]) -> str:
+    """The protocol of the session, JSON unless the client asked for one this server speaks."""
+    return requested if requested in TRANSCRIPT_PROTOCOLS else TRANSCRIPT_PROTOCOL_JSON
+
+
+def _ms(seconds: float) -> int:
+    return int(round(seconds * 1000))
+
+
+def _translations(segment: TranscriptSegment) -> list:
+    return [[translation.lang, translation.text] for translation in segment.translations or []]
+
+
+class TranscriptDeltaEncoder:
+    """
+    Encodes the transcript updates of a listen session as msgpack.v1 binary frames.
+
+    A frame is `[1, [op, ...]]`. A segment is sent in full once (OP_NEW), then only what changed:
+    text appended to it, its text rewritten, its speaker, its times or its translations. Times are in
+    integer milliseconds. Reads the segment models directly, no dict conversion.
+
+    One per session, the frames have to reach the client in order.
+    """
+
+    version = 1
+
+    def __init__(self, max_segments: int = TRANSCRIPT_DELTA_MAX_SEGMENTS):
+        self.max_segments = max_segments
+        # segment id -> [ref, text, speaker, is_user, person_id, start_ms, end_ms, translations]
+        self._segments: OrderedDict = OrderedDict()
+        self._next_ref = 0
+        self._packer = msgpack.Packer()
+
+    def encode(self, segments: List[TranscriptSegment]) -> Optional[bytes]:
+        """The frame updating the client to `segments`, None when nothing changed."""
+        ops = []
+        for segment in segments:
+            start_ms, end_ms = _ms(segment.start), _ms(segment.end)
+            state = self._segments.get(segment.id)
+            if state is None:
+                ref = self._next_ref
+                self._next_ref += 1
+                translations = _translations(segment)
+                self._segments[segment.id] = [ref, segment.text, segment.speaker, segment.is_user, segment.person_id,
+                                              start_ms, end_ms, translations]
+                if len(self._segments) > self.max_segments:
+                    self._segments.popitem(last=False)
+                ops.append([OP_NEW, ref, segment.id, segment.text, segment.speaker, segment.is_user,
+                            segment.person_id, start_ms, end_ms, translations])
+                continue
+
+            self._segments.move_to_end(segment.id)
+            ref, text = state[0], state[1]
+            if segment.text != text:
+                if segment.text.startswith(text) and start_ms == state[5]:
+                    ops.append([OP_APPEND, ref, segment.text[len(text):], end_ms])
+                else:
+                    ops.append([OP_TEXT, ref, segment.text, start_ms, end_ms])
+                state[1], state[5], state[6] = segment.text, start_ms, end_ms
+            elif start_ms != state[5] or end_ms != state[6]:
+                ops.append([OP_TIMES, ref, start_ms, end_ms])
+                state[5], state[6] = start_ms, end_ms
+
+            if segment.speaker != state[2] or segment.is_user != state[3] or segment.person_id != state[4]:
+                ops.append([OP_SPEAKER, ref, segment.speaker, segment.is_user, segment.person_id])
+                state[2], state[3], state[4] = segment.speaker, segment.is_user, segment.person_id
+
+            if segment.translations or state[7]:
+                translations = _translations(segment)
+                if translations != state[7]:
+                    ops.append([OP_TRANSLATIONS, ref, translations])
+                    state[7] = translations
+
+        if not ops:
+            return None
+        return self._packer.pack([self.version, ops])
+
+
+class TranscriptDeltaDecoder:
+    """
+    Client side of msgpack.v1, rebuilds the segment dicts the JSON protocol would have sent.
+    The reference for the app implementations, and what the benchmark checks the encoder against.
+    """
+
+    def __init__(self):
+        self._segments = {}
+
+    def decode(self, frame: bytes) -> List[dict]:
+        version, ops = msgpack.unpackb(frame)
+        if version != TranscriptDeltaEncoder.version:
+            raise ValueError(f'Unsupported transcript protocol version {version}')
+        updated = {}
+        for op in ops:
+            code, ref = op[0], op[1]
+            if code == OP_NEW:
+                _, _, segment_id, text, speaker, is_user, person_id, start_ms, end_ms, translations = op
+                segment = {'id': segment_id, 'text': text, 'speaker': speaker, 'is_user': is_user,
+                           'person_id': person_id, 'start': start_ms / 1000, 'end': end_ms / 1000,
+                           'translations': translations}
+                self._segments[ref] = segment
+            else:
+                segment = self._segments[ref]
+                if code == OP_APPEND:
+                    segment['text'] += op[2]
+                    segment['end'] = op[3] / 1000
+                elif code == OP_TEXT:
+                    segment['text'], segment['start'], segment['end'] = op[2], op[3] / 1000, op[4] / 1000
+                elif code == OP_SPEAKER:
+                    segment['speaker'], segment['is_user'], segment['person_id'] = op[2], op[3], op[4]
+                elif code == OP_TIMES:
+                    segment['start'], segment['end'] = op[2] / 1000, op[3] / 1000
+                elif code == OP_TRANSLATIONS:
+                    segment['translations'] = op[2]
+            updated[ref] = segment
+
+        segments = []
+        for segment in updated.values():
+            speaker = segment['speaker']
+            segments.append({'id': segment['id'], 'text': segment['text'], 'speaker': speaker,
+                             'speaker_id': int(speaker.split('_')[1]) if speaker else 0,
+                             'is_user': segment['is_user'], 'person_id': segment['person_id'],
+                             'start': segment['start'], 'end': segment['end'],
+                             'translations': [{'lang': lang, 'text': text} for lang, text in segment['translations']]})
+        return segments
@@ -1,21 +1,49 @@
+import asyncio
 import os
 import hashlib
+import re
+import threading
 from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
 from google.cloud import translate_v3
 
-# LRU Cache for translations with a maximum size of 1000 entries
+from database import redis_db
+from utils.language_detection import detect_language_locally
+from utils.other.metrics import Counter, Histogram, SIZE_BUCKETS
+
+# LRU Cache for translations, in front of the Redis cache shared by the instances
 translation_cache = OrderedDict()
-MAX_CACHE_SIZE = 1000
+translation_cache_lock = threading.Lock()
+MAX_CACHE_SIZE = int(os.getenv('TRANSLATION_CACHE_SIZE', '10000'))
 PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT")
 
+# Time the translations of the sessions are collected before one batched request
+TRANSLATION_BATCH_WINDOW_SECONDS = float(os.getenv('TRANSLATION_BATCH_WINDOW_MS', '50')) / 1000
+# Limits of a translate request, the API accepts 1024 texts, 30k codepoints recommended
+TRANSLATION_BATCH_MAX_TEXTS = 128
+TRANSLATION_BATCH_MAX_CHARS = 20000
+
+TRANSLATION_TEXTS = Counter('translation_texts_total', 'Texts to translate, by where the translation came from',
+                            ['source'])
+TRANSLATION_REQUESTS = Counter('translation_api_requests_total', 'Translate requests to the Google API')
+LANGUAGE_DETECTIONS = Counter('translation_language_detections_total', 'Language detections, local or remote',
+                              ['source'])
+TRANSLATION_BATCH_TEXTS = Histogram('translation_batch_texts', 'Texts of the translate requests',
+                                    buckets=SIZE_BUCKETS)
+
 # Initialize the translation client globally
 client = translate_v3.TranslationServiceClient()
 parent = f"projects/{PROJECT_ID}/locations/global"
 mime_type = "text/plain"
 
+_whitespace = re.compile(r'\s+')
+
+
 def detect_language(text: str) -> str | None:
     """
-    Detects the language of the provided text using Google Cloud Translate API.
+    Detects the language of the provided text, locally when the character n-gram model is confident,
+    otherwise using Google Cloud Translate API.
 
     Args:
         text: The text to detect language for
@@ -25,7 +53,12 @@ def detect_language(text: str) -> str | None:
         or None if no language with sufficient confidence is found
     """
     try:
-        # Call the Google Cloud Translate API to detect language
+        if language := detect_language_locally(text):
+            LANGUAGE_DETECTIONS.labels('local').inc()
+            return language
+
+        # Ambiguous, call the Google Cloud Translate API to detect language
+        LANGUAGE_DETECTIONS.labels('remote').inc()
         response = client.detect_language(
             parent=parent,
             content=text,
@@ -37,16 +70,117 @@ def detect_language(text: str) -> str | None:
             for language in response.languages:
                 if language.confidence >= 1:
                     return language.language_code
-        
+
         return None  # Return None if no language with confidence >= 1 is found
     except Exception as e:
         print(f"Language detection error: {e}")
         return None  # Return None on error
 
+def normalize_text(text: str) -> str:
+    """The text as it is translated and cached, the transcripts differ in whitespace only between updates"""
+    return _whitespace.sub(' ', text).strip()
+
 def get_cache_key(text_hash: str, dest_language: str) -> str:
     """Generate a cache key from text hash and language"""
     return f"{text_hash}:{dest_language}"
 
+def _text_cache_key(text: str, dest_language: str) -> str:
+    return get_cache_key(hashlib.md5(text.encode()).hexdigest(), dest_language)
+
+def _get_local(cache_key: str) -> Optional[str]:
+    with translation_cache_lock:
+        if cache_key not in translation_cache:
+            return None
+        # Move the item to the end of the OrderedDict to mark it as recently used
+        translation_cache.move_to_end(cache_key)
+        return translation_cache[cache_key]
+
+def _set_local(cache_key: str, translated_text: str):
+    with translation_cache_lock:
+        translation_cache[cache_key] = translated_text
+        translation_cache.move_to_end(cache_key)
+        if len(translation_cache) > MAX_CACHE_SIZE:
+            # Remove oldest item (first item in OrderedDict)
+            translation_cache.popitem(last=False)
+
+def _chunks(texts: List[str]) -> List[List[int]]:
+    """Indexes of the texts split in requests within the API limits"""
+    chunks, chunk, chars = [], [], 0
+    for i, text in enumerate(texts):
+        if chunk and (len(chunk) >= TRANSLATION_BATCH_MAX_TEXTS or chars + len(text) > TRANSLATION_BATCH_MAX_CHARS):
+            chunks.append(chunk)
+            chunk, chars = [], 0
+        chunk.append(i)
+        chars += len(text)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def translate_texts(dest_language: str, texts: List[str]) -> List[str]:
+    """
+    Translates the texts to the specified destination language, the texts found in neither the local
+    nor the Redis cache go in as few Google Cloud Translation requests as possible.
+
+    Args:
+        dest_language: The language code to translate to (e.g., 'en', 'es', 'fr')
+        texts: The texts to translate
+
+    Returns:
+        The translated texts, in order, a text which failed to translate is returned as is
+    """
+    normalized = [normalize_text(text) for text in texts]
+    keys = [_text_cache_key(text, dest_language) for text in normalized]
+    results: List[Optional[str]] = [text if not text else _get_local(key) for text, key in zip(normalized, keys)]
+    TRANSLATION_TEXTS.labels('local').inc(sum(1 for text, result in zip(normalized, results) if text and result))
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        cached = redis_db.get_cached_translations([keys[i] for i in missing]) or [None] * len(missing)
+        for i, translated_text in zip(missing, cached):
+            if translated_text is not None:
+                results[i] = translated_text
+                _set_local(keys[i], translated_text)
+        TRANSLATION_TEXTS.labels('redis').inc(sum(1 for text in cached if text is not None))
+
+    # the same text is translated once
+    to_translate: Dict[str, List[int]] = {}
+    for i, result in enumerate(results):
+        if result is None:
+            to_translate.setdefault(normalized[i], []).append(i)
+    if not to_translate:
+        return results
+
+    contents = list(to_translate.keys())
+    translated: Dict[str, str] = {}
+    for chunk in _chunks(contents):
+        try:
+            TRANSLATION_REQUESTS.inc()
+            TRANSLATION_BATCH_TEXTS.observe(len(chunk))
+            response = client.translate_text(
+                contents=[contents[i] for i in chunk],
+                parent=parent,
+                mime_type=mime_type,
+                target_language_code=dest_language,
+            )
+            for i, translation in zip(chunk, response.translations):
+                translated[contents[i]] = translation.translated_text
+        except Exception as e:
+            print(f"Translation error: {e}")
+    TRANSLATION_TEXTS.labels('api').inc(len(translated))
+
+    to_cache = {}
+    for text, indexes in to_translate.items():
+        translated_text = translated.get(text)
+        for i in indexes:
+            # Return original text if translation fails
+            results[i] = translated_text if translated_text is not None else texts[i]
+        if translated_text is not None:
+            _set_local(keys[indexes[0]], translated_text)
+            to_cache[keys[indexes[0]]] = translated_text
+    if to_cache:
+        redis_db.cache_translations(to_cache)
+    return results
+
 def translate_text(dest_language: str, text: str) -> str:
     """
     Translates text to the specified destination language using Google Cloud Translation API.
@@ -59,35 +193,82 @@ def translate_text(dest_language: str, text: str) -> str:
     Returns:
         The translated text as a string
     """
-    # Generate hash for the text
-    text_hash = hashlib.md5(text.encode()).hexdigest()
+    return translate_texts(dest_language, [text])[0]
 
-    # Check if translation is in cache
-    cache_key = get_cache_key(text_hash, dest_language)
-    if cache_key in translation_cache:
-        # Move the item to the end of the OrderedDict to mark it as recently used
-        translated_text = translation_cache.pop(cache_key)
-        translation_cache[cache_key] = translated_text
-        return translated_text
 
-    try:
-        # Not in cache, perform translation
-        response = client.translate_text(
-            contents=[text],
-            parent=parent,
-            mime_type=mime_type,
-            target_language_code=dest_language,
-        )
+class TranslationBatcher:
+    """
+    Translates the texts of all the sessions of the process off the event loop.
 
-        translated_text = response.translations[0].translated_text
+    The texts requested during the batch window are grouped by destination language and translated
+    together with `translate_texts` in an executor thread, a text already requested and not translated
+    yet waits for the same result instead of being requested again.
+    """
 
-        # Add to cache
-        if len(translation_cache) >= MAX_CACHE_SIZE:
-            # Remove oldest item (first item in OrderedDict)
-            translation_cache.popitem(last=False)
+    def __init__(self, window_seconds: float = TRANSLATION_BATCH_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self._pending: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._flush_scheduled = False
 
-        translation_cache[cache_key] = translated_text
-        return translated_text
-    except Exception as e:
-        print(f"Translation error: {e}")
-        return text  # Return original text if translation fails
+    async def translate(self, dest_language: str, texts: List[str]) -> List[str]:
+        """The translated texts, in order, a text which failed to translate is returned as is."""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            normalized = normalize_text(text)
+            if not normalized:
+                futures.append(None)
+                continue
+            key = (dest_language, normalized)
+            future = self._pending.get(key) or self._in_flight.get(key)
+            if future is None:
+                future = loop.create_future()
+                self._pending[key] = future
+            futures.append(future)
+
+        if self._pending and not self._flush_scheduled:
+            self._flush_scheduled = True
+            loop.call_later(self.window_seconds, self._flush)
+
+        results = []
+        for text, future in zip(texts, futures):
+            translated_text = await future if future is not None else None
+            results.append(translated_text if translated_text is not None else text)
+        return results
+
+    def _flush(self):
+        self._flush_scheduled = False
+        pending = self._pending
+        self._pending = {}
+        self._in_flight.update(pending)
+
+        by_language: Dict[str, List[str]] = {}
+        for dest_language, text in pending.keys():
+            by_language.setdefault(dest_language, []).append(text)
+        loop = asyncio.get_running_loop()
+        for dest_language, texts in by_language.items():
+            future = loop.run_in_executor(None, translate_texts, dest_language, texts)
+            future.add_done_callback(lambda f, d=dest_language, t=texts: self._done(f, d, t))
+
+    def _done(self, future: asyncio.Future, dest_language: str, texts: List[str]):
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"Translation error: {e}")
+            results = [None] * len(texts)
+
+        for text, translated_text in zip(texts, results):
+            waiter = self._in_flight.pop((dest_language, text), None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(translated_text)
+
+
+_batcher: Optional[TranslationBatcher] = None
+
+
+def get_translation_batcher() -> TranslationBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = TranslationBatcher()
+    return _batcher
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import database.users as users_db
+from database.redis_db import r, get_user_webhook_with_status_db, USER_CONTEXT_INVALIDATION_CHANNEL
+from models.app import App
+from utils.apps import get_available_apps
+
+# Fields of a snapshot older than that are reloaded, in case an invalidation was missed
+USER_CONTEXT_MAX_AGE_SECONDS = int(os.getenv('USER_CONTEXT_MAX_AGE_SECONDS', '600'))
+
+
+class UserContext:
+    """
+    Snapshot of the user settings read by the realtime consumers of a session (`_listen` and the pusher):
+    the available apps, the notification token, the store recording permission, the language, and the
+    developer webhooks.
+
+    Every field is loaded on first use and kept for the session, the writers of the settings publish an
+    invalidation (`publish_user_context_invalidation`) that drops the fields of the snapshots holding them.
+    """
+
+    def __init__(self, uid: str, max_age_seconds: float = USER_CONTEXT_MAX_AGE_SECONDS):
+        self.uid = uid
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._values: Dict[str, Tuple[float, object]] = {}
+        self._generation = 0
+
+        self.loads = 0
+        self.hits = 0
+        self.invalidations = 0
+
+    def _get(self, field: str, load: Callable[[], object]):
+        with self._lock:
+            value = self._values.get(field)
+            if value is not None and time.monotonic() - value[0] < self.max_age_seconds:
+                self.hits += 1
+                return value[1]
+            generation = self._generation
+
+        result = load()
+        with self._lock:
+            self.loads += 1
+            # not kept if invalidated while loading
+            if self._generation == generation:
+                self._values[field] = (time.monotonic(), result)
+        return result
+
+    def invalidate(self, fields: Optional[List[str]] = None):
+        """Drops `fields` ('user', 'apps', 'webhooks' or 'webhook:<type>'), all of them if None."""
+        with self._lock:
+            self.invalidations += 1
+            self._generation += 1
+            for field in list(self._values):
+                if fields is None or field in fields or ('webhooks' in fields and field.startswith('webhook:')):
+                    del self._values[field]
+
+    @property
+    def apps(self) -> List[App]:
+        return self._get('apps', lambda: get_available_apps(self.uid))
+
+    @property
+    def audio_bytes_apps_enabled(self) -> bool:
+        return any(app.enabled and app.triggers_realtime_audio_bytes() for app in self.apps)
+
+    def _settings(self) -> dict:
+        return self._get('user', lambda: users_db.get_user_settings(self.uid))
+
+    @property
+    def token(self) -> Optional[str]:
+        return self._settings()['fcm_token']
+
+    @property
+    def store_recording_permission(self) -> bool:
+        return self._settings()['store_recording_permission']
+
+    @property
+    def language(self) -> str:
+        return self._settings()['language']
+
+    def webhook_url(self, wtype: str) -> Optional[str]:
+        """Url of the developer webhook, None when disabled."""
+        toggled, url = self._get(f'webhook:{wtype}', lambda: get_user_webhook_with_status_db(self.uid, wtype))
+        return url if toggled else None
+
+    def stats(self) -> dict:
+        return {'loads': self.loads, 'hits': self.hits, 'invalidations': self.invalidations}
+
+
+_lock = threading.Lock()
+_contexts: Dict[str, Tuple[UserContext, int]] = {}
+_listener: Optional[threading.Thread] = None
+
+
+def acquire_user_context(uid: str) -> UserContext:
+    """The context of the user shared by the sessions of the process, held until `release_user_context`."""
+    global _listener
+    with _lock:
+        context, sessions = _contexts.get(uid, (None, 0))
+        if context is None:
+            context = UserContext(uid)
+        _contexts[uid] = (context, sessions + 1)
+        if _listener is None:
+            _listener = threading.Thread(target=_listen_invalidations, daemon=True, name='user-context-invalidations')
+            _listener.start()
+        return context
+
+
+def release_user_context(uid: str):
+    with _lock:
+        context, sessions = _contexts.get(uid, (None, 0))
+        if context is None:
+            return
+        if sessions <= 1:
+            del _contexts[uid]
+        else:
+            _contexts[uid] = (context, sessions - 1)
+
+
+def get_user_context(uid: str) -> UserContext:
+    """The context held by a session of the user, a fresh one not kept otherwise."""
+    with _lock:
+        context = _contexts.get(uid)
+    return context[0] if context else UserContext(uid)
+
+
+def _listen_invalidations():
+    while True:
+        try:
+            pubsub = r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(USER_CONTEXT_INVALIDATION_CHANNEL)
+            # the invalidations published while disconnected are lost
+            with _lock:
+                contexts = [context for context, _ in _contexts.values()]
+            for context in contexts:
+                context.invalidate()
+
+            for message in pubsub.listen():
+                data = json.loads(message['data'])
+                with _lock:
+                    context = _contexts.get(data['uid'])
+                if context:
+                    context[0].invalidate(data.get('fields') or None)
+        except Exception as e:
+            print('UserContext invalidation listener failed', e)
+            time.sleep(1)
@@ -3,15 +3,15 @@ import json
 from datetime import datetime
 from typing import List
 
-import requests
 import websockets
 
 from database.redis_db import get_user_webhook_db, user_webhook_status_db, disable_user_webhook_db, \
     enable_user_webhook_db, set_user_webhook_db
 from models.conversation import Conversation
 from models.users import WebhookType
-import database.notifications as notification_db
 from utils.notifications import send_notification
+from utils.other.http_delivery import get_http_delivery_engine
+from utils.user_context import get_user_context
 
 
 def conversation_created_webhook(uid, memory: Conversation):
@@ -21,16 +21,17 @@ def conversation_created_webhook(uid, memory: Conversation):
         if not webhook_url:
             return
         webhook_url += f'?uid={uid}'
-        try:
-            response = requests.post(
-                webhook_url,
-                json=memory.as_dict_cleaned_dates(),
-                headers={'Content-Type': 'application/json'},
-                timeout=30,
-            )
-            print('memory_created_webhook:', webhook_url, response.status_code)
-        except Exception as e:
-            print(f"Error sending memory created to developer webhook: {e}")
+        engine = get_http_delivery_engine()
+        response = engine.run_sync(engine.post(
+            webhook_url,
+            json=memory.as_dict_cleaned_dates(),
+            headers={'Content-Type': 'application/json'},
+            timeout=30,
+        ))
+        if response is None:
+            print("Error sending memory created to developer webhook", webhook_url)
+            return
+        print('memory_created_webhook:', webhook_url, response.status_code)
     else:
         return
 
@@ -42,39 +43,42 @@ def day_summary_webhook(uid, summary: str):
         if not webhook_url:
             return
         webhook_url += f'?uid={uid}'
-        try:
-            response = requests.post(
-                webhook_url,
-                json={
-                    'summary': summary,
-                    'uid': uid,
-                    'created_at': datetime.now().isoformat()
-                },
-                headers={'Content-Type': 'application/json'},
-                timeout=30,
-            )
-            print('day_summary_webhook:', webhook_url, response.status_code)
-        except Exception as e:
-            print(f"Error sending day summary to developer webhook: {e}")
+        engine = get_http_delivery_engine()
+        response = engine.run_sync(engine.post(
+            webhook_url,
+            json={
+                'summary': summary,
+                'uid': uid,
+                'created_at': datetime.now().isoformat()
+            },
+            headers={'Content-Type': 'application/json'},
+            timeout=30,
+        ))
+        if response is None:
+            print("Error sending day summary to developer webhook", webhook_url)
+            return
+        print('day_summary_webhook:', webhook_url, response.status_code)
     else:
         return
 
 
 async def realtime_transcript_webhook(uid, segments: List[dict]):
     print("realtime_transcript_webhook", uid)
-    toggled = user_webhook_status_db(uid, WebhookType.realtime_transcript)
-    if toggled:
-        webhook_url = get_user_webhook_db(uid, WebhookType.realtime_transcript)
+    user_context = get_user_context(uid)
+    webhook_url = await asyncio.to_thread(user_context.webhook_url, WebhookType.realtime_transcript)
+    if webhook_url is not None:
         if not webhook_url:
             return
         webhook_url += f'?uid={uid}'
+        response = await get_http_delivery_engine().post(
+            webhook_url,
+            json={'segments': segments, 'session_id': uid},
+            headers={'Content-Type': 'application/json'},
+            timeout=15,
+        )
+        if response is None:
+            return
         try:
-            response = requests.post(
-                webhook_url,
-                json={'segments': segments, 'session_id': uid},
-                headers={'Content-Type': 'application/json'},
-                timeout=15,
-            )
             print('realtime_transcript_webhook:', webhook_url, response.status_code)
             if response.status_code == 200:
                 response_data = response.json()
@@ -82,8 +86,7 @@ async def realtime_transcript_webhook(uid, segments: List[dict]):
                     return
                 message = response_data.get('message', '')
                 if len(message) > 5:
-                    token = notification_db.get_token_only(uid)
-                    send_webhook_notification(token, message)
+                    await asyncio.to_thread(send_webhook_notification, user_context.token, message)
         except Exception as e:
             print(f"Error sending realtime transcript to developer webhook: {e}")
     else:
@@ -91,9 +94,8 @@ async def realtime_transcript_webhook(uid, segments: List[dict]):
 
 
 def get_audio_bytes_webhook_seconds(uid: str):
-    toggled = user_webhook_status_db(uid, WebhookType.audio_bytes)
-    if toggled:
-        webhook_url = get_user_webhook_db(uid, WebhookType.audio_bytes)
+    webhook_url = get_user_context(uid).webhook_url(WebhookType.audio_bytes)
+    if webhook_url is not None:
         if not webhook_url:
             return
         parts = webhook_url.split(',')
@@ -110,18 +112,18 @@ def get_audio_bytes_webhook_seconds(uid: str):
 async def send_audio_bytes_developer_webhook(uid: str, sample_rate: int, data: bytearray):
     print("send_audio_bytes_developer_webhook", uid)
     # TODO: add a lock, send shorter segments, validate regex.
-    toggled = user_webhook_status_db(uid, WebhookType.audio_bytes)
-    if toggled:
-        webhook_url = get_user_webhook_db(uid, WebhookType.audio_bytes)
+    webhook_url = await asyncio.to_thread(get_user_context(uid).webhook_url, WebhookType.audio_bytes)
+    if webhook_url is not None:
         webhook_url = webhook_url.split(',')[0]
         if not webhook_url:
             return
         webhook_url += f'?sample_rate={sample_rate}&uid={uid}'
-        try:
-            response = requests.post(webhook_url, data=data, headers={'Content-Type': 'application/octet-stream'}, timeout=15)
-            print('send_audio_bytes_developer_webhook:', webhook_url, response.status_code)
-        except Exception as e:
-            print(f"Error sending audio bytes to developer webhook: {e}")
+        response = await get_http_delivery_engine().post(
+            webhook_url, content=bytes(data), headers={'Content-Type': 'application/octet-stream'}, timeout=15)
+        if response is None:
+            print("Error sending audio bytes to developer webhook", webhook_url)
+            return
+        print('send_audio_bytes_developer_webhook:', webhook_url, response.status_code)
     else:
         return
 